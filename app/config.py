@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import List, Optional
 from pydantic_settings import BaseSettings
 from pathlib import Path
 
@@ -21,6 +21,31 @@ class Settings(BaseSettings):
     # Paths - maptoposter files are in the root directory
     maptoposter_dir: Path = Path(__file__).parent.parent
 
+    # Map data source - "overpass" (OSM API), the path of a local .osm/.osm.pbf extract,
+    # or "tiles" for the tiled map store only
+    map_data_source: str = "overpass"
+
+    # Render memory - jobs are admitted against this budget (0 = 75% of physical RAM)
+    memory_budget_mb: int = 0
+    job_memory_headroom: float = 1.5  # a job is stopped above this multiple of its predicted peak
+
+    # Shared jobs - a Redis-compatible broker (redis://host:6379/0) lets several API nodes and
+    # render workers share jobs and progress; "" keeps them in this process
+    broker_url: str = ""
+    remote_render: bool = False  # queue renders for `python -m app.worker` processes instead of running them here
+    # Render worker's place in the fleet; keep it across restarts so its cities (and warm cache/) stay
+    # with it. "" = the hostname; set it when running several workers on one host
+    worker_id: str = ""
+
+    # Cache warmer - pre-fetches map data for popular cities in the background
+    warm_enabled: bool = True
+    warm_cities: List[str] = []  # "City, Country" or "City, State, Country"; JSON list in env
+    warm_recent_jobs: int = 20  # how many recent job locations to keep warm
+    warm_refresh_minutes: int = 60  # how often to re-collect warm targets
+    warm_min_gap_seconds: float = 30.0  # spacing between warm fetches (Overpass rate budget)
+    warm_timeout_seconds: int = 300
+    gallery_file: Path = Path(__file__).parent.parent / "server" / "data" / "gallery.json"
+
     # Logging
     log_level: str = "INFO"
 
@@ -7,10 +7,12 @@ from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.requests import Request
 from fastapi_x402 import init_x402, PaymentMiddleware
 
-from .routers import themes, jobs, posters, websocket
+from .routers import themes, jobs, posters, websocket, warm
 from .models import HealthResponse
-from .services.job_manager import set_notify_callback
-from .services.websocket_manager import notify_job_update
+from .services.broker import connect
+from .services.job_manager import set_notify_callback, set_preview_callback, use_broker
+from .services.websocket_manager import notify_job_update, notify_job_preview
+from .services.cache_warmer import warmer
 from .config import settings
 
 # Debug: Log settings at module load
@@ -54,15 +56,31 @@ app.add_middleware(APIOnlyPaymentMiddleware, payment_middleware_class=PaymentMid
 
 @app.on_event("startup")
 async def startup_event():
-    """Register WebSocket callback with access to the main event loop."""
+    """Register WebSocket callback with access to the main event loop and start background services."""
     loop = asyncio.get_running_loop()
     set_notify_callback(notify_job_update, loop)
+    set_preview_callback(notify_job_preview)
+    if settings.broker_url:
+        use_broker(connect(settings.broker_url))
+    elif settings.remote_render:
+        raise RuntimeError("REMOTE_RENDER needs BROKER_URL, the broker the render workers read from")
+    # With remote rendering the warmer runs on the workers, next to the cache it fills
+    if settings.warm_enabled and not settings.remote_render:
+        warmer.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background services."""
+    await warmer.stop()
+    use_broker(None)
 
 # Include routers
 app.include_router(themes.router)
 app.include_router(jobs.router)
 app.include_router(posters.router)
 app.include_router(websocket.router)
+app.include_router(warm.router)
 
 # Mount static files
 static_dir = Path(__file__).parent.parent / "static"
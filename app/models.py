@@ -25,6 +25,19 @@ class SizePreset(str, Enum):
     REGION = "region"
 
 
+class RenderQuality(str, Enum):
+    PREVIEW = "preview"  # 72 DPI, for viewing on screen
+    PRINT = "print"  # 300 DPI
+
+
+class JobClass(str, Enum):
+    """Scheduling lane of a job, most urgent first."""
+
+    PREVIEW = "preview"  # someone is waiting to look at it
+    PRINT = "print"  # full-resolution render
+    BACKGROUND = "background"  # cache warming and batch work
+
+
 class PosterRequest(BaseModel):
     city: str = Field(..., min_length=1, max_length=100, examples=["Tokyo"])
     state: Optional[str] = Field(default=None, max_length=100, examples=["Virginia"])
@@ -32,6 +45,20 @@ class PosterRequest(BaseModel):
     theme: str = Field(default="feature_based", examples=["noir"])
     size: SizePreset = Field(default=SizePreset.AUTO, examples=["city"])
     distance: Optional[int] = Field(default=None, ge=1000, le=50000)
+    quality: RenderQuality = Field(default=RenderQuality.PREVIEW, examples=["print"])
+
+
+class WarmRequest(BaseModel):
+    city: str = Field(..., min_length=1, max_length=100, examples=["Tokyo"])
+    state: Optional[str] = Field(default=None, max_length=100, examples=["Virginia"])
+    country: str = Field(..., min_length=1, max_length=100, examples=["Japan"])
+    size: SizePreset = Field(default=SizePreset.AUTO, examples=["city"])
+    distance: Optional[int] = Field(default=None, ge=1000, le=50000)
+
+
+class WarmResponse(BaseModel):
+    queued: bool
+    message: Optional[str] = None
 
 
 class JobStatus(str, Enum):
@@ -39,6 +66,7 @@ class JobStatus(str, Enum):
     PROCESSING = "processing"
     COMPLETED = "completed"
     FAILED = "failed"
+    CANCELLED = "cancelled"
 
 
 class JobResponse(BaseModel):
@@ -48,6 +76,10 @@ class JobResponse(BaseModel):
     message: Optional[str] = None
     error: Optional[str] = None
     download_url: Optional[str] = None
+    preview_url: Optional[str] = None
+    job_class: Optional[JobClass] = None
+    queue_wait_seconds: Optional[float] = None  # so far, while the job is still queued
+    version: int = 0  # increases with every change; pass it back to wait for the next one
 
 
 class HealthResponse(BaseModel):
@@ -1,26 +1,148 @@
-from fastapi import APIRouter, HTTPException
-from ..services.job_manager import get_job
+import json
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from ..services.job_manager import load_job, update_job, wait_for_job_change
+from ..services.poster_generator import cancel_poster_job
+from ..services.websocket_manager import job_update_message
 from ..models import JobResponse, JobStatus
 
 router = APIRouter(prefix="/api", tags=["jobs"])
 
+# Longest a status request may be held open waiting for a change
+LONG_POLL_MAX_SECONDS = 60
+
+# Comment line sent on an idle event stream so proxies don't close it
+SSE_KEEPALIVE_SECONDS = 15
+
+FINISHED_STATUSES = (JobStatus.COMPLETED, JobStatus.FAILED, JobStatus.CANCELLED)
 
-@router.get("/jobs/{job_id}", response_model=JobResponse)
-async def get_job_status(job_id: str):
-    """Check the status of a poster generation job."""
-    job = get_job(job_id)
-    if not job:
-        raise HTTPException(status_code=404, detail="Job not found")
 
+def build_job_response(job_id: str, job: dict) -> JobResponse:
+    """Build the API view of a job."""
     response = JobResponse(
         job_id=job["id"],
         status=job["status"],
         progress=job.get("progress", 0),
         message=job.get("message"),
         error=job.get("error"),
+        job_class=job.get("job_class"),
+        queue_wait_seconds=job.get("queue_wait_seconds"),
+        version=job.get("version", 0),
     )
 
+    if response.queue_wait_seconds is None and job["status"] == JobStatus.PENDING:
+        # Still queued: report the wait so far
+        waited = datetime.utcnow() - datetime.fromisoformat(job["created_at"])
+        response.queue_wait_seconds = round(waited.total_seconds(), 1)
+
     if job["status"] == JobStatus.COMPLETED:
         response.download_url = f"/api/posters/{job_id}"
+    if job.get("preview_file"):
+        response.preview_url = f"/api/posters/{job_id}/preview"
 
     return response
+
+
+@router.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job_status(
+    job_id: str,
+    wait: float = Query(0, ge=0, description="Seconds to wait for the job to change before answering"),
+    version: Optional[int] = Query(None, description="Version the caller has already seen"),
+):
+    """
+    Check the status of a poster generation job.
+
+    With wait, this is a long-poll: the response is held until the job's
+    version differs from version (or, without one, until its next change),
+    the job finishes, or wait seconds (at most LONG_POLL_MAX_SECONDS) pass.
+    """
+    job = await load_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    if wait and job["status"] not in FINISHED_STATUSES:
+        seen = job.get("version", 0) if version is None else version
+        job = await wait_for_job_change(job_id, seen, min(wait, LONG_POLL_MAX_SECONDS))
+        if not job:
+            raise HTTPException(status_code=404, detail="Job not found")
+
+    return build_job_response(job_id, job)
+
+
+def sse_event(event: str, data: dict, event_id: int = None) -> str:
+    """Format one server-sent event."""
+    frame = f"event: {event}\n"
+    if event_id is not None:
+        frame += f"id: {event_id}\n"
+    return frame + f"data: {json.dumps(data, default=str)}\n\n"
+
+
+async def job_events(job_id: str):
+    """
+    Server-sent events for a job: the messages /ws/jobs/{job_id} sends,
+    starting with its current state and ending once it finishes.
+    """
+    job = await load_job(job_id)
+    version = job.get("version", 0)
+    preview_sent = bool(job.get("preview_file"))
+    yield sse_event("job_update", job_update_message(job_id, job), version)
+
+    while job["status"] not in FINISHED_STATUSES:
+        job = await wait_for_job_change(job_id, version, SSE_KEEPALIVE_SECONDS)
+        if job is None:
+            return
+        if job.get("version", 0) == version:
+            yield ": keep-alive\n\n"
+            continue
+        version = job.get("version", 0)
+        if job.get("preview_file") and not preview_sent:
+            preview_sent = True
+            yield sse_event("preview", {
+                "type": "preview",
+                "job_id": job_id,
+                "preview_url": f"/api/posters/{job_id}/preview",
+            }, version)
+        yield sse_event("job_update", job_update_message(job_id, job), version)
+
+
+@router.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    """
+    Stream a job's progress as server-sent events, for clients that can't use WebSockets.
+
+    Each change is sent as a job_update event (and a preview event once a
+    quick preview exists), with the job's version as the event ID. Updates
+    that arrive faster than they can be sent are coalesced into the latest
+    state. The stream ends when the job finishes.
+    """
+    if not await load_job(job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    return StreamingResponse(
+        job_events(job_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/jobs/{job_id}/cancel", response_model=JobResponse)
+async def cancel_job(job_id: str):
+    """
+    Cancel a pending or running poster generation job.
+
+    Returns once the generator process has been killed.
+    """
+    job = await load_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    if job["status"] not in (JobStatus.PENDING, JobStatus.PROCESSING):
+        raise HTTPException(status_code=409, detail=f"Job is already {JobStatus(job['status']).value}")
+
+    if not await cancel_poster_job(job_id):
+        # Not started yet (or already gone): nothing to kill
+        update_job(job_id, status=JobStatus.CANCELLED, message="Generation cancelled")
+
+    return build_job_response(job_id, await load_job(job_id))
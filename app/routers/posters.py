@@ -1,30 +1,48 @@
-from fastapi import APIRouter, BackgroundTasks, HTTPException
+import asyncio
+from pathlib import Path
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import FileResponse
 from fastapi_x402 import pay
 from ..config import settings
-from ..services.job_manager import create_job, get_job
-from ..services.poster_generator import generate_poster_task
+from ..services.job_manager import create_job, enqueue_job, load_job
+from ..services.poster_generator import start_poster_job
+from ..services.routing import location_key
 from ..models import PosterRequest, JobResponse, JobStatus
 
 router = APIRouter(prefix="/api", tags=["posters"])
 
 
+def client_id(http_request: Request) -> str:
+    """Who a request comes from, for fair scheduling: the original client address behind proxies."""
+    forwarded = http_request.headers.get("x-forwarded-for")
+    if forwarded:
+        return forwarded.split(",")[0].strip()
+    return http_request.client.host if http_request.client else "unknown"
+
+
 @pay(f"${settings.poster_price}")
 @router.post("/posters", response_model=JobResponse)
-async def create_poster(request: PosterRequest, background_tasks: BackgroundTasks):
+async def create_poster(request: PosterRequest, http_request: Request):
     """
     Create a new poster generation job.
 
     Requires $0.10 USDC payment via x402 protocol.
-    Generation takes 30-60 seconds. Poll /api/jobs/{job_id} for status.
+    Previews (the default quality) are scheduled ahead of print renders.
+    Generation takes 30-60 seconds. Poll /api/jobs/{job_id} for status,
+    or POST /api/jobs/{job_id}/cancel to stop it.
     """
     # Validate theme exists
     themes_dir = settings.maptoposter_dir / "themes"
     if not (themes_dir / f"{request.theme}.json").exists():
         raise HTTPException(status_code=400, detail=f"Theme '{request.theme}' not found")
 
-    job_id = create_job(request)
-    background_tasks.add_task(generate_poster_task, job_id, request)
+    job_id = create_job(request, client=client_id(http_request))
+    if settings.remote_render:
+        await asyncio.to_thread(
+            enqueue_job, job_id, location_key(request.city, request.country, request.state)
+        )
+    else:
+        start_poster_job(job_id, request)
 
     return JobResponse(
         job_id=job_id,
@@ -36,7 +54,7 @@ async def create_poster(request: PosterRequest, background_tasks: BackgroundTask
 @router.get("/posters/{job_id}")
 async def download_poster(job_id: str):
     """Download a completed poster image."""
-    job = get_job(job_id)
+    job = await load_job(job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
 
@@ -55,3 +73,16 @@ async def download_poster(job_id: str):
     filename = f"{city_slug}_{request['theme']}_poster.png"
 
     return FileResponse(path=file_path, media_type="image/png", filename=filename)
+
+
+@router.get("/posters/{job_id}/preview")
+async def download_preview(job_id: str):
+    """Download the quick low-detail preview of a poster, available before it completes."""
+    job = await load_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    if not job.get("preview_file") or not Path(job["preview_file"]).exists():
+        raise HTTPException(status_code=404, detail="Preview not available")
+
+    return FileResponse(path=job["preview_file"], media_type="image/png")
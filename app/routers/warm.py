@@ -0,0 +1,19 @@
+from fastapi import APIRouter
+from ..services.cache_warmer import warmer, WarmTarget, PRIORITY_DEMAND
+from ..models import WarmRequest, WarmResponse
+
+router = APIRouter(prefix="/api", tags=["warm"])
+
+
+@router.post("/warm", response_model=WarmResponse, status_code=202)
+async def warm_location(request: WarmRequest):
+    """
+    Signal intent to order a poster for a location.
+
+    The location's map data is fetched into the cache in the background
+    (ahead of any other warm-up work) so the paid render starts from a
+    cache hit. No payment required.
+    """
+    queued = warmer.enqueue(WarmTarget.from_request(request.model_dump()), priority=PRIORITY_DEMAND)
+    message = "Warm-up queued" if queued else "Warm-up already pending"
+    return WarmResponse(queued=queued, message=message)
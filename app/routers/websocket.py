@@ -3,9 +3,8 @@ WebSocket endpoint for real-time job progress updates.
 """
 
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-from ..services.websocket_manager import manager
-from ..services.job_manager import get_job
-from ..models import JobStatus
+from ..services.websocket_manager import manager, job_update_message
+from ..services.job_manager import load_job
 
 router = APIRouter(tags=["websocket"])
 
@@ -22,18 +21,24 @@ async def websocket_job_status(websocket: WebSocket, job_id: str):
     {
         "type": "job_update",
         "job_id": "...",
-        "status": "pending|processing|completed|failed",
+        "status": "pending|processing|completed|failed|cancelled",
         "progress": 0-100,
         "message": "...",  # optional
         "error": "...",    # optional, on failure
         "download_url": "..."  # optional, on completion
+        "preview_url": "..."   # optional, once a quick preview exists
+    }
+    {
+        "type": "preview",     # sent once, ahead of the full render
+        "job_id": "...",
+        "preview_url": "..."
     }
     """
     # Must accept websocket before we can close it or send messages
     await websocket.accept()
 
     # Check if job exists
-    job = get_job(job_id)
+    job = await load_job(job_id)
     if not job:
         await websocket.close(code=4004, reason="Job not found")
         return
@@ -43,17 +48,7 @@ async def websocket_job_status(websocket: WebSocket, job_id: str):
 
     try:
         # Send current job status immediately
-        initial_status = {
-            "type": "job_update",
-            "job_id": job_id,
-            "status": job["status"],
-            "progress": job.get("progress", 0),
-        }
-        if job["status"] == JobStatus.COMPLETED:
-            initial_status["download_url"] = f"/api/posters/{job_id}"
-        if job.get("error"):
-            initial_status["error"] = job["error"]
-
+        initial_status = job_update_message(job_id, job)
         await websocket.send_json(initial_status)
 
         # Keep connection alive and wait for messages (heartbeat)
@@ -0,0 +1,202 @@
+"""
+Broker shared by API nodes and render workers.
+
+Jobs, their progress and the render queue live in a Redis-compatible
+broker (Redis, Valkey, KeyDB, Dragonfly, ...) once BROKER_URL is set, so
+any API node can answer for any job and render workers can run on other
+machines (see job_manager and app.worker). Only a small subset of Redis
+is used:
+
+    job records       hashes (HSET/HGETALL/HINCRBY/EXPIRE)
+    render workers    a hash of heartbeats (HSET/HGETALL/HDEL)
+    render queues     lists, shared and per worker (LPUSH/BRPOP/LLEN/LMOVE)
+    job events        pub/sub (PUBLISH/SUBSCRIBE)
+
+InProcessBroker implements that subset for a single process. Tests use it
+to stand in for a real broker, and "memory://" selects it for development.
+"""
+
+import queue
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Optional
+
+
+class InProcessBroker:
+    """Thread-safe, in-memory stand-in for the Redis commands the service uses (strings only)."""
+
+    def __init__(self):
+        self._hashes = {}
+        self._lists = defaultdict(deque)
+        self._expires = {}  # key -> monotonic deadline
+        self._subscribers = defaultdict(set)  # channel -> set of _PubSub
+        self._lock = threading.Condition()
+
+    def _expire_stale(self, name):
+        deadline = self._expires.get(name)
+        if deadline is not None and deadline <= time.monotonic():
+            self._hashes.pop(name, None)
+            self._lists.pop(name, None)
+            del self._expires[name]
+
+    def hset(self, name, key=None, value=None, mapping=None):
+        with self._lock:
+            self._expire_stale(name)
+            fields = dict(mapping or {})
+            if key is not None:
+                fields[key] = value
+            entry = self._hashes.setdefault(name, {})
+            added = len(fields.keys() - entry.keys())
+            entry.update({k: str(v) for k, v in fields.items()})
+            return added
+
+    def hgetall(self, name):
+        with self._lock:
+            self._expire_stale(name)
+            return dict(self._hashes.get(name, {}))
+
+    def hdel(self, name, *keys):
+        with self._lock:
+            self._expire_stale(name)
+            entry = self._hashes.get(name, {})
+            return sum(entry.pop(key, None) is not None for key in keys)
+
+    def hincrby(self, name, key, amount=1):
+        with self._lock:
+            self._expire_stale(name)
+            entry = self._hashes.setdefault(name, {})
+            value = int(entry.get(key, 0)) + amount
+            entry[key] = str(value)
+            return value
+
+    def expire(self, name, seconds):
+        with self._lock:
+            self._expire_stale(name)
+            if name not in self._hashes and name not in self._lists:
+                return False
+            self._expires[name] = time.monotonic() + seconds
+            return True
+
+    def delete(self, *names):
+        with self._lock:
+            removed = 0
+            for name in names:
+                removed += (self._hashes.pop(name, None) is not None) + (self._lists.pop(name, None) is not None)
+                self._expires.pop(name, None)
+            return removed
+
+    def lpush(self, name, *values):
+        with self._lock:
+            self._expire_stale(name)
+            items = self._lists[name]
+            items.extendleft(str(value) for value in values)
+            self._lock.notify_all()
+            return len(items)
+
+    def llen(self, name):
+        with self._lock:
+            self._expire_stale(name)
+            return len(self._lists.get(name, ()))
+
+    def lmove(self, first_list, second_list, src="LEFT", dest="RIGHT"):
+        """Pop an item from one end of a list and push it onto an end of another, atomically."""
+        with self._lock:
+            self._expire_stale(first_list)
+            self._expire_stale(second_list)
+            items = self._lists.get(first_list)
+            if not items:
+                return None
+            value = items.popleft() if src == "LEFT" else items.pop()
+            target = self._lists[second_list]
+            if dest == "LEFT":
+                target.appendleft(value)
+            else:
+                target.append(value)
+            self._lock.notify_all()
+            return value
+
+    def brpop(self, keys, timeout=0):
+        """Pop from the tail of the first non-empty list, waiting up to timeout seconds (0 = forever)."""
+        if isinstance(keys, str):
+            keys = [keys]
+        deadline = time.monotonic() + timeout if timeout else None
+        with self._lock:
+            while True:
+                for name in keys:
+                    self._expire_stale(name)
+                    if self._lists.get(name):
+                        return name, self._lists[name].pop()
+                remaining = deadline - time.monotonic() if deadline else None
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._lock.wait(remaining)
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscriber in subscribers:
+            subscriber._deliver(channel, str(message))
+        return len(subscribers)
+
+    def pubsub(self):
+        return _PubSub(self)
+
+
+class _PubSub:
+    """Subscription handle mirroring redis-py's PubSub.get_message()."""
+
+    def __init__(self, broker):
+        self._broker = broker
+        self._channels = set()
+        self._messages = queue.Queue()
+
+    def subscribe(self, *channels):
+        with self._broker._lock:
+            for channel in channels:
+                self._channels.add(channel)
+                self._broker._subscribers[channel].add(self)
+                self._messages.put({"type": "subscribe", "channel": channel, "data": len(self._channels)})
+
+    def _deliver(self, channel, data):
+        self._messages.put({"type": "message", "channel": channel, "data": data})
+
+    def get_message(self, ignore_subscribe_messages=False, timeout=0.0):
+        try:
+            message = self._messages.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if ignore_subscribe_messages and message["type"] != "message":
+            return None
+        return message
+
+    def close(self):
+        with self._broker._lock:
+            for channel in self._channels:
+                self._broker._subscribers[channel].discard(self)
+                # Also wakes a reader blocked in get_message()
+                self._messages.put({"type": "unsubscribe", "channel": channel, "data": 0})
+            self._channels.clear()
+
+
+_memory_broker: Optional[InProcessBroker] = None
+
+
+def connect(url: str):
+    """
+    Connect to the broker at url: "memory://" for this process only, else a Redis URL.
+
+    Raises:
+        RuntimeError: if url is a Redis URL and the redis package isn't installed
+    """
+    global _memory_broker
+    if url.startswith("memory://"):
+        if _memory_broker is None:
+            _memory_broker = InProcessBroker()
+        return _memory_broker
+
+    try:
+        import redis
+    except ImportError:
+        raise RuntimeError("BROKER_URL needs the redis package: pip install redis") from None
+    return redis.Redis.from_url(url, decode_responses=True, health_check_interval=30)
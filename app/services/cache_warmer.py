@@ -0,0 +1,239 @@
+"""
+Background cache warmer.
+
+Pre-fetches map data for locations customers are likely to order so the
+paying request finds it in the cache. Targets come from (highest priority
+first) explicit warm-up signals from the frontend, the configured city list,
+recent job history and the Node gallery. Warming runs one location at a time
+at low CPU priority, spaces fetches to stay inside the Overpass rate budget
+and pauses while real render jobs are queued or running; fetches are
+admitted by the job scheduler in its background lane. On render workers
+each worker only warms the locations routed to it (see routing.py), since
+that is the cache their jobs will look in.
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import os
+from collections import Counter
+from dataclasses import dataclass
+from typing import Optional
+
+from ..config import settings
+from ..models import JobClass
+from .job_manager import list_jobs, owns_location
+from .poster_generator import build_location_args
+from .routing import location_key
+from .scheduler import AUTO_MAX_DISTANCE, SIZE_PRESETS, predict_job_bytes, scheduler
+
+logger = logging.getLogger(__name__)
+
+# Lower number = warmed first
+PRIORITY_DEMAND = 0
+PRIORITY_CONFIG = 1
+PRIORITY_RECENT_JOBS = 2
+PRIORITY_GALLERY = 3
+
+
+@dataclass(frozen=True)
+class WarmTarget:
+    """A location whose map data should be cached."""
+
+    city: str
+    country: str
+    state: Optional[str] = None
+    size: str = "auto"
+    distance: Optional[int] = None
+
+    @classmethod
+    def parse(cls, value: str, size: str = "auto") -> "WarmTarget":
+        """Parse "City, Country" or "City, State, Country"."""
+        parts = [part.strip() for part in value.split(",")]
+        if len(parts) == 2:
+            return cls(city=parts[0], country=parts[1], size=size)
+        if len(parts) == 3:
+            return cls(city=parts[0], state=parts[1], country=parts[2], size=size)
+        raise ValueError(f"Expected 'City, Country' or 'City, State, Country', got '{value}'")
+
+    @classmethod
+    def from_request(cls, request: dict) -> "WarmTarget":
+        size = request.get("size") or "auto"
+        return cls(
+            city=request["city"],
+            country=request["country"],
+            state=request.get("state"),
+            size=getattr(size, "value", size),
+            distance=request.get("distance"),
+        )
+
+
+def _render_queue_busy() -> bool:
+    """True while any render is waiting for or holding memory in this process's scheduler."""
+    stats = scheduler.stats()
+    return stats["running"] > 0 or stats["waiting"] > 0
+
+
+def _lower_priority():
+    """Run in the child before exec: deprioritize warm fetches against renders."""
+    os.nice(10)
+
+
+def collect_targets() -> list:
+    """
+    Gather warm targets from configuration, recent jobs and the gallery.
+
+    Returns:
+        list of (priority, WarmTarget), most important first
+    """
+    targets = []
+
+    for value in settings.warm_cities:
+        try:
+            targets.append((PRIORITY_CONFIG, WarmTarget.parse(value)))
+        except ValueError as e:
+            logger.warning(f"Ignoring warm city: {e}")
+
+    # Most requested locations among recent jobs
+    recent = sorted(list_jobs(), key=lambda job: job["created_at"], reverse=True)
+    counts = Counter(WarmTarget.from_request(job["request"]) for job in recent[:200])
+    for target, _ in counts.most_common(settings.warm_recent_jobs):
+        targets.append((PRIORITY_RECENT_JOBS, target))
+
+    # The Node gallery renders at the 'city' preset
+    try:
+        with open(settings.gallery_file) as f:
+            gallery = json.load(f)
+        for entry in gallery.get("entries", []):
+            targets.append((
+                PRIORITY_GALLERY,
+                WarmTarget(city=entry["city"], state=entry.get("state"), country=entry["country"], size="city"),
+            ))
+    except FileNotFoundError:
+        pass
+    except (ValueError, KeyError) as e:
+        logger.warning(f"Could not read gallery for cache warming: {e}")
+
+    return targets
+
+
+class CacheWarmer:
+    """Priority queue of locations to pre-fetch, drained by one background task."""
+
+    def __init__(self):
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._pending: set = set()
+        self._order = itertools.count()
+        self._tasks: list = []
+        self._routed = False
+
+    def enqueue(self, target: WarmTarget, priority: int = PRIORITY_DEMAND) -> bool:
+        """Queue a target unless it is already waiting. Returns True if queued."""
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+        if target in self._pending:
+            return False
+        self._pending.add(target)
+        self._queue.put_nowait((priority, next(self._order), target))
+        return True
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def start(self, routed: bool = False):
+        """
+        Start the refresh and worker tasks on the running event loop.
+
+        Args:
+            routed: only warm the locations whose jobs are routed to this
+                render worker (see job_manager.owns_location)
+        """
+        if self._tasks:
+            return
+        self._routed = routed
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+        self._tasks = [
+            asyncio.create_task(self._refresh_loop()),
+            asyncio.create_task(self._worker_loop()),
+        ]
+        logger.info("Cache warmer started")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _refresh_loop(self):
+        while True:
+            for priority, target in collect_targets():
+                self.enqueue(target, priority)
+            await asyncio.sleep(settings.warm_refresh_minutes * 60)
+
+    async def _worker_loop(self):
+        while True:
+            _, _, target = await self._queue.get()
+            try:
+                if not await self._owns(target):
+                    continue
+                # Paying customers first: wait for the render queue to drain
+                while _render_queue_busy():
+                    await asyncio.sleep(5)
+                # Fetching only: no raster, so no DPI
+                dist = target.distance or SIZE_PRESETS.get(target.size, AUTO_MAX_DISTANCE)
+                job_id = f"warm:{target.city}, {target.country}"
+                async with scheduler.reserve(job_id, predict_job_bytes(dist, 0), JobClass.BACKGROUND, "cache-warmer"):
+                    await self.warm(target)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Cache warm failed for {target.city}, {target.country}: {e}")
+            finally:
+                self._pending.discard(target)
+            await asyncio.sleep(settings.warm_min_gap_seconds)
+
+    async def _owns(self, target: WarmTarget) -> bool:
+        """False if the target's jobs go to another render worker, which warms it instead."""
+        if not self._routed:
+            return True
+        return await owns_location(location_key(target.city, target.country, target.state))
+
+    async def warm(self, target: WarmTarget) -> bool:
+        """Fetch one target's map data into the cache. Returns True on success."""
+        cmd = [
+            "python3",
+            str(settings.maptoposter_dir / "create_map_poster.py"),
+            *build_location_args(target),
+            "--warm",
+            "--data-source",
+            settings.map_data_source,
+        ]
+        logger.info(f"Warming cache: {' '.join(cmd)}")
+
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            cwd=str(settings.maptoposter_dir),
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+            preexec_fn=_lower_priority if os.name == "posix" else None,
+            env={**os.environ, "TQDM_DISABLE": "1"},
+        )
+        try:
+            _, stderr = await asyncio.wait_for(process.communicate(), timeout=settings.warm_timeout_seconds)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            logger.warning(f"Cache warm timed out for {target.city}, {target.country}")
+            return False
+
+        if process.returncode != 0:
+            logger.warning(f"Cache warm failed for {target.city}, {target.country}: {stderr.decode()[-500:]}")
+            return False
+        return True
+
+
+# Global cache warmer instance
+warmer = CacheWarmer()
@@ -1,19 +1,83 @@
+"""
+Job records, change notifications and the render queue.
+
+By default jobs live in this process only. With a broker (see broker.py
+and use_broker()), every job is also kept as a hash in the broker, which is
+the source of truth: get_job() and load_job() read through it, so any API
+node can answer for any job, and each change is published so the other
+nodes wake their long-polls and event streams and forward it to their
+WebSocket clients. Broker calls are made on one background thread, in the
+order this process asked for them, so a slow broker never stalls the event
+loop and a read always sees this process's earlier writes. Render workers (app.worker) take jobs from the render queues and
+report progress through the same records. Jobs are routed to the worker
+most likely to have their location's map data cached (see routing.py and
+enqueue_job()).
+"""
+
+import json
+import logging
+import socket
+import threading
+import time
 import uuid
 import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
-from typing import Dict, Optional, Callable, Awaitable
-from ..models import JobStatus
+from typing import Dict, List, Optional, Callable, Awaitable
+from ..config import settings
+from ..models import JobClass, JobStatus
+from .routing import HashRing
+
+logger = logging.getLogger(__name__)
+
+# Broker keys and channel
+JOB_KEY = "maptoposter:job:{}"
+JOB_CHANNEL = "maptoposter:job-events"
+RENDER_QUEUE = "maptoposter:render-queue"  # taken by any worker
+WORKER_QUEUE = "maptoposter:render-queue:{}"  # jobs routed to one worker
+WORKERS_KEY = "maptoposter:workers"  # worker ID -> last heartbeat (unix time)
+
+# A worker that hasn't sent a heartbeat for this long has left the fleet
+WORKER_TIMEOUT_SECONDS = 30
+
+# A worker with this many jobs queued for it is saturated: further jobs spill to the next
+SPILL_QUEUE_DEPTH = 2
 
+# Fields stored as enum values
+_ENUM_FIELDS = {"status": JobStatus, "job_class": JobClass}
 
-# In-memory job storage
+# Identifies this process's events on the broker
+node_id = uuid.uuid4().hex[:12]
+
+# This process's ID as a render worker: stable across restarts, so the locations routed
+# to it (and cached on its disk) stay with it
+worker_id = settings.worker_id or socket.gethostname()
+
+# Jobs this process has created or looked up (a copy of the broker's when there is one)
 jobs: Dict[str, dict] = {}
 
+# Shared broker, if jobs are shared with other nodes (see use_broker)
+_broker = None
+_listener: Optional["_EventListener"] = None
+
+# Makes the broker calls, one at a time and in the order they were asked for
+_broker_calls = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-broker")
+
+# Live render workers, kept in step with their heartbeats
+_ring = HashRing()
+
 # Callback for WebSocket notifications (set by websocket_manager)
 _notify_callback: Optional[Callable[[str, str, int, Optional[str], Optional[str], Optional[str]], Awaitable[None]]] = None
 
+# Callback for WebSocket preview notifications (job_id, preview_url)
+_preview_callback: Optional[Callable[[str, str], Awaitable[None]]] = None
+
 # Reference to the main event loop (set on app startup)
 _main_loop: Optional[asyncio.AbstractEventLoop] = None
 
+# Futures of long-polls and event streams waiting for a job to change, by job ID
+_change_waiters: Dict[str, List[asyncio.Future]] = {}
+
 
 def set_notify_callback(callback, loop: asyncio.AbstractEventLoop = None):
     """Set the async callback for WebSocket notifications and the main event loop."""
@@ -22,56 +86,407 @@ def set_notify_callback(callback, loop: asyncio.AbstractEventLoop = None):
     _main_loop = loop
 
 
-def create_job(request) -> str:
-    """Create a new job and return its ID."""
+def set_preview_callback(callback):
+    """Set the async callback announcing a job's quick preview."""
+    global _preview_callback
+    _preview_callback = callback
+
+
+def use_broker(broker):
+    """
+    Share jobs with other API nodes and render workers through broker, or
+    keep them in this process again with None.
+    """
+    global _broker, _listener
+    # Let the changes already asked for reach the old broker
+    _in_order(lambda: None).result()
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    _broker = broker
+    if broker is not None:
+        _listener = _EventListener(broker.pubsub())
+        _listener.start()
+
+
+def shares_jobs() -> bool:
+    """True if jobs are shared with other nodes through a broker."""
+    return _broker is not None
+
+
+def create_job(request, client: Optional[str] = None) -> str:
+    """Create a new job and return its ID. client identifies the requester for fair scheduling."""
     job_id = str(uuid.uuid4())
     jobs[job_id] = {
         "id": job_id,
         "status": JobStatus.PENDING,
         "request": request.model_dump(),
+        "job_class": JobClass(request.quality.value),
+        "client": client,
+        "queue_wait_seconds": None,
+        "version": 0,  # bumped on every change; long-polls and event streams wait on it
         "created_at": datetime.utcnow().isoformat(),
         "completed_at": None,
         "result_file": None,
+        "preview_file": None,
         "error": None,
         "progress": 0,
         "message": None,
     }
+    if _broker is not None:
+        _in_background(_store_job, _broker, job_id, _encode(jobs[job_id]))
     return job_id
 
 
+def _store_job(broker, job_id: str, record: dict):
+    key = JOB_KEY.format(job_id)
+    broker.hset(key, mapping=record)
+    broker.expire(key, settings.cleanup_hours * 3600)
+
+
 def update_job(job_id: str, **kwargs):
-    """Update job status and metadata, notify WebSocket clients."""
-    if job_id not in jobs:
+    """
+    Update job status and metadata, notify WebSocket clients.
+
+    Only jobs this node has created or looked up can be updated; the change
+    reaches the broker in the background.
+    """
+    job = jobs.get(job_id)
+    if job is None:
         return
 
-    jobs[job_id].update(kwargs)
-
-    # Notify WebSocket clients asynchronously
-    if _notify_callback and _main_loop:
-        job = jobs[job_id]
-        download_url = f"/api/posters/{job_id}" if job["status"] == JobStatus.COMPLETED else None
-
-        try:
-            coro = _notify_callback(
-                job_id,
-                job["status"],
-                job.get("progress", 0),
-                job.get("message"),
-                job.get("error"),
-                download_url
-            )
-            # Schedule the coroutine on the main event loop from any thread
-            asyncio.run_coroutine_threadsafe(coro, _main_loop)
-        except Exception as e:
-            # Don't let WebSocket errors break job updates
-            pass
+    job.update(kwargs)
+    _job_changed(job_id, kwargs)
+    _notify_update(job_id)
 
 
-def get_job(job_id: str) -> Optional[dict]:
-    """Retrieve job by ID."""
+def set_job_preview(job_id: str, preview_file: str):
+    """Record a job's quick preview and notify WebSocket clients."""
+    job = jobs.get(job_id)
+    if job is None:
+        return
+
+    job["preview_file"] = preview_file
+    _job_changed(job_id, {"preview_file": preview_file})
+    _notify_preview(job_id)
+
+
+def _notify_update(job_id: str):
+    """Tell this node's WebSocket clients about a job's current state."""
+    if not (_notify_callback and _main_loop):
+        return
+    job = jobs[job_id]
+    download_url = f"/api/posters/{job_id}" if job["status"] == JobStatus.COMPLETED else None
+
+    try:
+        coro = _notify_callback(
+            job_id,
+            job["status"],
+            job.get("progress", 0),
+            job.get("message"),
+            job.get("error"),
+            download_url
+        )
+        # Schedule the coroutine on the main event loop from any thread
+        asyncio.run_coroutine_threadsafe(coro, _main_loop)
+    except Exception as e:
+        # Don't let WebSocket errors break job updates
+        pass
+
+
+def _notify_preview(job_id: str):
+    """Tell this node's WebSocket clients that a job's quick preview is available."""
+    if not (_preview_callback and _main_loop):
+        return
+    try:
+        coro = _preview_callback(job_id, f"/api/posters/{job_id}/preview")
+        asyncio.run_coroutine_threadsafe(coro, _main_loop)
+    except Exception:
+        # Don't let WebSocket errors break the job
+        pass
+
+
+def _wake_change_waiters(job_id: str):
+    for future in _change_waiters.pop(job_id, []):
+        if not future.done():
+            future.set_result(None)
+
+
+def _job_changed(job_id: str, fields: dict):
+    """
+    Bump a job's version and wake everyone waiting for it to change.
+
+    With a broker, the changed fields are written to the shared record and
+    published so the other nodes update their copies (see _apply_event);
+    the version is bumped, and waiters woken, once the broker has it.
+    """
+    if _broker is not None:
+        _in_background(_publish_change, _broker, job_id, fields)
+        return
+    job = jobs[job_id]
+    job["version"] = job.get("version", 0) + 1
+    _call_on_main_loop(_wake_change_waiters, job_id)
+
+
+def _publish_change(broker, job_id: str, fields: dict):
+    key = JOB_KEY.format(job_id)
+    encoded = _encode(fields)
+    broker.hset(key, mapping=encoded)
+    version = broker.hincrby(key, "version", 1)
+    broker.publish(JOB_CHANNEL, json.dumps({
+        "node": node_id,
+        "job_id": job_id,
+        "version": version,
+        "fields": encoded,
+    }))
+    job = jobs.get(job_id)
+    if job is not None:
+        # Again, in case a read that was already under way refreshed our copy from the older record
+        job.update(fields)
+        job["version"] = version
+    _call_on_main_loop(_wake_change_waiters, job_id)
+
+
+def _in_order(call, *args) -> Future:
+    """Make a broker call on the broker thread, after the ones asked for before it."""
+    return _broker_calls.submit(call, *args)
+
+
+def _in_background(call, *args):
+    """Make a broker call in order without waiting for it, logging it if it fails."""
+    def log_failure(future: Future):
+        if future.exception() is not None:
+            logger.warning(f"Broker call {call.__name__} failed: {future.exception()}")
+
+    _in_order(call, *args).add_done_callback(log_failure)
+
+
+def _call_on_main_loop(callback, *args):
+    """Run callback now if on the main loop's thread (or there is none), else schedule it there."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        # Called from a worker thread: waiters' futures belong to the main loop
+        if _main_loop and _main_loop.is_running():
+            _main_loop.call_soon_threadsafe(callback, *args)
+            return
+    callback(*args)
+
+
+async def wait_for_job_change(job_id: str, version: int, timeout: float) -> Optional[dict]:
+    """
+    Wait until a job's version differs from version, or timeout seconds pass.
+
+    Returns:
+        The job as it is then (unchanged on timeout), or None if it doesn't exist
+    """
+    job = await load_job(job_id)
+    if job is None or job.get("version", 0) != version:
+        return job
+
+    future = asyncio.get_running_loop().create_future()
+    _change_waiters.setdefault(job_id, []).append(future)
+    try:
+        await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        waiters = _change_waiters.get(job_id)
+        if waiters and future in waiters:
+            waiters.remove(future)
+            if not waiters:
+                del _change_waiters[job_id]
     return jobs.get(job_id)
 
 
+def get_job(job_id: str) -> Optional[dict]:
+    """
+    Retrieve job by ID (as the broker has it now, when there is one).
+
+    Waits for the broker: on the event loop, use load_job().
+    """
+    if _broker is None:
+        return jobs.get(job_id)
+    return _in_order(_read_job, _broker, job_id).result()
+
+
+async def load_job(job_id: str) -> Optional[dict]:
+    """Retrieve job by ID, as get_job() does, without blocking the event loop."""
+    if _broker is None:
+        return jobs.get(job_id)
+    return await asyncio.wrap_future(_in_order(_read_job, _broker, job_id))
+
+
+def _read_job(broker, job_id: str) -> Optional[dict]:
+    record = broker.hgetall(JOB_KEY.format(job_id))
+    if not record:
+        jobs.pop(job_id, None)
+        return None
+    # Refresh in place: long-polls and event streams hold on to the dict
+    job = jobs.setdefault(job_id, {})
+    job.update(_decode(record))
+    return job
+
+
 def list_jobs() -> list:
-    """List all jobs."""
+    """List the jobs this node has created or looked up."""
     return list(jobs.values())
+
+
+def enqueue_job(job_id: str, location: Optional[str] = None) -> Optional[str]:
+    """
+    Queue a job for the render workers.
+
+    A job with a location (routing.location_key) is queued for the worker
+    the location hashes to, or the next one round the ring while that one
+    already has SPILL_QUEUE_DEPTH jobs waiting. Other jobs, and jobs every
+    worker is too busy for, go on the shared queue.
+
+    Waits for the broker: on the event loop, run it in a thread.
+
+    Returns:
+        The worker the job was queued for, or None for the shared queue
+    """
+    # After this process's earlier broker calls, so the job's record is there before a worker takes it
+    return _in_order(_enqueue, job_id, location).result()
+
+
+def _enqueue(job_id: str, location: Optional[str]) -> Optional[str]:
+    if location:
+        for worker in _route(location):
+            queue = WORKER_QUEUE.format(worker)
+            if _broker.llen(queue) < SPILL_QUEUE_DEPTH:
+                _broker.lpush(queue, job_id)
+                logger.info(f"[{job_id}] Queued for worker {worker}")
+                return worker
+    _broker.lpush(RENDER_QUEUE, job_id)
+    return None
+
+
+def dequeue_job(timeout: int, worker: Optional[str] = None) -> Optional[str]:
+    """
+    Take the oldest job queued for worker, else the oldest shared one,
+    waiting up to timeout seconds. Blocks: call from a thread.
+    """
+    queues = [WORKER_QUEUE.format(worker), RENDER_QUEUE] if worker else [RENDER_QUEUE]
+    popped = _broker.brpop(queues, timeout=timeout)
+    return popped[1] if popped else None
+
+
+def live_workers() -> List[str]:
+    """Render workers that have sent a heartbeat within WORKER_TIMEOUT_SECONDS."""
+    now = time.time()
+    return sorted(
+        worker for worker, seen in _broker.hgetall(WORKERS_KEY).items()
+        if now - float(seen) < WORKER_TIMEOUT_SECONDS
+    )
+
+
+def _route(location: str) -> List[str]:
+    """Live workers in the order a location tries them."""
+    live = set(live_workers())
+    # Only workers that joined or left change the ring
+    for worker in _ring.nodes - live:
+        _ring.remove(worker)
+    for worker in live - _ring.nodes:
+        _ring.add(worker)
+    return _ring.preference(location)
+
+
+async def owns_location(location: str) -> bool:
+    """
+    True if this process's render worker is the one a location's jobs are
+    routed to first, or no worker has joined yet.
+    """
+    owners = await asyncio.wrap_future(_in_order(_route, location))
+    return not owners or owners[0] == worker_id
+
+
+def register_worker(worker: str):
+    """Announce a render worker, or keep it in the fleet (call every few seconds)."""
+    _broker.hset(WORKERS_KEY, worker, time.time())
+
+
+def retire_worker(worker: str):
+    """Take a worker out of the fleet and hand the jobs queued for it to the others."""
+    _broker.hdel(WORKERS_KEY, worker)
+    _release_queue(worker)
+
+
+def reap_workers():
+    """Retire workers that stopped sending heartbeats (crashed or cut off)."""
+    now = time.time()
+    for worker, seen in _broker.hgetall(WORKERS_KEY).items():
+        # Only the node that removes the worker moves its jobs
+        if now - float(seen) >= WORKER_TIMEOUT_SECONDS and _broker.hdel(WORKERS_KEY, worker):
+            logger.warning(f"Render worker {worker} stopped sending heartbeats")
+            _release_queue(worker)
+
+
+def _release_queue(worker: str):
+    """Move a worker's queued jobs to the front of the shared queue, oldest first."""
+    queue = WORKER_QUEUE.format(worker)
+    # Newest first onto the popping end, so the oldest ends up taken first
+    while _broker.lmove(queue, RENDER_QUEUE, "LEFT", "RIGHT") is not None:
+        pass
+
+
+def _encode(fields: dict) -> dict:
+    return {name: json.dumps(value, default=str) for name, value in fields.items()}
+
+
+def _decode(record: dict) -> dict:
+    fields = {name: json.loads(value) for name, value in record.items()}
+    for name, enum in _ENUM_FIELDS.items():
+        if fields.get(name) is not None:
+            fields[name] = enum(fields[name])
+    return fields
+
+
+def _apply_event(event: dict):
+    """Apply another node's change to our copy of the job and pass it on to our waiters and clients."""
+    job_id = event["job_id"]
+    job = jobs.get(job_id)
+    if event["node"] == node_id or job is None:
+        # Our own change, or a job nobody here is watching
+        return
+
+    if event["version"] > job.get("version", 0):
+        job.update(_decode(event["fields"]))
+        job["version"] = event["version"]
+    _wake_change_waiters(job_id)
+    if "preview_file" in event["fields"]:
+        _notify_preview(job_id)
+    else:
+        _notify_update(job_id)
+
+
+class _EventListener(threading.Thread):
+    """Follows the broker's job events on a background thread and applies them on the main loop."""
+
+    def __init__(self, pubsub):
+        super().__init__(name="job-events", daemon=True)
+        self._pubsub = pubsub
+        self._stopped = threading.Event()
+        # Subscribe now, so no change made after use_broker() returns is missed
+        self._pubsub.subscribe(JOB_CHANNEL)
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                message = self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except Exception as e:
+                if self._stopped.is_set():
+                    break
+                # Connection lost; the client reconnects on the next call
+                logger.warning(f"Lost job events from the broker: {e}")
+                self._stopped.wait(1)
+                continue
+            if message:
+                _call_on_main_loop(_apply_event, json.loads(message["data"]))
+
+    def stop(self):
+        self._stopped.set()
+        # Closing the subscription wakes the thread if it is waiting for a message
+        self._pubsub.close()
+        self.join(timeout=5)
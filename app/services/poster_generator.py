@@ -1,94 +1,312 @@
-import subprocess
+import asyncio
+import os
+import signal
 import logging
+from collections import deque
 from datetime import datetime
-from pathlib import Path
+from typing import Dict
 from ..config import settings
-from ..models import JobStatus
-from .job_manager import update_job
+from ..models import JobClass, JobStatus, RenderQuality
+from .job_manager import load_job, shares_jobs, update_job, set_job_preview, wait_for_job_change
+from .scheduler import MB, plan_job, scheduler
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Printed by create_map_poster.py once its --preview-output file is written
+PREVIEW_MARKER = "PREVIEW_READY"
 
-def generate_poster_task(job_id: str, request):
+GENERATION_TIMEOUT_SECONDS = 300
+
+# Output DPI by quality (create_map_poster.py renders at 72 DPI with --preview)
+RENDER_DPI = {RenderQuality.PREVIEW: 72, RenderQuality.PRINT: 300}
+
+# How often a running generator's resident memory is checked against its limit
+RSS_POLL_SECONDS = 0.5
+
+# How long a generator gets to exit after SIGTERM before it is SIGKILLed
+KILL_GRACE_SECONDS = 5
+
+# Longest between re-reads of a running job's record, in case a cancel event was missed
+CANCEL_CHECK_SECONDS = 30
+
+# Lines of stderr kept for the error message of a failed job
+STDERR_TAIL_LINES = 20
+
+# create_map_poster.py output line prefix -> (progress, message). Progress only
+# ever moves forward, so stages skipped on a cache hit are simply never seen.
+PROGRESS_STAGES = [
+    ("Looking up coordinates", 10, "Looking up location..."),
+    ("Checking cache", 15, "Checking map data cache..."),
+    ("  Cache miss", 20, "Fetching map data from OpenStreetMap..."),
+    ("✓ All data downloaded", 40, "Map data downloaded"),
+    ("✓ All data read", 40, "Map data read from the local extract"),
+    ("✓ Cache hit", 40, "Using cached map data"),
+    ("✓ Using cached base map", 60, "Using cached base map..."),
+    (PREVIEW_MARKER, 50, "Preview ready, rendering full poster..."),
+    ("Rendering map", 60, "Rendering poster..."),
+    ("Saving to", 85, "Saving poster image..."),
+    ("✓ Done!", 95, "Finalizing poster..."),
+]
+
+# Running generation tasks by job ID, so they can be cancelled
+_running: Dict[str, asyncio.Task] = {}
+
+
+def get_city_with_state(request) -> str:
+    """Include state in city name for better geocoding (e.g., "Springfield, Illinois")."""
+    if request.state:
+        return f"{request.city}, {request.state}"
+    return request.city
+
+
+def build_location_args(request) -> list:
+    """Build the create_map_poster.py arguments selecting a request's location and radius."""
+    args = ["--city", get_city_with_state(request), "--country", request.country]
+
+    # Add size/distance options
+    if request.distance:
+        # Manual distance override
+        args.extend(["--distance", str(request.distance)])
+    elif request.size and request.size != "auto":
+        # Size preset
+        args.extend(["--size", request.size])
+    # else: auto mode (default)
+
+    return args
+
+
+def match_progress_stage(line: str):
+    """Return the (progress, message) stage a line of generator output marks, or None."""
+    for prefix, progress, message in PROGRESS_STAGES:
+        if line.startswith(prefix):
+            return progress, message
+    return None
+
+
+def start_poster_job(job_id: str, request) -> asyncio.Task:
+    """
+    Schedule generation of a poster on the running event loop.
+
+    With shared jobs, the generation is stopped once the job is cancelled
+    through any node, not just this one.
+    """
+    task = asyncio.create_task(generate_poster_task(job_id, request))
+    _running[job_id] = task
+    task.add_done_callback(lambda _: _running.pop(job_id, None))
+    if shares_jobs():
+        watcher = asyncio.create_task(_cancel_when_requested(job_id, task))
+        task.add_done_callback(lambda _: watcher.cancel())
+    return task
+
+
+async def _cancel_when_requested(job_id: str, task: asyncio.Task):
+    """Stop a job's generation once the job is cancelled through any node."""
+    while not task.done():
+        # Re-read each time: covers a cancel event this node missed
+        job = await load_job(job_id)
+        if job is None:
+            return
+        if job["status"] == JobStatus.CANCELLED:
+            await cancel_poster_job(job_id)
+            return
+        await wait_for_job_change(job_id, job["version"], CANCEL_CHECK_SECONDS)
+
+
+async def cancel_poster_job(job_id: str) -> bool:
+    """
+    Cancel a running generation and wait until its process is gone.
+
+    Returns False if the job has no generation running.
+    """
+    task = _running.get(job_id)
+    if task is None or task.done():
+        return False
+
+    task.cancel()
+    await asyncio.wait([task])
+    return True
+
+
+def _signal_process_group(process, sig):
+    try:
+        if os.name == "posix":
+            os.killpg(process.pid, sig)
+        else:
+            process.kill()
+    except ProcessLookupError:
+        pass
+
+
+class MemoryLimitExceeded(Exception):
+    """A generator grew past its memory limit and was stopped."""
+
+
+def _rss_bytes(pid: int):
+    """Resident memory of a process, or None where /proc isn't available."""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+async def _terminate(process):
+    """Stop a generator and everything it spawned: SIGTERM, then SIGKILL after a grace period."""
+    if process.returncode is not None:
+        return
+    _signal_process_group(process, signal.SIGTERM)
+    try:
+        await asyncio.wait_for(process.wait(), timeout=KILL_GRACE_SECONDS)
+    except asyncio.TimeoutError:
+        _signal_process_group(process, signal.SIGKILL)
+        await process.wait()
+
+
+async def _run_generator(job_id: str, cmd: list, preview_file, rss_limit_bytes: int = None) -> tuple:
+    """
+    Run create_map_poster.py, turning its output into job progress as it streams.
+
+    The generator runs in its own session so that on timeout or cancellation
+    the whole process group is killed. With rss_limit_bytes it is also
+    stopped as soon as its resident memory passes the limit, well before
+    the kernel's OOM killer would pick a victim.
+
+    Returns:
+        (returncode, stderr tail)
+
+    Raises:
+        MemoryLimitExceeded: if the generator was stopped for its memory use
+    """
+    process = await asyncio.create_subprocess_exec(
+        *cmd,
+        cwd=str(settings.maptoposter_dir),
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        start_new_session=os.name == "posix",
+        env={**os.environ, "PYTHONUNBUFFERED": "1", "TQDM_DISABLE": "1"},
+    )
+    stderr_tail = deque(maxlen=STDERR_TAIL_LINES)
+    progress = 5
+
+    async def read_stdout():
+        nonlocal progress
+        async for raw in process.stdout:
+            line = raw.decode(errors="replace").rstrip()
+            if not line:
+                continue
+            logger.info(f"[{job_id}] {line}")
+
+            if line.startswith(PREVIEW_MARKER) and preview_file.exists():
+                set_job_preview(job_id, str(preview_file))
+
+            stage = match_progress_stage(line)
+            if stage and stage[0] > progress:
+                progress = stage[0]
+                update_job(job_id, progress=progress, message=stage[1])
+
+    async def read_stderr():
+        async for raw in process.stderr:
+            line = raw.decode(errors="replace").rstrip()
+            # Skip progress bar redraws
+            if line and "\r" not in line:
+                stderr_tail.append(line)
+                logger.warning(f"[{job_id}] stderr: {line}")
+
+    peak_rss = 0
+
+    async def watch_memory():
+        nonlocal peak_rss
+        while process.returncode is None:
+            rss = _rss_bytes(process.pid)
+            if rss is None:
+                return
+            peak_rss = max(peak_rss, rss)
+            if rss > rss_limit_bytes:
+                logger.error(f"[{job_id}] Using {rss // MB} MB, over its {rss_limit_bytes // MB} MB limit")
+                await _terminate(process)
+                return
+            await asyncio.sleep(RSS_POLL_SECONDS)
+
+    watchdog = asyncio.create_task(watch_memory()) if rss_limit_bytes else None
+    try:
+        await asyncio.gather(read_stdout(), read_stderr())
+        returncode = await process.wait()
+    finally:
+        if watchdog:
+            watchdog.cancel()
+        # Timed out or cancelled: don't leave the generator running
+        await _terminate(process)
+
+    if rss_limit_bytes and peak_rss > rss_limit_bytes:
+        raise MemoryLimitExceeded(
+            f"Rendering used more than its {rss_limit_bytes // MB} MB memory limit; try a smaller size"
+        )
+    return returncode, "\n".join(stderr_tail)
+
+
+async def generate_poster_task(job_id: str, request):
     """Background task to generate a poster."""
     try:
-        # Include state in city name for better geocoding (e.g., "Springfield, Illinois")
-        city_with_state = request.city
-        if request.state:
-            city_with_state = f"{request.city}, {request.state}"
+        city_with_state = get_city_with_state(request)
 
         logger.info(f"[{job_id}] Starting poster generation for {city_with_state}, {request.country}")
-        update_job(job_id, status=JobStatus.PROCESSING, progress=5, message="Initializing...")
-
-        output_file = settings.data_dir / f"{job_id}.png"
-
-        # Build command
-        cmd = [
-            "python3",
-            str(settings.maptoposter_dir / "create_map_poster.py"),
-            "--city",
-            city_with_state,
-            "--country",
-            request.country,
-            "--theme",
-            request.theme,
-            "--preview",  # Use low-res (72 DPI) until stable build
-        ]
-
-        # Add size/distance options
-        if request.distance:
-            # Manual distance override
-            cmd.extend(["--distance", str(request.distance)])
-        elif request.size and request.size != "auto":
-            # Size preset
-            cmd.extend(["--size", request.size])
-        # else: auto mode (default)
-
-        logger.info(f"[{job_id}] Running command: {' '.join(cmd)}")
-        update_job(job_id, progress=15, message="Fetching map data from OpenStreetMap...")
-
-        # Run maptoposter as subprocess with longer timeout
-        result = subprocess.run(
-            cmd,
-            cwd=str(settings.maptoposter_dir),
-            capture_output=True,
-            text=True,
-            timeout=300,  # 5 minute timeout
-        )
 
-        logger.info(f"[{job_id}] Subprocess completed with return code: {result.returncode}")
-        if result.stdout:
-            logger.info(f"[{job_id}] stdout: {result.stdout[:500]}")
-        if result.stderr:
-            logger.warning(f"[{job_id}] stderr: {result.stderr[:500]}")
+        # Raises MemoryBudgetError if the poster can't be rendered on this machine
+        plan = plan_job(request, RENDER_DPI[request.quality], scheduler.budget_bytes)
+        logger.info(
+            f"[{job_id}] Predicted peak memory {plan.predicted_bytes // MB} MB "
+            f"(limit {plan.rss_limit_bytes // MB} MB)"
+        )
+        if not scheduler.can_start(plan.predicted_bytes):
+            update_job(job_id, message="Waiting in queue...")
 
-        update_job(job_id, progress=80, message="Finalizing poster...")
+        job_class = JobClass(request.quality.value)
+        client = (await load_job(job_id) or {}).get("client")
+        async with scheduler.reserve(job_id, plan.predicted_bytes, job_class, client) as waited:
+            logger.info(f"[{job_id}] Started after {waited:.1f}s in the {job_class.value} queue")
+            message = "Initializing..."
+            if plan.downgraded_to:
+                logger.info(f"[{job_id}] Downgraded to size '{plan.downgraded_to}' to fit the memory budget")
+                message = f"Rendering at size '{plan.downgraded_to}' to fit available memory..."
+            update_job(
+                job_id, status=JobStatus.PROCESSING, progress=5, message=message,
+                queue_wait_seconds=round(waited, 1),
+            )
 
-        if result.returncode != 0:
-            raise Exception(f"Generation failed: {result.stderr}")
+            output_file = settings.data_dir / f"{job_id}.png"
+            preview_file = settings.data_dir / f"{job_id}.preview.png"
 
-        # Find the generated file (maptoposter saves to posters/ with timestamp)
-        posters_dir = settings.maptoposter_dir / "posters"
+            # Build command
+            cmd = [
+                "python3",
+                str(settings.maptoposter_dir / "create_map_poster.py"),
+                *plan.location_args,
+                "--theme",
+                request.theme,
+                "--output",
+                str(output_file),
+                "--preview-output",
+                str(preview_file),
+                "--data-source",
+                settings.map_data_source,
+            ]
+            if request.quality == RenderQuality.PREVIEW:
+                cmd.append("--preview")  # Low-res (72 DPI)
 
-        # Get all recent PNG files and find the one matching our theme
-        # maptoposter filename format varies, so we look for theme name in recent files
-        all_pngs = list(posters_dir.glob(f"*_{request.theme}_*.png"))
+            logger.info(f"[{job_id}] Running command: {' '.join(cmd)}")
 
-        # Filter to files created in the last 10 minutes
-        import time
-        recent_cutoff = time.time() - 600  # 10 minutes ago
-        matching_files = [f for f in all_pngs if f.stat().st_mtime > recent_cutoff]
+            returncode, stderr = await asyncio.wait_for(
+                _run_generator(job_id, cmd, preview_file, plan.rss_limit_bytes),
+                timeout=GENERATION_TIMEOUT_SECONDS,
+            )
+        logger.info(f"[{job_id}] Subprocess completed with return code: {returncode}")
 
-        logger.info(f"[{job_id}] Found {len(matching_files)} recent files matching theme '{request.theme}'")
+        if returncode != 0:
+            raise Exception(f"Generation failed: {stderr}")
 
-        if matching_files:
-            latest_file = max(matching_files, key=lambda f: f.stat().st_mtime)
-            logger.info(f"[{job_id}] Moving {latest_file} to {output_file}")
-            # Move to our output directory
-            latest_file.rename(output_file)
-        else:
+        if not output_file.exists():
             raise Exception("Generated poster file not found")
 
         logger.info(f"[{job_id}] Poster generation completed successfully")
@@ -100,13 +318,22 @@ def generate_poster_task(job_id: str, request):
             completed_at=datetime.utcnow().isoformat(),
         )
 
-    except subprocess.TimeoutExpired as e:
-        logger.error(f"[{job_id}] Timeout after 5 minutes")
+    except asyncio.TimeoutError:
+        logger.error(f"[{job_id}] Timeout after {GENERATION_TIMEOUT_SECONDS} seconds")
         update_job(
             job_id,
             status=JobStatus.FAILED,
             error="Generation timed out (exceeded 5 minutes)",
         )
+    except asyncio.CancelledError:
+        logger.info(f"[{job_id}] Cancelled")
+        update_job(
+            job_id,
+            status=JobStatus.CANCELLED,
+            message="Generation cancelled",
+            completed_at=datetime.utcnow().isoformat(),
+        )
+        raise
     except Exception as e:
         logger.error(f"[{job_id}] Error: {str(e)}")
         update_job(job_id, status=JobStatus.FAILED, error=str(e))
@@ -0,0 +1,74 @@
+"""
+Cache-affinity routing of render jobs to workers.
+
+Each render worker keeps its own cache directory and in-memory map data,
+so a job for a location a worker has rendered before is much cheaper on
+that worker than anywhere else. Jobs are therefore routed by consistent
+hashing on the normalized location key: every worker owns VIRTUAL_NODES
+points on a hash ring, and a location belongs to the first worker point at
+or after the location's hash. Repeat orders for a city land on the same
+worker, and when a worker joins or leaves only the locations on the arcs
+it gains or loses move, about 1/N of them, so the rest of the fleet keeps
+its cache hits.
+
+When the preferred worker is saturated, the job spills over to the next
+distinct workers around the ring, which gives each location a stable
+second choice too (see job_manager.enqueue_job).
+"""
+
+import hashlib
+from bisect import bisect_left
+from typing import Iterable, List, Optional
+
+# Points per worker on the ring; more spreads locations more evenly
+VIRTUAL_NODES = 64
+
+
+def location_key(city: str, country: str, state: Optional[str] = None) -> str:
+    """Normalized location of a job, as in the generator's cache keys (without the radius)."""
+    city_with_state = f"{city}, {state}" if state else city
+    city_slug = city_with_state.lower().replace(" ", "_").replace(",", "")
+    return f"{city_slug}_{country.lower().replace(' ', '_')}"
+
+
+def _hash(value: str) -> int:
+    # Stable across processes and machines, unlike hash(); matches routing.js
+    return int.from_bytes(hashlib.sha1(value.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent hash ring of worker IDs."""
+
+    def __init__(self, nodes: Iterable[str] = (), virtual_nodes: int = VIRTUAL_NODES):
+        self.virtual_nodes = virtual_nodes
+        self.nodes = set()
+        self._points = []  # sorted (hash, node)
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node: str):
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        self._points.extend((_hash(f"{node}#{i}"), node) for i in range(self.virtual_nodes))
+        self._points.sort()
+
+    def remove(self, node: str):
+        if node not in self.nodes:
+            return
+        self.nodes.discard(node)
+        self._points = [point for point in self._points if point[1] != node]
+
+    def preference(self, key: str) -> List[str]:
+        """Every worker, in the order a key tries them: its owner first, then clockwise."""
+        if not self._points:
+            return []
+        start = bisect_left(self._points, (_hash(key), ""))
+        order = []
+        for i in range(len(self._points)):
+            node = self._points[(start + i) % len(self._points)][1]
+            if node not in order:
+                order.append(node)
+                if len(order) == len(self.nodes):
+                    break
+        return order
@@ -0,0 +1,339 @@
+"""
+Memory-aware, prioritized admission of render jobs.
+
+A neighbourhood preview and a 35 km print render differ in peak memory by
+well over an order of magnitude, so running a fixed number of generators
+either leaves the machine idle or gets it OOM-killed. Each job's peak
+memory is predicted up front from its radius, DPI and, when the location
+is already cached, the size of its cached layers. Jobs are then admitted
+against a machine-wide byte budget: the most urgent waiting job starts as
+soon as its prediction fits next to those already running (see
+JobScheduler for how urgency, aging and per-client fairness decide which
+job that is).
+
+Jobs whose prediction exceeds the whole budget are downgraded to a smaller
+size preset when the customer left the size on auto, and fail up front
+otherwise. While running, each generator's RSS is held to its prediction
+plus headroom (see poster_generator._run_generator), so a job that was
+underestimated fails on its own instead of taking the machine down.
+"""
+
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Optional
+
+from ..config import settings
+from ..models import JobClass
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+# Interpreter plus numpy/shapely/matplotlib/osmnx once imported
+BASE_BYTES = 350 * MB
+
+# Canvas RGBA buffer, the composed figure and the PNG encoder's copies
+RASTER_BYTES_PER_PIXEL = 16
+
+# Downloading and simplifying a street network, per km² of map (cache miss)
+DOWNLOAD_BYTES_PER_KM2 = MB // 2
+
+# In-memory size of map data relative to its cache entry on disk
+CACHED_EXPANSION = 4
+
+# Auto-sized jobs whose location hasn't been cached yet are planned for the
+# largest radius the generator's auto sizing can pick (see get_coordinates)
+AUTO_MAX_DISTANCE = 50000
+
+# Poster size in inches (portrait, the only format the API renders)
+FIGSIZE = (12, 16)
+
+# Lower = more urgent: someone is watching a preview, a print was paid for,
+# nobody is waiting on cache warming
+LANE_RANKS = {
+    JobClass.PREVIEW: 0,
+    JobClass.PRINT: 1,
+    JobClass.BACKGROUND: 2,
+}
+
+# A waiting job moves up one lane per this many seconds
+AGING_SECONDS = 60
+
+# Mirrors SIZE_PRESETS in create_map_poster.py, smallest first
+SIZE_PRESETS = {
+    "neighborhood": 2000,
+    "small": 4000,
+    "town": 6000,
+    "city": 12000,
+    "metro": 20000,
+    "region": 35000,
+}
+
+
+class MemoryBudgetError(Exception):
+    """A job is predicted to need more memory than the machine can give it."""
+
+
+@dataclass
+class JobPlan:
+    """How a job will run: its radius arguments and predicted peak memory."""
+
+    location_args: list
+    predicted_bytes: int
+    rss_limit_bytes: int
+    downgraded_to: Optional[str] = None
+
+
+def memory_budget_bytes() -> int:
+    """Machine-wide memory budget for render jobs (settings.memory_budget_mb, else 75% of RAM)."""
+    if settings.memory_budget_mb > 0:
+        return settings.memory_budget_mb * MB
+    try:
+        total = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        total = 4096 * MB
+    return int(total * 0.75)
+
+
+def predict_job_bytes(dist: int, dpi: int, cached_bytes: Optional[int] = None) -> int:
+    """
+    Predicted peak memory of a render.
+
+    Args:
+        dist: Map radius in meters
+        dpi: Output DPI
+        cached_bytes: On-disk size of the location's cache entry, if cached
+    """
+    width, height = FIGSIZE
+    pixels = width * height * dpi * dpi
+    if cached_bytes is not None:
+        data = cached_bytes * CACHED_EXPANSION
+    else:
+        # The long side spans ±dist, the short side is cut to the aspect ratio
+        area_km2 = (2 * dist / 1000) ** 2 * min(width, height) / max(width, height)
+        data = int(area_km2 * DOWNLOAD_BYTES_PER_KM2)
+    return BASE_BYTES + pixels * RASTER_BYTES_PER_PIXEL + data
+
+
+def cached_location(city: str, country: str, distance: Optional[int] = None):
+    """
+    (distance, size in bytes) of the most recently used cache entry for a
+    location, or None. Reads the generator's cache index without locking it.
+    """
+    index = settings.maptoposter_dir / "cache" / "index.db"
+    if not index.exists():
+        return None
+    # Same normalization as cache.get_cache_key
+    query = "SELECT distance, size_bytes FROM entries WHERE city_slug = ? AND country_slug = ?"
+    params = [city.lower().replace(" ", "_").replace(",", ""), country.lower().replace(" ", "_")]
+    if distance is not None:
+        query += " AND distance = ?"
+        params.append(distance)
+    try:
+        conn = sqlite3.connect(f"{index.as_uri()}?mode=ro", uri=True, timeout=1)
+        try:
+            row = conn.execute(query + " ORDER BY last_access DESC LIMIT 1", params).fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.warning(f"Could not read cache index for memory prediction: {e}")
+        return None
+    return tuple(row) if row else None
+
+
+def plan_job(request, dpi: int, budget: int) -> JobPlan:
+    """
+    Decide a job's radius arguments and predicted memory within a budget.
+
+    Unless map data comes from the tiled map store, where roads are streamed
+    tile by tile, auto-sized jobs are capped at the 'city' preset: Overpass
+    and extracts load the whole street network, which OOMs on large metros.
+    Auto-sized jobs too big for the budget are stepped down to the largest
+    size preset that fits; jobs with an explicit size or distance are not
+    changed behind the customer's back.
+
+    Raises:
+        MemoryBudgetError: if no acceptable radius fits the budget
+    """
+    from .poster_generator import build_location_args, get_city_with_state
+
+    city = get_city_with_state(request)
+    size = getattr(request.size, "value", request.size)
+    auto = not request.distance and (not size or size == "auto")
+
+    if request.distance:
+        dist = request.distance
+    elif auto and settings.map_data_source != "tiles":
+        request = request.model_copy(update={"size": "city"})
+        dist = SIZE_PRESETS["city"]
+    elif not auto:
+        dist = SIZE_PRESETS[size]
+    else:
+        cached = cached_location(city, request.country)
+        dist = cached[0] if cached else AUTO_MAX_DISTANCE
+
+    cached = cached_location(city, request.country, dist)
+    predicted = predict_job_bytes(dist, dpi, cached[1] if cached else None)
+    location_args = build_location_args(request)
+    downgraded_to = None
+
+    if predicted > budget:
+        if not auto:
+            raise MemoryBudgetError(
+                f"This poster needs about {predicted // MB} MB, more than the "
+                f"{budget // MB} MB available for rendering; choose a smaller size"
+            )
+        for preset, preset_dist in reversed(SIZE_PRESETS.items()):
+            if preset_dist >= dist:
+                continue
+            cached = cached_location(city, request.country, preset_dist)
+            predicted = predict_job_bytes(preset_dist, dpi, cached[1] if cached else None)
+            if predicted <= budget:
+                downgraded_to = preset
+                location_args = build_location_args(request.model_copy(update={"size": preset}))
+                break
+        else:
+            raise MemoryBudgetError(
+                f"Not enough memory to render this poster ({budget // MB} MB available)"
+            )
+
+    rss_limit = min(int(predicted * settings.job_memory_headroom), budget)
+    return JobPlan(location_args, predicted, rss_limit, downgraded_to)
+
+
+class JobScheduler:
+    """
+    Admission of jobs against a memory budget, by priority lane.
+
+    Of the waiting jobs, the next to start is the one in the most urgent
+    lane (see LANE_RANKS); each AGING_SECONDS a job waits moves it up a
+    lane, so a print or warm job can't be held back forever by a stream of
+    previews. Within a lane, clients with fewer jobs running go first and
+    then jobs in arrival order, so one client's batch can't crowd out
+    everyone else. The next job blocks those behind it until its predicted
+    bytes fit next to the running jobs', so a large job is never starved by
+    small ones either. A job is always admitted onto an idle machine.
+
+    The next job is picked in one place, whenever a job arrives, leaves
+    the queue or finishes, and when the next waiting job moves up a lane,
+    so waiters never have to agree among themselves on who is next.
+    """
+
+    def __init__(self, budget_bytes: int):
+        self.budget_bytes = budget_bytes
+        self.used_bytes = 0
+        self.running = 0
+        self._running_by_client = Counter()
+        self._waiting = []  # _Waiter, in arrival order
+        self._aging_timer: Optional[asyncio.TimerHandle] = None
+
+    def _fits(self, nbytes: int) -> bool:
+        return self.running == 0 or self.used_bytes + nbytes <= self.budget_bytes
+
+    def _lane(self, waiter: "_Waiter", now: float) -> int:
+        """Lane rank of a waiting job after aging."""
+        promoted = int((now - waiter.enqueued) // AGING_SECONDS)
+        return max(0, LANE_RANKS[waiter.job_class] - promoted)
+
+    def _next(self, now: float) -> Optional["_Waiter"]:
+        return min(
+            self._waiting,
+            key=lambda w: (self._lane(w, now), self._running_by_client[w.client], w.enqueued),
+            default=None,
+        )
+
+    def _admit(self):
+        """Start waiting jobs, most urgent first, for as long as the next one fits."""
+        if self._aging_timer is not None:
+            self._aging_timer.cancel()
+            self._aging_timer = None
+        now = time.monotonic()
+        while True:
+            waiter = self._next(now)
+            if waiter is None:
+                return
+            if not self._fits(waiter.nbytes):
+                break
+            self._waiting.remove(waiter)
+            self.used_bytes += waiter.nbytes
+            self.running += 1
+            self._running_by_client[waiter.client] += 1
+            waiter.admitted.set_result(None)
+
+        # Aging may make a job that fits the next one before anything finishes
+        boundaries = [
+            w.enqueued + ((now - w.enqueued) // AGING_SECONDS + 1) * AGING_SECONDS
+            for w in self._waiting
+            if self._lane(w, now) > 0
+        ]
+        if boundaries:
+            self._aging_timer = asyncio.get_running_loop().call_later(min(boundaries) - now, self._admit)
+
+    def _release(self, waiter: "_Waiter"):
+        self.used_bytes -= waiter.nbytes
+        self.running -= 1
+        self._running_by_client[waiter.client] -= 1
+        self._admit()
+
+    def can_start(self, nbytes: int) -> bool:
+        """True if a job of nbytes arriving now would start without waiting."""
+        return not self._waiting and self._fits(nbytes)
+
+    @asynccontextmanager
+    async def reserve(self, job_id: str, nbytes: int, job_class: JobClass = JobClass.PREVIEW, client: str = None):
+        """
+        Wait until a job is next and fits the budget, and hold its bytes while it runs.
+
+        Yields:
+            Seconds the job waited
+        """
+        waiter = _Waiter(
+            job_id, nbytes, JobClass(job_class), client, time.monotonic(),
+            asyncio.get_running_loop().create_future(),
+        )
+        self._waiting.append(waiter)
+        self._admit()
+        try:
+            await waiter.admitted
+        except BaseException:
+            if waiter in self._waiting:
+                self._waiting.remove(waiter)
+                # Another job may be next now, and may fit
+                self._admit()
+            else:
+                # Admitted just as it was cancelled
+                self._release(waiter)
+            raise
+        try:
+            yield time.monotonic() - waiter.enqueued
+        finally:
+            self._release(waiter)
+
+    def stats(self) -> dict:
+        waiting = Counter(w.job_class.value for w in self._waiting)
+        return {
+            "budget_bytes": self.budget_bytes,
+            "used_bytes": self.used_bytes,
+            "running": self.running,
+            "waiting": len(self._waiting),
+            "waiting_by_class": {job_class.value: waiting[job_class.value] for job_class in JobClass},
+        }
+
+
+@dataclass(eq=False)
+class _Waiter:
+    job_id: str
+    nbytes: int
+    job_class: JobClass
+    client: Optional[str]
+    enqueued: float
+    admitted: asyncio.Future
+
+
+scheduler = JobScheduler(memory_budget_bytes())
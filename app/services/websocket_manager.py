@@ -7,6 +7,7 @@ import json
 import logging
 from typing import Dict, Set
 from fastapi import WebSocket
+from ..models import JobStatus
 
 logger = logging.getLogger(__name__)
 
@@ -65,6 +66,25 @@ class ConnectionManager:
 manager = ConnectionManager()
 
 
+def job_update_message(job_id: str, job: dict) -> dict:
+    """The job_update message describing a job's current state."""
+    payload = {
+        "type": "job_update",
+        "job_id": job_id,
+        "status": job["status"],
+        "progress": job.get("progress", 0),
+    }
+    if job.get("message"):
+        payload["message"] = job["message"]
+    if job["status"] == JobStatus.COMPLETED:
+        payload["download_url"] = f"/api/posters/{job_id}"
+    if job.get("error"):
+        payload["error"] = job["error"]
+    if job.get("preview_file"):
+        payload["preview_url"] = f"/api/posters/{job_id}/preview"
+    return payload
+
+
 async def notify_job_update(job_id: str, status: str, progress: int, message: str = None, error: str = None, download_url: str = None):
     """
     Notify all connected clients about a job update.
@@ -84,3 +104,15 @@ async def notify_job_update(job_id: str, status: str, progress: int, message: st
         payload["download_url"] = download_url
 
     await manager.broadcast_to_job(job_id, payload)
+
+
+async def notify_job_preview(job_id: str, preview_url: str):
+    """
+    Tell connected clients that a quick preview of the poster is available.
+    Called from job_manager.set_job_preview().
+    """
+    await manager.broadcast_to_job(job_id, {
+        "type": "preview",
+        "job_id": job_id,
+        "preview_url": preview_url,
+    })
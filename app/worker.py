@@ -0,0 +1,123 @@
+"""
+Render worker: runs queued poster jobs for the API nodes.
+
+With BROKER_URL and REMOTE_RENDER set on the API nodes, new jobs are put
+on the broker's render queue instead of rendered by the node that took
+the order. Run any number of workers on other machines:
+
+    BROKER_URL=redis://broker:6379/0 python -m app.worker
+
+Jobs are routed by location, so repeat orders for a city reach the worker
+that already has its map data cached (see job_manager.enqueue_job). Each
+worker sends a heartbeat to stay in the fleet; the jobs queued for a
+worker that leaves or stops sending heartbeats move to the shared queue.
+
+Each worker takes jobs while its memory scheduler has room for them,
+renders them exactly as an API node would, and reports progress and
+results through the shared job records, so status requests, event streams
+and WebSockets work on every API node. Posters are written to DATA_DIR,
+which the API nodes must share (e.g. a network volume). A job cancelled
+through the API is stopped on whichever worker is running it.
+"""
+
+import asyncio
+import logging
+import signal
+
+from .config import settings
+from .models import JobStatus, PosterRequest
+from .services import job_manager
+from .services.broker import connect
+from .services.cache_warmer import warmer
+from .services.poster_generator import start_poster_job
+from .services.scheduler import scheduler
+
+logger = logging.getLogger(__name__)
+
+# Longest a BRPOP blocks, so shutdown is noticed
+DEQUEUE_TIMEOUT_SECONDS = 5
+
+# How often to check whether the scheduler has room for another job
+ADMIT_POLL_SECONDS = 0.5
+
+# How often a worker sends its heartbeat and retires workers that stopped sending theirs
+HEARTBEAT_SECONDS = 10
+
+async def _send_heartbeats():
+    """Keep this worker in the fleet, and retire the workers that left it without notice."""
+    while True:
+        await asyncio.to_thread(job_manager.register_worker, job_manager.worker_id)
+        await asyncio.to_thread(job_manager.reap_workers)
+        await asyncio.sleep(HEARTBEAT_SECONDS)
+
+
+async def run_worker(stop: asyncio.Event):
+    """Take and render queued jobs until stop is set, then wait for the running ones."""
+    running = set()
+    await asyncio.to_thread(job_manager.register_worker, job_manager.worker_id)
+    heartbeats = asyncio.create_task(_send_heartbeats())
+    try:
+        await _take_jobs(stop, running)
+    finally:
+        heartbeats.cancel()
+        # Jobs routed here but not yet taken go to the other workers
+        await asyncio.to_thread(job_manager.retire_worker, job_manager.worker_id)
+
+    if running:
+        logger.info(f"Waiting for {len(running)} running job(s)")
+        await asyncio.gather(*running, return_exceptions=True)
+
+
+async def _take_jobs(stop: asyncio.Event, running: set):
+    while not stop.is_set():
+        # Leave queued jobs for other workers while ours wait for memory
+        if scheduler.stats()["waiting"]:
+            await asyncio.sleep(ADMIT_POLL_SECONDS)
+            continue
+
+        job_id = await asyncio.to_thread(
+            job_manager.dequeue_job, DEQUEUE_TIMEOUT_SECONDS, job_manager.worker_id
+        )
+        if job_id is None:
+            continue
+        job = await job_manager.load_job(job_id)
+        if job is None or job["status"] != JobStatus.PENDING:
+            # Expired or cancelled while queued
+            logger.info(f"[{job_id}] Skipped: no longer pending")
+            continue
+
+        logger.info(f"[{job_id}] Taken by worker {job_manager.worker_id}")
+        task = start_poster_job(job_id, PosterRequest(**job["request"]))
+        running.add(task)
+        # Stopped by start_poster_job's watcher if cancelled through an API node
+        task.add_done_callback(running.discard)
+        # Let the job plan itself and reach the scheduler before looking for another
+        await asyncio.sleep(0)
+
+
+async def main():
+    if not settings.broker_url:
+        raise SystemExit("Set BROKER_URL to the broker the API nodes use")
+
+    loop = asyncio.get_running_loop()
+    # No WebSocket clients here, but events from the API nodes are applied on this loop
+    job_manager.set_notify_callback(None, loop)
+    job_manager.use_broker(connect(settings.broker_url))
+    if settings.warm_enabled:
+        warmer.start(routed=True)
+
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    logger.info(f"Render worker {job_manager.worker_id} started")
+    try:
+        await run_worker(stop)
+    finally:
+        await warmer.stop()
+        job_manager.use_broker(None)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=settings.log_level)
+    asyncio.run(main())
@@ -2,25 +2,146 @@
 Cache module for map data.
 
 Caches OSMnx graph and feature data to avoid repeated API calls.
-Cache key format: {city}_{country}_{distance}
+Cache key format: {city}_{country}_{distance}[_{variant}]
+
+Each entry lives in its own directory (meta.json plus one pickle per layer).
+Layers (graph, water, parks) are validated and expire independently, so a
+partially cached location only needs its missing or stale layers fetched.
+Layer pickles can be compressed with lz4 or zstd (see CODECS); the codec is
+recorded per layer in meta.json so entries with mixed codecs stay readable.
+An entry can also hold rasterised base maps per theme and DPI, which are
+dropped whenever its layers are re-saved.
+Entries are written to a hidden temp directory and published with a rename,
+so readers never see a half-written entry; cache_lock() serializes the
+download of one key across processes.
+A SQLite index (cache/index.db) mirrors the metadata of every entry so that
+lookups, validation and listing are indexed queries instead of directory
+scans. meta.json stays the source of truth: the index is rebuilt from it
+whenever it is missing or its schema changes.
 """
 
+import atexit
 import os
+import sys
 import pickle
 import json
-import hashlib
+import math
+import shutil
+import io
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from pathlib import Path
 
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to no cross-process locking
+    fcntl = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 CACHE_DIR = Path("cache")
 CACHE_EXPIRY_DAYS = 30
 
+# Total on-disk budget; least-recently-used entries are evicted beyond it
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", 2 * 1024 ** 3))
+
+INDEX_FILE = "index.db"
+INDEX_VERSION = 4
+
+# Cached layers and their data files. New layers only need an entry here
+# (and a fetcher in create_map_poster.LAYER_FETCHERS).
+LAYER_FILES = {
+    "graph": "graph.pkl",
+    "water": "water.pkl",
+    "parks": "parks.pkl",
+}
+LAYERS = tuple(LAYER_FILES)
+
+# Compression codecs for layer pickles: name -> zstd level (None = not zstd)
+CODECS = {
+    "none": None,
+    "lz4": None,
+    "zstd-1": 1,
+    "zstd-3": 3,
+    "zstd-9": 9,
+    "zstd-19": 19,
+}
+
+# Default codec for new layers, with optional per-layer overrides,
+# e.g. CACHE_LAYER_CODECS="graph=zstd-3,water=lz4"
+CACHE_CODEC = os.environ.get("CACHE_CODEC", "none")
+CACHE_LAYER_CODECS = dict(
+    item.split("=", 1) for item in os.environ.get("CACHE_LAYER_CODECS", "").split(",") if "=" in item
+)
+
+# Rasterised base maps stored alongside an entry's layers (see save_basemap).
+# Raw pixel arrays compress far better and faster with zstd than as PNG.
+BASEMAP_PREFIX = "basemap-"
+BASEMAP_CODEC = "zstd-1"
+
+# Hits served from memory (see record_access) are written to the index at
+# most this often per entry
+ACCESS_FLUSH_SECONDS = 60
+
+_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    cache_key TEXT PRIMARY KEY,
+    city TEXT NOT NULL,
+    country TEXT NOT NULL,
+    city_slug TEXT NOT NULL,
+    country_slug TEXT NOT NULL,
+    distance INTEGER NOT NULL,
+    lat REAL NOT NULL,
+    lon REAL NOT NULL,
+    south REAL NOT NULL,
+    west REAL NOT NULL,
+    north REAL NOT NULL,
+    east REAL NOT NULL,
+    cached_at TEXT NOT NULL,
+    last_access TEXT,
+    size_bytes INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_entries_location ON entries (city_slug, country_slug);
+CREATE TABLE IF NOT EXISTS layers (
+    cache_key TEXT NOT NULL REFERENCES entries (cache_key) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    size_bytes INTEGER NOT NULL DEFAULT 0,
+    cached_at TEXT NOT NULL,
+    codec TEXT NOT NULL DEFAULT 'none',
+    PRIMARY KEY (cache_key, name)
+);
+CREATE INDEX IF NOT EXISTS idx_entries_last_access ON entries (last_access);
+CREATE TABLE IF NOT EXISTS stats (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+def _city_slug(city: str) -> str:
+    return city.lower().replace(" ", "_").replace(",", "")
+
 
-def get_cache_key(city: str, country: str, distance: int) -> str:
-    """Generate a normalized cache key."""
-    city_slug = city.lower().replace(" ", "_").replace(",", "")
-    country_slug = country.lower().replace(" ", "_")
-    return f"{city_slug}_{country_slug}_{distance}"
+def _country_slug(country: str) -> str:
+    return country.lower().replace(" ", "_")
+
+
+def get_cache_key(city: str, country: str, distance: int, variant: str = None) -> str:
+    """Generate a normalized cache key (variant separates differently shaped extents)."""
+    key = f"{_city_slug(city)}_{_country_slug(country)}_{distance}"
+    return f"{key}_{variant}" if variant else key
 
 
 def get_cache_path(cache_key: str) -> Path:
@@ -28,107 +149,509 @@ def get_cache_path(cache_key: str) -> Path:
     return CACHE_DIR / cache_key
 
 
-def is_cache_valid(cache_key: str) -> bool:
-    """Check if cache exists and is not expired."""
+def _bbox_from_point(coords, distance: int):
+    """Approximate (south, west, north, east) of a ±distance box around coords."""
+    lat, lon = coords
+    dlat = distance / 111320
+    dlon = distance / (111320 * max(math.cos(math.radians(lat)), 0.01))
+    return lat - dlat, lon - dlon, lat + dlat, lon + dlon
+
+
+# --- Codecs ----------------------------------------------------------------
+
+def get_layer_codec(name: str, default: str = None) -> str:
+    """Codec to use for newly written data of a layer."""
+    codec = CACHE_LAYER_CODECS.get(name, default or CACHE_CODEC)
+    if codec not in CODECS:
+        print(f"  ⚠ Unknown cache codec '{codec}', storing {name} uncompressed")
+        return "none"
+    if (codec == "lz4" and lz4 is None) or (CODECS[codec] is not None and zstandard is None):
+        print(f"  ⚠ Cache codec '{codec}' is not installed, storing {name} uncompressed")
+        return "none"
+    return codec
+
+
+def dump_layer(data, path: Path, codec: str = "none"):
+    """Pickle data to path, compressing it as a stream with the given codec."""
+    with open(path, "wb") as f:
+        if codec == "none":
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        elif codec == "lz4":
+            with lz4.frame.open(f, "wb") as stream:
+                pickle.dump(data, stream, protocol=pickle.HIGHEST_PROTOCOL)
+        else:
+            compressor = zstandard.ZstdCompressor(level=CODECS[codec])
+            with compressor.stream_writer(f, closefd=False) as stream:
+                pickle.dump(data, stream, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_layer(path: Path, codec: str = "none"):
+    """Unpickle data from path, decompressing it as a stream."""
+    with open(path, "rb") as f:
+        if codec == "none":
+            return pickle.load(f)
+        if codec == "lz4":
+            with lz4.frame.open(f, "rb") as stream:
+                return pickle.load(stream)
+        if codec in CODECS:
+            reader = zstandard.ZstdDecompressor().stream_reader(f, closefd=False)
+            with io.BufferedReader(reader, buffer_size=1 << 20) as stream:
+                return pickle.load(stream)
+    raise ValueError(f"Unknown cache codec '{codec}'")
+
+
+# --- Index -----------------------------------------------------------------
+
+def _create_index(conn):
+    """
+    (Re)create the index schema and populate it from meta.json files.
+
+    Recency survives the rebuild: last_access is carried over from the old
+    index, or for entries it doesn't have, taken from when the entry's
+    files were last read.
+    """
+    try:
+        last_access = dict(conn.execute("SELECT cache_key, last_access FROM entries"))
+    except sqlite3.Error:
+        # No index yet, or one from before last_access was kept
+        last_access = {}
+    conn.executescript("DROP TABLE IF EXISTS layers; DROP TABLE IF EXISTS entries;")
+    conn.executescript(_INDEX_SCHEMA)
+    conn.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+
+    for entry in CACHE_DIR.iterdir():
+        if not entry.is_dir() or entry.name.startswith("."):
+            continue
+        meta_file = entry / "meta.json"
+        if not meta_file.exists():
+            continue
+        try:
+            with open(meta_file, "r") as f:
+                meta = json.load(f)
+            meta["last_access"] = last_access.get(entry.name) or _last_read(entry, meta)
+            _index_entry(conn, entry.name, meta)
+        except Exception as e:
+            print(f"  Cache index: skipping {entry.name} ({e})")
+
+
+def _last_read(entry: Path, meta: dict) -> str:
+    """When an entry's data files were last read or written, going by atime and mtime."""
+    # Not meta.json: rebuilding the index reads it
+    stats = [f.stat() for f in entry.iterdir() if f.is_file() and f.name != "meta.json"]
+    times = [max(stat.st_atime, stat.st_mtime) for stat in stats]
+    if not times:
+        return meta["cached_at"]
+    return max(datetime.fromtimestamp(max(times)).isoformat(), meta["cached_at"])
+
+
+@contextmanager
+def _open_index(directory: Path = None):
+    """Open the cache index (of CACHE_DIR by default), building it on first use. Commits on success."""
+    directory = directory or CACHE_DIR
+    directory.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(directory / INDEX_FILE, timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.execute("PRAGMA foreign_keys = ON")
+        if conn.execute("PRAGMA user_version").fetchone()[0] != INDEX_VERSION:
+            with conn:
+                _create_index(conn)
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def _index_entry(conn, cache_key: str, meta: dict):
+    """Insert or replace the index rows for one entry from its metadata."""
     cache_path = get_cache_path(cache_key)
+    layers = {}
+    for name, filename in LAYER_FILES.items():
+        layer_file = cache_path / filename
+        if layer_file.exists():
+            layers[name] = layer_file.stat().st_size
+
     meta_file = cache_path / "meta.json"
+    size_bytes = sum(layers.values()) + (meta_file.stat().st_size if meta_file.exists() else 0)
+    size_bytes += sum(f.stat().st_size for f in cache_path.glob(f"{BASEMAP_PREFIX}*"))
+    south, west, north, east = _bbox_from_point(meta["coords"], meta["distance"])
 
-    if not meta_file.exists():
-        return False
+    conn.execute("DELETE FROM layers WHERE cache_key = ?", (cache_key,))
+    conn.execute(
+        """
+        INSERT OR REPLACE INTO entries (
+            cache_key, city, country, city_slug, country_slug, distance,
+            lat, lon, south, west, north, east, cached_at, last_access, size_bytes
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (
+            cache_key, meta["city"], meta["country"],
+            _city_slug(meta["city"]), _country_slug(meta["country"]), meta["distance"],
+            meta["coords"][0], meta["coords"][1], south, west, north, east,
+            meta["cached_at"], meta.get("last_access", meta["cached_at"]), size_bytes,
+        ),
+    )
+    layer_meta = meta.get("layers", {})
+    conn.executemany(
+        "INSERT INTO layers (cache_key, name, size_bytes, cached_at, codec) VALUES (?, ?, ?, ?, ?)",
+        [
+            (
+                cache_key, name, size,
+                layer_meta.get(name, {}).get("cached_at", meta["cached_at"]),
+                layer_meta.get(name, {}).get("codec", "none"),
+            )
+            for name, size in layers.items()
+        ],
+    )
 
-    try:
-        with open(meta_file, "r") as f:
-            meta = json.load(f)
 
-        cached_time = datetime.fromisoformat(meta["cached_at"])
-        expiry_time = cached_time + timedelta(days=CACHE_EXPIRY_DAYS)
+def _row_to_meta(conn, row) -> dict:
+    """Convert an entries row into the dict shape of meta.json (plus index fields)."""
+    codecs = {
+        r["name"]: r["codec"] for r in conn.execute(
+            "SELECT name, codec FROM layers WHERE cache_key = ? ORDER BY name", (row["cache_key"],)
+        )
+    }
+    return {
+        "cache_key": row["cache_key"],
+        "city": row["city"],
+        "country": row["country"],
+        "distance": row["distance"],
+        "coords": [row["lat"], row["lon"]],
+        "bbox": [row["south"], row["west"], row["north"], row["east"]],
+        "cached_at": row["cached_at"],
+        "last_access": row["last_access"],
+        "size_bytes": row["size_bytes"],
+        "layers": list(codecs),
+        "codecs": codecs,
+    }
 
-        if datetime.now() > expiry_time:
-            print(f"  Cache expired (cached {meta['cached_at']})")
-            return False
 
-        # Check that all data files exist
-        required_files = ["graph.pkl", "meta.json"]
-        for f in required_files:
-            if not (cache_path / f).exists():
-                return False
+def rebuild_index():
+    """Rebuild the cache index from the meta.json files on disk."""
+    with _open_index() as conn:
+        _create_index(conn)
+        count = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+    print(f"✓ Rebuilt cache index ({count} entries)")
+    return count
 
-        return True
-    except Exception as e:
+
+def get_cached_meta(cache_key: str):
+    """
+    Look up the indexed metadata for a cache entry.
+
+    Returns:
+        dict with keys: cache_key, city, country, distance, coords, bbox,
+        cached_at, last_access, size_bytes, layers; or None if not cached
+    """
+    with _open_index() as conn:
+        row = conn.execute("SELECT * FROM entries WHERE cache_key = ?", (cache_key,)).fetchone()
+        return _row_to_meta(conn, row) if row else None
+
+
+def get_fresh_layers(cache_key: str) -> set:
+    """Return the names of the layers of an entry that are cached and not expired."""
+    return set(_fresh_layer_times(cache_key))
+
+
+def _fresh_layer_times(cache_key: str) -> dict:
+    """When each cached, unexpired layer of an entry was downloaded, by name."""
+    cutoff = _expiry_cutoff()
+    try:
+        with _open_index() as conn:
+            rows = conn.execute(
+                "SELECT name, cached_at FROM layers WHERE cache_key = ?", (cache_key,)
+            ).fetchall()
+    except sqlite3.Error as e:
         print(f"  Cache validation error: {e}")
-        return False
+        return {}
+
+    fresh = {}
+    for row in rows:
+        if row["cached_at"] >= cutoff:
+            fresh[row["name"]] = row["cached_at"]
+        else:
+            print(f"  Cached {row['name']} expired (cached {row['cached_at']})")
+    return fresh
 
 
-def load_from_cache(cache_key: str):
+def is_cache_valid(cache_key: str) -> bool:
+    """Check if the entry's street network is cached and not expired."""
+    return "graph" in get_fresh_layers(cache_key)
+
+
+def _drop_from_index(cache_key: str):
+    with _open_index() as conn:
+        conn.execute("DELETE FROM entries WHERE cache_key = ?", (cache_key,))
+
+
+def _increment(conn, name: str, amount: int = 1):
+    conn.execute(
+        "INSERT INTO stats (name, value) VALUES (?, ?) "
+        "ON CONFLICT (name) DO UPDATE SET value = value + excluded.value",
+        (name, amount),
+    )
+
+
+def _record_stat(name: str, enabled: bool = True):
+    if not enabled:
+        return
+    try:
+        with _open_index() as conn:
+            _increment(conn, name)
+    except sqlite3.Error:
+        pass
+
+
+def load_layers(cache_key: str, layers=LAYERS, record_stats: bool = True):
     """
-    Load cached map data.
+    Load whichever of the requested layers are cached and fresh.
+
+    Args:
+        layers: layer names to load
+        record_stats: count this lookup towards the hit/miss statistics
+            (a hit means every requested layer was available)
 
     Returns:
-        dict with keys: graph, water, parks, coords, city, country, distance
-        or None if cache miss
+        dict with keys: layers (name -> data, only fresh ones), layer_cached_at
+        (name -> when it was downloaded, for the loaded layers), coords, city,
+        country, distance, cached_at; or None if nothing usable is cached
     """
-    if not is_cache_valid(cache_key):
+    layer_times = _fresh_layer_times(cache_key)
+    fresh = set(layer_times) & set(layers)
+    complete = fresh == set(layers)
+    if not fresh:
+        _record_stat("misses", record_stats)
         return None
 
     cache_path = get_cache_path(cache_key)
 
     try:
-        # Load metadata
-        with open(cache_path / "meta.json", "r") as f:
-            meta = json.load(f)
-
-        # Load graph
-        with open(cache_path / "graph.pkl", "rb") as f:
-            graph = pickle.load(f)
-
-        # Load water (optional)
-        water = None
-        water_file = cache_path / "water.pkl"
-        if water_file.exists():
-            with open(water_file, "rb") as f:
-                water = pickle.load(f)
-
-        # Load parks (optional)
-        parks = None
-        parks_file = cache_path / "parks.pkl"
-        if parks_file.exists():
-            with open(parks_file, "rb") as f:
-                parks = pickle.load(f)
+        meta = get_cached_meta(cache_key)
+        if meta is None:
+            _record_stat("misses", record_stats)
+            return None
+
+        loaded = {}
+        for name in layers:
+            if name in fresh:
+                loaded[name] = load_layer(cache_path / LAYER_FILES[name], meta["codecs"][name])
+
+        with _open_index() as conn:
+            conn.execute(
+                "UPDATE entries SET last_access = ? WHERE cache_key = ?",
+                (datetime.now().isoformat(), cache_key),
+            )
+            if record_stats:
+                _increment(conn, "hits" if complete else "misses")
 
         return {
-            "graph": graph,
-            "water": water,
-            "parks": parks,
+            "layers": loaded,
+            "layer_cached_at": {name: layer_times[name] for name in loaded},
             "coords": tuple(meta["coords"]),
             "city": meta["city"],
             "country": meta["country"],
             "distance": meta["distance"],
             "cached_at": meta["cached_at"],
         }
+    except FileNotFoundError as e:
+        # Entry was removed behind the index's back - forget it
+        print(f"  Cache load error: {e}")
+        _drop_from_index(cache_key)
+        _record_stat("misses", record_stats)
+        return None
     except Exception as e:
         print(f"  Cache load error: {e}")
+        _record_stat("misses", record_stats)
         return None
 
 
-def save_to_cache(cache_key: str, graph, water, parks, coords, city: str, country: str, distance: int):
-    """Save map data to cache."""
+_pending_access = {}  # (cache dir, cache_key) -> [hits not yet written, monotonic time of the last write]
+_pending_access_lock = threading.Lock()
+
+
+def record_access(cache_key: str):
+    """
+    Count a hit on map data held in memory (see create_map_poster's hot and
+    shared tiers) as a use of the entry: it moves the entry's last_access
+    and the hit statistics the way load_layers does, so entries that are
+    only ever served from memory aren't evicted as unused. Writes are
+    batched, one per entry per ACCESS_FLUSH_SECONDS.
+    """
+    now = time.monotonic()
+    with _pending_access_lock:
+        pending = _pending_access.setdefault((CACHE_DIR, cache_key), [0, None])
+        pending[0] += 1
+        if pending[1] is not None and now - pending[1] < ACCESS_FLUSH_SECONDS:
+            return
+        hits, pending[0], pending[1] = pending[0], 0, now
+    if not _write_access(CACHE_DIR, cache_key, hits):
+        with _pending_access_lock:
+            pending[0] += hits
+
+
+def _write_access(directory: Path, cache_key: str, hits: int) -> bool:
+    try:
+        with _open_index(directory) as conn:
+            conn.execute(
+                "UPDATE entries SET last_access = ? WHERE cache_key = ?",
+                (datetime.now().isoformat(), cache_key),
+            )
+            _increment(conn, "hits", hits)
+    except sqlite3.Error:
+        return False
+    return True
+
+
+@atexit.register
+def flush_access():
+    """Write the memory hits record_access is still holding back."""
+    with _pending_access_lock:
+        pending = {key: hits for key, (hits, _) in _pending_access.items() if hits}
+        _pending_access.clear()
+    for (directory, cache_key), hits in pending.items():
+        if (directory / INDEX_FILE).exists():
+            _write_access(directory, cache_key, hits)
+
+
+def load_from_cache(cache_key: str, record_stats: bool = True):
+    """
+    Load cached map data.
+
+    Args:
+        record_stats: count this lookup towards the hit/miss statistics
+
+    Returns:
+        dict with keys: graph, water, parks, coords, city, country, distance
+        or None if cache miss (no fresh street network)
+    """
+    fresh = get_fresh_layers(cache_key)
+    if "graph" not in fresh:
+        _record_stat("misses", record_stats)
+        return None
+
+    cached = load_layers(cache_key, tuple(fresh), record_stats=record_stats)
+    if cached is None or "graph" not in cached["layers"]:
+        return None
+
+    layers = cached.pop("layers")
+    return {
+        "graph": layers["graph"],
+        "water": layers.get("water"),
+        "parks": layers.get("parks"),
+        **cached,
+    }
+
+
+@contextmanager
+def cache_lock(cache_key: str, blocking: bool = True):
+    """
+    Hold an exclusive, cross-process lock on one cache key.
+
+    A process that finds a cache miss takes the lock, re-checks the cache and
+    only then downloads, so concurrent jobs for the same city wait for and
+    reuse the first download instead of repeating it.
+
+    Lock files are removed with their entry (see _remove_lock_file); a
+    process that was waiting on a removed file starts over on a new one.
+
+    Yields:
+        True once the lock is held; with blocking=False, False instead of
+        waiting if someone else holds it
+    """
+    path = _lock_path(cache_key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    while True:
+        f = open(path, "a")
+        if fcntl:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                f.close()
+                yield False
+                return
+            if not _is_current(f, path):
+                f.close()
+                continue
+        break
+    with f:
+        try:
+            yield True
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _lock_path(cache_key: str) -> Path:
+    return CACHE_DIR / ".locks" / f"{cache_key}.lock"
+
+
+def _is_current(f, path: Path) -> bool:
+    """True if an open lock file is still the one at path (it wasn't removed meanwhile)."""
+    try:
+        return os.path.samestat(os.fstat(f.fileno()), os.stat(path))
+    except FileNotFoundError:
+        return False
+
+
+def _remove_lock_file(cache_key: str):
+    """Delete a key's lock file. Only call while holding cache_lock(cache_key)."""
+    try:
+        _lock_path(cache_key).unlink(missing_ok=True)
+    except OSError:
+        # Windows won't delete a file that is open
+        pass
+
+
+def _publish_entry(tmp_path: Path, cache_path: Path):
+    """Atomically move a fully written temp directory into place."""
+    if cache_path.exists():
+        # A directory can't be renamed over a non-empty one, so move the old
+        # entry aside first; readers in that instant see a plain cache miss.
+        trash_path = CACHE_DIR / f".trash-{cache_path.name}-{uuid.uuid4().hex[:8]}"
+        os.rename(cache_path, trash_path)
+        os.rename(tmp_path, cache_path)
+        shutil.rmtree(trash_path, ignore_errors=True)
+    else:
+        os.rename(tmp_path, cache_path)
+
+
+def save_layers(cache_key: str, layers: dict, coords, city: str, country: str, distance: int):
+    """
+    Save some layers of an entry, keeping its other cached layers.
+
+    The new entry (written layers plus the previous entry's other layers)
+    is assembled in a temp directory and published atomically. Callers that
+    may race on the same key should hold cache_lock(cache_key).
+    """
     cache_path = get_cache_path(cache_key)
-    cache_path.mkdir(parents=True, exist_ok=True)
+    tmp_path = CACHE_DIR / f".tmp-{cache_key}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    tmp_path.mkdir(parents=True)
 
     try:
-        # Save graph
-        with open(cache_path / "graph.pkl", "wb") as f:
-            pickle.dump(graph, f)
+        now = datetime.now().isoformat()
+        layer_meta = {}
 
-        # Save water (if exists)
-        if water is not None:
-            with open(cache_path / "water.pkl", "wb") as f:
-                pickle.dump(water, f)
+        # Carry over the layers we are not replacing
+        previous = get_cached_meta(cache_key)
+        if previous is not None and (cache_path / "meta.json").exists():
+            with open(cache_path / "meta.json", "r") as f:
+                previous_meta = json.load(f)
+            for name in previous["layers"]:
+                if name in layers:
+                    continue
+                try:
+                    os.link(cache_path / LAYER_FILES[name], tmp_path / LAYER_FILES[name])
+                except OSError:
+                    shutil.copy2(cache_path / LAYER_FILES[name], tmp_path / LAYER_FILES[name])
+                layer_meta[name] = previous_meta.get("layers", {}).get(
+                    name, {"cached_at": previous_meta["cached_at"]}
+                )
 
-        # Save parks (if exists)
-        if parks is not None:
-            with open(cache_path / "parks.pkl", "wb") as f:
-                pickle.dump(parks, f)
+        for name, data in layers.items():
+            codec = get_layer_codec(name)
+            dump_layer(data, tmp_path / LAYER_FILES[name], codec)
+            layer_meta[name] = {"cached_at": now, "codec": codec}
 
         # Save metadata
         meta = {
@@ -136,17 +659,104 @@ def save_to_cache(cache_key: str, graph, water, parks, coords, city: str, countr
             "country": country,
             "distance": distance,
             "coords": list(coords),
-            "cached_at": datetime.now().isoformat(),
+            "cached_at": now,
+            "layers": layer_meta,
         }
-        with open(cache_path / "meta.json", "w") as f:
+        with open(tmp_path / "meta.json", "w") as f:
             json.dump(meta, f, indent=2)
 
-        print(f"✓ Saved to cache: {cache_key}")
+        _publish_entry(tmp_path, cache_path)
+
+        with _open_index() as conn:
+            _index_entry(conn, cache_key, meta)
+
+        print(f"✓ Saved to cache: {cache_key} ({', '.join(sorted(layers))})")
+        evict_in_background()
         return True
     except Exception as e:
         print(f"  Cache save error: {e}")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        return False
+
+
+def save_to_cache(cache_key: str, graph, water, parks, coords, city: str, country: str, distance: int):
+    """Save map data to cache. Layers passed as None are left as they are."""
+    layers = {
+        name: data
+        for name, data in (("graph", graph), ("water", water), ("parks", parks))
+        if data is not None
+    }
+    return save_layers(cache_key, layers, coords, city, country, distance)
+
+
+# --- Base maps -------------------------------------------------------------
+
+def _find_basemap(cache_key: str, name: str):
+    """Path and codec of a stored base map, or (None, None)."""
+    prefix = f"{BASEMAP_PREFIX}{name}."
+    for path in get_cache_path(cache_key).glob(f"{prefix}*"):
+        return path, path.name[len(prefix):]
+    return None, None
+
+
+def load_basemap(cache_key: str, name: str):
+    """
+    Load a rasterised base map stored with an entry.
+
+    Base maps are only served while every layer of the entry is fresh;
+    re-saving any layer republishes the entry directory without them.
+
+    Returns:
+        the stored image array, or None
+    """
+    if get_fresh_layers(cache_key) != set(LAYERS):
+        return None
+    path, codec = _find_basemap(cache_key, name)
+    if path is None:
+        return None
+    try:
+        image = load_layer(path, codec)
+    except Exception as e:
+        print(f"  Base map load error: {e}")
+        return None
+
+    with _open_index() as conn:
+        conn.execute(
+            "UPDATE entries SET last_access = ? WHERE cache_key = ?",
+            (datetime.now().isoformat(), cache_key),
+        )
+    return image
+
+
+def save_basemap(cache_key: str, name: str, image) -> bool:
+    """Store a rasterised base map with a fully fresh entry. Returns True on success."""
+    cache_path = get_cache_path(cache_key)
+    if not cache_path.exists() or get_fresh_layers(cache_key) != set(LAYERS):
         return False
 
+    codec = get_layer_codec("basemap", default=BASEMAP_CODEC)
+    path = cache_path / f"{BASEMAP_PREFIX}{name}.{codec}"
+    tmp_path = cache_path / f".{path.name}-{uuid.uuid4().hex[:8]}"
+    try:
+        old_path, _ = _find_basemap(cache_key, name)
+        old_size = old_path.stat().st_size if old_path is not None else 0
+        dump_layer(image, tmp_path, codec)
+        os.replace(tmp_path, path)
+        if old_path is not None and old_path != path:
+            old_path.unlink(missing_ok=True)
+    except Exception as e:
+        print(f"  Base map save error: {e}")
+        tmp_path.unlink(missing_ok=True)
+        return False
+
+    with _open_index() as conn:
+        conn.execute(
+            "UPDATE entries SET size_bytes = size_bytes + ? WHERE cache_key = ?",
+            (path.stat().st_size - old_size, cache_key),
+        )
+    evict_in_background()
+    return True
+
 
 def find_cached_location(city: str, country: str):
     """
@@ -156,37 +766,31 @@ def find_cached_location(city: str, country: str):
     Returns:
         dict with cache metadata if found, None otherwise
     """
-    if not CACHE_DIR.exists():
+    try:
+        with _open_index() as conn:
+            row = conn.execute(
+                """
+                SELECT * FROM entries
+                WHERE city_slug = ? AND country_slug = ?
+                ORDER BY last_access DESC
+                LIMIT 1
+                """,
+                (_city_slug(city), _country_slug(country)),
+            ).fetchone()
+            return _row_to_meta(conn, row) if row else None
+    except sqlite3.Error as e:
+        print(f"  Cache index error: {e}")
         return None
 
-    city_slug = city.lower().replace(" ", "_").replace(",", "")
-    country_slug = country.lower().replace(" ", "_")
-    prefix = f"{city_slug}_{country_slug}_"
-
-    for entry in CACHE_DIR.iterdir():
-        if entry.is_dir() and entry.name.startswith(prefix):
-            meta_file = entry / "meta.json"
-            if meta_file.exists():
-                try:
-                    with open(meta_file, "r") as f:
-                        meta = json.load(f)
-                    # Return the first valid cache found
-                    meta["cache_key"] = entry.name
-                    return meta
-                except:
-                    continue
-    return None
-
 
 def clear_cache(cache_key: str = None):
     """Clear cache. If cache_key is None, clear all."""
-    import shutil
-
     if cache_key:
         cache_path = get_cache_path(cache_key)
         if cache_path.exists():
             shutil.rmtree(cache_path)
             print(f"✓ Cleared cache: {cache_key}")
+        _drop_from_index(cache_key)
     else:
         if CACHE_DIR.exists():
             shutil.rmtree(CACHE_DIR)
@@ -200,13 +804,289 @@ def list_cache():
         print("No cache directory")
         return []
 
-    entries = []
+    with _open_index() as conn:
+        rows = conn.execute("SELECT * FROM entries ORDER BY cache_key").fetchall()
+        return [_row_to_meta(conn, row) for row in rows]
+
+
+# --- Retention -------------------------------------------------------------
+
+def _expiry_cutoff() -> str:
+    return (datetime.now() - timedelta(days=CACHE_EXPIRY_DAYS)).isoformat()
+
+
+def evict_cache(max_bytes: int = None):
+    """
+    Delete expired entries, then least-recently-used entries until the cache
+    fits in max_bytes (default CACHE_MAX_BYTES).
+
+    Entries whose cache_lock is held (being downloaded and saved) are
+    skipped and left for a later pass.
+
+    Returns:
+        tuple (entries removed, bytes freed)
+    """
+    if max_bytes is None:
+        max_bytes = CACHE_MAX_BYTES
+
+    with _open_index() as conn:
+        rows = conn.execute(
+            "SELECT cache_key, size_bytes, cached_at FROM entries "
+            "ORDER BY last_access ASC, cached_at ASC"
+        ).fetchall()
+
+    total = sum(row["size_bytes"] for row in rows)
+    cutoff = _expiry_cutoff()
+    # Expired entries first, then least recently used ones while over budget
+    candidates = [row for row in rows if row["cached_at"] < cutoff]
+    candidates += [row for row in rows if row["cached_at"] >= cutoff]
+
+    evicted = freed = 0
+    for row in candidates:
+        if row["cached_at"] >= cutoff and total <= max_bytes:
+            break
+        with cache_lock(row["cache_key"], blocking=False) as locked:
+            if not locked:
+                continue
+            shutil.rmtree(get_cache_path(row["cache_key"]), ignore_errors=True)
+            _drop_from_index(row["cache_key"])
+            _remove_lock_file(row["cache_key"])
+        evicted += 1
+        freed += row["size_bytes"]
+        total -= row["size_bytes"]
+
+    if evicted:
+        with _open_index() as conn:
+            _increment(conn, "evictions", evicted)
+        print(f"✓ Evicted {evicted} cache entries ({freed / 1024 ** 2:.1f} MB)")
+    return evicted, freed
+
+
+_eviction_lock = threading.Lock()
+
+
+def evict_in_background(max_bytes: int = None):
+    """
+    Run evict_cache() on a worker thread if the cache is over budget.
+
+    The thread is not a daemon, so a CLI run still finishes eviction after
+    the poster has been written; renders never wait on it.
+    """
+    if max_bytes is None:
+        max_bytes = CACHE_MAX_BYTES
+
+    try:
+        with _open_index() as conn:
+            total, expired = conn.execute(
+                "SELECT COALESCE(SUM(size_bytes), 0), COALESCE(SUM(cached_at < ?), 0) FROM entries",
+                (_expiry_cutoff(),),
+            ).fetchone()
+    except sqlite3.Error:
+        return None
+    if total <= max_bytes and not expired:
+        return None
+
+    # One eviction pass per process at a time
+    if not _eviction_lock.acquire(blocking=False):
+        return None
+
+    def run():
+        try:
+            evict_cache(max_bytes)
+        except Exception as e:
+            print(f"  Cache eviction error: {e}")
+        finally:
+            _eviction_lock.release()
+
+    thread = threading.Thread(target=run, name="cache-eviction")
+    thread.start()
+    return thread
+
+
+def compact_cache(max_bytes: int = None):
+    """
+    Evict down to budget, remove entry directories the index does not know
+    about (interrupted writes) and lock files no one holds for keys that
+    aren't cached, and vacuum the index.
+
+    Returns:
+        tuple (entries removed, bytes freed)
+    """
+    removed, freed = evict_cache(max_bytes)
+
+    with _open_index() as conn:
+        known = {row["cache_key"] for row in conn.execute("SELECT cache_key FROM entries")}
+    stale_before = time.time() - 3600
     for entry in CACHE_DIR.iterdir():
-        if entry.is_dir():
-            meta_file = entry / "meta.json"
-            if meta_file.exists():
-                with open(meta_file, "r") as f:
-                    meta = json.load(f)
-                entries.append(meta)
-
-    return entries
+        if not entry.is_dir() or entry.name == ".locks":
+            continue
+        if entry.name.startswith("."):
+            # Leftovers of writes interrupted more than an hour ago
+            if entry.stat().st_mtime < stale_before:
+                shutil.rmtree(entry, ignore_errors=True)
+            continue
+        if entry.name not in known:
+            size = sum(f.stat().st_size for f in entry.rglob("*") if f.is_file())
+            shutil.rmtree(entry, ignore_errors=True)
+            removed += 1
+            freed += size
+
+    lock_dir = CACHE_DIR / ".locks"
+    if lock_dir.exists():
+        for lock_file in lock_dir.glob("*.lock"):
+            cache_key = lock_file.stem
+            if cache_key in known:
+                continue
+            with cache_lock(cache_key, blocking=False) as locked:
+                if locked:
+                    _remove_lock_file(cache_key)
+
+    conn = sqlite3.connect(CACHE_DIR / INDEX_FILE, timeout=30)
+    try:
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+    return removed, freed
+
+
+def cache_stats() -> dict:
+    """
+    Summarize cache usage.
+
+    Returns:
+        dict with keys: entries, bytes, max_bytes, expired, hits, misses,
+        hit_rate, evictions
+    """
+    with _open_index() as conn:
+        entries, total, expired = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0), COALESCE(SUM(cached_at < ?), 0) FROM entries",
+            (_expiry_cutoff(),),
+        ).fetchone()
+        counters = {row["name"]: row["value"] for row in conn.execute("SELECT name, value FROM stats")}
+
+    hits = counters.get("hits", 0)
+    misses = counters.get("misses", 0)
+    lookups = hits + misses
+    return {
+        "entries": entries,
+        "bytes": total,
+        "max_bytes": CACHE_MAX_BYTES,
+        "expired": expired,
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / lookups if lookups else 0.0,
+        "evictions": counters.get("evictions", 0),
+    }
+
+
+# --- Benchmark -------------------------------------------------------------
+
+def benchmark_codecs(codecs=None, repeat: int = 3):
+    """
+    Measure every codec on the layers of all cached entries.
+
+    Each layer is re-encoded into a temp directory on the cache volume and
+    evicted from the page cache before every read, so read time reflects the
+    volume's throughput. Read time is wall-clock time of load_layer() and
+    read CPU is process time, both the best of `repeat` runs.
+
+    Returns:
+        list of dicts with keys: codec, bytes, write_s, read_s, read_cpu_s
+        (totals over all cached layers)
+    """
+    import tempfile
+
+    codecs = codecs or [
+        c for c in CODECS
+        if c == "none" or (c == "lz4" and lz4) or (CODECS[c] is not None and zstandard)
+    ]
+    totals = {codec: {"codec": codec, "bytes": 0, "write_s": 0.0, "read_s": 0.0, "read_cpu_s": 0.0}
+              for codec in codecs}
+
+    def drop_page_cache(path):
+        if hasattr(os, "posix_fadvise"):
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            finally:
+                os.close(fd)
+
+    with tempfile.TemporaryDirectory(dir=CACHE_DIR, prefix=".bench-") as tmp:
+        for meta in list_cache():
+            cache_path = get_cache_path(meta["cache_key"])
+            for name, stored_codec in meta["codecs"].items():
+                data = load_layer(cache_path / LAYER_FILES[name], stored_codec)
+                for codec in codecs:
+                    path = Path(tmp) / f"{meta['cache_key']}_{name}_{codec}"
+                    start = time.perf_counter()
+                    dump_layer(data, path, codec)
+                    totals[codec]["write_s"] += time.perf_counter() - start
+                    totals[codec]["bytes"] += path.stat().st_size
+
+                    best_wall = best_cpu = float("inf")
+                    for _ in range(repeat):
+                        drop_page_cache(path)
+                        start, start_cpu = time.perf_counter(), time.process_time()
+                        load_layer(path, codec)
+                        best_wall = min(best_wall, time.perf_counter() - start)
+                        best_cpu = min(best_cpu, time.process_time() - start_cpu)
+                    totals[codec]["read_s"] += best_wall
+                    totals[codec]["read_cpu_s"] += best_cpu
+                    path.unlink()
+
+    return list(totals.values())
+
+
+# --- CLI -------------------------------------------------------------------
+
+def main(argv=None):
+    """Entry point for `python cache.py ...` / `python create_map_poster.py cache ...`."""
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="cache", description="Inspect and maintain the map-data cache")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("stats", help="Show entries, size and hit rate")
+    subparsers.add_parser("list", help="List cached locations")
+    compact = subparsers.add_parser("compact", help="Evict down to the byte budget and vacuum the index")
+    compact.add_argument("--max-bytes", type=int, default=None,
+                         help=f"Byte budget (default: CACHE_MAX_BYTES={CACHE_MAX_BYTES})")
+    clear = subparsers.add_parser("clear", help="Delete one entry, or everything")
+    clear.add_argument("cache_key", nargs="?", help="Entry to delete (default: all)")
+    subparsers.add_parser("rebuild-index", help="Rebuild the index from meta.json files")
+    bench = subparsers.add_parser("bench", help="Compare compression codecs on the cached entries")
+    bench.add_argument("--codecs", nargs="+", choices=list(CODECS), help="Codecs to compare (default: all installed)")
+    bench.add_argument("--repeat", type=int, default=3, help="Read repetitions per layer (best is kept)")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "stats":
+        stats = cache_stats()
+        print(f"Entries:    {stats['entries']} ({stats['expired']} expired)")
+        print(f"Size:       {stats['bytes'] / 1024 ** 2:.1f} MB of {stats['max_bytes'] / 1024 ** 2:.0f} MB")
+        print(f"Hit rate:   {stats['hit_rate']:.1%} ({stats['hits']} hits, {stats['misses']} misses)")
+        print(f"Evictions:  {stats['evictions']}")
+    elif args.command == "list":
+        for meta in list_cache():
+            print(f"  {meta['cache_key']:<50} {meta['size_bytes'] / 1024 ** 2:>7.1f} MB  "
+                  f"{','.join(meta['layers']) or '-':<18} last used {meta['last_access']}")
+    elif args.command == "compact":
+        removed, freed = compact_cache(args.max_bytes)
+        print(f"✓ Compacted cache: removed {removed} entries, freed {freed / 1024 ** 2:.1f} MB")
+    elif args.command == "clear":
+        clear_cache(args.cache_key)
+    elif args.command == "rebuild-index":
+        rebuild_index()
+    elif args.command == "bench":
+        results = benchmark_codecs(args.codecs, args.repeat)
+        baseline = results[0]["bytes"] or 1
+        print(f"{'codec':<10} {'size MB':>9} {'ratio':>7} {'write s':>9} {'read s':>8} {'read CPU s':>11}")
+        for r in results:
+            print(f"{r['codec']:<10} {r['bytes'] / 1024 ** 2:>9.2f} {r['bytes'] / baseline:>7.2f} "
+                  f"{r['write_s']:>9.3f} {r['read_s']:>8.3f} {r['read_cpu_s']:>11.3f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
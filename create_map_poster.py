@@ -1,17 +1,32 @@
-import osmnx as ox
-import matplotlib.pyplot as plt
-from matplotlib.font_manager import FontProperties
-import matplotlib.colors as mcolors
-import numpy as np
-from geopy.geocoders import Nominatim
-from tqdm import tqdm
+"""
+City map poster generator.
+
+Heavy dependencies (osmnx, matplotlib, numpy, geopy, tqdm) are imported
+inside the functions that use them, so --list-themes, argument errors and
+the cache subcommand start instantly. tests/test_cli_startup.py guards this.
+
+Besides the CLI, render_poster() renders a RenderRequest in-process. The
+theme, fonts and map data are passed in explicitly and drawing only uses
+matplotlib's object-oriented API (no pyplot state), so several posters can
+be rendered concurrently from threads.
+"""
+
 import time
 import json
+import hashlib
+import math
 import os
+from dataclasses import dataclass
 from datetime import datetime
+from typing import Optional
 import argparse
 
-from cache import get_cache_key, load_from_cache, save_to_cache, is_cache_valid, get_cache_path, find_cached_location
+from cache import (
+    CACHE_EXPIRY_DAYS, LAYERS, get_cache_key, load_layers, save_layers, get_cached_meta, find_cached_location, cache_lock,
+    load_basemap, save_basemap, record_access,
+)
+from hot_cache import HotLocations
+from shared_cache import SharedLocations
 
 THEMES_DIR = "themes"
 FONTS_DIR = "fonts"
@@ -96,8 +111,6 @@ def load_fonts():
     
     return fonts
 
-FONTS = load_fonts()
-
 def generate_output_filename(city, theme_name, distance):
     """
     Generate unique output filename with city, theme, distance, and datetime.
@@ -157,13 +170,13 @@ def load_theme(theme_name="feature_based"):
             print(f"  {theme['description']}")
         return theme
 
-# Load theme (can be changed via command line or input)
-THEME = None  # Will be loaded later
-
 def create_gradient_fade(ax, color, location='bottom', zorder=10):
     """
     Creates a fade effect at the top or bottom of the map.
     """
+    import numpy as np
+    import matplotlib.colors as mcolors
+
     vals = np.linspace(0, 1, 256).reshape(-1, 1)
     gradient = np.hstack((vals, vals))
     
@@ -194,67 +207,50 @@ def create_gradient_fade(ax, color, location='bottom', zorder=10):
     ax.imshow(gradient, extent=[xlim[0], xlim[1], y_bottom, y_top], 
               aspect='auto', cmap=custom_cmap, zorder=zorder, origin='lower')
 
-def get_edge_colors_by_type(G):
+def get_road_color(highway, theme):
+    """Theme color for a road type based on road type hierarchy."""
+    if highway in ['motorway', 'motorway_link']:
+        return theme['road_motorway']
+    elif highway in ['trunk', 'trunk_link', 'primary', 'primary_link']:
+        return theme['road_primary']
+    elif highway in ['secondary', 'secondary_link']:
+        return theme['road_secondary']
+    elif highway in ['tertiary', 'tertiary_link']:
+        return theme['road_tertiary']
+    elif highway in ['residential', 'living_street', 'unclassified']:
+        return theme['road_residential']
+    else:
+        return theme['road_default']
+
+def get_road_width(highway):
+    """Line width for a road type. Major roads get thicker lines."""
+    if highway in ['motorway', 'motorway_link']:
+        return 1.2
+    elif highway in ['trunk', 'trunk_link', 'primary', 'primary_link']:
+        return 1.0
+    elif highway in ['secondary', 'secondary_link']:
+        return 0.8
+    elif highway in ['tertiary', 'tertiary_link']:
+        return 0.6
+    else:
+        return 0.4
+
+def get_edge_colors_by_type(roads, theme):
     """
     Assigns colors to edges based on road type hierarchy.
-    Returns a list of colors corresponding to each edge in the graph.
+    Returns a list of colors corresponding to each edge in the network.
     """
-    edge_colors = []
-    
-    for u, v, data in G.edges(data=True):
-        # Get the highway type (can be a list or string)
-        highway = data.get('highway', 'unclassified')
-        
-        # Handle list of highway types (take the first one)
-        if isinstance(highway, list):
-            highway = highway[0] if highway else 'unclassified'
-        
-        # Assign color based on road type
-        if highway in ['motorway', 'motorway_link']:
-            color = THEME['road_motorway']
-        elif highway in ['trunk', 'trunk_link', 'primary', 'primary_link']:
-            color = THEME['road_primary']
-        elif highway in ['secondary', 'secondary_link']:
-            color = THEME['road_secondary']
-        elif highway in ['tertiary', 'tertiary_link']:
-            color = THEME['road_tertiary']
-        elif highway in ['residential', 'living_street', 'unclassified']:
-            color = THEME['road_residential']
-        else:
-            color = THEME['road_default']
-        
-        edge_colors.append(color)
-    
-    return edge_colors
+    # Style each distinct highway type once, then look edges up by code
+    palette = [get_road_color(highway, theme) for highway in roads.highways]
+    return [palette[code] for code in roads.codes]
 
-def get_edge_widths_by_type(G):
+def get_edge_widths_by_type(roads):
     """
     Assigns line widths to edges based on road type.
-    Major roads get thicker lines.
+    Returns a list of widths corresponding to each edge in the network.
     """
-    edge_widths = []
-    
-    for u, v, data in G.edges(data=True):
-        highway = data.get('highway', 'unclassified')
-        
-        if isinstance(highway, list):
-            highway = highway[0] if highway else 'unclassified'
-        
-        # Assign width based on road importance
-        if highway in ['motorway', 'motorway_link']:
-            width = 1.2
-        elif highway in ['trunk', 'trunk_link', 'primary', 'primary_link']:
-            width = 1.0
-        elif highway in ['secondary', 'secondary_link']:
-            width = 0.8
-        elif highway in ['tertiary', 'tertiary_link']:
-            width = 0.6
-        else:
-            width = 0.4
-        
-        edge_widths.append(width)
-    
-    return edge_widths
+    widths = [get_road_width(highway) for highway in roads.highways]
+    return [widths[code] for code in roads.codes]
 
 def haversine_distance(lat1, lon1, lat2, lon2):
     """Calculate distance in meters between two lat/lon points."""
@@ -317,6 +313,8 @@ def get_coordinates(city, country):
     Returns (lat, lon) tuple and suggested distance based on place type and importance.
     Includes rate limiting to be respectful to the geocoding service.
     """
+    from geopy.geocoders import Nominatim
+
     print("Looking up coordinates...")
     geolocator = Nominatim(user_agent="city_map_poster", timeout=10)
 
@@ -376,6 +374,47 @@ SIZE_PRESETS = {
     'region': 35000
 }
 
+# Poster formats: figure size in inches (width, height)
+POSTER_FORMATS = {
+    'portrait': (12, 16),
+    'landscape': (16, 12),
+    'square': (12, 12),
+}
+
+# Mean earth radius, as used by osmnx for point/distance boxes
+EARTH_RADIUS_M = 6_371_009
+
+# Polygons are clipped this fraction beyond the frame to avoid edge artifacts
+CLIP_MARGIN = 0.02
+
+def get_map_extent(dist, poster_format='portrait'):
+    """
+    Half-width and half-height in meters of the map shown on a poster.
+
+    The long side of the poster spans ±dist; the short side is cut to the
+    poster's aspect ratio, so nothing outside the frame is fetched or drawn.
+    """
+    width, height = POSTER_FORMATS[poster_format]
+    scale = dist / max(width, height)
+    return width * scale, height * scale
+
+def get_map_bbox(point, extent, margin=0.0):
+    """
+    Bounding box of a map extent around a point, grown by a relative margin.
+
+    Returns:
+        (west, south, east, north) in degrees
+    """
+    lat, lon = point
+    half_width, half_height = extent
+    delta_lat = math.degrees(half_height / EARTH_RADIUS_M) * (1 + margin)
+    delta_lon = math.degrees(half_width / EARTH_RADIUS_M) / math.cos(math.radians(lat)) * (1 + margin)
+    return lon - delta_lon, lat - delta_lat, lon + delta_lon, lat + delta_lat
+
+def get_cache_variant(poster_format):
+    """Cache key variant for a format (portrait keeps the plain key)."""
+    return None if poster_format == 'portrait' else poster_format
+
 def get_cached_coords(city, country, dist):
     """
     Check if we have cached data for this location and return cached coordinates.
@@ -384,143 +423,320 @@ def get_cached_coords(city, country, dist):
     Returns:
         tuple (lat, lon) if cached, None otherwise
     """
-    cache_key = get_cache_key(city, country, dist)
-    cache_path = get_cache_path(cache_key)
-    meta_file = cache_path / "meta.json"
-
-    if not meta_file.exists():
+    meta = get_cached_meta(get_cache_key(city, country, dist))
+    if meta is None:
         return None
+    return tuple(meta["coords"])
+
 
+def fetch_street_network(bbox):
+    """Download the street network inside a bbox, slimmed for rendering."""
+    import osmnx as ox
+    from roads import slim_graph
+    return slim_graph(ox.graph_from_bbox(bbox, network_type='all'))
+
+def fetch_polygons(bbox, tags):
+    """Download polygons inside a bbox, clipped to it (None if the area has none)."""
+    import osmnx as ox
+    from polygons import clip_polygons
     try:
-        import json
-        with open(meta_file, "r") as f:
-            meta = json.load(f)
-        return tuple(meta["coords"])
-    except:
+        features = ox.features_from_bbox(bbox, tags=tags)
+    except ox._errors.InsufficientResponseError:
         return None
+    return clip_polygons(features, bbox)
+
+WATER_TAGS = {'natural': 'water', 'waterway': 'riverbank'}
+PARK_TAGS = {'leisure': 'park', 'landuse': 'grass'}
 
+def fetch_water(bbox):
+    """Download water polygons inside a bbox."""
+    return fetch_polygons(bbox, WATER_TAGS)
 
-def fetch_map_data(city, country, point, dist, use_cache=True):
+def fetch_parks(bbox):
+    """Download parks/green spaces inside a bbox."""
+    return fetch_polygons(bbox, PARK_TAGS)
+
+# Layer name -> (progress label, fetch function, required). Optional layers
+# that fail to download are rendered without and retried on the next run.
+LAYER_FETCHERS = {
+    "graph": ("Downloading street network", fetch_street_network, True),
+    "water": ("Downloading water features", fetch_water, False),
+    "parks": ("Downloading parks/green spaces", fetch_parks, False),
+}
+
+def read_map_data(bbox, layers, source):
+    """Read the given layers inside a bbox from a local OSM extract."""
+    from osm_extract import read_extract
+
+    print(f"Reading map data from {source}...")
+    data = read_extract(source, bbox, layers, {"water": WATER_TAGS, "parks": PARK_TAGS})
+    print("✓ All data read from the extract!")
+    return data
+
+def download_map_data(bbox, layers=LAYERS, source="overpass"):
     """
-    Fetch map data from cache or OSM API.
+    Download the given layers inside a bbox from the OSM API, or read them
+    from a local extract.
+
+    source is where map data comes from: "overpass" (the OSM API), the
+    path of a local .osm/.osm.pbf extract (see osm_extract.py), or "tiles"
+    for the tiled map store only, where areas not ingested are an error.
 
     Returns:
-        dict with keys: graph, water, parks
+        dict of layer name -> data for every layer that downloaded
+        successfully (data is None when OSM has no features there)
     """
-    cache_key = get_cache_key(city, country, dist)
+    if source == "tiles":
+        tiled = load_tiles(bbox)
+        if tiled is None:
+            raise ValueError("This area is not in the tiled map store; ingest it with "
+                             "`create_map_poster.py tiles ingest`")
+        return {name: tiled[name] for name in layers}
+    if source != "overpass":
+        return read_map_data(bbox, layers, source)
+
+    from tqdm import tqdm
+
+    downloaded = {}
+    with tqdm(total=len(layers), desc="Fetching map data", unit="step", bar_format='{l_bar}{bar}| {n_fmt}/{total_fmt}') as pbar:
+        for i, name in enumerate(layers):
+            label, fetch, required = LAYER_FETCHERS[name]
+            pbar.set_description(label)
+            if i > 0:
+                time.sleep(0.3)  # Rate limit between requests
+            try:
+                downloaded[name] = fetch(bbox)
+            except Exception as e:
+                if required:
+                    raise
+                print(f"  ⚠ Could not download {name}: {e}")
+            pbar.update(1)
 
-    # Try cache first
-    if use_cache:
-        print(f"Checking cache for {cache_key}...")
-        cached = load_from_cache(cache_key)
-        if cached:
-            print(f"✓ Cache hit! Using cached data from {cached['cached_at']}")
-            return {
-                "graph": cached["graph"],
-                "water": cached["water"],
-                "parks": cached["parks"],
-                "from_cache": True,
-            }
-        print("  Cache miss, fetching from API...")
-
-    # Fetch from API
-    with tqdm(total=3, desc="Fetching map data", unit="step", bar_format='{l_bar}{bar}| {n_fmt}/{total_fmt}') as pbar:
-        # 1. Fetch Street Network
-        pbar.set_description("Downloading street network")
-        G = ox.graph_from_point(point, dist=dist, dist_type='bbox', network_type='all')
-        pbar.update(1)
-        time.sleep(0.5)  # Rate limit between requests
-
-        # 2. Fetch Water Features
-        pbar.set_description("Downloading water features")
-        try:
-            water = ox.features_from_point(point, tags={'natural': 'water', 'waterway': 'riverbank'}, dist=dist)
-        except:
-            water = None
-        pbar.update(1)
-        time.sleep(0.3)
+    print("✓ All data downloaded successfully!")
+    return downloaded
 
-        # 3. Fetch Parks
-        pbar.set_description("Downloading parks/green spaces")
-        try:
-            parks = ox.features_from_point(point, tags={'leisure': 'park', 'landuse': 'grass'}, dist=dist)
-        except:
-            parks = None
-        pbar.update(1)
 
-    print("✓ All data downloaded successfully!")
+# Render-ready map data of recently used locations, kept in memory by
+# long-lived processes (--serve) so repeat orders skip the disk cache. The
+# byte budget is 0 (disabled) for one-shot CLI runs; see hot_cache.py. Both
+# memory tiers expire map data when the disk cache would.
+hot_locations = HotLocations(0, max_age=CACHE_EXPIRY_DAYS * 86400)
+# The same for every process on the machine, as memory-mapped files; only
+# enabled in daemons too (see shared_cache.py)
+shared_locations = SharedLocations(max_bytes=0, max_age=CACHE_EXPIRY_DAYS * 86400)
 
-    # Save to cache
-    if use_cache:
-        save_to_cache(cache_key, G, water, parks, point, city, country, dist)
+def get_hot_location(cache_key):
+    """Map data held in memory for a cache key, or None."""
+    return hot_locations.get(cache_key)
 
-    return {
-        "graph": G,
-        "water": water,
-        "parks": parks,
-        "from_cache": False,
-    }
+def put_hot_location(cache_key, data, cached_at):
+    """Keep a location's map data in memory, within the hot_locations byte budget."""
+    if hot_locations.max_bytes <= 0:
+        return
+    from roads import slim_graph
 
+    hot_locations.put(
+        cache_key, {"graph": slim_graph(data["graph"]), "water": data["water"], "parks": data["parks"]},
+        cached_at=cached_at,
+    )
 
-def create_poster(city, country, point, dist, output_file, preview=False, use_cache=True, map_data=None):
-    print(f"\nGenerating map for {city}, {country}...")
-    if preview:
-        print("  (Preview mode: 72 DPI)")
+def load_tiles(bbox):
+    """
+    Map data of a bbox from the tiled map store (see tile_store.py), or None
+    if not ingested. Roads stay on disk and are streamed tile by tile when
+    the map is drawn.
+    """
+    from tile_store import load_bbox
+    return load_bbox(bbox, stream_roads=True)
 
-    # Fetch data if not provided
-    if map_data is None:
-        map_data = fetch_map_data(city, country, point, dist, use_cache=use_cache)
+def fetch_map_data(city, country, point, dist, use_cache=True, poster_format='portrait', data_source="overpass"):
+    """
+    Fetch map data from cache or OSM API (or the extract data_source names, see download_map_data).
 
-    G = map_data["graph"]
-    water = map_data["water"]
-    parks = map_data["parks"]
+    Only the area the poster format shows is fetched (see get_map_extent),
+    plus a small margin for clipping.
 
-    if map_data.get("from_cache"):
-        print("✓ Using cached map data")
-    
-    # 2. Setup Plot
-    print("Rendering map...")
-    fig, ax = plt.subplots(figsize=(12, 16), facecolor=THEME['bg'])
-    ax.set_facecolor(THEME['bg'])
-    ax.set_position([0, 0, 1, 1])
-    
-    # 3. Plot Layers
-    # Layer 1: Polygons (filter out Point geometries to avoid default markers)
-    if water is not None and not water.empty:
-        water_polys = water[water.geometry.type.isin(['Polygon', 'MultiPolygon'])]
-        if not water_polys.empty:
-            water_polys.plot(ax=ax, facecolor=THEME['water'], edgecolor='none', zorder=1)
-    if parks is not None and not parks.empty:
-        park_polys = parks[parks.geometry.type.isin(['Polygon', 'MultiPolygon'])]
-        if not park_polys.empty:
-            park_polys.plot(ax=ax, facecolor=THEME['parks'], edgecolor='none', zorder=2)
-    
-    # Layer 2: Roads with hierarchy coloring
-    print("Applying road hierarchy colors...")
-    edge_colors = get_edge_colors_by_type(G)
-    edge_widths = get_edge_widths_by_type(G)
-    
-    ox.plot_graph(
-        G, ax=ax, bgcolor=THEME['bg'],
-        node_size=0,
-        edge_color=edge_colors,
-        edge_linewidth=edge_widths,
-        show=False, close=False
-    )
-    
-    # Layer 3: Gradients (Top and Bottom)
-    create_gradient_fade(ax, THEME['gradient_color'], location='bottom', zorder=10)
-    create_gradient_fade(ax, THEME['gradient_color'], location='top', zorder=10)
+    Each layer is cached independently: only layers that are missing or
+    expired are downloaded. Locations inside a region ingested into the
+    tiled map store are assembled from its tiles instead. Concurrent processes needing the same layers are
+    serialized on a per-key lock; the first one downloads, the others wait
+    and then load its result from the cache.
+
+    Returns:
+        dict with keys: graph, water, parks
+    """
+    bbox = get_map_bbox(point, get_map_extent(dist, poster_format), margin=CLIP_MARGIN)
+
+    if not use_cache:
+        layers = download_map_data(bbox, LAYERS, data_source)
+        return {
+            "graph": layers["graph"],
+            "water": layers.get("water"),
+            "parks": layers.get("parks"),
+            "from_cache": False,
+        }
+
+    cache_key = get_cache_key(city, country, dist, get_cache_variant(poster_format))
+
+    # Try cache first
+    print(f"Checking cache for {cache_key}...")
+    hot = get_hot_location(cache_key)
+    if hot is not None:
+        print("✓ Cache hit! Using map data held in memory")
+        record_access(cache_key)
+        return {**hot, "from_cache": True}
+    shared = shared_locations.get(cache_key)
+    if shared is not None:
+        print("✓ Cache hit! Using map data shared by other renderers")
+        record_access(cache_key)
+        put_hot_location(cache_key, shared, shared["cached_at"])
+        return {**shared, "from_cache": True}
+
+    # When each layer was downloaded: the memory tiers expire the data with the oldest
+    layer_times = {}
+    cached = load_layers(cache_key, LAYERS)
+    layers = cached["layers"] if cached else {}
+    if cached:
+        layer_times.update(cached["layer_cached_at"])
+    missing = [name for name in LAYERS if name not in layers]
+
+    tiled = load_tiles(bbox) if missing else None
+    if tiled is not None:
+        print("✓ Cache hit! Using the tiled map store")
+        layers.update({name: tiled[name] for name in missing})
+        layer_times.update({name: datetime.now().isoformat() for name in missing})
+        missing = []
+    elif missing:
+        print(f"  Cache miss for {', '.join(missing)}, fetching from API...")
+        with cache_lock(cache_key):
+            # Another process may have downloaded them while we waited
+            cached = load_layers(cache_key, missing, record_stats=False)
+            if cached:
+                layers.update(cached["layers"])
+                layer_times.update(cached["layer_cached_at"])
+            missing = [name for name in LAYERS if name not in layers]
+            if missing:
+                downloaded = download_map_data(bbox, missing, data_source)
+                save_layers(cache_key, downloaded, point, city, country, dist)
+                layers.update(downloaded)
+                layer_times.update({name: datetime.now().isoformat() for name in downloaded})
+    else:
+        print(f"✓ Cache hit! Using cached data from {cached['cached_at']}")
+
+    data = {
+        "graph": layers["graph"],
+        "water": layers.get("water"),
+        "parks": layers.get("parks"),
+        "from_cache": not missing,
+    }
+    # Layers that failed to download are retried next time, so don't pin them
+    if all(name in layers for name in LAYERS):
+        cached_at = datetime.fromisoformat(min(layer_times.values())).timestamp()
+        if shared_locations.put(cache_key, data, cached_at):
+            # Keep the mapped copy rather than this process's private one
+            data = {**(shared_locations.get(cache_key) or data), "from_cache": data["from_cache"]}
+        put_hot_location(cache_key, data, cached_at)
+    return data
+
+
+# Quick previews are written at this DPI with sub-pixel geometry dropped; the
+# marker line tells the server that the preview file is ready to show
+PREVIEW_DPI = 36
+PREVIEW_MARKER = "PREVIEW_READY"
+
+# Theme colors that affect the base map (everything else is overlay)
+BASE_MAP_THEME_KEYS = [
+    'bg', 'water', 'parks', 'road_motorway', 'road_primary',
+    'road_secondary', 'road_tertiary', 'road_residential', 'road_default',
+]
+
+def get_base_map_name(theme, dpi):
+    """Cache name of the base map for a theme's map colors and a DPI."""
+    colors = json.dumps([theme.get(key) for key in BASE_MAP_THEME_KEYS])
+    return f"{hashlib.sha1(colors.encode()).hexdigest()[:12]}-{dpi}dpi"
+
+# Roads are drawn in chunks of this many edges, so matplotlib never holds
+# paths for the whole network of a regional poster at once
+ROAD_CHUNK_EDGES = 50_000
+ROAD_ZORDER = 1
+
+def render_base_map(roads, water, parks, frame, figsize, dpi, theme):
+    """
+    Rasterise the map layers (background, polygons, roads) of a poster.
+
+    Roads are streamed onto the canvas ROAD_CHUNK_EDGES at a time: each
+    chunk is drawn and released before the next one is built. roads is
+    SlimRoads or anything else with chunks(), such as tile_store.TiledRoads,
+    which loads one tile at a time, so peak memory follows the chunk size
+    rather than the map radius.
+
+    Returns:
+        (height, width, 4) uint8 RGBA array at the poster's pixel size
+    """
+    import numpy as np
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from roads import frame_axes, road_collection
+
+    fig = Figure(figsize=figsize, dpi=dpi, facecolor=theme['bg'])
+    FigureCanvasAgg(fig)
+    ax = fig.add_axes([0, 0, 1, 1])
+    ax.set_facecolor(theme['bg'])
+
+    # Layer 1: Polygons (clipping already dropped Point/Line geometries)
+    if water is not None:
+        water.plot(ax=ax, facecolor=theme['water'], edgecolor='none', zorder=1)
+    if parks is not None:
+        parks.plot(ax=ax, facecolor=theme['parks'], edgecolor='none', zorder=2)
+
+    frame_axes(ax, frame)
+    # The frame already has the poster's aspect ratio; let the axes fill the
+    # figure exactly instead of shrinking by a rounding error
+    ax.set_aspect('auto')
+
+    # Everything below the roads is drawn first; layers above them wait
+    above = [artist for artist in ax.collections if artist.get_zorder() > ROAD_ZORDER]
+    for artist in above:
+        artist.set_visible(False)
+    fig.canvas.draw()
+
+    # Layer 2: Roads with hierarchy coloring, one chunk at a time
+    for chunk in roads.chunks(ROAD_CHUNK_EDGES):
+        collection = road_collection(chunk, get_edge_colors_by_type(chunk, theme),
+                                     get_edge_widths_by_type(chunk), zorder=ROAD_ZORDER)
+        ax.add_collection(collection, autolim=False)
+        ax.draw_artist(collection)
+        collection.remove()
+
+    for artist in above:
+        artist.set_visible(True)
+        ax.draw_artist(artist)
+
+    # A view of the canvas buffer; no copy of the full-size image is made
+    return np.asarray(fig.canvas.buffer_rgba())
+
+def draw_overlays(ax, title, subtitle, point, theme, fonts):
+    """
+    Draw gradients and typography over the base map.
+
+    fonts is the dict returned by load_fonts(); without it the text falls
+    back to the system monospace font.
+    """
+    from matplotlib.font_manager import FontProperties
+
+    # Gradients (Top and Bottom)
+    create_gradient_fade(ax, theme['gradient_color'], location='bottom', zorder=10)
+    create_gradient_fade(ax, theme['gradient_color'], location='top', zorder=10)
     
-    # 4. Typography using Roboto font
+    # Typography using Roboto font
     # Get optimal layout for city name
-    city_layout = get_city_text_layout(city)
+    city_layout = get_city_text_layout(title)
     city_font_size = city_layout['font_size']
 
-    if FONTS:
-        font_main = FontProperties(fname=FONTS['bold'], size=city_font_size)
-        font_sub = FontProperties(fname=FONTS['light'], size=22)
-        font_coords = FontProperties(fname=FONTS['regular'], size=14)
+    if fonts:
+        font_main = FontProperties(fname=fonts['bold'], size=city_font_size)
+        font_sub = FontProperties(fname=fonts['light'], size=22)
+        font_coords = FontProperties(fname=fonts['regular'], size=14)
     else:
         # Fallback to system fonts
         font_main = FontProperties(family='monospace', weight='bold', size=city_font_size)
@@ -532,7 +748,7 @@ def create_poster(city, country, point, dist, output_file, preview=False, use_ca
     num_lines = len(city_layout['lines'])
     for i, (line, y_pos) in enumerate(zip(city_layout['lines'], city_layout['y_positions'])):
         ax.text(0.5, y_pos, line, transform=ax.transAxes,
-                color=THEME['text'], ha='center', fontproperties=font_main, zorder=11)
+                color=theme['text'], ha='center', fontproperties=font_main, zorder=11)
 
     # Adjust country and coords position based on number of city lines
     top_city_y = max(city_layout['y_positions'])
@@ -541,8 +757,8 @@ def create_poster(city, country, point, dist, output_file, preview=False, use_ca
     coords_y = country_y - 0.03
     line_y = country_y + 0.025
 
-    ax.text(0.5, country_y, country.upper(), transform=ax.transAxes,
-            color=THEME['text'], ha='center', fontproperties=font_sub, zorder=11)
+    ax.text(0.5, country_y, subtitle.upper(), transform=ax.transAxes,
+            color=theme['text'], ha='center', fontproperties=font_sub, zorder=11)
 
     lat, lon = point
     coords = f"{lat:.4f}° N / {lon:.4f}° E" if lat >= 0 else f"{abs(lat):.4f}° S / {lon:.4f}° E"
@@ -550,28 +766,235 @@ def create_poster(city, country, point, dist, output_file, preview=False, use_ca
         coords = coords.replace("E", "W")
 
     ax.text(0.5, coords_y, coords, transform=ax.transAxes,
-            color=THEME['text'], alpha=0.7, ha='center', fontproperties=font_coords, zorder=11)
+            color=theme['text'], alpha=0.7, ha='center', fontproperties=font_coords, zorder=11)
 
     ax.plot([0.4, 0.6], [line_y, line_y], transform=ax.transAxes,
-            color=THEME['text'], linewidth=1, zorder=11)
+            color=theme['text'], linewidth=1, zorder=11)
 
     # --- ATTRIBUTION (bottom right) ---
-    if FONTS:
-        font_attr = FontProperties(fname=FONTS['light'], size=8)
+    if fonts:
+        font_attr = FontProperties(fname=fonts['light'], size=8)
     else:
         font_attr = FontProperties(family='monospace', size=8)
     
     ax.text(0.98, 0.02, "© OpenStreetMap contributors", transform=ax.transAxes,
-            color=THEME['text'], alpha=0.5, ha='right', va='bottom', 
+            color=theme['text'], alpha=0.5, ha='right', va='bottom', 
             fontproperties=font_attr, zorder=11)
 
-    # 5. Save
-    dpi = 72 if preview else 300
-    print(f"Saving to {output_file}...")
-    plt.savefig(output_file, dpi=dpi, facecolor=THEME['bg'])
-    plt.close()
+
+def compose_poster(base_map, figsize, dpi, title, subtitle, point, output, theme, fonts):
+    """Draw overlays on a rasterised base map and save the poster as PNG to a path or file object."""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    # The base map is placed pixel for pixel on the figure; the axes only
+    # provide 0-1 coordinates for gradients and text
+    fig = Figure(figsize=figsize, facecolor=theme['bg'])
+    FigureCanvasAgg(fig)
+    fig.figimage(base_map, origin='upper', zorder=-1)
+    ax = fig.add_axes([0, 0, 1, 1])
+    ax.set_xlim(0, 1)
+    ax.set_ylim(0, 1)
+    ax.set_axis_off()
+
+    draw_overlays(ax, title, subtitle, point, theme, fonts)
+
+    fig.savefig(output, format='png', dpi=dpi, facecolor=theme['bg'])
+
+def write_quick_preview(roads, water, parks, frame, figsize, title, subtitle, point, output_file, theme, fonts):
+    """
+    Write a fast, low-detail preview of the poster.
+
+    Renders at PREVIEW_DPI and drops geometry smaller than a preview pixel,
+    then prints PREVIEW_MARKER so a server streaming our output can push the
+    preview to the customer while the full render continues.
+    """
+    west, south, east, north = frame
+    pixel = (north - south) / (figsize[1] * PREVIEW_DPI)
+
+    roads = roads.simplified(pixel)
+    if water is not None:
+        water = water.simplify(pixel, preserve_topology=False).to_frame()
+    if parks is not None:
+        parks = parks.simplify(pixel, preserve_topology=False).to_frame()
+
+    base_map = render_base_map(roads, water, parks, frame, figsize, PREVIEW_DPI, theme)
+    compose_poster(base_map, figsize, PREVIEW_DPI, title, subtitle, point, output_file, theme, fonts)
+    print(f"{PREVIEW_MARKER} {output_file}", flush=True)
+
+
+@dataclass
+class RenderRequest:
+    """
+    Everything needed to render one poster.
+
+    theme is a theme dict as returned by load_theme(); fonts is the dict
+    returned by load_fonts(), or None for the system monospace fallback.
+    Without map_data the layers are loaded through the cache, or downloaded
+    from data_source (see download_map_data).
+    """
+
+    city: str
+    country: str
+    point: tuple
+    dist: int
+    theme: dict
+    fonts: Optional[dict] = None
+    poster_format: str = 'portrait'
+    dpi: int = 300
+    title: Optional[str] = None
+    subtitle: Optional[str] = None
+    map_data: Optional[dict] = None
+    use_cache: bool = True
+    preview_output: Optional[str] = None
+    data_source: str = "overpass"
+
+
+def render_poster(request, output=None):
+    """
+    Render a poster: a rasterised base map with gradients and text on top.
+
+    With the cache enabled the base map is stored per location, theme colors
+    and DPI, so re-titled posters of the same map skip loading and drawing
+    the map data entirely. With preview_output, a quick low-detail preview
+    is written there as soon as the map data is loaded.
+
+    Args:
+        request: RenderRequest
+        output: path or binary file object to write the PNG to
+
+    Returns:
+        The PNG as bytes when no output is given, else output
+    """
+    import io
+    from roads import slim_graph
+    from polygons import clip_polygons
+
+    theme, fonts = request.theme, request.fonts
+    figsize = POSTER_FORMATS[request.poster_format]
+    title = request.title or request.city
+    subtitle = request.subtitle or request.country
+    map_data = request.map_data
+
+    # Base maps are only cached for data that comes from the cache
+    cache_key = None
+    base_map = None
+    base_map_name = get_base_map_name(theme, request.dpi)
+    if request.use_cache and map_data is None:
+        cache_key = get_cache_key(request.city, request.country, request.dist, get_cache_variant(request.poster_format))
+        base_map = load_basemap(cache_key, base_map_name)
+
+    if base_map is not None:
+        print("✓ Using cached base map")
+    else:
+        # Fetch data if not provided
+        if map_data is None:
+            map_data = fetch_map_data(request.city, request.country, request.point, request.dist,
+                                      use_cache=request.use_cache, poster_format=request.poster_format,
+                                      data_source=request.data_source)
+
+        # Graphs cached before slimming was introduced are slimmed here
+        roads = slim_graph(map_data["graph"])
+        # Likewise for polygon layers cached before clipping
+        extent = get_map_extent(request.dist, request.poster_format)
+        frame = get_map_bbox(request.point, extent)
+        clip_bbox = get_map_bbox(request.point, extent, margin=CLIP_MARGIN)
+        water = clip_polygons(map_data["water"], clip_bbox)
+        parks = clip_polygons(map_data["parks"], clip_bbox)
+
+        if map_data.get("from_cache"):
+            print("✓ Using cached map data")
+
+        if request.preview_output:
+            write_quick_preview(roads, water, parks, frame, figsize, title, subtitle, request.point,
+                                request.preview_output, theme, fonts)
+
+        print("Rendering map...")
+        print("Applying road hierarchy colors...")
+        base_map = render_base_map(roads, water, parks, frame, figsize, request.dpi, theme)
+        if cache_key is not None:
+            save_basemap(cache_key, base_map_name, base_map)
+
+    if output is None:
+        buffer = io.BytesIO()
+        compose_poster(base_map, figsize, request.dpi, title, subtitle, request.point, buffer, theme, fonts)
+        return buffer.getvalue()
+
+    print(f"Saving to {output}...")
+    compose_poster(base_map, figsize, request.dpi, title, subtitle, request.point, output, theme, fonts)
+    return output
+
+
+def create_poster(city, country, point, dist, output_file, theme, fonts=None, preview=False, use_cache=True,
+                  map_data=None, poster_format='portrait', title=None, subtitle=None, preview_output=None,
+                  data_source="overpass"):
+    """Render a poster to output_file at 300 DPI (72 DPI with preview), reporting progress."""
+    print(f"\nGenerating map for {city}, {country}...")
+    if preview:
+        print("  (Preview mode: 72 DPI)")
+
+    request = RenderRequest(
+        city=city, country=country, point=point, dist=dist, theme=theme, fonts=fonts,
+        poster_format=poster_format, dpi=72 if preview else 300, title=title, subtitle=subtitle,
+        map_data=map_data, use_cache=use_cache, preview_output=preview_output, data_source=data_source,
+    )
+    render_poster(request, output_file)
     print(f"✓ Done! Poster saved as {output_file}")
 
+def resolve_location(city, country, state=None, distance=None, size=None, use_cache=True):
+    """
+    Find a poster's center point and radius.
+
+    Cached locations are reused without geocoding when possible. The radius
+    comes from distance, then the size preset, then the geocoder's suggestion.
+
+    Returns:
+        ((lat, lon), dist)
+    """
+    coords = None
+    dist = None
+
+    # Fast path: check if we have cached data for this location (skip geocoding)
+    if use_cache and not distance and not size:
+        city_for_cache = f"{city}, {state}" if state else city
+        cached_meta = find_cached_location(city_for_cache, country)
+        if cached_meta:
+            coords = tuple(cached_meta["coords"])
+            dist = cached_meta["distance"]
+            print(f"✓ Found cached location: {city}, {country}")
+            print(f"✓ Using cached coordinates: {coords[0]:.4f}, {coords[1]:.4f}")
+            print(f"✓ Using cached distance: {dist}m")
+
+    # Explicit distance/size: reuse coordinates cached for exactly that radius
+    if use_cache and coords is None and (distance or size):
+        requested_dist = distance if distance is not None else SIZE_PRESETS[size]
+        coords = get_cached_coords(city, country, requested_dist)
+        if coords:
+            dist = requested_dist
+            print(f"✓ Using cached coordinates: {coords[0]:.4f}, {coords[1]:.4f}")
+
+    # If no cache hit, do geocoding
+    if coords is None:
+        # Include state in city name for better geocoding if provided
+        city_query = f"{city}, {state}" if state else city
+        coords, suggested_dist = get_coordinates(city_query, country)
+
+        # Determine distance to use (priority: distance > size > auto/suggested)
+        if distance is not None:
+            dist = distance
+            print(f"✓ Using specified distance: {dist}m")
+        elif size:
+            dist = SIZE_PRESETS[size]
+            print(f"✓ Using size preset '{size}': {dist}m")
+        elif suggested_dist:
+            dist = suggested_dist
+            print(f"✓ Using auto-calculated distance: {dist}m")
+        else:
+            dist = 12000  # Default fallback
+            print(f"✓ Using default distance: {dist}m")
+
+    return coords, dist
+
 def print_examples():
     """Print usage examples."""
     print("""
@@ -654,6 +1077,15 @@ def list_themes():
         print()
 
 if __name__ == "__main__":
+    # Cache maintenance subcommand: python create_map_poster.py cache <stats|compact|...>
+    if len(os.sys.argv) > 1 and os.sys.argv[1] == "cache":
+        from cache import main as cache_main
+        os.sys.exit(cache_main(os.sys.argv[2:]))
+    # Tiled map store subcommand: python create_map_poster.py tiles <ingest|stats>
+    if len(os.sys.argv) > 1 and os.sys.argv[1] == "tiles":
+        from tile_store import main as tiles_main
+        os.sys.exit(tiles_main(os.sys.argv[2:]))
+
     parser = argparse.ArgumentParser(
         description="Generate beautiful map posters for any city",
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -663,6 +1095,9 @@ Examples:
   python create_map_poster.py --city Tokyo --country Japan --theme midnight_blue
   python create_map_poster.py --city Paris --country France --theme noir --distance 15000
   python create_map_poster.py --list-themes
+  python create_map_poster.py --serve
+  python create_map_poster.py cache stats
+  python create_map_poster.py tiles ingest italy-latest.osm.pbf --bbox 12.0 45.2 12.8 45.7
         """
     )
     
@@ -675,9 +1110,21 @@ Examples:
     parser.add_argument('--auto', '-a', action='store_true', help='Auto-calculate distance from area size (default if no distance specified)')
     parser.add_argument('--size', '-s', type=str, choices=['neighborhood', 'small', 'town', 'city', 'metro', 'region'],
                         help='Size preset: neighborhood (2km), small (4km), town (6km), city (12km), metro (20km), region (35km)')
+    parser.add_argument('--format', '-f', dest='poster_format', choices=list(POSTER_FORMATS), default='portrait',
+                        help='Poster format (default: portrait)')
+    parser.add_argument('--title', type=str, help='Custom title instead of the city name')
+    parser.add_argument('--subtitle', type=str, help='Custom subtitle instead of the country name')
+    parser.add_argument('--preview-output', type=str,
+                        help='Also write a quick low-detail preview here as soon as map data is loaded')
     parser.add_argument('--preview', '-p', action='store_true', help='Generate low-res preview (72 DPI instead of 300)')
     parser.add_argument('--no-cache', action='store_true', help='Bypass cache and fetch fresh data from API')
+    parser.add_argument('--data-source', type=str, default=os.environ.get("MAP_DATA_SOURCE", "overpass"),
+                        help='"overpass" (default), a local .osm/.osm.pbf extract to read map data from, '
+                             'or "tiles" for the tiled map store only')
     parser.add_argument('--list-themes', action='store_true', help='List all available themes')
+    parser.add_argument('--warm', action='store_true', help='Fetch map data into the cache and exit without rendering')
+    parser.add_argument('--serve', action='store_true',
+                        help='Run as a render daemon taking JSON-lines requests on stdin (see render_daemon.py)')
     
     args = parser.parse_args()
     
@@ -690,6 +1137,17 @@ Examples:
     if args.list_themes:
         list_themes()
         os.sys.exit(0)
+
+    if args.data_source not in ("overpass", "tiles"):
+        from osm_extract import is_extract
+        if not is_extract(args.data_source) or not os.path.exists(args.data_source):
+            print(f"Error: --data-source must be 'overpass', 'tiles' or an existing .osm/.osm.pbf file, "
+                  f"got '{args.data_source}'.")
+            os.sys.exit(1)
+
+    if args.serve:
+        from render_daemon import serve
+        os.sys.exit(serve(data_source=args.data_source))
     
     # Validate required arguments
     if not args.city or not args.country:
@@ -709,51 +1167,29 @@ Examples:
     print("=" * 50)
     
     # Load theme
-    THEME = load_theme(args.theme)
+    theme = load_theme(args.theme)
     
     # Get coordinates and generate poster
     try:
         use_cache = not args.no_cache
-        coords = None
-        dist = None
-
-        # Fast path: check if we have cached data for this location (skip geocoding)
-        if use_cache and not args.distance and not args.size:
-            city_for_cache = f"{args.city}, {args.state}" if args.state else args.city
-            cached_meta = find_cached_location(city_for_cache, args.country)
-            if cached_meta:
-                coords = tuple(cached_meta["coords"])
-                dist = cached_meta["distance"]
-                print(f"✓ Found cached location: {args.city}, {args.country}")
-                print(f"✓ Using cached coordinates: {coords[0]:.4f}, {coords[1]:.4f}")
-                print(f"✓ Using cached distance: {dist}m")
-
-        # If no cache hit, do geocoding
-        if coords is None:
-            # Include state in city name for better geocoding if provided
-            city_query = f"{args.city}, {args.state}" if args.state else args.city
-            coords, suggested_dist = get_coordinates(city_query, args.country)
-
-            # Determine distance to use (priority: --distance > --size > auto/suggested)
-            if args.distance is not None:
-                dist = args.distance
-                print(f"✓ Using specified distance: {dist}m")
-            elif args.size:
-                dist = SIZE_PRESETS[args.size]
-                print(f"✓ Using size preset '{args.size}': {dist}m")
-            elif suggested_dist:
-                dist = suggested_dist
-                print(f"✓ Using auto-calculated distance: {dist}m")
-            else:
-                dist = 12000  # Default fallback
-                print(f"✓ Using default distance: {dist}m")
+        coords, dist = resolve_location(args.city, args.country, state=args.state, distance=args.distance,
+                                        size=args.size, use_cache=use_cache)
+
+        if args.warm:
+            fetch_map_data(args.city, args.country, coords, dist, use_cache=True, poster_format=args.poster_format,
+                           data_source=args.data_source)
+            print(f"✓ Map data for {args.city}, {args.country} ({dist}m) is cached")
+            os.sys.exit(0)
 
         # Use custom output path if provided, otherwise auto-generate
         if args.output:
             output_file = args.output
         else:
             output_file = generate_output_filename(args.city, args.theme, dist)
-        create_poster(args.city, args.country, coords, dist, output_file, preview=args.preview, use_cache=use_cache)
+        create_poster(args.city, args.country, coords, dist, output_file, theme, fonts=load_fonts(),
+                      preview=args.preview, use_cache=use_cache, poster_format=args.poster_format,
+                      title=args.title, subtitle=args.subtitle, preview_output=args.preview_output,
+                      data_source=args.data_source)
         
         print("\n" + "=" * 50)
         print("✓ Poster generation complete!")
@@ -0,0 +1,122 @@
+"""
+In-process LRU of render-ready map data.
+
+Long-lived renderers (--serve daemons) keep the map data of recently used
+locations in memory, so repeat orders for popular cities skip reading and
+unpickling their cache entry. The store is bounded by a byte budget rather
+than an entry count: a metro's street network can be a hundred times the
+size of a village's, so entries are weighed with data_nbytes() and the least
+recently used ones are evicted until the total fits. Data larger than the
+whole budget is never stored. Entries older than max_age seconds (counted
+from when their map data was downloaded) are dropped on lookup, so the
+store never outlives the disk cache's expiry. Hit, miss and eviction counts
+are kept for tuning the budget (see stats()).
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+# Rough per-geometry cost of a shapely object beyond its coordinates
+GEOMETRY_OVERHEAD_BYTES = 200
+
+
+def data_nbytes(data):
+    """Approximate memory held by a location's map data (roads plus polygon layers)."""
+    import numpy as np
+    import shapely
+
+    total = 0
+    graph = data.get("graph")
+    # Roads mapped from the shared store (shared_cache.py) aren't this process's memory
+    if not isinstance(getattr(graph, "coords", None), np.memmap):
+        total += getattr(graph, "nbytes", 0)
+    for layer in ("water", "parks"):
+        features = data.get(layer)
+        if features is not None and len(features):
+            geometries = features.geometry.values
+            total += int(shapely.get_num_coordinates(geometries).sum()) * 16
+            total += len(geometries) * GEOMETRY_OVERHEAD_BYTES
+    return total
+
+
+class HotLocations:
+    """Thread-safe, byte-bounded LRU of map data by cache key. A budget of 0 disables it."""
+
+    def __init__(self, max_bytes=0, max_age=None):
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._entries = OrderedDict()  # cache key -> (data, nbytes, cached_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, cache_key):
+        return cache_key in self._entries
+
+    def get(self, cache_key):
+        """Map data held for a cache key, or None."""
+        if self.max_bytes <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None and self.max_age is not None and time.time() - entry[2] > self.max_age:
+                # Expired: the next load refreshes it
+                self._bytes -= self._entries.pop(cache_key)[1]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(cache_key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, cache_key, data, nbytes=None, cached_at=None):
+        """
+        Hold a location's map data, evicting the least recently used beyond the budget.
+
+        cached_at is when the data was downloaded (a Unix time, default now).
+
+        Returns:
+            True if the data is now held
+        """
+        if self.max_bytes <= 0:
+            return False
+        if nbytes is None:
+            nbytes = data_nbytes(data)
+        with self._lock:
+            if cache_key in self._entries:
+                self._bytes -= self._entries.pop(cache_key)[1]
+            if nbytes > self.max_bytes:
+                return False
+            self._entries[cache_key] = (data, nbytes, time.time() if cached_at is None else cached_at)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                _, (_, evicted, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+                self.evictions += 1
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Entries, bytes held, budget and hit/miss/eviction counts."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,363 @@
+"""
+Map data from a local OSM extract (.osm, .osm.gz, .osm.bz2 or .osm.pbf).
+
+An alternative to Overpass for batch and air-gapped rendering, selected with
+--data-source / MAP_DATA_SOURCE. Extracts are streamed, never loaded whole:
+every pass keeps only what touches the requested bbox, so memory depends on
+the poster area rather than the size of the extract.
+
+- Pass 1 keeps the nodes inside the bbox, the road and polygon ways that
+  use them and the tagged multipolygon relations.
+- Pass 2 finds the relations with a member way that uses a node inside the
+  bbox, then collects the member ways of just those relations.
+- Pass 3 looks up the polygon nodes outside the bbox, so polygons reaching
+  past the poster edge keep their true outline until they are clipped, and
+  the outside neighbours of the roads' inside nodes.
+
+Roads are cut to their segments that reach into the bbox, each run ending
+at the first node past its edge, so roads run off the poster rather than
+stopping short of it however far apart their nodes are.
+
+The result has the same shape as an Overpass download: SlimRoads for the
+graph layer and clipped, geometry-only GeoDataFrames for polygon layers.
+.osm.pbf needs pyosmium (pip install osmium); XML extracts only use the
+standard library.
+"""
+
+import bz2
+import gzip
+import os
+
+# Matches osmnx's network_type='all' filter
+EXCLUDED_HIGHWAYS = {"abandoned", "construction", "no", "planned", "platform", "proposed", "raceway", "razed"}
+
+
+def is_extract(source):
+    """True if a data source names an OSM extract file rather than an online API."""
+    return source.endswith((".osm", ".osm.gz", ".osm.bz2", ".pbf"))
+
+
+def _open_xml(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rb")
+    return open(path, "rb")
+
+
+def _iter_xml(path):
+    from xml.etree.ElementTree import iterparse
+
+    with _open_xml(path) as f:
+        root = None
+        for event, elem in iterparse(f, events=("start", "end")):
+            if root is None:
+                root = elem
+            if event != "end":
+                continue
+
+            if elem.tag == "node":
+                yield "node", int(elem.get("id")), (float(elem.get("lon")), float(elem.get("lat")))
+            elif elem.tag == "way":
+                refs = [int(nd.get("ref")) for nd in elem.iter("nd")]
+                tags = {tag.get("k"): tag.get("v") for tag in elem.iter("tag")}
+                yield "way", int(elem.get("id")), (refs, tags)
+            elif elem.tag == "relation":
+                members = [(m.get("type")[0], int(m.get("ref")), m.get("role")) for m in elem.iter("member")]
+                tags = {tag.get("k"): tag.get("v") for tag in elem.iter("tag")}
+                yield "relation", int(elem.get("id")), (members, tags)
+            else:
+                continue
+            # Drop parsed elements so memory stays flat over the whole file
+            root.clear()
+
+
+def _iter_pbf(path, kinds):
+    try:
+        import osmium
+    except ImportError as e:
+        raise RuntimeError("Reading .osm.pbf extracts needs pyosmium (pip install osmium)") from e
+
+    entities = 0
+    for kind, flag in (("node", osmium.osm.NODE), ("way", osmium.osm.WAY), ("relation", osmium.osm.RELATION)):
+        if kind in kinds:
+            entities |= flag
+
+    for obj in osmium.FileProcessor(path, entities):
+        if obj.is_node():
+            if obj.location.valid():
+                yield "node", obj.id, (obj.location.lon, obj.location.lat)
+        elif obj.is_way():
+            yield "way", obj.id, ([node.ref for node in obj.nodes], {tag.k: tag.v for tag in obj.tags})
+        elif obj.is_relation():
+            members = [(m.type, m.ref, m.role) for m in obj.members]
+            yield "relation", obj.id, (members, {tag.k: tag.v for tag in obj.tags})
+
+
+def _declared_bounds(path):
+    """The bbox an extract's header says it covers, or None."""
+    if path.endswith(".pbf"):
+        try:
+            import osmium
+        except ImportError as e:
+            raise RuntimeError("Reading .osm.pbf extracts needs pyosmium (pip install osmium)") from e
+        reader = osmium.io.Reader(path, osmium.osm.osm_entity_bits.NOTHING)
+        try:
+            box = reader.header().box()
+        finally:
+            reader.close()
+        if not box.valid():
+            return None
+        return box.bottom_left.lon, box.bottom_left.lat, box.top_right.lon, box.top_right.lat
+
+    from xml.etree.ElementTree import iterparse
+
+    with _open_xml(path) as f:
+        for _, elem in iterparse(f, events=("start",)):
+            if elem.tag == "bounds":
+                return tuple(float(elem.get(name)) for name in ("minlon", "minlat", "maxlon", "maxlat"))
+            if elem.tag in ("node", "way", "relation"):
+                return None
+    return None
+
+
+def extract_coverage(path):
+    """
+    (west, south, east, north) of the area an extract holds complete data for.
+
+    This is the bbox in the extract's header when it has one (osmium,
+    osmosis and download sites write it), else the extent of its nodes,
+    which takes a pass over them.
+    """
+    declared = _declared_bounds(path)
+    if declared is not None:
+        return declared
+    west = south = float("inf")
+    east = north = float("-inf")
+    for _, _, (lon, lat) in iter_elements(path, ("node",)):
+        west, south, east, north = min(west, lon), min(south, lat), max(east, lon), max(north, lat)
+    return None if west > east else (west, south, east, north)
+
+
+def iter_elements(path, kinds=("node", "way", "relation")):
+    """
+    Stream (kind, id, data) tuples from an extract, in file order.
+
+    data is (lon, lat) for nodes, (node refs, tags) for ways and
+    ([(member type 'n'/'w'/'r', ref, role)], tags) for relations.
+    """
+    if path.endswith(".pbf"):
+        yield from _iter_pbf(path, kinds)
+        return
+    for element in _iter_xml(path):
+        if element[0] in kinds:
+            yield element
+
+
+def _is_road(tags):
+    highway = tags.get("highway")
+    return (
+        highway is not None
+        and highway not in EXCLUDED_HIGHWAYS
+        and tags.get("area") != "yes"
+        and tags.get("service") != "private"
+    )
+
+
+def _matches(tags, wanted):
+    """True if tags match an osmnx-style tag filter ({key: value | [values] | True})."""
+    for key, value in wanted.items():
+        actual = tags.get(key)
+        if actual is None:
+            continue
+        if value is True or actual == value or (isinstance(value, list) and actual in value):
+            return True
+    return False
+
+
+def _polygon_layer(tags, polygon_tags):
+    for layer, wanted in polygon_tags.items():
+        if _matches(tags, wanted):
+            return layer
+    return None
+
+
+def _road_neighbours(road_ways, inside):
+    """Nodes outside the bbox next to a road node inside it."""
+    found = set()
+    for _, refs in road_ways:
+        for i, ref in enumerate(refs):
+            if ref in inside:
+                continue
+            if (i > 0 and refs[i - 1] in inside) or (i + 1 < len(refs) and refs[i + 1] in inside):
+                found.add(ref)
+    return found
+
+
+def _segment_reaches(start, end, bbox):
+    """True if a segment's bounding box overlaps the bbox (so it may cross it)."""
+    west, south, east, north = bbox
+    return (
+        min(start[0], end[0]) <= east and max(start[0], end[0]) >= west
+        and min(start[1], end[1]) <= north and max(start[1], end[1]) >= south
+    )
+
+
+def _build_roads(road_ways, coords, bbox):
+    """SlimRoads from the runs of each road's segments that reach into the bbox."""
+    import numpy as np
+    from roads import SlimRoads
+
+    highways = {}
+    codes = []
+    parts = []
+    offsets = [0]
+
+    def add(highway, run):
+        if len(run) >= 2:
+            codes.append(highways.setdefault(highway, len(highways)))
+            parts.append(np.array(run, dtype=np.float64))
+            offsets.append(offsets[-1] + len(run))
+
+    for highway, refs in road_ways:
+        run = []
+        for start, end in zip(refs, refs[1:]):
+            start, end = coords.get(start), coords.get(end)
+            if start is not None and end is not None and _segment_reaches(start, end, bbox):
+                run.extend([start, end] if not run else [end])
+                continue
+            add(highway, run)
+            run = []
+        add(highway, run)
+
+    code_dtype = np.uint8 if len(highways) <= 256 else np.uint16
+    return SlimRoads(
+        highways=highways,
+        codes=np.array(codes, dtype=code_dtype),
+        coords=np.concatenate(parts) if parts else np.empty((0, 2)),
+        offsets=np.array(offsets, dtype=np.int64),
+    )
+
+
+def _ring(refs, coords):
+    return [coords[ref] for ref in refs if ref in coords]
+
+
+def _build_polygons(closed_ways, relations, member_refs, coords):
+    """Polygons per layer from closed ways and multipolygon relations."""
+    from shapely.geometry import LineString, Polygon
+    from shapely.ops import linemerge, polygonize, unary_union
+
+    geometries = {}
+    for layer, refs in closed_ways:
+        ring = _ring(refs, coords)
+        if len(ring) >= 4:
+            geometries.setdefault(layer, []).append(Polygon(ring))
+
+    for layer, members in relations:
+        lines = {"outer": [], "inner": []}
+        for way_id, role in members:
+            ring = _ring(member_refs.get(way_id, []), coords)
+            if len(ring) >= 2:
+                lines["inner" if role == "inner" else "outer"].append(LineString(ring))
+        if not lines["outer"]:
+            continue
+        outer = unary_union(list(polygonize(linemerge(lines["outer"]))))
+        if lines["inner"]:
+            outer = outer.difference(unary_union(list(polygonize(linemerge(lines["inner"])))))
+        if not outer.is_empty:
+            geometries.setdefault(layer, []).append(outer)
+
+    return geometries
+
+
+def read_extract(path, bbox, layers, polygon_tags):
+    """
+    Read map layers inside a bbox from a local OSM extract.
+
+    Args:
+        path: .osm, .osm.gz, .osm.bz2 or .osm.pbf file
+        bbox: (west, south, east, north)
+        layers: layer names to read ("graph" and/or keys of polygon_tags)
+        polygon_tags: layer name -> osmnx-style tag filter, e.g.
+            {"water": {"natural": "water"}}
+
+    Returns:
+        dict of layer name -> SlimRoads (graph) or clipped GeoDataFrame/None
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"OSM extract not found: {path}")
+
+    west, south, east, north = bbox
+    want_roads = "graph" in layers
+    polygon_tags = {layer: tags for layer, tags in polygon_tags.items() if layer in layers}
+
+    # Pass 1: nodes inside the bbox and the ways and relations that may use them
+    inside = {}
+    road_ways = []
+    closed_ways = []
+    relations = []
+    for kind, element_id, data in iter_elements(path):
+        if kind == "node":
+            lon, lat = data
+            if west <= lon <= east and south <= lat <= north:
+                inside[element_id] = data
+        elif kind == "way":
+            refs, tags = data
+            if want_roads and _is_road(tags):
+                if any(ref in inside for ref in refs):
+                    road_ways.append((tags["highway"], refs))
+                continue
+            layer = _polygon_layer(tags, polygon_tags)
+            if layer and len(refs) >= 4 and refs[0] == refs[-1] and any(ref in inside for ref in refs):
+                closed_ways.append((layer, refs))
+        elif kind == "relation":
+            members, tags = data
+            layer = _polygon_layer(tags, polygon_tags)
+            if layer and tags.get("type") == "multipolygon":
+                relations.append((layer, [(ref, role) for kind_code, ref, role in members if kind_code == "w"]))
+
+    # Pass 2: relations with a member reaching the bbox, then those relations' member ways.
+    # Only IDs are kept until the relations are known, so far-off members are never held.
+    member_refs = {}
+    if relations:
+        wanted = {way_id for _, members in relations for way_id, _ in members}
+        touching = set()
+        for _, way_id, (refs, _) in iter_elements(path, ("way",)):
+            if way_id in wanted and any(ref in inside for ref in refs):
+                touching.add(way_id)
+        relations = [
+            (layer, members) for layer, members in relations
+            if any(way_id in touching for way_id, _ in members)
+        ]
+        used = {way_id for _, members in relations for way_id, _ in members}
+        if used:
+            for _, way_id, (refs, _) in iter_elements(path, ("way",)):
+                if way_id in used:
+                    member_refs[way_id] = refs
+
+    # Pass 3: polygon nodes outside the bbox, and the roads' first nodes past its edge
+    coords = dict(inside)
+    outside = {ref for _, refs in closed_ways for ref in refs if ref not in inside}
+    outside.update(ref for refs in member_refs.values() for ref in refs if ref not in inside)
+    if want_roads:
+        outside.update(_road_neighbours(road_ways, inside))
+    if outside:
+        for _, node_id, data in iter_elements(path, ("node",)):
+            if node_id in outside:
+                coords[node_id] = data
+
+    result = {}
+    if want_roads:
+        result["graph"] = _build_roads(road_ways, coords, bbox)
+
+    if polygon_tags:
+        import geopandas as gpd
+        from polygons import clip_polygons
+
+        geometries = _build_polygons(closed_ways, relations, member_refs, coords)
+        for layer in polygon_tags:
+            features = gpd.GeoDataFrame(geometry=geometries.get(layer, []), crs="epsg:4326")
+            result[layer] = clip_polygons(features, bbox)
+
+    return result
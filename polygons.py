@@ -0,0 +1,51 @@
+"""
+Render-only water and park polygons.
+
+OSM feature queries return whole polygons, so a sea, lake or regional
+park that only touches the map comes back with its full outline, often far
+larger than the poster. Polygon layers are clipped to the map frame (plus a
+small margin) before they are cached and again before drawing, which also
+trims entries cached before clipping was introduced. Only the geometry is
+kept; rendering never reads the OSM tags.
+"""
+
+POLYGON_TYPES = ["Polygon", "MultiPolygon"]
+
+
+def clip_polygons(features, bbox):
+    """
+    Keep only the polygon geometry of features that falls inside bbox.
+
+    Candidates are found through the layer's spatial index, so features far
+    from the viewport are never touched, and the remaining ones are cut with
+    a rectangle clip rather than a general intersection.
+
+    Args:
+        features: GeoDataFrame (or None) as returned by features_from_bbox
+        bbox: (west, south, east, north)
+
+    Returns:
+        GeoDataFrame with only a geometry column, or None if nothing is left
+    """
+    import geopandas as gpd
+
+    if features is None or features.empty:
+        return None
+
+    polygons = features.geometry[features.geometry.type.isin(POLYGON_TYPES)]
+    if polygons.empty:
+        return None
+
+    west, south, east, north = bbox
+    minx, miny, maxx, maxy = polygons.total_bounds
+    if west <= minx and south <= miny and maxx <= east and maxy <= north:
+        # Already inside (e.g. clipped before caching)
+        clipped = polygons
+    else:
+        clipped = gpd.clip(polygons, bbox)
+        # Polygons grazing the box edge can clip down to lines or points
+        clipped = clipped[clipped.type.isin(POLYGON_TYPES)]
+        if clipped.empty:
+            return None
+
+    return gpd.GeoDataFrame(geometry=clipped.reset_index(drop=True), crs=features.crs)
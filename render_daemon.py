@@ -0,0 +1,184 @@
+"""
+Long-lived render daemon.
+
+`python create_map_poster.py --serve` reads one JSON render request per line
+on stdin and writes one JSON event per line on stdout. Heavy imports, fonts,
+themes and recently used map data stay loaded between requests, so only the
+first order pays for Python's cold start.
+
+Requests (only id, city and country are required):
+
+    {"id": "job-1", "city": "Venice", "country": "Italy", "state": null,
+     "theme": "noir", "size": "city", "distance": null, "format": "portrait",
+     "title": null, "subtitle": null, "preview": false, "no_cache": false,
+     "output": "/data/job-1.png", "preview_output": "/data/job-1.preview.png"}
+
+{"id": "s", "command": "stats"} asks for the in-memory map data counters
+instead of rendering.
+
+Events:
+
+    {"event": "ready", "pid": 1234}                    once, at startup
+    {"id": "job-1", "event": "log", "line": "..."}     each line the CLI would print
+    {"id": "job-1", "event": "done", "output": "/data/job-1.png", "hot_cache": {...}, "shared_cache": {...}}
+    {"id": "job-1", "event": "error", "error": "..."}
+    {"id": "s", "event": "stats", "hot_cache": {...}, "shared_cache": {...}}
+
+hot_cache holds HotLocations.stats(): entries, bytes, max_bytes, hits,
+misses, evictions and hit_rate. shared_cache holds SharedLocations.stats()
+for the store all daemons on the machine share: entries, bytes, max_bytes.
+
+Requests are handled one at a time; run several daemons for concurrency.
+The daemon exits when stdin is closed.
+"""
+
+import io
+import json
+import os
+import sys
+import traceback
+from contextlib import redirect_stdout
+
+import create_map_poster
+
+# Memory budget for map data kept between requests (see hot_cache.py)
+DEFAULT_HOT_CACHE_MB = 512
+
+# Budget for map data shared with the machine's other daemons (see shared_cache.py)
+DEFAULT_SHARED_CACHE_MB = 2048
+
+
+class _LogLines(io.TextIOBase):
+    """Text stream that turns every printed line into a log event."""
+
+    def __init__(self, emit_line):
+        self._emit_line = emit_line
+        self._pending = ""
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        lines = (self._pending + text).split("\n")
+        self._pending = lines.pop()
+        for line in lines:
+            if line.strip():
+                self._emit_line(line)
+        return len(text)
+
+    def close(self):
+        if self._pending.strip():
+            self._emit_line(self._pending)
+        self._pending = ""
+        super().close()
+
+
+def emit(out, event):
+    """Write one event line and flush it straight to the reader."""
+    out.write(json.dumps(event, ensure_ascii=False) + "\n")
+    out.flush()
+
+
+def warm_up():
+    """Import everything a render can need, so the first request doesn't pay for it."""
+    import osmnx  # noqa: F401
+    import geopandas  # noqa: F401
+    import matplotlib.font_manager  # noqa: F401
+    from matplotlib.backends import backend_agg  # noqa: F401
+    import polygons  # noqa: F401
+    import roads  # noqa: F401
+
+
+def render(request, fonts, themes, data_source="overpass"):
+    """
+    Render one request the way the CLI would, reading map data that isn't
+    cached from data_source (see create_map_poster.download_map_data).
+
+    Returns:
+        Path of the written poster
+    """
+    city, country = request.get("city"), request.get("country")
+    if not city or not country:
+        raise ValueError("city and country are required")
+
+    theme_name = request.get("theme") or "feature_based"
+    if theme_name not in themes:
+        if theme_name not in create_map_poster.get_available_themes():
+            raise ValueError(f"Theme '{theme_name}' not found")
+        themes[theme_name] = create_map_poster.load_theme(theme_name)
+
+    size = request.get("size")
+    if size == "auto":
+        size = None
+    if size is not None and size not in create_map_poster.SIZE_PRESETS:
+        raise ValueError(f"Unknown size preset '{size}'")
+
+    use_cache = not request.get("no_cache", False)
+    coords, dist = create_map_poster.resolve_location(
+        city, country, state=request.get("state"), distance=request.get("distance"), size=size,
+        use_cache=use_cache,
+    )
+
+    output = request.get("output") or create_map_poster.generate_output_filename(city, theme_name, dist)
+    create_map_poster.create_poster(
+        city, country, coords, dist, output, themes[theme_name], fonts=fonts,
+        preview=bool(request.get("preview")), use_cache=use_cache,
+        poster_format=request.get("format") or "portrait",
+        title=request.get("title"), subtitle=request.get("subtitle"),
+        preview_output=request.get("preview_output"), data_source=data_source,
+    )
+    return output
+
+
+def serve(stdin=None, stdout=None, data_source="overpass"):
+    """
+    Handle render requests from stdin until it is closed.
+
+    Every request reads map data from data_source (the CLI passes its
+    --data-source here).
+    """
+    stdin = stdin or sys.stdin
+    out = stdout or sys.stdout
+
+    create_map_poster.hot_locations.max_bytes = int(os.environ.get("RENDER_HOT_CACHE_MB", DEFAULT_HOT_CACHE_MB)) * 1024 ** 2
+    create_map_poster.shared_locations.max_bytes = (
+        int(os.environ.get("RENDER_SHARED_CACHE_MB", DEFAULT_SHARED_CACHE_MB)) * 1024 ** 2
+    )
+
+    # stdout carries only protocol events; anything printed while starting up goes to stderr
+    with redirect_stdout(sys.stderr):
+        warm_up()
+        fonts = create_map_poster.load_fonts()
+    themes = {}
+
+    emit(out, {"event": "ready", "pid": os.getpid()})
+
+    for raw in stdin:
+        if not raw.strip():
+            continue
+        try:
+            request = json.loads(raw)
+        except ValueError as e:
+            emit(out, {"id": None, "event": "error", "error": f"Invalid request: {e}"})
+            continue
+
+        job_id = request.get("id")
+        if request.get("command") == "stats":
+            emit(out, {"id": job_id, "event": "stats", "hot_cache": create_map_poster.hot_locations.stats(),
+                       "shared_cache": create_map_poster.shared_locations.stats()})
+            continue
+
+        log = _LogLines(lambda line: emit(out, {"id": job_id, "event": "log", "line": line}))
+        try:
+            with redirect_stdout(log):
+                output = render(request, fonts, themes, data_source)
+            log.close()
+            emit(out, {"id": job_id, "event": "done", "output": output,
+                       "hot_cache": create_map_poster.hot_locations.stats(),
+                       "shared_cache": create_map_poster.shared_locations.stats()})
+        except Exception as e:
+            log.close()
+            traceback.print_exc(file=sys.stderr)
+            emit(out, {"id": job_id, "event": "error", "error": str(e) or type(e).__name__})
+
+    return 0
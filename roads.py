@@ -0,0 +1,147 @@
+"""
+Render-only street network.
+
+osmnx graphs carry every OSM attribute it collects (names, osmid lists,
+lanes, maxspeed, node street_count, ...), but a poster only ever draws each
+edge's polyline styled by its highway type. SlimRoads keeps just that:
+
+- highways: the distinct highway values, in first-seen order
+- codes:    one small integer per edge indexing into highways
+- coords:   every edge's vertices concatenated into one (N, 2) float array
+- offsets:  edge i spans coords[offsets[i]:offsets[i + 1]]
+
+Edges with a geometry keep its vertices; edges without one are stored as
+the straight segment between their end nodes, so no node table is kept.
+Graphs are slimmed before they are cached; older cached graphs are slimmed
+when loaded.
+"""
+
+import numpy as np
+
+DEFAULT_HIGHWAY = "unclassified"
+
+
+class SlimRoads:
+    """Edge polylines and interned highway types of a street network."""
+
+    __slots__ = ("highways", "codes", "coords", "offsets", "crs")
+
+    def __init__(self, highways, codes, coords, offsets, crs="epsg:4326"):
+        self.highways = tuple(highways)
+        self.codes = codes
+        self.coords = coords
+        self.offsets = offsets
+        self.crs = crs
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.coords.nbytes + self.offsets.nbytes
+
+    @property
+    def bounds(self):
+        """(left, bottom, right, top) of all edge vertices."""
+        left, bottom = self.coords.min(axis=0)
+        right, top = self.coords.max(axis=0)
+        return left, bottom, right, top
+
+    def lines(self):
+        """One (n, 2) vertex array per edge, as views into coords."""
+        return np.split(self.coords, self.offsets[1:-1])
+
+    def edge_highways(self):
+        """The highway type of every edge."""
+        return [self.highways[code] for code in self.codes]
+
+    def select(self, mask):
+        """Copy keeping only the edges where mask is True."""
+        lengths = np.diff(self.offsets)
+        offsets = np.zeros(int(mask.sum()) + 1, dtype=np.int64)
+        np.cumsum(lengths[mask], out=offsets[1:])
+        return SlimRoads(self.highways, self.codes[mask], self.coords[np.repeat(mask, lengths)], offsets, self.crs)
+
+    def chunks(self, max_edges):
+        """Consecutive slices of at most max_edges edges, as views into the arrays."""
+        for start in range(0, len(self), max_edges):
+            end = min(start + max_edges, len(self))
+            offsets = self.offsets[start:end + 1]
+            yield SlimRoads(self.highways, self.codes[start:end], self.coords[offsets[0]:offsets[-1]],
+                            offsets - offsets[0], self.crs)
+
+    def simplified(self, tolerance):
+        """Copy without edges spanning less than tolerance in both x and y."""
+        if len(self) == 0:
+            return self
+        starts = self.offsets[:-1]
+        span = np.maximum.reduceat(self.coords, starts) - np.minimum.reduceat(self.coords, starts)
+        return self.select((span >= tolerance).any(axis=1))
+
+
+def _edge_highway(data):
+    highway = data.get("highway", DEFAULT_HIGHWAY)
+    # osmnx merges simplified edges' tags into lists; the first one wins
+    if isinstance(highway, list):
+        highway = highway[0] if highway else DEFAULT_HIGHWAY
+    return highway
+
+
+def slim_graph(G):
+    """
+    Reduce an osmnx graph to what rendering needs.
+
+    Returns:
+        SlimRoads with one polyline per graph edge, in G.edges() order.
+        Roads that are already render-ready (SlimRoads, or anything else
+        drawn through chunks(), like tile_store.TiledRoads) are returned as is.
+    """
+    if isinstance(G, SlimRoads) or hasattr(G, "chunks"):
+        return G
+
+    highways = {}
+    codes = []
+    parts = []
+    offsets = [0]
+    nodes = G.nodes
+
+    for u, v, data in G.edges(data=True):
+        codes.append(highways.setdefault(_edge_highway(data), len(highways)))
+
+        geometry = data.get("geometry")
+        if geometry is not None:
+            line = np.asarray(geometry.coords, dtype=np.float64)[:, :2]
+        else:
+            line = np.array([[nodes[u]["x"], nodes[u]["y"]], [nodes[v]["x"], nodes[v]["y"]]], dtype=np.float64)
+        parts.append(line)
+        offsets.append(offsets[-1] + len(line))
+
+    code_dtype = np.uint8 if len(highways) <= 256 else np.uint16
+    return SlimRoads(
+        highways=highways,
+        codes=np.array(codes, dtype=code_dtype),
+        coords=np.concatenate(parts) if parts else np.empty((0, 2)),
+        offsets=np.array(offsets, dtype=np.int64),
+        crs=G.graph.get("crs", "epsg:4326"),
+    )
+
+
+def road_collection(roads, colors, widths, zorder=1):
+    """A LineCollection of every edge of roads."""
+    from matplotlib.collections import LineCollection
+
+    return LineCollection(roads.lines(), colors=colors, linewidths=widths, zorder=zorder)
+
+
+def frame_axes(ax, bbox):
+    """Show exactly bbox (west, south, east, north), latitude-corrected, without axes."""
+    west, south, east, north = bbox
+    ax.set_xlim((west, east))
+    ax.set_ylim((south, north))
+    ax.margins(0)
+    for spine in ax.spines.values():
+        spine.set_visible(False)
+    ax.get_xaxis().set_visible(False)
+    ax.get_yaxis().set_visible(False)
+    ax.set_aspect(1 / np.cos(np.deg2rad((south + north) / 2)))
+
@@ -16,6 +16,7 @@ import { postersRouter } from './routes/posters.js';
 import { galleryRouter } from './routes/gallery.js';
 import { setupWebSocket } from './routes/websocket.js';
 import { config } from './config.js';
+import { getRenderPool } from './services/renderPool.js';
 
 const __dirname = dirname(fileURLToPath(import.meta.url));
 
@@ -47,7 +48,7 @@ export function createApp(options = {}) {
 
   // Health check (no payment required)
   app.get('/health', (req, res) => {
-    res.json({ status: 'ok' });
+    res.json({ status: 'ok', renderPool: getRenderPool().stats() });
   });
 
   // API routes (themes, jobs, and gallery don't require payment)
@@ -1,4 +1,5 @@
 import { fileURLToPath } from 'url';
+import { hostname } from 'os';
 import { dirname, join } from 'path';
 import dotenv from 'dotenv';
 
@@ -62,6 +63,27 @@ export const config = {
   dataDir: process.env.DATA_DIR || join(__dirname, '../../data/posters'),
   cleanupHours: parseInt(process.env.CLEANUP_HOURS || '24', 10),
 
+  // Warm `create_map_poster.py --serve` daemons kept for rendering; 0 spawns a fresh process per job
+  renderPoolSize: parseInt(process.env.RENDER_POOL_SIZE || '2', 10),
+
+  // Render memory: jobs are admitted against MEMORY_BUDGET_MB (0 = 75% of RAM) and
+  // stopped above JOB_MEMORY_HEADROOM times their predicted peak
+  memoryBudgetMb: parseInt(process.env.MEMORY_BUDGET_MB || '0', 10),
+  jobMemoryHeadroom: parseFloat(process.env.JOB_MEMORY_HEADROOM || '1.5'),
+
+  // Shared jobs: a Redis-compatible broker (redis://host:6379/0) lets several API nodes and
+  // render workers share jobs and progress; '' keeps them in this process. With
+  // REMOTE_RENDER=true renders are queued for worker.js processes instead of run here.
+  brokerUrl: process.env.BROKER_URL || '',
+  remoteRender: process.env.REMOTE_RENDER === 'true',
+  // A render worker's place in the fleet; kept across restarts so its cities (and warm cache/)
+  // stay with it. Defaults to the hostname; set WORKER_ID when running several workers on one host
+  workerId: process.env.WORKER_ID || hostname(),
+
+  // Map data source: 'overpass' (OSM API), the path of a local .osm/.osm.pbf extract, or
+  // 'tiles' for the tiled map store only. Auto-sized posters are capped at 'city' unless 'tiles'.
+  mapDataSource: process.env.MAP_DATA_SOURCE || 'overpass',
+
   // Paths
   maptoposterDir: join(__dirname, '../..'),
   themesDir: join(__dirname, '../../themes'),
@@ -6,6 +6,14 @@ import { dirname, join } from 'path';
 dotenv.config({ path: join(dirname(fileURLToPath(import.meta.url)), '../../.env') });
 
 import { createApp, config } from './app.js';
+import { connectBroker } from './services/broker.js';
+import { useBroker } from './services/jobManager.js';
+
+if (config.brokerUrl) {
+  await useBroker(await connectBroker(config.brokerUrl));
+} else if (config.remoteRender) {
+  throw new Error('REMOTE_RENDER needs BROKER_URL, the broker the render workers read from');
+}
 
 const app = createApp();
 
@@ -1,28 +1,157 @@
 import { Router } from 'express';
-import { getJob, JobStatus } from '../services/jobManager.js';
+import { jobUpdateMessage, loadJob, updateJob, waitForJobChange, JobStatus } from '../services/jobManager.js';
+import { cancelPoster } from '../services/posterGenerator.js';
+import { config } from '../config.js';
 
 export const jobsRouter = Router();
 
-/**
- * GET /api/jobs/:jobId
- * Check the status of a poster generation job.
- */
-jobsRouter.get('/jobs/:jobId', (req, res) => {
-  const { jobId } = req.params;
-  const job = getJob(jobId);
+// Longest a status request may be held open waiting for a change
+const LONG_POLL_MAX_SECONDS = 60;
 
-  if (!job) {
-    return res.status(404).json({ detail: 'Job not found' });
-  }
+// Comment line sent on an idle event stream so proxies don't close it
+const SSE_KEEPALIVE_MS = 15000;
 
-  const response = {
+const FINISHED_STATUSES = [JobStatus.COMPLETED, JobStatus.FAILED, JobStatus.CANCELLED];
+
+/**
+ * Build the API view of a job.
+ * @param {Object} job - The job
+ * @returns {Object} Job status response
+ */
+function jobResponse(job) {
+  const jobId = job.id;
+  return {
     job_id: job.id,
     status: job.status,
     progress: job.progress || 0,
     message: job.message || null,
     error: job.error || null,
     download_url: job.status === JobStatus.COMPLETED ? `/api/posters/${jobId}` : null,
+    preview_url: job.previewFile ? `/api/posters/${jobId}/preview` : null,
+    job_class: job.jobClass || null,
+    // While the job is still queued, the wait so far
+    queue_wait_seconds: job.queueWaitSeconds ?? (job.status === JobStatus.PENDING
+      ? Math.round((Date.now() - Date.parse(job.createdAt)) / 100) / 10
+      : null),
+    version: job.version,
   };
+}
+
+/**
+ * Format one server-sent event.
+ * @param {string} event - Event name
+ * @param {Object} data - Event data
+ * @param {number} id - Event ID
+ * @returns {string}
+ */
+function sseEvent(event, data, id) {
+  return `event: ${event}\nid: ${id}\ndata: ${JSON.stringify(data)}\n\n`;
+}
+
+/**
+ * GET /api/jobs/:jobId[?wait=<seconds>&version=<n>]
+ * Check the status of a poster generation job.
+ * With wait, this is a long-poll: the response is held until the job's
+ * version differs from version (or, without one, until its next change),
+ * the job finishes, or wait seconds (at most LONG_POLL_MAX_SECONDS) pass.
+ */
+jobsRouter.get('/jobs/:jobId', async (req, res) => {
+  const { jobId } = req.params;
+  let job = await loadJob(jobId);
+
+  if (!job) {
+    return res.status(404).json({ detail: 'Job not found' });
+  }
+
+  const wait = Number(req.query.wait || 0);
+  if (!(wait >= 0)) {
+    return res.status(400).json({ detail: 'wait must be a number of seconds' });
+  }
+  if (wait > 0 && !FINISHED_STATUSES.includes(job.status)) {
+    const seen = req.query.version === undefined ? job.version : Number(req.query.version);
+    job = await waitForJobChange(jobId, seen, Math.min(wait, LONG_POLL_MAX_SECONDS) * 1000);
+    if (!job) {
+      return res.status(404).json({ detail: 'Job not found' });
+    }
+  }
+
+  res.json(jobResponse(job));
+});
+
+/**
+ * GET /api/jobs/:jobId/events
+ * Stream a job's progress as server-sent events, for clients that can't use
+ * WebSockets: the messages /ws/jobs/:jobId sends, with the job's version as
+ * the event ID, starting with its current state and ending once it finishes.
+ * Updates that arrive faster than they can be sent are coalesced.
+ */
+jobsRouter.get('/jobs/:jobId/events', async (req, res) => {
+  const { jobId } = req.params;
+  let job = await loadJob(jobId);
+
+  if (!job) {
+    return res.status(404).json({ detail: 'Job not found' });
+  }
+
+  res.set({
+    'Content-Type': 'text/event-stream',
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no',
+  });
+  res.flushHeaders();
+
+  let closed = false;
+  req.on('close', () => {
+    closed = true;
+  });
+
+  let version = job.version;
+  let previewSent = Boolean(job.previewFile);
+  res.write(sseEvent('job_update', jobUpdateMessage(job), version));
+
+  while (!closed && !FINISHED_STATUSES.includes(job.status)) {
+    job = await waitForJobChange(jobId, version, SSE_KEEPALIVE_MS);
+    if (!job || closed) break;
+    if (job.version === version) {
+      res.write(': keep-alive\n\n');
+      continue;
+    }
+    version = job.version;
+    if (job.previewFile && !previewSent) {
+      previewSent = true;
+      res.write(sseEvent('preview', {
+        type: 'preview',
+        job_id: jobId,
+        preview_url: `/api/posters/${jobId}/preview`,
+      }, version));
+    }
+    res.write(sseEvent('job_update', jobUpdateMessage(job), version));
+  }
+  res.end();
+});
+
+/**
+ * POST /api/jobs/:jobId/cancel
+ * Cancel a pending or running poster generation job.
+ * Responds once the generator process has exited.
+ */
+jobsRouter.post('/jobs/:jobId/cancel', async (req, res) => {
+  const { jobId } = req.params;
+  const job = await loadJob(jobId);
+
+  if (!job) {
+    return res.status(404).json({ detail: 'Job not found' });
+  }
+
+  if (job.status !== JobStatus.PENDING && job.status !== JobStatus.PROCESSING) {
+    return res.status(409).json({ detail: `Job is already ${job.status}` });
+  }
+
+  // With remote rendering the worker running the job stops it when it sees the cancellation
+  if (config.remoteRender || !(await cancelPoster(jobId))) {
+    // Not started yet (or already gone): nothing to kill
+    updateJob(jobId, { status: JobStatus.CANCELLED, message: 'Generation cancelled' });
+  }
 
-  res.json(response);
+  res.json(jobResponse(await loadJob(jobId)));
 });
@@ -1,14 +1,29 @@
 import { Router } from 'express';
 import { existsSync } from 'fs';
 import { join } from 'path';
-import { createJob, getJob, JobStatus } from '../services/jobManager.js';
+import { createJob, enqueueJob, loadJob, JobStatus } from '../services/jobManager.js';
 import { generatePoster } from '../services/posterGenerator.js';
+import { locationKey } from '../services/routing.js';
 import { config } from '../config.js';
 
 export const postersRouter = Router();
 
 // Valid themes and sizes
 const VALID_SIZES = ['auto', 'neighborhood', 'small', 'town', 'city', 'metro', 'region'];
+const VALID_QUALITIES = ['preview', 'print'];
+
+/**
+ * Who a request comes from, for fair scheduling: the original client address behind proxies.
+ * @param {Request} req - Express request
+ * @returns {string}
+ */
+function clientId(req) {
+  const forwarded = req.headers['x-forwarded-for'];
+  if (forwarded) {
+    return forwarded.split(',')[0].trim();
+  }
+  return req.ip || 'unknown';
+}
 
 /**
  * POST /api/posters
@@ -17,7 +32,7 @@ const VALID_SIZES = ['auto', 'neighborhood', 'small', 'town', 'city', 'metro', '
  */
 postersRouter.post('/posters', async (req, res) => {
   try {
-    const { city, state, country, theme, size, distance, showInGallery } = req.body;
+    const { city, state, country, theme, size, distance, quality, showInGallery } = req.body;
 
     // Validate required fields
     if (!city || city.length < 1 || city.length > 100) {
@@ -44,6 +59,12 @@ postersRouter.post('/posters', async (req, res) => {
       return res.status(400).json({ detail: `Invalid size '${size}'. Must be one of: ${VALID_SIZES.join(', ')}` });
     }
 
+    // Validate quality: 'print' (300 DPI, the default) or 'preview' (72 DPI, scheduled first)
+    const renderQuality = quality || 'print';
+    if (!VALID_QUALITIES.includes(renderQuality)) {
+      return res.status(400).json({ detail: `Invalid quality '${quality}'. Must be one of: ${VALID_QUALITIES.join(', ')}` });
+    }
+
     // Validate distance if provided
     if (distance !== undefined && (distance < 1000 || distance > 50000)) {
       return res.status(400).json({ detail: 'Distance must be between 1000 and 50000 meters' });
@@ -57,15 +78,21 @@ postersRouter.post('/posters', async (req, res) => {
       theme: theme || 'feature_based',
       size: posterSize,
       distance: distance || null,
+      quality: renderQuality,
       showInGallery: showInGallery !== false, // Default to true
     };
 
-    const jobId = createJob(request);
+    const jobId = createJob(request, clientId(req));
 
-    // Start poster generation in background
-    generatePoster(jobId, request).catch((error) => {
-      console.error(`[Job ${jobId}] Generation failed:`, error);
-    });
+    if (config.remoteRender) {
+      // A render worker (worker.js) picks it up, preferably one with the location cached
+      await enqueueJob(jobId, locationKey(city, country, state));
+    } else {
+      // Start poster generation in background
+      generatePoster(jobId, request).catch((error) => {
+        console.error(`[Job ${jobId}] Generation failed:`, error);
+      });
+    }
 
     // Return job info
     res.status(200).json({
@@ -82,13 +109,33 @@ postersRouter.post('/posters', async (req, res) => {
   }
 });
 
+/**
+ * GET /api/posters/:jobId/preview
+ * Download the quick low-detail preview, available before the poster completes.
+ */
+postersRouter.get('/posters/:jobId/preview', async (req, res) => {
+  const { jobId } = req.params;
+  const job = await loadJob(jobId);
+
+  if (!job) {
+    return res.status(404).json({ detail: 'Job not found' });
+  }
+
+  if (!job.previewFile || !existsSync(job.previewFile)) {
+    return res.status(404).json({ detail: 'Preview not available' });
+  }
+
+  res.setHeader('Content-Type', 'image/png');
+  res.sendFile(job.previewFile);
+});
+
 /**
  * GET /api/posters/:jobId
  * Download a completed poster image.
  */
-postersRouter.get('/posters/:jobId', (req, res) => {
+postersRouter.get('/posters/:jobId', async (req, res) => {
   const { jobId } = req.params;
-  const job = getJob(jobId);
+  const job = await loadJob(jobId);
 
   if (!job) {
     return res.status(404).json({ detail: 'Job not found' });
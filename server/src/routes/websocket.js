@@ -1,4 +1,4 @@
-import { getJob, setNotifyCallback } from '../services/jobManager.js';
+import { jobUpdateMessage, loadJob, setNotifyCallback, setPreviewCallback } from '../services/jobManager.js';
 
 // Track active WebSocket connections by job ID
 const connections = new Map();
@@ -26,8 +26,32 @@ function notifyJobUpdate(jobId, update) {
   }
 }
 
-// Set the notification callback for the job manager
+/**
+ * Tell all connected clients that a quick preview is available.
+ * @param {string} jobId - The job ID
+ * @param {Object} preview - job_id and preview_url
+ */
+function notifyJobPreview(jobId, preview) {
+  const jobConnections = connections.get(jobId);
+  if (!jobConnections || jobConnections.size === 0) {
+    return;
+  }
+
+  const message = JSON.stringify({
+    type: 'preview',
+    ...preview,
+  });
+
+  for (const ws of jobConnections) {
+    if (ws.readyState === 1) { // OPEN
+      ws.send(message);
+    }
+  }
+}
+
+// Set the notification callbacks for the job manager
 setNotifyCallback(notifyJobUpdate);
+setPreviewCallback(notifyJobPreview);
 
 /**
  * Set up WebSocket routes on the app.
@@ -55,19 +79,14 @@ export function setupWebSocket(app) {
       }
     }, 30000);
 
-    // Send current job status immediately
-    const job = getJob(jobId);
-    if (job) {
-      ws.send(JSON.stringify({
-        type: 'job_update',
-        job_id: jobId,
-        status: job.status,
-        progress: job.progress,
-        message: job.message,
-        error: job.error,
-        download_url: job.status === 'completed' ? `/api/posters/${jobId}` : null,
-      }));
-    }
+    // Send current job status immediately (the job may have been created on another node)
+    loadJob(jobId).then((job) => {
+      if (job && ws.readyState === 1) { // OPEN
+        ws.send(JSON.stringify(jobUpdateMessage(job)));
+      }
+    }).catch((error) => {
+      console.error(`[WebSocket] Could not load job ${jobId}:`, error.message);
+    });
 
     // Handle client disconnect
     ws.on('close', () => {
@@ -0,0 +1,221 @@
+import { EventEmitter } from 'events';
+
+/**
+ * Broker shared by API nodes and render workers (mirrors app/services/broker.py).
+ *
+ * Jobs, their progress and the render queue live in a Redis-compatible
+ * broker (Redis, Valkey, KeyDB, Dragonfly, ...) once BROKER_URL is set, so
+ * any API node can answer for any job and render workers can run on other
+ * machines (see jobManager.js and worker.js). Only a small subset of Redis
+ * is used:
+ *
+ *   job records   hashes (HSET/HGETALL/HINCRBY/EXPIRE)
+ *   workers       a hash of heartbeats (HSET/HGETALL/HDEL)
+ *   render queues lists, shared and per worker (LPUSH/BRPOP/LLEN/LMOVE)
+ *   job events    pub/sub (PUBLISH/SUBSCRIBE)
+ *
+ * InProcessBroker implements that subset, with ioredis's method names, for
+ * a single process: tests use it to stand in for a real broker, and
+ * "memory://" selects it for development.
+ */
+
+/**
+ * In-memory stand-in for an ioredis client. Clients made with duplicate()
+ * share the same data, as connections to one Redis server do.
+ */
+export class InProcessBroker extends EventEmitter {
+  constructor(store = null) {
+    super();
+    this.store = store || {
+      hashes: new Map(),
+      lists: new Map(),
+      expires: new Map(), // key -> deadline (ms)
+      subscribers: new Map(), // channel -> Set of clients
+      popWaiters: new Set(), // blocked BRPOPs, retried on every LPUSH
+    };
+    this.channels = new Set();
+  }
+
+  duplicate() {
+    return new InProcessBroker(this.store);
+  }
+
+  expireStale(key) {
+    const deadline = this.store.expires.get(key);
+    if (deadline !== undefined && deadline <= Date.now()) {
+      this.store.hashes.delete(key);
+      this.store.lists.delete(key);
+      this.store.expires.delete(key);
+    }
+  }
+
+  async hset(key, fields) {
+    this.expireStale(key);
+    if (!this.store.hashes.has(key)) {
+      this.store.hashes.set(key, new Map());
+    }
+    const hash = this.store.hashes.get(key);
+    let added = 0;
+    for (const [field, value] of Object.entries(fields)) {
+      if (!hash.has(field)) added += 1;
+      hash.set(field, String(value));
+    }
+    return added;
+  }
+
+  async hgetall(key) {
+    this.expireStale(key);
+    return Object.fromEntries(this.store.hashes.get(key) || []);
+  }
+
+  async hdel(key, ...fields) {
+    this.expireStale(key);
+    const hash = this.store.hashes.get(key);
+    return hash ? fields.filter((field) => hash.delete(field)).length : 0;
+  }
+
+  async hincrby(key, field, amount) {
+    this.expireStale(key);
+    if (!this.store.hashes.has(key)) {
+      this.store.hashes.set(key, new Map());
+    }
+    const hash = this.store.hashes.get(key);
+    const value = parseInt(hash.get(field) || '0', 10) + amount;
+    hash.set(field, String(value));
+    return value;
+  }
+
+  async expire(key, seconds) {
+    this.expireStale(key);
+    if (!this.store.hashes.has(key) && !this.store.lists.has(key)) {
+      return 0;
+    }
+    this.store.expires.set(key, Date.now() + seconds * 1000);
+    return 1;
+  }
+
+  async lpush(key, ...values) {
+    this.expireStale(key);
+    if (!this.store.lists.has(key)) {
+      this.store.lists.set(key, []);
+    }
+    const list = this.store.lists.get(key);
+    list.unshift(...values.map(String).reverse());
+    for (const retry of [...this.store.popWaiters]) retry();
+    return list.length;
+  }
+
+  async llen(key) {
+    this.expireStale(key);
+    return (this.store.lists.get(key) || []).length;
+  }
+
+  /**
+   * Pop an item from one end of a list and push it onto an end of another.
+   * @returns {Promise<string|null>} The item, or null if the first list is empty
+   */
+  async lmove(source, destination, from, to) {
+    this.expireStale(source);
+    this.expireStale(destination);
+    const list = this.store.lists.get(source);
+    if (!list || !list.length) return null;
+    const value = from === 'LEFT' ? list.shift() : list.pop();
+    if (!this.store.lists.has(destination)) {
+      this.store.lists.set(destination, []);
+    }
+    if (to === 'LEFT') this.store.lists.get(destination).unshift(value);
+    else this.store.lists.get(destination).push(value);
+    for (const retry of [...this.store.popWaiters]) retry();
+    return value;
+  }
+
+  /**
+   * Pop from the tail of the first non-empty list, waiting up to timeout seconds (0 = forever).
+   * Called as brpop(key, ..., timeout), like ioredis.
+   * @returns {Promise<[string, string]|null>}
+   */
+  brpop(...args) {
+    const timeout = args.pop();
+    const pop = () => {
+      for (const key of args) {
+        this.expireStale(key);
+        const list = this.store.lists.get(key);
+        if (list && list.length) return [key, list.pop()];
+      }
+      return null;
+    };
+    const popped = pop();
+    if (popped) return Promise.resolve(popped);
+
+    return new Promise((resolve) => {
+      let timer = null;
+      const retry = () => {
+        const result = pop();
+        if (result) {
+          this.store.popWaiters.delete(retry);
+          clearTimeout(timer);
+          resolve(result);
+        }
+      };
+      this.store.popWaiters.add(retry);
+      if (timeout) {
+        timer = setTimeout(() => {
+          this.store.popWaiters.delete(retry);
+          resolve(null);
+        }, timeout * 1000);
+      }
+    });
+  }
+
+  async publish(channel, message) {
+    const subscribers = [...(this.store.subscribers.get(channel) || [])];
+    // Delivered asynchronously, like messages arriving from a server
+    setImmediate(() => {
+      for (const client of subscribers) {
+        if (client.channels.has(channel)) client.emit('message', channel, String(message));
+      }
+    });
+    return subscribers.length;
+  }
+
+  async subscribe(...channels) {
+    for (const channel of channels) {
+      if (!this.store.subscribers.has(channel)) {
+        this.store.subscribers.set(channel, new Set());
+      }
+      this.store.subscribers.get(channel).add(this);
+      this.channels.add(channel);
+    }
+    return this.channels.size;
+  }
+
+  async quit() {
+    for (const channel of this.channels) {
+      this.store.subscribers.get(channel)?.delete(this);
+    }
+    this.channels.clear();
+    return 'OK';
+  }
+}
+
+let memoryBroker = null;
+
+/**
+ * Connect to the broker at url: "memory://" for this process only, else a Redis URL.
+ * @param {string} url - Broker URL
+ * @returns {Promise<Object>} An ioredis client, or the process's InProcessBroker
+ */
+export async function connectBroker(url) {
+  if (url.startsWith('memory://')) {
+    memoryBroker = memoryBroker || new InProcessBroker();
+    return memoryBroker;
+  }
+
+  let Redis;
+  try {
+    ({ default: Redis } = await import('ioredis'));
+  } catch {
+    throw new Error('BROKER_URL needs the ioredis package: npm install ioredis');
+  }
+  return new Redis(url);
+}
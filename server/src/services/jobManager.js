@@ -1,41 +1,133 @@
 import { v4 as uuidv4 } from 'uuid';
+import { config } from '../config.js';
+import { JobClass } from './jobScheduler.js';
+import { HashRing } from './routing.js';
 
-// In-memory job storage (use Redis for production)
+/**
+ * Job records, change notifications and the render queue (mirrors
+ * app/services/job_manager.py).
+ *
+ * By default jobs live in this process only. With a broker (see broker.js
+ * and useBroker()), every job is also kept as a hash in the broker, which
+ * is the source of truth: loadJob() reads through it, so any API node can
+ * answer for any job, and each change is published so the other nodes wake
+ * their long-polls and event streams and forward it to their WebSocket
+ * clients. Render workers (worker.js) take jobs from the render queues and
+ * report progress through the same records. Jobs are routed to the worker
+ * most likely to have their location's map data cached (see routing.js and
+ * enqueueJob()).
+ */
+
+// Broker keys and channel
+const JOB_KEY_PREFIX = 'maptoposter:job:';
+const JOB_CHANNEL = 'maptoposter:job-events';
+const RENDER_QUEUE = 'maptoposter:render-queue'; // taken by any worker
+const WORKER_QUEUE_PREFIX = 'maptoposter:render-queue:'; // jobs routed to one worker
+const WORKERS_KEY = 'maptoposter:workers'; // worker ID -> last heartbeat (unix time)
+
+// A worker that hasn't sent a heartbeat for this long has left the fleet
+const WORKER_TIMEOUT_SECONDS = 30;
+
+// A worker with this many jobs queued for it is saturated: further jobs spill to the next
+const SPILL_QUEUE_DEPTH = 2;
+
+// Identifies this process's events on the broker
+export const nodeId = uuidv4().replaceAll('-', '').slice(0, 12);
+
+// This process's ID as a render worker: stable across restarts, so the locations routed
+// to it (and cached on its disk) stay with it
+export const workerId = config.workerId;
+
+// Jobs this process has created or looked up (a copy of the broker's when there is one)
 const jobs = new Map();
 
+// Shared broker, if jobs are shared with other nodes (see useBroker), and its
+// extra connections: one subscribed to job events, one for blocking queue pops
+let broker = null;
+let subscriber = null;
+let queueClient = null;
+
+// Live render workers, kept in step with their heartbeats
+const ring = new HashRing();
+
 // Callback for WebSocket notifications
 let notifyCallback = null;
 
+// Callback for WebSocket preview notifications
+let previewCallback = null;
+
+// Long-polls and event streams waiting for a job to change: job ID -> Set of wake functions
+const changeWaiters = new Map();
+
 export const JobStatus = {
   PENDING: 'pending',
   PROCESSING: 'processing',
   COMPLETED: 'completed',
   FAILED: 'failed',
+  CANCELLED: 'cancelled',
 };
 
+/**
+ * Whether jobs are shared with other nodes through a broker.
+ * @returns {boolean}
+ */
+export function sharesJobs() {
+  return broker !== null;
+}
+
+/**
+ * Share jobs with other API nodes and render workers through a broker, or
+ * keep them in this process again with null.
+ * @param {Object|null} client - An ioredis client or InProcessBroker
+ */
+export async function useBroker(client) {
+  await Promise.all([subscriber?.quit(), queueClient?.quit()]);
+  subscriber = null;
+  queueClient = null;
+  broker = client;
+  if (!client) return;
+
+  subscriber = client.duplicate();
+  subscriber.on('message', (channel, message) => applyEvent(JSON.parse(message)));
+  await subscriber.subscribe(JOB_CHANNEL);
+}
+
 /**
  * Create a new job.
  * @param {Object} request - The poster request
+ * @param {string} [client] - Who requested it, for fair scheduling
  * @returns {string} The job ID
  */
-export function createJob(request) {
+export function createJob(request, client = null) {
   const jobId = uuidv4();
   const job = {
     id: jobId,
     status: JobStatus.PENDING,
+    jobClass: request.quality === 'preview' ? JobClass.PREVIEW : JobClass.PRINT,
+    client,
+    queueWaitSeconds: null,
+    version: 0, // bumped on every change; long-polls and event streams wait on it
     progress: 0,
     message: null,
     error: null,
+    previewFile: null,
     request,
     createdAt: new Date().toISOString(),
   };
 
   jobs.set(jobId, job);
+  if (broker) {
+    const key = JOB_KEY_PREFIX + jobId;
+    // Commands on one connection run in order, so this lands before any update or enqueue
+    broker.hset(key, encode(job))
+      .then(() => broker.expire(key, config.cleanupHours * 3600))
+      .catch((error) => console.error(`[Job ${jobId}] Could not store job on broker:`, error.message));
+  }
   return jobId;
 }
 
 /**
- * Get a job by ID.
+ * Get a job by ID from this process's copies.
  * @param {string} jobId - The job ID
  * @returns {Object|null} The job or null if not found
  */
@@ -43,6 +135,29 @@ export function getJob(jobId) {
   return jobs.get(jobId) || null;
 }
 
+/**
+ * Get a job by ID as the broker has it now, when there is one (it may have
+ * been created on another node); else as getJob().
+ * @param {string} jobId - The job ID
+ * @returns {Promise<Object|null>} The job or null if not found
+ */
+export async function loadJob(jobId) {
+  if (!broker) {
+    return getJob(jobId);
+  }
+
+  const record = await broker.hgetall(JOB_KEY_PREFIX + jobId);
+  if (!Object.keys(record).length) {
+    jobs.delete(jobId);
+    return null;
+  }
+  // Refresh in place: event streams hold on to the object
+  if (!jobs.has(jobId)) {
+    jobs.set(jobId, {});
+  }
+  return Object.assign(jobs.get(jobId), decode(record));
+}
+
 /**
  * Update a job's status.
  * @param {string} jobId - The job ID
@@ -53,20 +168,278 @@ export function updateJob(jobId, updates) {
   if (!job) return;
 
   Object.assign(job, updates);
+  jobChanged(job, updates);
+  notifyUpdate(job);
+}
+
+/**
+ * Record a job's quick preview and announce it to WebSocket clients.
+ * @param {string} jobId - The job ID
+ * @param {string} previewFile - Path of the preview image
+ */
+export function setJobPreview(jobId, previewFile) {
+  const job = jobs.get(jobId);
+  if (!job) return;
 
-  // Notify via WebSocket if callback is set
+  job.previewFile = previewFile;
+  jobChanged(job, { previewFile });
+  notifyPreview(job);
+}
+
+/**
+ * Tell this node's WebSocket clients about a job's current state.
+ * @param {Object} job - The job
+ */
+function notifyUpdate(job) {
   if (notifyCallback) {
-    notifyCallback(jobId, {
-      job_id: jobId,
+    notifyCallback(job.id, {
+      job_id: job.id,
       status: job.status,
       progress: job.progress,
       message: job.message,
       error: job.error,
-      download_url: job.status === JobStatus.COMPLETED ? `/api/posters/${jobId}` : null,
+      download_url: job.status === JobStatus.COMPLETED ? `/api/posters/${job.id}` : null,
+    });
+  }
+}
+
+/**
+ * Tell this node's WebSocket clients that a job's quick preview is available.
+ * @param {Object} job - The job
+ */
+function notifyPreview(job) {
+  if (previewCallback) {
+    previewCallback(job.id, {
+      job_id: job.id,
+      preview_url: `/api/posters/${job.id}/preview`,
     });
   }
 }
 
+/**
+ * Bump a job's version and wake everyone waiting for it to change. With a
+ * broker, the changed fields are written to the shared record and published
+ * so the other nodes update their copies (see applyEvent).
+ * @param {Object} job - The job
+ * @param {Object} updates - The changed fields
+ */
+function jobChanged(job, updates) {
+  if (!broker) {
+    job.version += 1;
+    wakeChangeWaiters(job.id);
+    return;
+  }
+
+  const key = JOB_KEY_PREFIX + job.id;
+  const fields = encode(updates);
+  broker.hset(key, fields)
+    .then(() => broker.hincrby(key, 'version', 1))
+    .then((version) => {
+      job.version = Math.max(job.version, version);
+      wakeChangeWaiters(job.id);
+      return broker.publish(JOB_CHANNEL, JSON.stringify({ node: nodeId, job_id: job.id, version, fields }));
+    })
+    .catch((error) => console.error(`[Job ${job.id}] Could not share job update:`, error.message));
+}
+
+/**
+ * Wake everyone waiting for a job to change.
+ * @param {string} jobId - The job ID
+ */
+function wakeChangeWaiters(jobId) {
+  const waiters = changeWaiters.get(jobId);
+  if (waiters) {
+    changeWaiters.delete(jobId);
+    for (const wake of waiters) wake();
+  }
+}
+
+/**
+ * Apply another node's change to our copy of the job and pass it on to our waiters and clients.
+ * @param {Object} event - node, job_id, version and the encoded changed fields
+ */
+function applyEvent(event) {
+  const job = jobs.get(event.job_id);
+  if (event.node === nodeId || !job) {
+    // Our own change, or a job nobody here is watching
+    return;
+  }
+
+  if (event.version > job.version) {
+    Object.assign(job, decode(event.fields));
+    job.version = event.version;
+  }
+  wakeChangeWaiters(job.id);
+  if ('previewFile' in event.fields) {
+    notifyPreview(job);
+  } else {
+    notifyUpdate(job);
+  }
+}
+
+/**
+ * Queue a job for the render workers.
+ *
+ * A job with a location (routing.locationKey) is queued for the worker the
+ * location hashes to, or the next one round the ring while that one already
+ * has SPILL_QUEUE_DEPTH jobs waiting. Other jobs, and jobs every worker is
+ * too busy for, go on the shared queue.
+ * @param {string} jobId - The job ID
+ * @param {string} [location] - The job's location key
+ * @returns {Promise<string|null>} The worker the job was queued for, or null for the shared queue
+ */
+export async function enqueueJob(jobId, location = null) {
+  if (location) {
+    for (const worker of await route(location)) {
+      const queue = WORKER_QUEUE_PREFIX + worker;
+      if (await broker.llen(queue) < SPILL_QUEUE_DEPTH) {
+        await broker.lpush(queue, jobId);
+        console.log(`[Job ${jobId}] Queued for worker ${worker}`);
+        return worker;
+      }
+    }
+  }
+  await broker.lpush(RENDER_QUEUE, jobId);
+  return null;
+}
+
+/**
+ * Take the oldest job queued for worker, else the oldest shared one.
+ * @param {number} timeout - Longest to wait, in seconds
+ * @param {string} [worker] - The worker taking the job
+ * @returns {Promise<string|null>} The job ID, or null on timeout
+ */
+export async function dequeueJob(timeout, worker = null) {
+  // BRPOP blocks its connection, so it gets one of its own
+  queueClient = queueClient || broker.duplicate();
+  const queues = worker ? [WORKER_QUEUE_PREFIX + worker, RENDER_QUEUE] : [RENDER_QUEUE];
+  const popped = await queueClient.brpop(...queues, timeout);
+  return popped ? popped[1] : null;
+}
+
+/**
+ * Render workers that have sent a heartbeat within WORKER_TIMEOUT_SECONDS.
+ * @returns {Promise<string[]>}
+ */
+export async function liveWorkers() {
+  const now = Date.now() / 1000;
+  return Object.entries(await broker.hgetall(WORKERS_KEY))
+    .filter(([, seen]) => now - parseFloat(seen) < WORKER_TIMEOUT_SECONDS)
+    .map(([worker]) => worker)
+    .sort();
+}
+
+// Live workers in the order a location tries them
+async function route(location) {
+  const live = new Set(await liveWorkers());
+  // Only workers that joined or left change the ring
+  for (const worker of [...ring.nodes]) {
+    if (!live.has(worker)) ring.remove(worker);
+  }
+  for (const worker of live) ring.add(worker);
+  return ring.preference(location);
+}
+
+/**
+ * Announce a render worker, or keep it in the fleet (call every few seconds).
+ * @param {string} worker - The worker ID
+ */
+export function registerWorker(worker) {
+  return broker.hset(WORKERS_KEY, { [worker]: Date.now() / 1000 });
+}
+
+/**
+ * Take a worker out of the fleet and hand the jobs queued for it to the others.
+ * @param {string} worker - The worker ID
+ */
+export async function retireWorker(worker) {
+  await broker.hdel(WORKERS_KEY, worker);
+  await releaseQueue(worker);
+}
+
+/**
+ * Retire workers that stopped sending heartbeats (crashed or cut off).
+ */
+export async function reapWorkers() {
+  const now = Date.now() / 1000;
+  for (const [worker, seen] of Object.entries(await broker.hgetall(WORKERS_KEY))) {
+    // Only the node that removes the worker moves its jobs
+    if (now - parseFloat(seen) >= WORKER_TIMEOUT_SECONDS && await broker.hdel(WORKERS_KEY, worker)) {
+      console.warn(`Render worker ${worker} stopped sending heartbeats`);
+      await releaseQueue(worker);
+    }
+  }
+}
+
+// Move a worker's queued jobs to the front of the shared queue, oldest first
+async function releaseQueue(worker) {
+  // Newest first onto the popping end, so the oldest ends up taken first
+  let moved;
+  do {
+    moved = await broker.lmove(WORKER_QUEUE_PREFIX + worker, RENDER_QUEUE, 'LEFT', 'RIGHT');
+  } while (moved !== null);
+}
+
+function encode(fields) {
+  return Object.fromEntries(Object.entries(fields).map(([name, value]) => [name, JSON.stringify(value ?? null)]));
+}
+
+function decode(record) {
+  return Object.fromEntries(Object.entries(record).map(([name, value]) => [name, JSON.parse(value)]));
+}
+
+/**
+ * Wait until a job's version differs from version, or timeoutMs passes.
+ * @param {string} jobId - The job ID
+ * @param {number} version - Version the caller has already seen
+ * @param {number} timeoutMs - Longest to wait
+ * @returns {Promise<Object|null>} The job as it is then (unchanged on timeout), or null if it doesn't exist
+ */
+export async function waitForJobChange(jobId, version, timeoutMs) {
+  const job = await loadJob(jobId);
+  if (!job || job.version !== version) {
+    return job;
+  }
+
+  return new Promise((resolve) => {
+    const wake = () => {
+      clearTimeout(timer);
+      resolve(jobs.get(jobId) || null);
+    };
+    const timer = setTimeout(() => {
+      const waiters = changeWaiters.get(jobId);
+      if (waiters) {
+        waiters.delete(wake);
+        if (waiters.size === 0) changeWaiters.delete(jobId);
+      }
+      resolve(jobs.get(jobId) || null);
+    }, timeoutMs);
+
+    if (!changeWaiters.has(jobId)) {
+      changeWaiters.set(jobId, new Set());
+    }
+    changeWaiters.get(jobId).add(wake);
+  });
+}
+
+/**
+ * The job_update message describing a job's current state (as sent over WebSockets).
+ * @param {Object} job - The job
+ * @returns {Object}
+ */
+export function jobUpdateMessage(job) {
+  return {
+    type: 'job_update',
+    job_id: job.id,
+    status: job.status,
+    progress: job.progress,
+    message: job.message,
+    error: job.error,
+    download_url: job.status === JobStatus.COMPLETED ? `/api/posters/${job.id}` : null,
+    preview_url: job.previewFile ? `/api/posters/${job.id}/preview` : null,
+  };
+}
+
 /**
  * Set the notification callback for WebSocket updates.
  * @param {Function} callback - The callback function
@@ -75,6 +448,14 @@ export function setNotifyCallback(callback) {
   notifyCallback = callback;
 }
 
+/**
+ * Set the notification callback for quick previews.
+ * @param {Function} callback - The callback function
+ */
+export function setPreviewCallback(callback) {
+  previewCallback = callback;
+}
+
 /**
  * Get all jobs (for debugging).
  * @returns {Array} All jobs
@@ -0,0 +1,184 @@
+/**
+ * Which waiting render starts next (mirrors JobScheduler in app/services/scheduler.py).
+ *
+ * The most urgent lane goes first: previews someone is looking at, then
+ * print renders, then background work. Every AGING_MS a job waits moves it
+ * up a lane, so print and background jobs can't be held back forever by a
+ * stream of previews. Within a lane, clients with fewer jobs running go
+ * first and then jobs in arrival order, so one client's batch can't crowd
+ * out everyone else. The chosen job blocks those behind it until its
+ * predicted memory fits, so a large job isn't starved by small ones.
+ */
+
+export const JobClass = {
+  PREVIEW: 'preview',
+  PRINT: 'print',
+  BACKGROUND: 'background',
+};
+
+// Lower = more urgent
+const LANE_RANKS = {
+  [JobClass.PREVIEW]: 0,
+  [JobClass.PRINT]: 1,
+  [JobClass.BACKGROUND]: 2,
+};
+
+// A waiting job moves up one lane per this many milliseconds
+export const AGING_MS = 60 * 1000;
+
+/**
+ * Lane rank of a waiting job after aging.
+ * @param {Object} job - Waiting job with jobClass and enqueuedAt
+ * @param {number} now - Date.now()
+ * @param {number} [agingMs] - Wait per lane
+ * @returns {number}
+ */
+function lane(job, now, agingMs) {
+  const promoted = Math.floor((now - job.enqueuedAt) / agingMs);
+  return Math.max(0, (LANE_RANKS[job.jobClass] ?? LANE_RANKS[JobClass.PRINT]) - promoted);
+}
+
+/**
+ * Index of the waiting job to start next.
+ * @param {Array<Object>} waiting - Jobs with jobClass, client and enqueuedAt, in arrival order
+ * @param {Map<string, number>} runningByClient - Running jobs per client
+ * @param {number} [agingMs] - Wait per lane
+ * @returns {number} Index into waiting, or -1 if empty
+ */
+export function pickNext(waiting, runningByClient, agingMs = AGING_MS) {
+  const now = Date.now();
+  let best = -1;
+  let bestKey = null;
+  waiting.forEach((job, index) => {
+    const key = [lane(job, now, agingMs), runningByClient.get(job.client) || 0, job.enqueuedAt];
+    // Lane, then the client's running jobs, then arrival
+    if (!bestKey || (key[0] - bestKey[0] || key[1] - bestKey[1] || key[2] - bestKey[2]) < 0) {
+      best = index;
+      bestKey = key;
+    }
+  });
+  return best;
+}
+
+/**
+ * Admission of jobs against a memory budget, by priority lane.
+ * A job is always admitted onto an idle machine.
+ */
+export class JobScheduler {
+  /**
+   * @param {number} budgetBytes - Machine-wide budget
+   * @param {number} [agingMs] - Wait per lane
+   */
+  constructor(budgetBytes, agingMs = AGING_MS) {
+    this.budgetBytes = budgetBytes;
+    this.agingMs = agingMs;
+    this.usedBytes = 0;
+    this.running = 0;
+    this.runningByClient = new Map();
+    this.waiting = [];
+    this.agingTimer = null;
+  }
+
+  fits(bytes) {
+    return this.running === 0 || this.usedBytes + bytes <= this.budgetBytes;
+  }
+
+  /**
+   * @param {number} bytes - Predicted peak memory
+   * @returns {boolean} True if a job arriving now would start without waiting
+   */
+  canStart(bytes) {
+    return this.waiting.length === 0 && this.fits(bytes);
+  }
+
+  /**
+   * Wait until a job is next and fits the budget.
+   * @param {string} id - Job ID
+   * @param {number} bytes - Predicted peak memory
+   * @param {Object} [options]
+   * @param {string} [options.jobClass] - Lane (JobClass)
+   * @param {string} [options.client] - Requester, for fairness between clients
+   * @returns {Promise<{release: Function, waitedMs: number}|null>} null if cancelled while waiting
+   */
+  acquire(id, bytes, { jobClass = JobClass.PRINT, client = null } = {}) {
+    return new Promise((resolve) => {
+      this.waiting.push({ id, bytes, jobClass, client, enqueuedAt: Date.now(), resolve });
+      this.admit();
+    });
+  }
+
+  /**
+   * Drop a waiting job.
+   * @param {string} id - Job ID
+   * @returns {boolean} False if the job wasn't waiting
+   */
+  cancel(id) {
+    const index = this.waiting.findIndex((waiter) => waiter.id === id);
+    if (index === -1) return false;
+    const [waiter] = this.waiting.splice(index, 1);
+    waiter.resolve(null);
+    this.admit();
+    return true;
+  }
+
+  admit() {
+    clearTimeout(this.agingTimer);
+    this.agingTimer = null;
+    for (;;) {
+      const index = pickNext(this.waiting, this.runningByClient, this.agingMs);
+      if (index === -1) return;
+      if (!this.fits(this.waiting[index].bytes)) {
+        this.admitOnNextAging();
+        return;
+      }
+
+      const [{ bytes, client, enqueuedAt, resolve }] = this.waiting.splice(index, 1);
+      this.usedBytes += bytes;
+      this.running += 1;
+      this.runningByClient.set(client, (this.runningByClient.get(client) || 0) + 1);
+      let released = false;
+      const release = () => {
+        if (released) return;
+        released = true;
+        this.usedBytes -= bytes;
+        this.running -= 1;
+        this.runningByClient.set(client, this.runningByClient.get(client) - 1);
+        this.admit();
+      };
+      resolve({ release, waitedMs: Date.now() - enqueuedAt });
+    }
+  }
+
+  /**
+   * Aging may make a job that fits the next one before anything finishes,
+   * so look again when the next waiting job moves up a lane.
+   */
+  admitOnNextAging() {
+    const now = Date.now();
+    let next = Infinity;
+    for (const waiter of this.waiting) {
+      if (lane(waiter, now, this.agingMs) === 0) continue;
+      const promoted = Math.floor((now - waiter.enqueuedAt) / this.agingMs);
+      next = Math.min(next, waiter.enqueuedAt + (promoted + 1) * this.agingMs);
+    }
+    if (next !== Infinity) {
+      this.agingTimer = setTimeout(() => this.admit(), next - now);
+      // Never what keeps the process alive
+      this.agingTimer.unref?.();
+    }
+  }
+
+  stats() {
+    const waitingByClass = Object.fromEntries(Object.values(JobClass).map((jobClass) => [jobClass, 0]));
+    for (const waiter of this.waiting) {
+      waitingByClass[waiter.jobClass] += 1;
+    }
+    return {
+      budgetBytes: this.budgetBytes,
+      usedBytes: this.usedBytes,
+      running: this.running,
+      waiting: this.waiting.length,
+      waitingByClass,
+    };
+  }
+}
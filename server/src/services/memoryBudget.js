@@ -0,0 +1,220 @@
+import { existsSync, readFileSync } from 'fs';
+import { totalmem } from 'os';
+import { join } from 'path';
+import { config } from '../config.js';
+
+/**
+ * Memory-aware admission of render jobs (mirrors app/services/scheduler.py).
+ *
+ * Each job's peak memory is predicted from its radius, DPI and, when the
+ * location is cached, the size of its cache entry. Jobs start once their
+ * prediction fits the machine-wide budget next to the running jobs' (see
+ * jobScheduler.js for which waiting job goes next), and each render's RSS
+ * is held to its prediction plus headroom so an underestimated job fails
+ * on its own instead of getting the machine OOM-killed.
+ */
+
+export const MB = 1024 * 1024;
+
+// Interpreter plus numpy/shapely/matplotlib/osmnx once imported
+const BASE_BYTES = 350 * MB;
+
+// Canvas RGBA buffer, the composed figure and the PNG encoder's copies
+const RASTER_BYTES_PER_PIXEL = 16;
+
+// Downloading and simplifying a street network, per km² of map (cache miss)
+const DOWNLOAD_BYTES_PER_KM2 = MB / 2;
+
+// In-memory size of map data relative to its cache entry on disk
+const CACHED_EXPANSION = 4;
+
+// Auto-sized jobs whose location hasn't been cached yet are planned for the
+// largest radius the generator's auto sizing can pick (see get_coordinates)
+const AUTO_MAX_DISTANCE = 50000;
+
+// Poster size in inches (portrait)
+const FIGSIZE = [12, 16];
+
+// How often a render's resident memory is checked against its limit
+const RSS_POLL_MS = 500;
+
+// Mirrors SIZE_PRESETS in create_map_poster.py, smallest first
+export const SIZE_PRESETS = {
+  neighborhood: 2000,
+  small: 4000,
+  town: 6000,
+  city: 12000,
+  metro: 20000,
+  region: 35000,
+};
+
+/**
+ * Machine-wide memory budget for renders: MEMORY_BUDGET_MB, else 75% of RAM.
+ * @returns {number} Bytes
+ */
+export function memoryBudgetBytes() {
+  if (config.memoryBudgetMb > 0) {
+    return config.memoryBudgetMb * MB;
+  }
+  return Math.floor(totalmem() * 0.75);
+}
+
+/**
+ * Predicted peak memory of a render.
+ * @param {number} dist - Map radius in meters
+ * @param {number} dpi - Output DPI
+ * @param {number|null} [cachedBytes] - On-disk size of the location's cache entry
+ * @returns {number} Bytes
+ */
+export function predictJobBytes(dist, dpi, cachedBytes = null) {
+  const [width, height] = FIGSIZE;
+  const pixels = width * height * dpi * dpi;
+  let data;
+  if (cachedBytes !== null) {
+    data = cachedBytes * CACHED_EXPANSION;
+  } else {
+    // The long side spans ±dist, the short side is cut to the aspect ratio
+    const areaKm2 = ((2 * dist) / 1000) ** 2 * (Math.min(width, height) / Math.max(width, height));
+    data = Math.round(areaKm2 * DOWNLOAD_BYTES_PER_KM2);
+  }
+  return BASE_BYTES + pixels * RASTER_BYTES_PER_PIXEL + data;
+}
+
+/**
+ * A location's entries in the generator's cache index (cache/index.db), most
+ * recently used first, as cache.find_cached_location orders them. Read-only
+ * and without locking the index; empty when it can't be read.
+ * @param {Object} request - The poster request
+ * @returns {Array<{distance: number, bytes: number}>}
+ */
+export function cachedLocations({ city, state, country }) {
+  const index = join(config.maptoposterDir, 'cache', 'index.db');
+  // Built into Node 22.5+ (unflagged from 22.13)
+  const sqlite = process.getBuiltinModule?.('node:sqlite');
+  if (!sqlite || !existsSync(index)) {
+    return [];
+  }
+  // Same normalization as cache.get_cache_key
+  const citySlug = (state ? `${city}, ${state}` : city).toLowerCase().replaceAll(' ', '_').replaceAll(',', '');
+  const countrySlug = country.toLowerCase().replaceAll(' ', '_');
+  let db;
+  try {
+    db = new sqlite.DatabaseSync(index, { readOnly: true });
+    return db
+      .prepare(
+        'SELECT distance, size_bytes AS bytes FROM entries WHERE city_slug = ? AND country_slug = ? ' +
+        'ORDER BY last_access DESC',
+      )
+      .all(citySlug, countrySlug)
+      .map(({ distance, bytes }) => ({ distance, bytes }));
+  } catch (error) {
+    console.warn(`Could not read cache index for memory prediction: ${error.message}`);
+    return [];
+  } finally {
+    db?.close();
+  }
+}
+
+/**
+ * Decide a job's radius and predicted memory within a budget.
+ *
+ * Unless map data comes from the tiled map store, where roads are streamed
+ * tile by tile, auto-sized jobs are capped at the 'city' preset: Overpass
+ * and extracts load the whole street network, which OOMs on large metros.
+ * Auto-sized jobs too big for the budget are stepped down to the largest
+ * size preset that fits; jobs with an explicit size or distance fail.
+ * @param {Object} request - The poster request
+ * @param {number} dpi - Output DPI
+ * @param {number} budget - Bytes available for rendering
+ * @returns {{size: string|null, distance: number|null, predictedBytes: number, rssLimitBytes: number, downgradedTo: string|null}}
+ */
+export function planJob(request, dpi, budget) {
+  const auto = !request.distance && (!request.size || request.size === 'auto');
+  const cached = cachedLocations(request);
+  let size = auto ? null : request.size || null;
+  let dist;
+  if (request.distance) {
+    dist = request.distance;
+  } else if (auto && config.mapDataSource !== 'tiles') {
+    size = 'city';
+    dist = SIZE_PRESETS.city;
+  } else if (!auto) {
+    dist = SIZE_PRESETS[request.size];
+  } else {
+    dist = cached[0]?.distance || AUTO_MAX_DISTANCE;
+  }
+
+  const predict = (radius) => predictJobBytes(
+    radius, dpi, cached.find((entry) => entry.distance === radius)?.bytes ?? null,
+  );
+  const plan = {
+    size,
+    distance: request.distance || null,
+    predictedBytes: predict(dist),
+    downgradedTo: null,
+  };
+
+  if (plan.predictedBytes > budget) {
+    if (!auto) {
+      throw new Error(
+        `This poster needs about ${Math.round(plan.predictedBytes / MB)} MB, more than the ` +
+        `${Math.round(budget / MB)} MB available for rendering; choose a smaller size`,
+      );
+    }
+    const smaller = Object.entries(SIZE_PRESETS).filter(([, radius]) => radius < dist).reverse();
+    const fit = smaller.find(([, radius]) => predict(radius) <= budget);
+    if (!fit) {
+      throw new Error(`Not enough memory to render this poster (${Math.round(budget / MB)} MB available)`);
+    }
+    plan.size = fit[0];
+    plan.downgradedTo = fit[0];
+    plan.predictedBytes = predict(fit[1]);
+  }
+
+  plan.rssLimitBytes = Math.min(Math.floor(plan.predictedBytes * config.jobMemoryHeadroom), budget);
+  return plan;
+}
+
+/**
+ * Resident memory of a process, or null where /proc isn't available.
+ * @param {number} pid - Process ID
+ * @returns {number|null} Bytes
+ */
+export function readRssBytes(pid) {
+  try {
+    // statm counts pages; Linux pages are 4 KiB on every platform we deploy to
+    return parseInt(readFileSync(`/proc/${pid}/statm`, 'utf-8').split(' ')[1], 10) * 4096;
+  } catch {
+    return null;
+  }
+}
+
+/**
+ * Call onExceed once if a process's resident memory passes a limit.
+ * @param {number} pid - Process ID
+ * @param {number} limitBytes - RSS limit
+ * @param {Function} onExceed - Called with the RSS seen
+ * @returns {Function} Stops watching
+ */
+export function watchRss(pid, limitBytes, onExceed) {
+  const timer = setInterval(() => {
+    const rss = readRssBytes(pid);
+    if (rss === null) {
+      clearInterval(timer);
+    } else if (rss > limitBytes) {
+      clearInterval(timer);
+      onExceed(rss);
+    }
+  }, RSS_POLL_MS);
+  timer.unref();
+  return () => clearInterval(timer);
+}
+
+/**
+ * Error message of a render stopped for its memory use.
+ * @param {number} limitBytes - The limit it passed
+ * @returns {string}
+ */
+export function memoryLimitMessage(limitBytes) {
+  return `Rendering used more than its ${Math.round(limitBytes / MB)} MB memory limit; try a smaller size`;
+}
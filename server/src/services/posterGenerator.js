@@ -2,8 +2,118 @@ import { spawn } from 'child_process';
 import { join } from 'path';
 import { readFileSync, existsSync } from 'fs';
 import { config } from '../config.js';
-import { updateJob, JobStatus } from './jobManager.js';
+import {
+  getJob, loadJob, sharesJobs, updateJob, setJobPreview, waitForJobChange, JobStatus,
+} from './jobManager.js';
 import { addToGallery } from './galleryManager.js';
+import { getRenderPool } from './renderPool.js';
+import { MB, memoryBudgetBytes, memoryLimitMessage, planJob, watchRss } from './memoryBudget.js';
+import { JobClass, JobScheduler } from './jobScheduler.js';
+
+// Printed by create_map_poster.py once its --preview-output file is written
+const PREVIEW_MARKER = 'PREVIEW_READY';
+
+// Output DPI by job class (create_map_poster.py renders at 72 DPI with --preview)
+const RENDER_DPI = { [JobClass.PREVIEW]: 72, [JobClass.PRINT]: 300 };
+
+// How long a generator gets to exit after SIGTERM before it is SIGKILLed
+const KILL_GRACE_MS = 5000;
+
+// Longest between re-reads of a running job's record, in case a cancel event was missed
+const CANCEL_CHECK_MS = 30000;
+
+// Lines of stderr kept for the error message of a failed job, and the most
+// kept of a line still being written (progress bars redraw without a newline)
+const STDERR_TAIL_LINES = 20;
+const STDERR_LINE_MAX = 4096;
+
+// create_map_poster.py output line prefix -> progress and message. Progress only
+// ever moves forward, so stages skipped on a cache hit are simply never seen.
+const PROGRESS_STAGES = [
+  ['Looking up coordinates', 10, 'Looking up location...'],
+  ['Checking cache', 15, 'Checking map data cache...'],
+  ['  Cache miss', 20, 'Fetching map data from OpenStreetMap...'],
+  ['✓ All data downloaded', 40, 'Map data downloaded'],
+  ['✓ All data read', 40, 'Map data read from the local extract'],
+  ['✓ Cache hit', 40, 'Using cached map data'],
+  ['✓ Using cached base map', 60, 'Using cached base map...'],
+  [PREVIEW_MARKER, 50, 'Preview ready, rendering full poster...'],
+  ['Rendering map', 60, 'Rendering poster...'],
+  ['Saving to', 85, 'Saving poster image...'],
+  ['✓ Done!', 95, 'Finalizing poster...'],
+];
+
+// Running generator processes by job ID, so they can be cancelled
+const runningProcesses = new Map();
+
+// Admits fresh generator processes by priority against the memory budget (the render pool admits its own)
+const jobScheduler = new JobScheduler(memoryBudgetBytes());
+
+/**
+ * Find the progress stage a line of generator output marks.
+ * @param {string} line - One line of stdout
+ * @returns {Array|null} [prefix, progress, message] or null
+ */
+function matchProgressStage(line) {
+  return PROGRESS_STAGES.find(([prefix]) => line.startsWith(prefix)) || null;
+}
+
+/**
+ * Signal a generator and everything it spawned (it leads its own process group).
+ * @param {ChildProcess} child - The generator process
+ * @param {string} signal - Signal name
+ */
+function signalProcessGroup(child, signal) {
+  try {
+    process.kill(-child.pid, signal);
+  } catch {
+    // Already exited
+  }
+}
+
+/**
+ * Stop a generator: SIGTERM, then SIGKILL if it is still around after a grace period.
+ * @param {ChildProcess} child - The generator process
+ */
+function terminate(child) {
+  signalProcessGroup(child, 'SIGTERM');
+  setTimeout(() => {
+    if (child.exitCode === null && child.signalCode === null) {
+      signalProcessGroup(child, 'SIGKILL');
+    }
+  }, KILL_GRACE_MS).unref();
+}
+
+/**
+ * Cancel a running poster generation.
+ * @param {string} jobId - The job ID
+ * @returns {Promise<boolean>} Resolves once the process has exited; false if none was running
+ */
+export function cancelPoster(jobId) {
+  if (jobScheduler.cancel(jobId)) {
+    return Promise.resolve(true);
+  }
+  const running = runningProcesses.get(jobId);
+  if (!running) {
+    return config.renderPoolSize > 0 ? getRenderPool().cancel(jobId) : Promise.resolve(false);
+  }
+
+  running.cancelled = true;
+  const exited = new Promise((resolve) => running.child.once('close', () => resolve(true)));
+  terminate(running.child);
+  return exited;
+}
+
+/**
+ * Whether a job started now would go straight to rendering rather than wait
+ * behind other jobs (render workers take work from the shared queue only then).
+ * @returns {boolean}
+ */
+export function hasRenderCapacity() {
+  return config.renderPoolSize > 0
+    ? getRenderPool().stats().queued === 0
+    : jobScheduler.stats().waiting === 0;
+}
 
 /**
  * Load theme information from theme file.
@@ -27,14 +137,213 @@ function loadThemeInfo(themeId) {
   return { name: themeId, bg: '#0a0a0a', text: '#f5f0e8' };
 }
 
+/**
+ * Build a handler turning generator output lines into job progress.
+ * @param {string} jobId - The job ID
+ * @param {string} previewPath - Where the quick preview is written
+ * @returns {Function} Handler for one line of output
+ */
+function createOutputHandler(jobId, previewPath) {
+  let progress = 5;
+
+  return (line) => {
+    if (!line.trim()) return;
+    console.log(`[Job ${jobId}] ${line}`);
+
+    // The quick preview is pushed to clients ahead of the full render
+    if (line.startsWith(PREVIEW_MARKER) && existsSync(previewPath)) {
+      setJobPreview(jobId, previewPath);
+    }
+
+    const stage = matchProgressStage(line);
+    if (stage && stage[1] > progress) {
+      progress = stage[1];
+      updateJob(jobId, { progress, message: stage[2] });
+    }
+  };
+}
+
+/**
+ * Mark a job as completed and add it to the gallery.
+ * @param {string} jobId - The job ID
+ * @param {Object} request - The poster request
+ */
+function completeJob(jobId, request) {
+  console.log(`[Job ${jobId}] Completed successfully`);
+
+  // Add to gallery BEFORE updating job status (which triggers WebSocket)
+  if (request.showInGallery !== false) {
+    const themeInfo = loadThemeInfo(request.theme || 'feature_based');
+    addToGallery(jobId, request, themeInfo);
+  }
+
+  updateJob(jobId, {
+    status: JobStatus.COMPLETED,
+    progress: 100,
+    message: 'Poster generated successfully!',
+  });
+}
+
 /**
  * Generate a poster using the Python maptoposter script.
+ * Renders on the warm daemon pool unless config.renderPoolSize is 0.
  * @param {string} jobId - The job ID
  * @param {Object} request - The poster request
  */
-export async function generatePoster(jobId, request) {
-  const { city, state, country, theme, size, distance } = request;
+export function generatePoster(jobId, request) {
+  const render = renderPoster(jobId, request);
+  if (sharesJobs()) {
+    cancelWhenRequested(jobId, render).catch((error) => {
+      console.error(`[Job ${jobId}] Watching for cancellation failed:`, error);
+    });
+  }
+  return render;
+}
+
+/**
+ * Stop a job's render once the job is cancelled through any node, not just this one.
+ * @param {string} jobId - The job ID
+ * @param {Promise} render - Settles when the render ends
+ */
+async function cancelWhenRequested(jobId, render) {
+  let finished = false;
+  render.finally(() => {
+    finished = true;
+  }).catch(() => {});
+  while (!finished) {
+    // Re-read each time: covers a cancel event this node missed
+    const job = await loadJob(jobId);
+    if (!job) return;
+    if (job.status === JobStatus.CANCELLED) {
+      await cancelPoster(jobId);
+      return;
+    }
+    await waitForJobChange(jobId, job.version, CANCEL_CHECK_MS);
+  }
+}
+
+async function renderPoster(jobId, request) {
   const outputPath = join(config.dataDir, `${jobId}.png`);
+  const previewPath = join(config.dataDir, `${jobId}.preview.png`);
+
+  // Fit the job to the memory budget before it takes a slot. Auto-sized
+  // jobs may be downgraded; the generator otherwise picks the radius itself.
+  const { jobClass, client } = getJob(jobId) || {};
+  const preview = jobClass === JobClass.PREVIEW;
+  let plan;
+  try {
+    const budget = config.renderPoolSize > 0 ? getRenderPool().memoryBudget : jobScheduler.budgetBytes;
+    plan = planJob(request, RENDER_DPI[preview ? JobClass.PREVIEW : JobClass.PRINT], budget);
+  } catch (error) {
+    console.error(`[Job ${jobId}] Refused: ${error.message}`);
+    updateJob(jobId, { status: JobStatus.FAILED, error: error.message });
+    throw error;
+  }
+  console.log(`[Job ${jobId}] Predicted peak memory ${Math.round(plan.predictedBytes / MB)} MB`);
+
+  updateJob(jobId, { message: 'Waiting in queue...' });
+
+  const scheduling = {
+    jobClass,
+    client,
+    preview,
+    // Update job status to processing once the job leaves the queue
+    onStart: (waitedMs) => {
+      console.log(`[Job ${jobId}] Started after ${(waitedMs / 1000).toFixed(1)}s in the ${jobClass} queue`);
+      updateJob(jobId, {
+        status: JobStatus.PROCESSING,
+        progress: 5,
+        queueWaitSeconds: Math.round(waitedMs / 100) / 10,
+        message: plan.downgradedTo
+          ? `Rendering at size '${plan.downgradedTo}' to fit available memory...`
+          : 'Starting poster generation...',
+      });
+    },
+  };
+
+  if (config.renderPoolSize > 0) {
+    return renderOnPool(jobId, request, plan, scheduling, outputPath, previewPath);
+  }
+  return renderInSubprocess(jobId, request, plan, scheduling, outputPath, previewPath);
+}
+
+/**
+ * Render on a warm daemon from the render pool.
+ */
+function renderOnPool(jobId, request, plan, scheduling, outputPath, previewPath) {
+  const daemonRequest = {
+    city: request.city,
+    state: request.state || null,
+    country: request.country,
+    theme: request.theme || 'feature_based',
+    size: plan.size,
+    distance: plan.distance,
+    preview: scheduling.preview,
+    output: outputPath,
+    preview_output: previewPath,
+  };
+  const pool = getRenderPool();
+
+  return new Promise((resolve, reject) => {
+    console.log(`[Job ${jobId}] Queued on render pool: ${JSON.stringify(daemonRequest)}`);
+    let killed = false;
+
+    // 10 minute timeout, including time spent waiting for a free daemon
+    const timeout = setTimeout(() => {
+      killed = true;
+      pool.cancel(jobId);
+      console.error(`[Job ${jobId}] Killed due to timeout (10 minutes)`);
+      updateJob(jobId, {
+        status: JobStatus.FAILED,
+        error: 'Generation timed out after 10 minutes',
+      });
+      reject(new Error('Generation timed out after 10 minutes'));
+    }, 10 * 60 * 1000);
+
+    const options = {
+      predictedBytes: plan.predictedBytes,
+      rssLimitBytes: plan.rssLimitBytes,
+      jobClass: scheduling.jobClass,
+      client: scheduling.client,
+      onStart: scheduling.onStart,
+    };
+    pool.render(jobId, daemonRequest, createOutputHandler(jobId, previewPath), options).then(
+      (output) => {
+        clearTimeout(timeout);
+        if (killed) return; // Already handled by timeout
+
+        if (output === null) {
+          console.log(`[Job ${jobId}] Cancelled`);
+          updateJob(jobId, {
+            status: JobStatus.CANCELLED,
+            message: 'Generation cancelled',
+          });
+          resolve(null);
+          return;
+        }
+
+        completeJob(jobId, request);
+        resolve(outputPath);
+      },
+      (error) => {
+        clearTimeout(timeout);
+        if (killed) return;
+        console.error(`[Job ${jobId}] Failed: ${error.message}`);
+        updateJob(jobId, {
+          status: JobStatus.FAILED,
+          error: error.message,
+        });
+        reject(error);
+      },
+    );
+  });
+}
+
+/**
+ * Render in a fresh `python3 create_map_poster.py` process.
+ */
+async function renderInSubprocess(jobId, request, plan, scheduling, outputPath, previewPath) {
+  const { city, state, country, theme } = request;
 
   // Build the command arguments
   const args = [
@@ -43,36 +352,42 @@ export async function generatePoster(jobId, request) {
     '--country', country,
     '--theme', theme || 'feature_based',
     '--output', outputPath,
+    '--preview-output', previewPath,
+    '--data-source', config.mapDataSource,
   ];
 
   if (state) {
     args.push('--state', state);
   }
 
-  if (size && size !== 'auto') {
-    args.push('--size', size);
-  } else if (!distance) {
-    // Default to 'city' size (12km) to prevent OOM on large metros
-    // User can override with explicit size or distance
-    args.push('--size', 'city');
+  if (plan.size) {
+    args.push('--size', plan.size);
   }
 
-  if (distance) {
-    args.push('--distance', String(distance));
+  if (plan.distance) {
+    args.push('--distance', String(plan.distance));
   }
 
-  // Update job status to processing
-  updateJob(jobId, {
-    status: JobStatus.PROCESSING,
-    progress: 5,
-    message: 'Starting poster generation...',
-  });
+  if (scheduling.preview) {
+    args.push('--preview');
+  }
+
+  const admitted = await jobScheduler.acquire(jobId, plan.predictedBytes, scheduling);
+  if (!admitted) {
+    console.log(`[Job ${jobId}] Cancelled`);
+    updateJob(jobId, { status: JobStatus.CANCELLED, message: 'Generation cancelled' });
+    return null;
+  }
+  const { release, waitedMs } = admitted;
+  scheduling.onStart(waitedMs);
 
   return new Promise((resolve, reject) => {
     console.log(`[Job ${jobId}] Starting: python3 ${args.join(' ')}`);
 
     const childProcess = spawn('python3', args, {
       cwd: config.maptoposterDir,
+      // Own process group, so a timeout or cancel kills everything it spawned
+      detached: true,
       env: {
         ...process.env,
         PYTHONUNBUFFERED: '1',
@@ -80,14 +395,19 @@ export async function generatePoster(jobId, request) {
         TQDM_DISABLE: '1',
       },
     });
+    const running = { child: childProcess, cancelled: false, memoryExceeded: false };
+    runningProcesses.set(jobId, running);
 
-    let stderr = '';
+    const handleLine = createOutputHandler(jobId, previewPath);
+    const stderrTail = [];
+    let stderrBuffer = '';
+    let stdoutBuffer = '';
     let killed = false;
 
     // 10 minute timeout
     const timeout = setTimeout(() => {
       killed = true;
-      childProcess.kill('SIGTERM');
+      terminate(childProcess);
       console.error(`[Job ${jobId}] Killed due to timeout (10 minutes)`);
       updateJob(jobId, {
         status: JobStatus.FAILED,
@@ -96,77 +416,73 @@ export async function generatePoster(jobId, request) {
       reject(new Error('Generation timed out after 10 minutes'));
     }, 10 * 60 * 1000);
 
-    childProcess.stdout.on('data', (data) => {
-      const output = data.toString().trim();
-      console.log(`[Job ${jobId}] ${output}`);
-
-      // Parse progress from output
-      const progressMatch = output.match(/(\d+)%/);
-      if (progressMatch) {
-        const progress = parseInt(progressMatch[1], 10);
-        updateJob(jobId, { progress });
-      }
+    // Stop the generator before the kernel's OOM killer has to pick a victim
+    const stopWatching = watchRss(childProcess.pid, plan.rssLimitBytes, (rss) => {
+      console.error(`[Job ${jobId}] Using ${Math.round(rss / MB)} MB, over its memory limit`);
+      running.memoryExceeded = true;
+      terminate(childProcess);
+    });
+    const finish = () => {
+      clearTimeout(timeout);
+      stopWatching();
+      release();
+      runningProcesses.delete(jobId);
+    };
 
-      // Update message based on output
-      if (output.includes('Fetching') || output.includes('Downloading')) {
-        updateJob(jobId, {
-          progress: 15,
-          message: 'Fetching map data from OpenStreetMap...',
-        });
-      } else if (output.includes('Processing') || output.includes('Building')) {
-        updateJob(jobId, {
-          progress: 40,
-          message: 'Processing map data...',
-        });
-      } else if (output.includes('Rendering') || output.includes('Drawing')) {
-        updateJob(jobId, {
-          progress: 70,
-          message: 'Rendering poster...',
-        });
-      } else if (output.includes('Saving') || output.includes('Writing')) {
-        updateJob(jobId, {
-          progress: 90,
-          message: 'Saving poster image...',
-        });
-      }
+    childProcess.stdout.on('data', (data) => {
+      // Chunks don't follow line boundaries; keep the unfinished tail for next time
+      const lines = (stdoutBuffer + data.toString()).split('\n');
+      stdoutBuffer = lines.pop();
+      lines.forEach(handleLine);
     });
 
     childProcess.stderr.on('data', (data) => {
       const text = data.toString();
-      stderr += text;
       // Filter out tqdm progress bar noise (contains \r or |)
       if (!text.includes('\r') && !text.includes('|')) {
         console.error(`[Job ${jobId}] stderr: ${text.trim()}`);
       }
+      const lines = (stderrBuffer + text).split('\n');
+      stderrBuffer = lines.pop().slice(-STDERR_LINE_MAX);
+      for (const line of lines) {
+        if (!line.includes('\r') && !line.includes('|') && line.trim()) {
+          stderrTail.push(line);
+        }
+      }
+      stderrTail.splice(0, stderrTail.length - STDERR_TAIL_LINES);
     });
 
     childProcess.on('close', (code) => {
-      clearTimeout(timeout);
+      finish();
       if (killed) return; // Already handled by timeout
 
-      if (code === 0) {
-        console.log(`[Job ${jobId}] Completed successfully`);
-
-        // Add to gallery BEFORE updating job status (which triggers WebSocket)
-        if (request.showInGallery !== false) {
-          const themeInfo = loadThemeInfo(request.theme || 'feature_based');
-          addToGallery(jobId, request, themeInfo);
-        }
-
+      if (running.cancelled) {
+        console.log(`[Job ${jobId}] Cancelled`);
         updateJob(jobId, {
-          status: JobStatus.COMPLETED,
-          progress: 100,
-          message: 'Poster generated successfully!',
+          status: JobStatus.CANCELLED,
+          message: 'Generation cancelled',
         });
+        resolve(null);
+        return;
+      }
+
+      if (running.memoryExceeded) {
+        const errorMsg = memoryLimitMessage(plan.rssLimitBytes);
+        console.error(`[Job ${jobId}] ${errorMsg}`);
+        updateJob(jobId, { status: JobStatus.FAILED, error: errorMsg });
+        reject(new Error(errorMsg));
+        return;
+      }
 
+      if (code === 0) {
+        completeJob(jobId, request);
         resolve(outputPath);
       } else {
-        // Clean up stderr - remove tqdm progress bars and extract actual error
-        const cleanedStderr = stderr
-          .split('\n')
-          .filter(line => !line.includes('\r') && !line.includes('|') && line.trim())
-          .join('\n')
-          .trim();
+        // The last lines of stderr, without tqdm progress bars, hold the actual error
+        if (stderrBuffer.trim() && !stderrBuffer.includes('\r') && !stderrBuffer.includes('|')) {
+          stderrTail.push(stderrBuffer);
+        }
+        const cleanedStderr = stderrTail.slice(-STDERR_TAIL_LINES).join('\n').trim();
 
         const errorMsg = cleanedStderr || `Python process exited with code ${code}`;
         console.error(`[Job ${jobId}] Failed with code ${code}: ${errorMsg}`);
@@ -179,7 +495,7 @@ export async function generatePoster(jobId, request) {
     });
 
     childProcess.on('error', (error) => {
-      clearTimeout(timeout);
+      finish();
       if (killed) return;
       console.error(`[Job ${jobId}] Process error:`, error);
       updateJob(jobId, {
@@ -0,0 +1,352 @@
+import { spawn } from 'child_process';
+import { createInterface } from 'readline';
+import { join } from 'path';
+import { config } from '../config.js';
+import { MB, memoryBudgetBytes, memoryLimitMessage, readRssBytes, watchRss } from './memoryBudget.js';
+import { JobClass, pickNext } from './jobScheduler.js';
+
+// How long a daemon gets to exit after SIGTERM before it is SIGKILLed
+const KILL_GRACE_MS = 5000;
+
+// Delay before replacing a daemon that exited, so a broken install doesn't spin
+const RESPAWN_DELAY_MS = 1000;
+
+/**
+ * A small pool of warm `create_map_poster.py --serve` daemons.
+ *
+ * Each daemon keeps Python's imports, fonts and recently used map data
+ * loaded and renders one request at a time over a JSON-lines protocol
+ * (see render_daemon.py). Requests queue until a daemon is free. A daemon
+ * that crashes, times out or is cancelled is killed with its process group
+ * and replaced.
+ *
+ * Queued renders start by priority lane and client (see jobScheduler.js)
+ * once their predicted memory fits the pool's budget next to the running
+ * ones' and the daemons' own resident memory (see memoryBudget.js), and a
+ * render whose daemon grows past its RSS limit is stopped the same way.
+ */
+export class RenderPool {
+  /**
+   * @param {Object} options
+   * @param {number} options.size - Number of daemons
+   * @param {string} [options.cwd] - Working directory of the daemons
+   * @param {string} [options.command] - Python executable
+   * @param {Array<string>} [options.args] - Daemon arguments
+   * @param {number} [options.memoryBudget] - Bytes the daemons and their running renders may use in total
+   */
+  constructor({
+    size,
+    cwd = config.maptoposterDir,
+    command = 'python3',
+    args = [join(config.maptoposterDir, 'create_map_poster.py'), '--serve', '--data-source', config.mapDataSource],
+    memoryBudget = memoryBudgetBytes(),
+  }) {
+    this.size = size;
+    this.cwd = cwd;
+    this.command = command;
+    this.args = args;
+    this.workers = new Set();
+    this.queue = [];
+    this.stopped = false;
+    this.memoryBudget = memoryBudget;
+    this.memoryUsed = 0;
+    // Machine-wide store shared by all daemons, as last reported by any of them
+    this.sharedCache = null;
+  }
+
+  /**
+   * Start any missing daemons. Called lazily by render().
+   */
+  start() {
+    this.stopped = false;
+    while (this.workers.size < this.size) {
+      this.spawnWorker();
+    }
+  }
+
+  /**
+   * Render a request on the next free daemon.
+   * @param {string} id - Job ID, echoed in the daemon's events
+   * @param {Object} request - Render request (see render_daemon.py)
+   * @param {Function} onLog - Called with each printed line of the render
+   * @param {Object} [options]
+   * @param {number} [options.predictedBytes] - Predicted peak memory, admitted against the budget
+   * @param {number} [options.rssLimitBytes] - Growth of the daemon's RSS at which the render is stopped
+   * @param {string} [options.jobClass] - Priority lane (JobClass)
+   * @param {string} [options.client] - Requester, for fairness between clients
+   * @param {Function} [options.onStart] - Called with the milliseconds spent queued
+   * @returns {Promise<string|null>} Output path, or null if cancelled
+   */
+  render(id, request, onLog, {
+    predictedBytes = 0, rssLimitBytes = null, jobClass = JobClass.PRINT, client = null, onStart = () => {},
+  } = {}) {
+    this.start();
+    return new Promise((resolve, reject) => {
+      this.queue.push({
+        id, request, onLog, resolve, reject, cancelled: false, predictedBytes, rssLimitBytes, memoryExceeded: false,
+        jobClass, client, onStart, enqueuedAt: Date.now(),
+      });
+      this.dispatch();
+    });
+  }
+
+  /**
+   * Cancel a queued or running render. A running render's daemon is killed.
+   * @param {string} id - Job ID
+   * @returns {Promise<boolean>} Resolves once the render is gone; false if unknown
+   */
+  cancel(id) {
+    const queued = this.queue.findIndex((job) => job.id === id);
+    if (queued !== -1) {
+      const [job] = this.queue.splice(queued, 1);
+      job.resolve(null);
+      return Promise.resolve(true);
+    }
+
+    for (const worker of this.workers) {
+      if (worker.job && worker.job.id === id) {
+        worker.job.cancelled = true;
+        const exited = new Promise((resolve) => worker.child.once('exit', () => resolve(true)));
+        this.terminate(worker);
+        return exited;
+      }
+    }
+    return Promise.resolve(false);
+  }
+
+  /**
+   * Stop all daemons. Queued renders are rejected.
+   */
+  stop() {
+    this.stopped = true;
+    for (const job of this.queue.splice(0)) {
+      job.reject(new Error('Render pool stopped'));
+    }
+    for (const worker of this.workers) {
+      this.terminate(worker);
+    }
+  }
+
+  /**
+   * Pool occupancy, the daemons' in-memory map data counters summed over
+   * daemons as of their last finished render, and the shared map data store.
+   * @returns {Object}
+   */
+  stats() {
+    const hotCache = { entries: 0, bytes: 0, maxBytes: 0, hits: 0, misses: 0, evictions: 0 };
+    let busy = 0;
+    for (const worker of this.workers) {
+      if (worker.job) busy += 1;
+      const counters = worker.hotCache;
+      if (!counters) continue;
+      hotCache.entries += counters.entries;
+      hotCache.bytes += counters.bytes;
+      hotCache.maxBytes += counters.max_bytes;
+      hotCache.hits += counters.hits;
+      hotCache.misses += counters.misses;
+      hotCache.evictions += counters.evictions;
+    }
+    const lookups = hotCache.hits + hotCache.misses;
+    hotCache.hitRate = lookups ? hotCache.hits / lookups : 0;
+    return {
+      size: this.size,
+      workers: this.workers.size,
+      busy,
+      queued: this.queue.length,
+      queuedByClass: Object.fromEntries(
+        Object.values(JobClass).map((jobClass) => [jobClass, this.queue.filter((job) => job.jobClass === jobClass).length]),
+      ),
+      memory: { budgetBytes: this.memoryBudget, usedBytes: this.memoryUsed, residentBytes: this.residentBytes() },
+      hotCache,
+      sharedCache: this.sharedCache,
+    };
+  }
+
+  /**
+   * Resident memory of the daemons between renders (imports, fonts and hot
+   * map data), as last measured: when ready, before and after each render.
+   * @returns {number} Bytes
+   */
+  residentBytes() {
+    let total = 0;
+    for (const worker of this.workers) total += worker.residentBytes;
+    return total;
+  }
+
+  spawnWorker() {
+    const child = spawn(this.command, this.args, {
+      cwd: this.cwd,
+      // Own process group, so killing a daemon also kills anything it spawned
+      detached: true,
+      env: {
+        ...process.env,
+        PYTHONUNBUFFERED: '1',
+        TQDM_DISABLE: '1',
+      },
+    });
+    const worker = { child, ready: false, job: null, hotCache: null, stopWatching: null, residentBytes: 0 };
+    this.workers.add(worker);
+
+    createInterface({ input: child.stdout }).on('line', (line) => this.handleEvent(worker, line));
+    createInterface({ input: child.stderr }).on('line', (line) => {
+      if (line.trim()) {
+        console.error(`[Render daemon ${child.pid}] ${line}`);
+      }
+    });
+
+    child.on('error', (error) => {
+      if (child.pid !== undefined) {
+        console.error(`[Render daemon ${child.pid}] ${error.message}`);
+        return;
+      }
+      console.error(`[Render daemon] Failed to start: ${error.message}`);
+      // 'exit' may never follow: free the slot and try again
+      this.handleExit(worker, null, null);
+    });
+    child.on('exit', (code, signal) => this.handleExit(worker, code, signal));
+  }
+
+  handleEvent(worker, line) {
+    let event;
+    try {
+      event = JSON.parse(line);
+    } catch {
+      console.warn(`[Render daemon ${worker.child.pid}] Unexpected output: ${line}`);
+      return;
+    }
+
+    if (event.event === 'ready') {
+      worker.ready = true;
+      worker.residentBytes = readRssBytes(worker.child.pid) || 0;
+      this.dispatch();
+      return;
+    }
+
+    const job = worker.job;
+    if (!job || event.id !== job.id) return;
+
+    if (event.event === 'log') {
+      job.onLog(event.line);
+    } else if (event.event === 'done' || event.event === 'error') {
+      this.finishJob(worker);
+      // What the render left behind (hot map data) stays counted
+      worker.residentBytes = readRssBytes(worker.child.pid) || 0;
+      if (event.hot_cache) {
+        worker.hotCache = event.hot_cache;
+      }
+      if (event.shared_cache) {
+        this.sharedCache = event.shared_cache;
+      }
+      if (event.event === 'done') {
+        job.resolve(event.output);
+      } else {
+        job.reject(new Error(event.error));
+      }
+      this.dispatch();
+    }
+  }
+
+  handleExit(worker, code, signal) {
+    // A failed spawn can report both 'error' and 'exit'
+    if (!this.workers.delete(worker)) return;
+
+    const job = worker.job;
+    this.finishJob(worker);
+    if (job) {
+      if (job.cancelled) {
+        job.resolve(null);
+      } else if (job.memoryExceeded) {
+        job.reject(new Error(memoryLimitMessage(job.rssLimitBytes)));
+      } else {
+        job.reject(new Error(`Render daemon exited (${signal || `code ${code}`})`));
+      }
+      // Its memory is free for the next queued render
+      this.dispatch();
+    }
+
+    if (!this.stopped) {
+      setTimeout(() => {
+        if (!this.stopped && this.workers.size < this.size) {
+          this.spawnWorker();
+        }
+      }, RESPAWN_DELAY_MS).unref();
+    }
+  }
+
+  dispatch() {
+    for (const worker of this.workers) {
+      if (this.queue.length === 0) return;
+      if (!worker.ready || worker.job) continue;
+
+      // The next render waits until its memory fits next to the running
+      // renders' and the daemons' own (or nothing is running)
+      const runningByClient = new Map();
+      for (const other of this.workers) {
+        if (other.job) runningByClient.set(other.job.client, (runningByClient.get(other.job.client) || 0) + 1);
+      }
+      const next = pickNext(this.queue, runningByClient);
+      const needed = this.residentBytes() + this.memoryUsed + this.queue[next].predictedBytes;
+      if (runningByClient.size && needed > this.memoryBudget) return;
+
+      const [job] = this.queue.splice(next, 1);
+      worker.job = job;
+      job.onStart(Date.now() - job.enqueuedAt);
+      this.memoryUsed += job.predictedBytes;
+      const baseline = readRssBytes(worker.child.pid);
+      if (baseline !== null) {
+        worker.residentBytes = baseline;
+      }
+      if (job.rssLimitBytes && baseline !== null) {
+        // Daemons hold on to imports and hot map data between renders; limit this render's growth
+        worker.stopWatching = watchRss(worker.child.pid, baseline + job.rssLimitBytes, (rss) => {
+          console.error(`[Job ${job.id}] Render daemon at ${Math.round(rss / MB)} MB, over its limit`);
+          job.memoryExceeded = true;
+          this.terminate(worker);
+        });
+      }
+      worker.child.stdin.write(`${JSON.stringify({ id: job.id, ...job.request })}\n`);
+    }
+  }
+
+  finishJob(worker) {
+    if (worker.job) {
+      this.memoryUsed -= worker.job.predictedBytes;
+    }
+    if (worker.stopWatching) {
+      worker.stopWatching();
+      worker.stopWatching = null;
+    }
+    worker.job = null;
+  }
+
+  terminate(worker) {
+    const { child } = worker;
+    const signalGroup = (signal) => {
+      try {
+        process.kill(-child.pid, signal);
+      } catch {
+        // Already exited
+      }
+    };
+
+    signalGroup('SIGTERM');
+    setTimeout(() => {
+      if (child.exitCode === null && child.signalCode === null) {
+        signalGroup('SIGKILL');
+      }
+    }, KILL_GRACE_MS).unref();
+  }
+}
+
+let pool = null;
+
+/**
+ * The shared render pool, sized by config.renderPoolSize.
+ * @returns {RenderPool}
+ */
+export function getRenderPool() {
+  if (!pool) {
+    pool = new RenderPool({ size: config.renderPoolSize });
+  }
+  return pool;
+}
@@ -0,0 +1,88 @@
+import { createHash } from 'crypto';
+
+/**
+ * Cache-affinity routing of render jobs to workers (mirrors app/services/routing.py).
+ *
+ * Each render worker keeps its own cache directory and in-memory map data,
+ * so jobs are routed by consistent hashing on the normalized location key:
+ * repeat orders for a city land on the same worker, and when a worker joins
+ * or leaves only about 1/N of the locations move. When the preferred worker
+ * is saturated, the job spills over to the next distinct workers around the
+ * ring (see jobManager.enqueueJob).
+ */
+
+// Points per worker on the ring; more spreads locations more evenly
+export const VIRTUAL_NODES = 64;
+
+/**
+ * Normalized location of a job, as in the generator's cache keys (without the radius).
+ * @param {string} city - City name
+ * @param {string} country - Country name
+ * @param {string} [state] - State or region
+ * @returns {string}
+ */
+export function locationKey(city, country, state = null) {
+  const cityWithState = state ? `${city}, ${state}` : city;
+  const citySlug = cityWithState.toLowerCase().replaceAll(' ', '_').replaceAll(',', '');
+  return `${citySlug}_${country.toLowerCase().replaceAll(' ', '_')}`;
+}
+
+// Same hash as routing.py, so Node and Python nodes agree on owners
+function hash(value) {
+  return createHash('sha1').update(value).digest().readBigUInt64BE(0);
+}
+
+function comparePoints([hashA, nodeA], [hashB, nodeB]) {
+  if (hashA !== hashB) return hashA < hashB ? -1 : 1;
+  return nodeA < nodeB ? -1 : nodeA > nodeB ? 1 : 0;
+}
+
+/**
+ * Consistent hash ring of worker IDs.
+ */
+export class HashRing {
+  constructor(nodes = [], virtualNodes = VIRTUAL_NODES) {
+    this.virtualNodes = virtualNodes;
+    this.nodes = new Set();
+    this.points = []; // sorted [hash, node]
+    for (const node of nodes) this.add(node);
+  }
+
+  add(node) {
+    if (this.nodes.has(node)) return;
+    this.nodes.add(node);
+    for (let i = 0; i < this.virtualNodes; i++) {
+      this.points.push([hash(`${node}#${i}`), node]);
+    }
+    this.points.sort(comparePoints);
+  }
+
+  remove(node) {
+    if (!this.nodes.delete(node)) return;
+    this.points = this.points.filter((point) => point[1] !== node);
+  }
+
+  /**
+   * Every worker, in the order a key tries them: its owner first, then clockwise.
+   * @param {string} key - Location key
+   * @returns {string[]}
+   */
+  preference(key) {
+    if (!this.points.length) return [];
+    const target = hash(key);
+    let low = 0;
+    let high = this.points.length;
+    while (low < high) {
+      const mid = (low + high) >> 1;
+      if (this.points[mid][0] < target) low = mid + 1;
+      else high = mid;
+    }
+
+    const order = [];
+    for (let i = 0; i < this.points.length && order.length < this.nodes.size; i++) {
+      const node = this.points[(low + i) % this.points.length][1];
+      if (!order.includes(node)) order.push(node);
+    }
+    return order;
+  }
+}
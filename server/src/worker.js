@@ -0,0 +1,121 @@
+import { config } from './config.js';
+import { connectBroker } from './services/broker.js';
+import {
+  dequeueJob, loadJob, reapWorkers, registerWorker, retireWorker, useBroker, workerId, JobStatus,
+} from './services/jobManager.js';
+import { generatePoster, hasRenderCapacity } from './services/posterGenerator.js';
+import { getRenderPool } from './services/renderPool.js';
+
+/**
+ * Render worker: runs queued poster jobs for the API nodes (mirrors app/worker.py).
+ *
+ * With BROKER_URL set and REMOTE_RENDER=true on the API nodes, new jobs are
+ * put on the broker's render queue instead of rendered by the node that took
+ * the order. Run any number of workers on other machines:
+ *
+ *   BROKER_URL=redis://broker:6379/0 node server/src/worker.js
+ *
+ * Jobs are routed by location, so repeat orders for a city reach the worker
+ * that already has its map data cached (see jobManager.enqueueJob). Each
+ * worker sends a heartbeat to stay in the fleet; the jobs queued for a worker
+ * that leaves or stops sending heartbeats move to the shared queue.
+ *
+ * Each worker takes jobs while it has room to start them, renders them
+ * exactly as an API node would, and reports progress and results through the
+ * shared job records, so status requests, event streams and WebSockets work
+ * on every API node. Posters are written to DATA_DIR, which the API nodes must
+ * share (e.g. a network volume). A job cancelled through the API is stopped on
+ * whichever worker is running it.
+ */
+
+// Longest a BRPOP blocks, so shutdown is noticed
+const DEQUEUE_TIMEOUT_SECONDS = 5;
+
+// How often to check whether there is room for another job
+const ADMIT_POLL_MS = 500;
+
+// How often a worker sends its heartbeat and retires workers that stopped sending theirs
+const HEARTBEAT_MS = 10000;
+
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+/**
+ * Take and render queued jobs until signal aborts, then wait for the running ones.
+ * @param {AbortSignal} signal - Stops taking jobs
+ */
+export async function runWorker(signal) {
+  const running = new Set();
+  const heartbeat = async () => {
+    await registerWorker(workerId);
+    await reapWorkers();
+  };
+  await heartbeat();
+  const heartbeats = setInterval(() => heartbeat().catch((error) => {
+    console.error('Heartbeat failed:', error);
+  }), HEARTBEAT_MS);
+
+  try {
+    await takeJobs(signal, running);
+  } finally {
+    clearInterval(heartbeats);
+    // Jobs routed here but not yet taken go to the other workers
+    await retireWorker(workerId);
+  }
+
+  if (running.size) {
+    console.log(`Waiting for ${running.size} running job(s)`);
+    await Promise.all(running);
+  }
+}
+
+async function takeJobs(signal, running) {
+  while (!signal.aborted) {
+    // Leave queued jobs for other workers while ours wait to start
+    if (!hasRenderCapacity()) {
+      await sleep(ADMIT_POLL_MS);
+      continue;
+    }
+
+    const jobId = await dequeueJob(DEQUEUE_TIMEOUT_SECONDS, workerId);
+    if (!jobId) continue;
+    const job = await loadJob(jobId);
+    if (!job || job.status !== JobStatus.PENDING) {
+      // Expired or cancelled while queued
+      console.log(`[Job ${jobId}] Skipped: no longer pending`);
+      continue;
+    }
+
+    console.log(`[Job ${jobId}] Taken by worker ${workerId}`);
+    const render = generatePoster(jobId, job.request).catch((error) => {
+      console.error(`[Job ${jobId}] Generation failed:`, error);
+    });
+    running.add(render);
+    // generatePoster stops it if the job is cancelled through an API node
+    render.finally(() => running.delete(render));
+  }
+}
+
+async function main() {
+  if (!config.brokerUrl) {
+    console.error('Set BROKER_URL to the broker the API nodes use');
+    process.exit(1);
+  }
+  await useBroker(await connectBroker(config.brokerUrl));
+
+  const controller = new AbortController();
+  for (const signal of ['SIGINT', 'SIGTERM']) {
+    process.once(signal, () => controller.abort());
+  }
+
+  console.log(`Render worker ${workerId} started`);
+  await runWorker(controller.signal);
+  if (config.renderPoolSize > 0) {
+    getRenderPool().stop();
+  }
+  await useBroker(null);
+  process.exit(0);
+}
+
+if (import.meta.url === `file://${process.argv[1]}`) {
+  main();
+}
@@ -0,0 +1,90 @@
+/**
+ * Tests for choosing which waiting render starts next.
+ *
+ * These tests verify that:
+ * 1. Previews start ahead of print and background jobs
+ * 2. Waiting jobs age into faster lanes
+ * 3. Clients with fewer jobs running go first within a lane
+ * 4. Jobs wait for memory, and a cancelled waiter leaves the queue
+ * 5. A job that ages to the front starts without another job finishing
+ */
+
+import { describe, it, expect } from 'vitest';
+import { JobClass, JobScheduler, pickNext } from '../src/services/jobScheduler.js';
+
+const waiting = (jobs, now = Date.now()) =>
+  jobs.map(([id, jobClass, client, age = 0], index) => ({ id, jobClass, client, enqueuedAt: now - age - 10 + index }));
+
+describe('pickNext', () => {
+  it('prefers previews over print and background jobs', () => {
+    const queue = waiting([['warm', JobClass.BACKGROUND, 'w'], ['print', JobClass.PRINT, 'a'], ['preview', JobClass.PREVIEW, 'b']]);
+
+    expect(queue[pickNext(queue, new Map())].id).toBe('preview');
+  });
+
+  it('ages waiting jobs into faster lanes', () => {
+    const queue = waiting([['warm', JobClass.BACKGROUND, 'w', 130_000], ['preview', JobClass.PREVIEW, 'b']]);
+
+    expect(queue[pickNext(queue, new Map())].id).toBe('warm');
+  });
+
+  it('prefers clients with fewer jobs running', () => {
+    const queue = waiting([['a2', JobClass.PRINT, 'a'], ['b1', JobClass.PRINT, 'b']]);
+
+    expect(queue[pickNext(queue, new Map([['a', 1]]))].id).toBe('b1');
+    expect(queue[pickNext(queue, new Map())].id).toBe('a2');
+  });
+
+  it('returns -1 for an empty queue', () => {
+    expect(pickNext([], new Map())).toBe(-1);
+  });
+});
+
+describe('JobScheduler', () => {
+  it('holds jobs until their memory fits', async () => {
+    const scheduler = new JobScheduler(100);
+    const first = await scheduler.acquire('a', 60);
+    const started = [];
+    const second = scheduler.acquire('b', 60, { jobClass: JobClass.PRINT }).then((admitted) => {
+      started.push('b');
+      return admitted;
+    });
+    await new Promise((resolve) => setTimeout(resolve, 10));
+
+    expect(started).toEqual([]);
+    expect(scheduler.stats()).toMatchObject({ usedBytes: 60, running: 1, waiting: 1, waitingByClass: { print: 1 } });
+
+    first.release();
+    const admitted = await second;
+    expect(started).toEqual(['b']);
+    expect(admitted.waitedMs).toBeGreaterThanOrEqual(0);
+    admitted.release();
+    expect(scheduler.stats()).toMatchObject({ usedBytes: 0, running: 0 });
+  });
+
+  it('drops a cancelled waiter', async () => {
+    const scheduler = new JobScheduler(100);
+    const running = await scheduler.acquire('a', 80);
+    const waiter = scheduler.acquire('b', 80);
+
+    expect(scheduler.cancel('b')).toBe(true);
+    expect(await waiter).toBeNull();
+    expect(scheduler.cancel('b')).toBe(false);
+    expect(scheduler.canStart(10)).toBe(true);
+    running.release();
+  });
+
+  it('starts a job that ages to the front without waiting for a release', async () => {
+    const scheduler = new JobScheduler(100, 20);
+    const running = await scheduler.acquire('hold', 60, { jobClass: JobClass.PREVIEW, client: 'a' });
+    const started = [];
+    // big is next but doesn't fit; warm fits once it has aged into big's lane
+    scheduler.acquire('big', 60, { jobClass: JobClass.PREVIEW, client: 'a' }).then(() => started.push('big'));
+    const warm = scheduler.acquire('warm', 30, { jobClass: JobClass.BACKGROUND, client: 'warmer' });
+    warm.then(() => started.push('warm'));
+
+    (await warm).release();
+    expect(started).toEqual(['warm']);
+    running.release();
+  });
+});
@@ -0,0 +1,54 @@
+/**
+ * Tests for fitting render jobs to the memory budget.
+ *
+ * These tests verify that:
+ * 1. Auto-sized jobs are capped at the 'city' preset unless map data comes from tiles
+ * 2. Auto-sized jobs too big for the budget are stepped down, and explicit sizes are refused
+ */
+
+import { mkdtempSync } from 'fs';
+import { tmpdir } from 'os';
+import { join } from 'path';
+import { describe, it, expect, beforeEach, afterEach } from 'vitest';
+import { config } from '../src/config.js';
+import { planJob, predictJobBytes, MB, SIZE_PRESETS } from '../src/services/memoryBudget.js';
+
+const ROME = { city: 'Rome', country: 'Italy' };
+const PLENTY = 64 * 1024 * MB;
+
+describe('planJob', () => {
+  const saved = {};
+
+  beforeEach(() => {
+    saved.mapDataSource = config.mapDataSource;
+    saved.maptoposterDir = config.maptoposterDir;
+    // No cache index: nothing is cached
+    config.maptoposterDir = mkdtempSync(join(tmpdir(), 'memory-budget-'));
+  });
+
+  afterEach(() => {
+    Object.assign(config, saved);
+  });
+
+  it('caps auto-sized jobs at city unless map data comes from tiles', () => {
+    config.mapDataSource = 'overpass';
+    let plan = planJob(ROME, 72, PLENTY);
+    expect(plan.size).toBe('city');
+    expect(plan.predictedBytes).toBe(predictJobBytes(SIZE_PRESETS.city, 72));
+
+    config.mapDataSource = 'tiles';
+    plan = planJob(ROME, 72, PLENTY);
+    expect(plan.size).toBeNull();
+    expect(plan.predictedBytes).toBe(predictJobBytes(50000, 72));
+  });
+
+  it('steps auto-sized jobs down to fit and refuses explicit sizes', () => {
+    const budget = predictJobBytes(SIZE_PRESETS.town, 72);
+
+    const plan = planJob(ROME, 72, budget);
+    expect(plan.downgradedTo).toBe('town');
+    expect(plan.rssLimitBytes).toBe(budget);
+
+    expect(() => planJob({ ...ROME, size: 'metro' }, 72, budget)).toThrow('smaller size');
+  });
+});
@@ -0,0 +1,160 @@
+/**
+ * Tests for the warm render daemon pool.
+ *
+ * These tests verify that:
+ * 1. Requests are rendered on daemons and log lines are forwarded
+ * 2. Cancelling a running render kills its daemon and frees the slot
+ * 3. A crashed daemon fails only its own job and is replaced, as is one that fails to start
+ * 4. The daemons' in-memory map data counters are summed for /health
+ * 5. Renders wait for memory to fit the budget next to the daemons' own, and one outgrowing its RSS limit is stopped
+ *
+ * A small fake daemon speaking the same JSON-lines protocol as
+ * render_daemon.py stands in for create_map_poster.py --serve.
+ */
+
+import { describe, it, expect, beforeAll, afterAll } from 'vitest';
+import { mkdtempSync, writeFileSync } from 'fs';
+import { tmpdir } from 'os';
+import { join } from 'path';
+import { RenderPool } from '../src/services/renderPool.js';
+import { MB } from '../src/services/memoryBudget.js';
+
+const FAKE_DAEMON = `
+import json, os, sys, time
+print(json.dumps({"event": "ready", "pid": os.getpid()}), flush=True)
+for raw in sys.stdin:
+    request = json.loads(raw)
+    if request["city"] == "Crash":
+        os._exit(3)
+    print(json.dumps({"id": request["id"], "event": "log", "line": "Rendering map..."}), flush=True)
+    if request["city"] == "Hang":
+        time.sleep(60)
+    if request["city"] == "Slow":
+        time.sleep(0.5)
+    if request["city"] == "Grow":
+        ballast = bytearray(200 * 1024 * 1024)
+        time.sleep(60)
+    hot_cache = {"entries": 1, "bytes": 100, "max_bytes": 1000, "hits": 1, "misses": 1, "evictions": 0}
+    print(json.dumps({"id": request["id"], "event": "done", "output": request["output"], "hot_cache": hot_cache}),
+          flush=True)
+`;
+
+let dir;
+let pool;
+
+beforeAll(() => {
+  dir = mkdtempSync(join(tmpdir(), 'render-pool-'));
+  writeFileSync(join(dir, 'fake_daemon.py'), FAKE_DAEMON);
+  pool = new RenderPool({ size: 2, cwd: dir, args: [join(dir, 'fake_daemon.py')], memoryBudget: 1024 * MB });
+});
+
+afterAll(() => {
+  pool.stop();
+});
+
+describe('RenderPool', () => {
+  it('renders a request and forwards log lines', async () => {
+    const lines = [];
+
+    const output = await pool.render('a', { city: 'Rome', output: 'a.png' }, (line) => lines.push(line));
+
+    expect(output).toBe('a.png');
+    expect(lines).toEqual(['Rendering map...']);
+  });
+
+  it('cancelling a running render frees its slot', async () => {
+    const hanging = pool.render('hang', { city: 'Hang', output: 'h.png' }, () => {});
+    const queued = [
+      pool.render('b', { city: 'Rome', output: 'b.png' }, () => {}),
+      pool.render('c', { city: 'Rome', output: 'c.png' }, () => {}),
+    ];
+    await new Promise((resolve) => setTimeout(resolve, 300));
+
+    expect(await pool.cancel('hang')).toBe(true);
+    expect(await hanging).toBeNull();
+    expect(await Promise.all(queued)).toEqual(['b.png', 'c.png']);
+    expect(await pool.cancel('unknown')).toBe(false);
+  });
+
+  it('a crashed daemon fails its job and is replaced', async () => {
+    await expect(pool.render('x', { city: 'Crash' }, () => {})).rejects.toThrow('Render daemon exited');
+
+    await new Promise((resolve) => setTimeout(resolve, 1500));
+
+    expect(await pool.render('d', { city: 'Rome', output: 'd.png' }, () => {})).toBe('d.png');
+    expect(pool.workers.size).toBe(2);
+  });
+
+  it('frees the slot of a daemon that fails to start and tries again', async () => {
+    const broken = new RenderPool({ size: 1, cwd: dir, command: join(dir, 'missing-python'), args: [] });
+    let spawned = 0;
+    const spawnWorker = broken.spawnWorker.bind(broken);
+    broken.spawnWorker = () => {
+      spawned += 1;
+      spawnWorker();
+    };
+
+    broken.start();
+    await new Promise((resolve) => setTimeout(resolve, 1500));
+    broken.stop();
+
+    expect(broken.workers.size).toBe(0);
+    expect(spawned).toBe(2);
+  });
+
+  it('sums hot cache counters over daemons', async () => {
+    await Promise.all([
+      pool.render('e', { city: 'Rome', output: 'e.png' }, () => {}),
+      pool.render('f', { city: 'Rome', output: 'f.png' }, () => {}),
+    ]);
+
+    const stats = pool.stats();
+
+    expect(stats).toMatchObject({ size: 2, workers: 2, busy: 0, queued: 0 });
+    expect(stats.hotCache.hits + stats.hotCache.misses).toBeGreaterThan(0);
+    expect(stats.hotCache.hitRate).toBe(0.5);
+  });
+
+  it('holds a render back until its memory fits', async () => {
+    const finished = [];
+    const render = (id, city) =>
+      pool.render(id, { city, output: `${id}.png` }, () => {}, { predictedBytes: 800 * MB }).then(() => finished.push(id));
+
+    const first = render('big1', 'Slow');
+    const second = render('big2', 'Rome');
+    await new Promise((resolve) => setTimeout(resolve, 300));
+
+    expect(pool.stats()).toMatchObject({ busy: 1, queued: 1, memory: { budgetBytes: 1024 * MB, usedBytes: 800 * MB } });
+    await Promise.all([first, second]);
+    expect(finished).toEqual(['big1', 'big2']);
+    expect(pool.stats().memory.usedBytes).toBe(0);
+  });
+
+  it('counts the daemons\' resident memory against the budget', async () => {
+    // Less than one idle Python process: only one render runs at a time
+    const small = new RenderPool({ size: 2, cwd: dir, args: [join(dir, 'fake_daemon.py')], memoryBudget: MB });
+    let started;
+    const first = new Promise((resolve) => {
+      started = resolve;
+    });
+    const renders = ['r1', 'r2'].map((id) => small.render(id, { city: 'Slow', output: `${id}.png` }, () => {}, {
+      onStart: started,
+    }));
+    await first;
+    // Both daemons are up while the first render runs
+    await new Promise((resolve) => setTimeout(resolve, 300));
+
+    const { busy, queued, memory } = small.stats();
+    small.stop();
+    await Promise.allSettled(renders);
+
+    expect({ busy, queued }).toEqual({ busy: 1, queued: 1 });
+    expect(memory.residentBytes).toBeGreaterThan(MB);
+  });
+
+  it('stops a render that outgrows its memory limit', async () => {
+    const growing = pool.render('grow', { city: 'Grow' }, () => {}, { rssLimitBytes: 50 * 1024 * 1024 });
+
+    await expect(growing).rejects.toThrow('50 MB memory limit');
+  });
+});
@@ -0,0 +1,98 @@
+/**
+ * Tests for routing queued jobs to render workers by location.
+ *
+ * These tests verify that:
+ * 1. Locations hash to the same worker every time
+ * 2. Adding a worker only moves the locations it gains
+ * 3. Jobs are queued for their location's worker, spilling over to the next when it is saturated
+ * 4. Workers take their own jobs first, and the jobs of workers that leave go to the others
+ */
+
+import { describe, it, expect, beforeEach, afterEach } from 'vitest';
+import { InProcessBroker } from '../src/services/broker.js';
+import {
+  dequeueJob, enqueueJob, liveWorkers, reapWorkers, registerWorker, retireWorker, useBroker,
+} from '../src/services/jobManager.js';
+import { HashRing, locationKey } from '../src/services/routing.js';
+
+const LOCATIONS = Array.from({ length: 2000 }, (_, i) => `city_${i}_country`);
+
+function owners(ring) {
+  return Object.fromEntries(LOCATIONS.map((location) => [location, ring.preference(location)[0]]));
+}
+
+describe('HashRing', () => {
+  it('normalizes location keys', () => {
+    expect(locationKey('New York', 'USA', 'New York')).toBe('new_york_new_york_usa');
+  });
+
+  it('maps a key to the same worker every time', () => {
+    expect(owners(new HashRing(['a', 'b', 'c']))).toEqual(owners(new HashRing(['c', 'a', 'b'])));
+  });
+
+  it('moves only the new worker\'s share when one is added', () => {
+    const ring = new HashRing(['a', 'b', 'c', 'd']);
+    const before = owners(ring);
+    ring.add('e');
+    const after = owners(ring);
+
+    const moved = LOCATIONS.filter((location) => before[location] !== after[location]);
+    expect(moved.every((location) => after[location] === 'e')).toBe(true);
+    expect(moved.length).toBeLessThan((LOCATIONS.length / 5) * 1.5);
+  });
+
+  it('lists each worker once in preference order', () => {
+    expect(new HashRing(['a', 'b', 'c']).preference('rome_italy').sort()).toEqual(['a', 'b', 'c']);
+    expect(new HashRing().preference('rome_italy')).toEqual([]);
+  });
+});
+
+describe('jobManager routing', () => {
+  let broker;
+
+  beforeEach(async () => {
+    broker = new InProcessBroker();
+    await useBroker(broker);
+  });
+
+  afterEach(async () => {
+    await useBroker(null);
+  });
+
+  it('queues jobs for their location\'s worker and spills over when it is saturated', async () => {
+    await registerWorker('a');
+    await registerWorker('b');
+    const [first, second] = new HashRing(['a', 'b']).preference('rome_italy');
+
+    expect(await enqueueJob('1', 'rome_italy')).toBe(first);
+    expect(await enqueueJob('2', 'rome_italy')).toBe(first);
+    expect(await enqueueJob('3', 'rome_italy')).toBe(second);
+    expect(await dequeueJob(1, first)).toBe('1');
+  });
+
+  it('takes a worker\'s own jobs before shared ones', async () => {
+    await registerWorker('a');
+    await enqueueJob('shared');
+    await enqueueJob('routed', 'rome_italy');
+
+    expect(await dequeueJob(1, 'a')).toBe('routed');
+    expect(await dequeueJob(1, 'a')).toBe('shared');
+  });
+
+  it('hands the jobs of retired and silent workers to the others', async () => {
+    await registerWorker('a');
+    await enqueueJob('1', 'rome_italy');
+    await enqueueJob('2', 'rome_italy');
+    await retireWorker('a');
+
+    expect(await liveWorkers()).toEqual([]);
+    expect([await dequeueJob(1, 'b'), await dequeueJob(1, 'b')]).toEqual(['1', '2']);
+
+    await broker.hset('maptoposter:workers', { gone: Date.now() / 1000 - 60 });
+    await broker.lpush('maptoposter:render-queue:gone', '3');
+    await reapWorkers();
+
+    expect(await broker.hgetall('maptoposter:workers')).toEqual({});
+    expect(await dequeueJob(1, 'b')).toBe('3');
+  });
+});
@@ -0,0 +1,122 @@
+/**
+ * Tests for sharing jobs between API nodes and render workers through a broker.
+ *
+ * These tests verify that:
+ * 1. The in-process broker behaves like the Redis commands the server relies on
+ * 2. A job's shared record can be loaded on any node
+ * 3. Changes published by other nodes wake long-polls and reach this node's WebSocket clients
+ * 4. The render queue is first in, first out
+ */
+
+import { describe, it, expect, beforeEach, afterEach } from 'vitest';
+import { InProcessBroker } from '../src/services/broker.js';
+import {
+  createJob, dequeueJob, enqueueJob, loadJob, setNotifyCallback, updateJob, useBroker, waitForJobChange,
+} from '../src/services/jobManager.js';
+
+const tick = () => new Promise((resolve) => setTimeout(resolve, 10));
+
+/**
+ * Change a job the way another node's updateJob does.
+ */
+async function updateOnOtherNode(broker, jobId, updates) {
+  const key = `maptoposter:job:${jobId}`;
+  const fields = Object.fromEntries(Object.entries(updates).map(([name, value]) => [name, JSON.stringify(value)]));
+  await broker.hset(key, fields);
+  const version = await broker.hincrby(key, 'version', 1);
+  await broker.publish('maptoposter:job-events', JSON.stringify({ node: 'other-node', job_id: jobId, version, fields }));
+}
+
+describe('InProcessBroker', () => {
+  it('stores hashes', async () => {
+    const broker = new InProcessBroker();
+    await broker.hset('job', { status: 'pending', version: 0 });
+
+    expect(await broker.hincrby('job', 'version', 1)).toBe(1);
+    expect(await broker.hgetall('job')).toEqual({ status: 'pending', version: '1' });
+    expect(await broker.hgetall('missing')).toEqual({});
+  });
+
+  it('pops lists in order and times out when empty', async () => {
+    const broker = new InProcessBroker();
+    const waiting = broker.duplicate().brpop('queue', 1);
+    await broker.lpush('queue', 'a');
+    await broker.lpush('queue', 'b');
+
+    expect(await waiting).toEqual(['queue', 'a']);
+    expect(await broker.brpop('queue', 1)).toEqual(['queue', 'b']);
+    expect(await broker.brpop('queue', 0.01)).toBeNull();
+  });
+
+  it('publishes to subscribed duplicates', async () => {
+    const broker = new InProcessBroker();
+    const subscriber = broker.duplicate();
+    const received = [];
+    subscriber.on('message', (channel, message) => received.push([channel, message]));
+    await subscriber.subscribe('events');
+
+    expect(await broker.publish('events', 'hello')).toBe(1);
+    await tick();
+    await subscriber.quit();
+    await broker.publish('events', 'again');
+    await tick();
+
+    expect(received).toEqual([['events', 'hello']]);
+  });
+});
+
+describe('jobManager with a broker', () => {
+  let broker;
+  let sent;
+
+  beforeEach(async () => {
+    broker = new InProcessBroker();
+    sent = [];
+    setNotifyCallback((jobId, update) => sent.push([jobId, update.status, update.progress]));
+    await useBroker(broker);
+  });
+
+  afterEach(async () => {
+    setNotifyCallback(null);
+    await useBroker(null);
+  });
+
+  it('keeps jobs in the shared record', async () => {
+    const jobId = createJob({ city: 'Rome', country: 'Italy', quality: 'print' });
+    updateJob(jobId, { progress: 40 });
+    await tick();
+
+    const record = await broker.hgetall(`maptoposter:job:${jobId}`);
+    expect(JSON.parse(record.progress)).toBe(40);
+    expect(record.version).toBe('1');
+    expect(await loadJob(jobId)).toMatchObject({ progress: 40, jobClass: 'print', version: 1 });
+    expect(await loadJob('nope')).toBeNull();
+  });
+
+  it('applies changes made on other nodes', async () => {
+    const jobId = createJob({ city: 'Rome', country: 'Italy' });
+    await tick();
+    const waiter = waitForJobChange(jobId, 0, 5000);
+
+    await updateOnOtherNode(broker, jobId, { status: 'completed', progress: 100 });
+
+    expect(await waiter).toMatchObject({ status: 'completed', progress: 100, version: 1 });
+    expect(sent).toEqual([[jobId, 'completed', 100]]);
+  });
+
+  it('does not apply its own changes twice', async () => {
+    const jobId = createJob({ city: 'Rome', country: 'Italy' });
+    updateJob(jobId, { progress: 10 });
+    await tick();
+
+    expect(sent).toEqual([[jobId, 'pending', 10]]);
+  });
+
+  it('queues jobs first in, first out', async () => {
+    await enqueueJob('a');
+    await enqueueJob('b');
+
+    expect(await dequeueJob(1)).toBe('a');
+    expect(await dequeueJob(1)).toBe('b');
+  });
+});
@@ -0,0 +1,264 @@
+"""
+Map data of hot locations shared by every render process on a machine.
+
+Each render daemon's HotLocations (hot_cache.py) keeps its own copy of the
+map data it has used, so N daemons hold N copies of a popular city. This
+store writes a location's render-ready arrays once, as plain .npy files in
+a shared directory, and every process maps them read-only with
+np.load(mmap_mode="r"). The pages live once in the OS page cache (or in RAM
+when the directory is on tmpfs such as /dev/shm), so adding daemons adds
+throughput without multiplying the memory used by roads.
+
+One entry per cache key:
+
+    <key>/roads_codes.npy, roads_coords.npy, roads_offsets.npy
+    <key>/<layer>.wkb, <layer>_offsets.npy    polygon layers, as WKB
+    <key>/meta.json                           highways, crs, layers, size, cached_at
+
+Coordination is done through the directory itself, so no extra process is
+needed. A process that misses loads the location as usual and publishes it:
+entries are written to a temp directory and renamed into place, and the
+publish plus eviction of the least recently used entries down to the byte
+budget run under an exclusive lock on the store. Readers touch meta.json on
+every hit, which is what recency is judged by. An evicted entry is only
+unlinked; processes still mapping it keep their pages until they let go.
+
+Each entry records when its map data was downloaded. Entries older than
+max_age seconds are not served, and publishing newer data for a key
+replaces the older entry, so refreshed map data reaches every process once
+the disk cache has expired the old one.
+
+Polygons are decoded per process (they are small next to roads); roads are
+never copied.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to no cross-process locking
+    fcntl = None
+
+DEFAULT_DIR = Path(os.environ.get("RENDER_SHARED_DIR", Path(tempfile.gettempdir()) / "maptoposter-shared"))
+
+POLYGON_LAYERS = ("water", "parks")
+META_FILE = "meta.json"
+
+
+class SharedLocations:
+    """Cross-process, byte-bounded store of memory-mapped map data by cache key. A budget of 0 disables it."""
+
+    def __init__(self, directory=DEFAULT_DIR, max_bytes=0, max_age=None):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+    def _entry(self, cache_key):
+        return self.directory / cache_key
+
+    @contextmanager
+    def _lock(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self.directory / ".lock", "a") as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _cached_at(self, cache_key):
+        """When a published entry's map data was downloaded, or None if there is no entry."""
+        try:
+            with open(self._entry(cache_key) / META_FILE) as f:
+                return json.load(f).get("cached_at", 0)
+        except (OSError, ValueError):
+            return None
+
+    def get(self, cache_key):
+        """
+        Map data for a cache key with roads mapped from the shared files, or
+        None. It includes cached_at, when the data was downloaded (Unix time).
+        """
+        if self.max_bytes <= 0:
+            return None
+        entry = self._entry(cache_key)
+        try:
+            with open(entry / META_FILE) as f:
+                meta = json.load(f)
+            cached_at = meta.get("cached_at", 0)
+            if self.max_age is not None and time.time() - cached_at > self.max_age:
+                # Expired: left for the next put to replace
+                return None
+            data = _read_entry(entry, meta)
+            os.utime(entry / META_FILE)
+        except (OSError, ValueError):
+            # Not published, or evicted while we were reading it
+            return None
+        return {**data, "cached_at": cached_at}
+
+    def _is_current(self, cache_key, cached_at):
+        published = self._cached_at(cache_key)
+        return published is not None and published >= cached_at
+
+    def put(self, cache_key, data, cached_at=None):
+        """
+        Publish a location's map data and evict down to the budget.
+
+        cached_at is when the data was downloaded (a Unix time, default
+        now); an entry already published for the key is replaced if it is
+        older. Only SlimRoads are shared; other road sources (TiledRoads)
+        are already on disk. Failures such as a full tmpfs are reported and
+        leave the store as it was.
+
+        Returns:
+            True if the data (or data at least as new) is now published
+        """
+        from roads import SlimRoads
+
+        if self.max_bytes <= 0 or not isinstance(data.get("graph"), SlimRoads):
+            return False
+        if cached_at is None:
+            cached_at = time.time()
+        if self._is_current(cache_key, cached_at):
+            return True
+
+        tmp_path = self.directory / f".tmp-{cache_key}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            nbytes = _write_entry(tmp_path, data, cached_at)
+            if nbytes > self.max_bytes:
+                return False
+            with self._lock():
+                if self._is_current(cache_key, cached_at):
+                    return True
+                self._remove(cache_key)
+                self._evict(self.max_bytes - nbytes)
+                os.rename(tmp_path, self._entry(cache_key))
+            return True
+        except OSError as e:
+            print(f"  ⚠ Could not share map data for {cache_key}: {e}")
+            return False
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def entries(self):
+        """(cache key, bytes, last used timestamp) of every published entry."""
+        if not self.directory.exists():
+            return []
+        found = []
+        for entry in self.directory.iterdir():
+            if entry.name.startswith("."):
+                continue
+            try:
+                stat = (entry / META_FILE).stat()
+                with open(entry / META_FILE) as f:
+                    nbytes = json.load(f)["nbytes"]
+            except (OSError, ValueError):
+                continue
+            found.append((entry.name, nbytes, stat.st_mtime))
+        return found
+
+    def _evict(self, budget):
+        """Remove least recently used entries until they total at most budget. Caller holds the lock."""
+        entries = sorted(self.entries(), key=lambda e: e[2])
+        total = sum(nbytes for _, nbytes, _ in entries)
+        for cache_key, nbytes, _ in entries:
+            if total <= budget:
+                break
+            self._remove(cache_key)
+            total -= nbytes
+
+    def _remove(self, cache_key):
+        """Unlink an entry, if published. Caller holds the lock."""
+        entry = self._entry(cache_key)
+        # Out of the way first, so the key can be published again right away
+        doomed = self.directory / f".old-{cache_key}-{uuid.uuid4().hex[:8]}"
+        try:
+            os.rename(entry, doomed)
+        except OSError:
+            return
+        shutil.rmtree(doomed, ignore_errors=True)
+
+    def stats(self):
+        """Entries and bytes published, and the budget."""
+        entries = self.entries()
+        return {
+            "entries": len(entries),
+            "bytes": sum(nbytes for _, nbytes, _ in entries),
+            "max_bytes": self.max_bytes,
+        }
+
+    def clear(self):
+        with self._lock():
+            self._evict(0)
+
+
+def _write_entry(path, data, cached_at):
+    """Write map data as an entry directory. Returns its size in bytes."""
+    import numpy as np
+    import shapely
+
+    path.mkdir(parents=True)
+    roads = data["graph"]
+    np.save(path / "roads_codes.npy", roads.codes)
+    np.save(path / "roads_coords.npy", roads.coords)
+    np.save(path / "roads_offsets.npy", roads.offsets)
+
+    layers = {}
+    for layer in POLYGON_LAYERS:
+        features = data.get(layer)
+        layers[layer] = features is not None
+        if features is None:
+            continue
+        blobs = [shapely.to_wkb(geometry) for geometry in features.geometry]
+        offsets = np.zeros(len(blobs) + 1, dtype=np.int64)
+        np.cumsum([len(blob) for blob in blobs], out=offsets[1:])
+        (path / f"{layer}.wkb").write_bytes(b"".join(blobs))
+        np.save(path / f"{layer}_offsets.npy", offsets)
+
+    nbytes = sum(f.stat().st_size for f in path.iterdir())
+    meta = {
+        "highways": list(roads.highways),
+        "crs": str(roads.crs),
+        "layers": layers,
+        "nbytes": nbytes,
+        "created": time.time(),
+        "cached_at": cached_at,
+    }
+    with open(path / META_FILE, "w") as f:
+        json.dump(meta, f)
+    return nbytes
+
+
+def _read_entry(path, meta):
+    import geopandas as gpd
+    import numpy as np
+    import shapely
+    from roads import SlimRoads
+
+    roads = SlimRoads(
+        highways=meta["highways"],
+        codes=np.load(path / "roads_codes.npy", mmap_mode="r"),
+        coords=np.load(path / "roads_coords.npy", mmap_mode="r"),
+        offsets=np.load(path / "roads_offsets.npy", mmap_mode="r"),
+        crs=meta["crs"],
+    )
+    data = {"graph": roads}
+    for layer in POLYGON_LAYERS:
+        if not meta["layers"][layer]:
+            data[layer] = None
+            continue
+        wkb = (path / f"{layer}.wkb").read_bytes()
+        offsets = np.load(path / f"{layer}_offsets.npy")
+        geometries = shapely.from_wkb([wkb[start:end] for start, end in zip(offsets[:-1], offsets[1:])])
+        data[layer] = gpd.GeoDataFrame(geometry=geometries, crs=meta["crs"])
+    return data
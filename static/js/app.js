@@ -551,6 +551,7 @@ async function submitPosterRequest(request, hideSection) {
         document.getElementById('status').classList.remove('hidden');
         document.getElementById('status-text').textContent = 'Initializing payment...';
         document.getElementById('progress').style.width = '0%';
+        document.getElementById('preview-render').classList.add('hidden');
 
         // Start rotating titles
         startTitleRotation();
@@ -654,6 +655,8 @@ function connectJobWebSocket(jobId) {
 
         if (data.type === 'job_update') {
             handleJobUpdate(data);
+        } else if (data.type === 'preview') {
+            showQuickPreview(data.preview_url);
         }
     };
 
@@ -694,8 +697,20 @@ function closeWebSocket() {
     }
 }
 
+// Show the quick low-detail render in the preview panel until the poster is done
+function showQuickPreview(previewUrl) {
+    const previewRender = document.getElementById('preview-render');
+    if (!previewUrl || !previewRender) return;
+    previewRender.src = `${API_BASE}${previewUrl}`;
+    previewRender.classList.remove('hidden');
+}
+
 // Handle job update from WebSocket
 function handleJobUpdate(data) {
+    if (data.preview_url) {
+        showQuickPreview(data.preview_url);
+    }
+
     // Update progress bar
     document.getElementById('progress').style.width = `${data.progress}%`;
 
@@ -738,6 +753,15 @@ function handleJobUpdate(data) {
                 `Generation failed: ${data.error || 'Unknown error'}`;
             document.querySelector('.status-rings').style.display = 'none';
             break;
+
+        case 'cancelled':
+            stopTitleRotation();
+            stopStatusTimer();
+            jobFinished = true;  // Prevent reconnect attempts
+            closeWebSocket();
+            document.getElementById('status-text').textContent = 'Generation cancelled';
+            document.querySelector('.status-rings').style.display = 'none';
+            break;
     }
 }
 
@@ -761,7 +785,8 @@ async function pollJobStatus() {
             progress: job.progress,
             message: job.message,
             error: job.error,
-            download_url: job.download_url
+            download_url: job.download_url,
+            preview_url: job.preview_url
         });
 
         // Continue polling if not finished
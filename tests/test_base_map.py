@@ -0,0 +1,91 @@
+"""
+Tests for cached base maps and overlay compositing (create_map_poster.py).
+
+These tests verify that:
+1. The first render stores a base map with the cache entry
+2. Re-titled renders reuse it without loading map data
+3. Base maps are keyed by theme colors and DPI and dropped with stale data
+"""
+
+import networkx as nx
+import pytest
+
+pytest.importorskip("matplotlib")
+
+import cache
+import create_map_poster
+from roads import slim_graph
+
+POINT = (45.4371908, 12.3345898)
+
+
+@pytest.fixture
+def poster_env(tmp_path, monkeypatch):
+    """Temporary cache and a fake OSM download."""
+    monkeypatch.setattr(cache, "CACHE_DIR", tmp_path / "cache")
+
+    G = nx.MultiDiGraph(crs="epsg:4326")
+    G.add_node(1, x=POINT[1] - 0.01, y=POINT[0])
+    G.add_node(2, x=POINT[1] + 0.01, y=POINT[0])
+    G.add_edge(1, 2, highway="primary")
+    downloads = []
+
+    def fake_download(bbox, layers, source):
+        downloads.append(list(layers))
+        return {"graph": slim_graph(G), "water": None, "parks": None}
+
+    monkeypatch.setattr(create_map_poster, "download_map_data", fake_download)
+    return tmp_path, downloads
+
+
+def render(tmp_path, name, **kwargs):
+    output = tmp_path / name
+    theme = create_map_poster.load_theme("noir")
+    create_map_poster.create_poster("Venice", "Italy", POINT, 2000, str(output), theme, preview=True, **kwargs)
+    return output
+
+
+class TestBaseMapCache:
+    """Tests for storing and reusing rasterised base maps."""
+
+    def test_retitled_render_reuses_base_map(self, poster_env, monkeypatch):
+        tmp_path, downloads = poster_env
+        render(tmp_path, "first.png")
+
+        def no_fetch(*args, **kwargs):
+            raise AssertionError("map data should not be loaded")
+
+        monkeypatch.setattr(create_map_poster, "fetch_map_data", no_fetch)
+        output = render(tmp_path, "second.png", title="La Serenissima", subtitle="Veneto")
+
+        assert output.exists()
+        assert len(downloads) == 1
+
+    def test_base_map_is_keyed_by_dpi_and_theme_colors(self, poster_env):
+        theme = create_map_poster.load_theme("noir")
+        name = create_map_poster.get_base_map_name(theme, 300)
+
+        assert create_map_poster.get_base_map_name(theme, 72) != name
+        assert create_map_poster.get_base_map_name({**theme, "text": "#FF0000"}, 300) == name
+        assert create_map_poster.get_base_map_name({**theme, "water": "#FF0000"}, 300) != name
+
+    def test_resaving_layers_drops_base_maps(self, poster_env):
+        tmp_path, _ = poster_env
+        render(tmp_path, "first.png")
+        key = cache.get_cache_key("Venice", "Italy", 2000)
+        name = create_map_poster.get_base_map_name(create_map_poster.load_theme("noir"), 72)
+        assert cache.load_basemap(key, name) is not None
+
+        cache.save_layers(key, {"water": None}, POINT, "Venice", "Italy", 2000)
+
+        assert cache.load_basemap(key, name) is None
+
+    def test_base_map_counts_toward_entry_size(self, poster_env):
+        tmp_path, _ = poster_env
+        key = cache.get_cache_key("Venice", "Italy", 2000)
+        create_map_poster.fetch_map_data("Venice", "Italy", POINT, 2000)
+        size = cache.get_cached_meta(key)["size_bytes"]
+
+        render(tmp_path, "first.png")
+
+        assert cache.get_cached_meta(key)["size_bytes"] > size
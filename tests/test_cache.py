@@ -0,0 +1,435 @@
+"""
+Tests for the map-data cache (cache.py).
+
+These tests verify that:
+1. Saved entries are indexed and can be loaded back
+2. Lookups, listing and validation are answered from the SQLite index
+3. The index is rebuilt from meta.json files when it is missing or outdated,
+   keeping when each entry was last used
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import cache
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    """Point the cache module at an empty temporary directory."""
+    directory = tmp_path / "cache"
+    directory.mkdir()
+    monkeypatch.setattr(cache, "CACHE_DIR", directory)
+    return directory
+
+
+def save_city(city="Venice", country="Italy", distance=12000, **layers):
+    key = cache.get_cache_key(city, country, distance)
+    cache.save_to_cache(
+        key,
+        layers.get("graph", {"edges": [1, 2, 3]}),
+        layers.get("water"),
+        layers.get("parks"),
+        (45.4371908, 12.3345898),
+        city,
+        country,
+        distance,
+    )
+    return key
+
+
+def age_entry(cache_dir, key, days):
+    """Backdate an entry and all of its layers by the given number of days."""
+    meta_file = cache_dir / key / "meta.json"
+    meta = json.loads(meta_file.read_text())
+    cached_at = (datetime.now() - timedelta(days=days)).isoformat()
+    meta["cached_at"] = cached_at
+    for layer in meta.get("layers", {}).values():
+        layer["cached_at"] = cached_at
+    meta_file.write_text(json.dumps(meta))
+    cache.rebuild_index()
+
+
+class TestCacheIndex:
+    """Tests for the SQLite-backed cache index."""
+
+    def test_save_and_load_roundtrip(self, cache_dir):
+        key = save_city(water=["lagoon"])
+
+        assert cache.is_cache_valid(key)
+        data = cache.load_from_cache(key)
+
+        assert data["graph"] == {"edges": [1, 2, 3]}
+        assert data["water"] == ["lagoon"]
+        assert data["parks"] is None
+        assert data["coords"] == (45.4371908, 12.3345898)
+
+    def test_meta_reports_layers_size_and_bbox(self, cache_dir):
+        key = save_city(water=["lagoon"], parks=["giardini"])
+
+        meta = cache.get_cached_meta(key)
+
+        assert meta["layers"] == ["graph", "parks", "water"]
+        assert meta["size_bytes"] > 0
+        south, west, north, east = meta["bbox"]
+        assert south < 45.4371908 < north
+        assert west < 12.3345898 < east
+
+    def test_find_cached_location_matches_any_distance(self, cache_dir):
+        save_city(distance=6000)
+
+        meta = cache.find_cached_location("Venice", "Italy")
+
+        assert meta["cache_key"] == "venice_italy_6000"
+        assert meta["distance"] == 6000
+        assert cache.find_cached_location("Rome", "Italy") is None
+
+    def test_lookup_does_not_read_meta_files(self, cache_dir):
+        key = save_city()
+        (cache_dir / key / "meta.json").unlink()
+
+        # The index alone answers metadata queries
+        assert cache.find_cached_location("Venice", "Italy")["cache_key"] == key
+        assert cache.is_cache_valid(key)
+
+    def test_entry_without_graph_is_not_valid(self, cache_dir):
+        key = save_city()
+        (cache_dir / key / "graph.pkl").unlink()
+        cache.rebuild_index()
+
+        assert not cache.is_cache_valid(key)
+        assert cache.get_cached_meta(key)["layers"] == []
+
+    def test_expired_entry_is_not_valid(self, cache_dir):
+        key = save_city()
+        age_entry(cache_dir, key, cache.CACHE_EXPIRY_DAYS + 1)
+
+        assert not cache.is_cache_valid(key)
+
+    def test_index_is_rebuilt_from_existing_entries(self, cache_dir):
+        key = save_city()
+        (cache_dir / cache.INDEX_FILE).unlink()
+
+        entries = cache.list_cache()
+
+        assert [e["cache_key"] for e in entries] == [key]
+
+    def test_upgraded_index_keeps_last_access(self, cache_dir):
+        key = save_city()
+        cache.load_from_cache(key)
+        last_access = cache.get_cached_meta(key)["last_access"]
+        with sqlite3.connect(cache_dir / cache.INDEX_FILE) as conn:
+            conn.execute(f"PRAGMA user_version = {cache.INDEX_VERSION - 1}")
+
+        assert cache.get_cached_meta(key)["last_access"] == last_access
+
+    def test_rebuilt_index_takes_last_access_from_the_files(self, cache_dir):
+        old = save_city("Venice", "Italy")
+        new = save_city("Rome", "Italy")
+        (cache_dir / cache.INDEX_FILE).unlink()
+        for f in (cache_dir / new).iterdir():
+            os.utime(f, (10 ** 6, 10 ** 6))
+        for f in (cache_dir / old).iterdir():
+            os.utime(f, (2 * 10 ** 6, 2 * 10 ** 6))
+        hour_ago = (datetime.now() - timedelta(hours=1)).isoformat()
+        for key in (old, new):
+            meta_file = cache_dir / key / "meta.json"
+            meta = json.loads(meta_file.read_text())
+            meta["cached_at"] = "1970-01-01T00:00:00"
+            meta_file.write_text(json.dumps(meta))
+            os.utime(meta_file, (0, 0))
+
+        cache.rebuild_index()
+
+        assert cache.get_cached_meta(new)["last_access"] < cache.get_cached_meta(old)["last_access"] < hour_ago
+
+    def test_clear_cache_removes_index_row(self, cache_dir):
+        key = save_city()
+
+        cache.clear_cache(key)
+
+        assert cache.get_cached_meta(key) is None
+        assert not (cache_dir / key).exists()
+
+
+class TestCacheRetention:
+    """Tests for LRU eviction, compaction and stats."""
+
+    def test_evict_removes_least_recently_used_first(self, cache_dir):
+        old = save_city("Venice", "Italy")
+        new = save_city("Rome", "Italy")
+        cache.load_from_cache(new)  # bump last access
+        budget = cache.get_cached_meta(new)["size_bytes"]
+
+        removed, freed = cache.evict_cache(max_bytes=budget)
+
+        assert removed == 1
+        assert freed > 0
+        assert cache.get_cached_meta(old) is None
+        assert not (cache_dir / old).exists()
+        assert cache.get_cached_meta(new) is not None
+
+    def test_evict_skips_entries_being_saved(self, cache_dir):
+        old = save_city("Venice", "Italy")
+        new = save_city("Rome", "Italy")
+        cache.load_from_cache(new)
+        budget = cache.get_cached_meta(new)["size_bytes"]
+
+        with cache.cache_lock(old):
+            removed, _ = cache.evict_cache(max_bytes=budget)
+
+        assert removed == 1
+        assert cache.get_cached_meta(old) is not None
+        assert cache.get_cached_meta(new) is None
+
+    def test_evict_removes_expired_entries_even_under_budget(self, cache_dir):
+        key = save_city()
+        age_entry(cache_dir, key, cache.CACHE_EXPIRY_DAYS + 1)
+
+        removed, _ = cache.evict_cache(max_bytes=10 ** 12)
+
+        assert removed == 1
+
+    def test_background_eviction_enforces_budget(self, cache_dir):
+        save_city("Venice", "Italy")
+
+        thread = cache.evict_in_background(max_bytes=1)
+        thread.join()
+
+        assert cache.list_cache() == []
+
+    def test_compact_removes_unindexed_directories(self, cache_dir):
+        save_city()
+        stray = cache_dir / "half_written_entry"
+        stray.mkdir()
+        (stray / "water.pkl").write_bytes(b"x" * 10)
+
+        removed, freed = cache.compact_cache(max_bytes=10 ** 12)
+
+        assert removed == 1
+        assert freed == 10
+        assert not stray.exists()
+
+    def test_lock_files_go_with_their_entries(self, cache_dir):
+        evicted = save_city("Venice", "Italy")
+        kept = save_city("Rome", "Italy")
+        cache.load_from_cache(kept)
+        for key in (evicted, kept, "never_cached_1000"):
+            with cache.cache_lock(key):
+                pass
+        with cache.cache_lock("being_saved_1000"):
+            cache.evict_cache(max_bytes=cache.get_cached_meta(kept)["size_bytes"])
+            cache.compact_cache(max_bytes=10 ** 12)
+
+        locks = sorted(path.stem for path in (cache_dir / ".locks").iterdir())
+        assert locks == ["being_saved_1000", kept]
+
+    def test_waiter_on_a_removed_lock_file_locks_the_new_one(self, cache_dir):
+        held = threading.Event()
+        release = threading.Event()
+
+        def waiter():
+            with cache.cache_lock("venice_italy_1000"):
+                held.set()
+                release.wait(5)
+
+        with cache.cache_lock("venice_italy_1000"):
+            thread = threading.Thread(target=waiter)
+            thread.start()
+            time.sleep(0.05)
+            cache._remove_lock_file("venice_italy_1000")
+        assert held.wait(5)
+
+        # The waiter holds the lock file that is there now
+        with cache.cache_lock("venice_italy_1000", blocking=False) as locked:
+            assert not locked
+        release.set()
+        thread.join()
+
+    def test_stats_track_hits_and_misses(self, cache_dir):
+        key = save_city()
+        cache.load_from_cache(key)
+        cache.load_from_cache("nowhere_none_1000")
+
+        stats = cache.cache_stats()
+
+        assert stats["entries"] == 1
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+        assert stats["hit_rate"] == 0.5
+
+    def test_memory_hits_count_as_uses(self, cache_dir, monkeypatch):
+        monkeypatch.setattr(cache, "_pending_access", {})
+        key = save_city()
+        before = cache.get_cached_meta(key)["last_access"]
+
+        for _ in range(3):
+            cache.record_access(key)
+
+        # The first hit is written right away, the others together later
+        assert cache.get_cached_meta(key)["last_access"] > before
+        assert cache.cache_stats()["hits"] == 1
+        cache.flush_access()
+        assert cache.cache_stats()["hits"] == 3
+
+    def test_cli_stats(self, cache_dir, capsys):
+        save_city()
+
+        assert cache.main(["stats"]) == 0
+        assert "Entries:    1" in capsys.readouterr().out
+
+
+class TestCacheConcurrency:
+    """Tests for atomic publishing and per-key download de-duplication."""
+
+    def test_save_leaves_no_temp_directories(self, cache_dir):
+        key = save_city(water=["lagoon"])
+        save_city(water=["laguna"])
+
+        entries = [p.name for p in cache_dir.iterdir() if p.is_dir() and p.name != ".locks"]
+        assert entries == [key]
+        assert cache.load_from_cache(key)["water"] == ["laguna"]
+
+    def test_failed_save_keeps_previous_entry(self, cache_dir):
+        key = save_city(water=["lagoon"])
+
+        # Lambdas can't be pickled, so this write fails midway
+        assert not cache.save_to_cache(key, {}, lambda: None, None, (45.4, 12.3), "Venice", "Italy", 12000)
+
+        assert cache.load_from_cache(key)["water"] == ["lagoon"]
+        assert [p.name for p in cache_dir.iterdir() if p.name.startswith(".tmp-")] == []
+
+    def test_concurrent_fetches_download_once(self, cache_dir, monkeypatch):
+        import threading
+        import time
+        import create_map_poster
+
+        downloads = []
+
+        def fake_download(bbox, layers, source):
+            downloads.append(layers)
+            time.sleep(0.2)
+            return {name: [name] for name in layers}
+
+        monkeypatch.setattr(create_map_poster, "download_map_data", fake_download)
+
+        results = []
+
+        def fetch():
+            results.append(create_map_poster.fetch_map_data("Venice", "Italy", (45.4, 12.3), 12000))
+
+        threads = [threading.Thread(target=fetch) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(downloads) == 1
+        assert sorted(r["from_cache"] for r in results) == [False, True, True]
+
+
+class TestLayerGranularCache:
+    """Tests for per-layer validation, expiry and fetching."""
+
+    def test_partial_entry_loads_available_layers(self, cache_dir):
+        key = cache.get_cache_key("Venice", "Italy", 12000)
+        cache.save_layers(key, {"water": ["lagoon"], "parks": ["giardini"]}, (45.4, 12.3), "Venice", "Italy", 12000)
+
+        assert not cache.is_cache_valid(key)
+        assert cache.load_from_cache(key) is None
+        assert cache.load_layers(key)["layers"] == {"water": ["lagoon"], "parks": ["giardini"]}
+
+    def test_saving_one_layer_keeps_the_others(self, cache_dir):
+        key = save_city(water=["lagoon"], parks=["giardini"])
+
+        cache.save_layers(key, {"water": ["laguna"]}, (45.4, 12.3), "Venice", "Italy", 12000)
+
+        data = cache.load_from_cache(key)
+        assert data["water"] == ["laguna"]
+        assert data["parks"] == ["giardini"]
+        assert data["graph"] == {"edges": [1, 2, 3]}
+
+    def test_layers_expire_independently(self, cache_dir):
+        key = save_city(water=["lagoon"])
+        age_entry(cache_dir, key, cache.CACHE_EXPIRY_DAYS + 1)
+        cache.save_layers(key, {"graph": {"edges": []}}, (45.4, 12.3), "Venice", "Italy", 12000)
+
+        assert cache.get_fresh_layers(key) == {"graph"}
+
+    def test_fetch_downloads_only_missing_layers(self, cache_dir, monkeypatch):
+        import create_map_poster
+
+        key = cache.get_cache_key("Venice", "Italy", 12000)
+        cache.save_layers(key, {"water": ["lagoon"], "parks": None}, (45.4, 12.3), "Venice", "Italy", 12000)
+        downloads = []
+
+        def fake_download(bbox, layers, source):
+            downloads.append(list(layers))
+            return {name: [name] for name in layers}
+
+        monkeypatch.setattr(create_map_poster, "download_map_data", fake_download)
+
+        data = create_map_poster.fetch_map_data("Venice", "Italy", (45.4, 12.3), 12000)
+
+        assert downloads == [["graph"]]
+        assert data["water"] == ["lagoon"]
+        assert data["parks"] is None
+        assert cache.get_fresh_layers(key) == {"graph", "water", "parks"}
+
+
+class TestCacheCodecs:
+    """Tests for compressed cache layers."""
+
+    @pytest.mark.parametrize("codec", list(cache.CODECS))
+    def test_layer_roundtrip(self, tmp_path, codec):
+        if codec == "lz4":
+            pytest.importorskip("lz4")
+        elif codec != "none":
+            pytest.importorskip("zstandard")
+        data = {"coords": list(range(10000))}
+        path = tmp_path / "layer.pkl"
+
+        cache.dump_layer(data, path, codec)
+
+        assert cache.load_layer(path, codec) == data
+
+    def test_codec_is_recorded_per_layer(self, cache_dir, monkeypatch):
+        pytest.importorskip("zstandard")
+        monkeypatch.setattr(cache, "CACHE_LAYER_CODECS", {"water": "zstd-3"})
+        key = save_city(water=["lagoon"] * 1000)
+
+        meta = json.loads((cache_dir / key / "meta.json").read_text())
+
+        assert meta["layers"]["water"]["codec"] == "zstd-3"
+        assert meta["layers"]["graph"]["codec"] == "none"
+        assert cache.get_cached_meta(key)["codecs"] == {"graph": "none", "water": "zstd-3"}
+
+    def test_entries_with_mixed_codecs_stay_readable(self, cache_dir, monkeypatch):
+        pytest.importorskip("lz4")
+        key = save_city(water=["lagoon"])
+        monkeypatch.setattr(cache, "CACHE_CODEC", "lz4")
+        cache.save_layers(key, {"parks": ["giardini"]}, (45.4, 12.3), "Venice", "Italy", 12000)
+
+        data = cache.load_from_cache(key)
+
+        assert data["water"] == ["lagoon"]
+        assert data["parks"] == ["giardini"]
+
+    def test_unknown_codec_falls_back_to_none(self, monkeypatch):
+        monkeypatch.setattr(cache, "CACHE_CODEC", "brotli")
+
+        assert cache.get_layer_codec("graph") == "none"
+
+    def test_benchmark_reports_every_codec(self, cache_dir):
+        save_city(water=["lagoon"] * 1000)
+
+        results = cache.benchmark_codecs(["none", "zstd-1"], repeat=1)
+
+        assert [r["codec"] for r in results] == ["none", "zstd-1"]
+        assert results[1]["bytes"] < results[0]["bytes"]
@@ -0,0 +1,140 @@
+"""
+Tests for the background cache warmer.
+
+These tests verify that:
+1. Warm targets are collected from config, recent jobs and the gallery
+2. The queue de-duplicates targets and honours priorities
+3. POST /api/warm queues a location without requiring payment
+4. Warming waits for live renders only, and render workers warm only the locations routed to them
+"""
+
+import json
+
+import pytest
+from httpx import AsyncClient, ASGITransport
+
+from app.main import app
+from app.config import settings
+from app.models import PosterRequest
+from app.services import cache_warmer, job_manager
+from app.services.broker import InProcessBroker
+from app.services.cache_warmer import CacheWarmer, WarmTarget
+from app.services.poster_generator import build_location_args
+from app.services.routing import HashRing, location_key
+
+
+@pytest.fixture
+def clean_state(tmp_path, monkeypatch):
+    """Isolate warm settings and job history."""
+    monkeypatch.setattr(settings, "warm_cities", [])
+    monkeypatch.setattr(settings, "gallery_file", tmp_path / "gallery.json")
+    monkeypatch.setattr(job_manager, "jobs", {})
+    return tmp_path
+
+
+class TestWarmTargets:
+    """Tests for collecting and parsing warm targets."""
+
+    def test_parse_city_country(self):
+        assert WarmTarget.parse("Tokyo, Japan") == WarmTarget(city="Tokyo", country="Japan")
+
+    def test_parse_city_state_country(self):
+        target = WarmTarget.parse("Austin, Texas, United States")
+        assert (target.city, target.state, target.country) == ("Austin", "Texas", "United States")
+
+    def test_location_args_match_poster_jobs(self):
+        target = WarmTarget(city="Austin", state="Texas", country="United States", size="city")
+        assert build_location_args(target) == [
+            "--city", "Austin, Texas", "--country", "United States", "--size", "city",
+        ]
+
+    def test_collect_targets_from_all_sources(self, clean_state, monkeypatch):
+        monkeypatch.setattr(settings, "warm_cities", ["Tokyo, Japan"])
+        (clean_state / "gallery.json").write_text(json.dumps({
+            "entries": [{"city": "Dubai", "state": None, "country": "UAE"}],
+        }))
+        job_manager.jobs["a"] = {
+            "created_at": "2026-01-01T00:00:00",
+            "request": {"city": "Rome", "state": None, "country": "Italy", "size": "auto", "distance": None},
+        }
+
+        targets = cache_warmer.collect_targets()
+
+        assert [(p, t.city) for p, t in targets] == [
+            (cache_warmer.PRIORITY_CONFIG, "Tokyo"),
+            (cache_warmer.PRIORITY_RECENT_JOBS, "Rome"),
+            (cache_warmer.PRIORITY_GALLERY, "Dubai"),
+        ]
+
+
+class TestWarmQueue:
+    """Tests for queue ordering and de-duplication."""
+
+    @pytest.mark.asyncio
+    async def test_enqueue_deduplicates(self):
+        warmer = CacheWarmer()
+        target = WarmTarget(city="Rome", country="Italy")
+
+        assert warmer.enqueue(target)
+        assert not warmer.enqueue(target)
+        assert warmer.pending == 1
+
+    @pytest.mark.asyncio
+    async def test_demand_signals_jump_the_queue(self):
+        warmer = CacheWarmer()
+        warmer.enqueue(WarmTarget(city="Dubai", country="UAE"), cache_warmer.PRIORITY_GALLERY)
+        warmer.enqueue(WarmTarget(city="Rome", country="Italy"), cache_warmer.PRIORITY_DEMAND)
+
+        _, _, first = warmer._queue.get_nowait()
+
+        assert first.city == "Rome"
+
+
+class TestWarmEndpoint:
+    """Tests for POST /api/warm."""
+
+    @pytest.mark.asyncio
+    async def test_warm_endpoint_queues_without_payment(self, monkeypatch):
+        monkeypatch.setattr(cache_warmer, "warmer", CacheWarmer())
+        from app.routers import warm
+        monkeypatch.setattr(warm, "warmer", cache_warmer.warmer)
+
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.post("/api/warm", json={"city": "Rome", "country": "Italy"})
+            repeat = await client.post("/api/warm", json={"city": "Rome", "country": "Italy"})
+
+        assert response.status_code == 202
+        assert response.json()["queued"] is True
+        assert repeat.json()["queued"] is False
+
+
+class TestWarmScheduling:
+    """Tests for when and where targets are warmed."""
+
+    @pytest.mark.asyncio
+    async def test_only_live_renders_pause_warming(self, clean_state):
+        # A job record left pending by a crashed render
+        job_manager.create_job(PosterRequest(city="Rome", country="Italy"))
+        assert not cache_warmer._render_queue_busy()
+
+        async with cache_warmer.scheduler.reserve("render", 1):
+            assert cache_warmer._render_queue_busy()
+
+    @pytest.mark.asyncio
+    async def test_render_worker_warms_only_its_own_locations(self, monkeypatch):
+        monkeypatch.setattr(job_manager, "_broker", InProcessBroker())
+        monkeypatch.setattr(job_manager, "_ring", HashRing())
+        monkeypatch.setattr(job_manager, "worker_id", "me")
+        job_manager.register_worker("me")
+        job_manager.register_worker("other")
+        warmer = CacheWarmer()
+        warmer._routed = True
+        targets = [WarmTarget(city=f"City {i}", country="Italy") for i in range(20)]
+
+        owned = [await warmer._owns(target) for target in targets]
+
+        ring = HashRing(["me", "other"])
+        assert owned == [ring.preference(location_key(t.city, t.country))[0] == "me" for t in targets]
+        assert any(owned) and not all(owned)
+        # API nodes rendering locally warm everything
+        assert await CacheWarmer()._owns(targets[owned.index(False)])
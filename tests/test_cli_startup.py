@@ -0,0 +1,66 @@
+"""
+Tests for CLI startup cost (create_map_poster.py).
+
+These tests verify that:
+1. Importing the module does not pull in the mapping/plotting stack
+2. Commands that don't render (--list-themes, cache, argument errors) stay light
+"""
+
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+HEAVY_MODULES = ["osmnx", "matplotlib", "geopandas", "geopy", "numpy", "networkx", "tqdm"]
+
+PROBE = """
+import runpy, sys
+sys.argv = ["create_map_poster.py"] + {args!r}
+try:
+    runpy.run_path("create_map_poster.py", run_name="__main__")
+except SystemExit:
+    pass
+heavy = [m for m in {heavy!r} if m in sys.modules]
+print("HEAVY:" + ",".join(heavy))
+"""
+
+
+def loaded_heavy_modules(args):
+    """Run the CLI with args in a fresh interpreter and report heavy imports."""
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE.format(args=args, heavy=HEAVY_MODULES)],
+        cwd=REPO_DIR,
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+    marker = [line for line in result.stdout.splitlines() if line.startswith("HEAVY:")]
+    assert marker, result.stderr
+    return [name for name in marker[-1][len("HEAVY:"):].split(",") if name]
+
+
+class TestCliStartup:
+    """Tests that light commands don't import heavy dependencies."""
+
+    def test_import_is_light(self):
+        result = subprocess.run(
+            [sys.executable, "-c",
+             f"import sys, create_map_poster; print([m for m in {HEAVY_MODULES!r} if m in sys.modules])"],
+            cwd=REPO_DIR,
+            capture_output=True,
+            text=True,
+            timeout=60,
+        )
+
+        assert result.stdout.strip() == "[]", result.stderr
+
+    @pytest.mark.parametrize("args", [
+        ["--list-themes"],
+        ["cache", "stats"],
+        ["--city", "Venice"],
+        [],
+    ])
+    def test_light_commands_skip_heavy_imports(self, args):
+        assert loaded_heavy_modules(args) == []
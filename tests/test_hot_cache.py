@@ -0,0 +1,106 @@
+"""
+Tests for the in-process LRU of map data (hot_cache.py).
+
+These tests verify that:
+1. Entries are weighed by their size and evicted least recently used first
+2. Data larger than the budget is never held, and a zero budget disables the store
+3. Data older than the disk cache's expiry is dropped
+4. Hits, misses and evictions are counted
+"""
+
+import time
+
+import geopandas as gpd
+import numpy as np
+from shapely.geometry import box
+
+from hot_cache import GEOMETRY_OVERHEAD_BYTES, HotLocations, data_nbytes
+from roads import SlimRoads
+
+
+def location(edges):
+    """Map data with `edges` two-point roads (64 bytes of coordinates each)."""
+    coords = np.zeros((2 * edges, 2))
+    roads = SlimRoads(["primary"], np.zeros(edges, dtype=np.uint8), coords, np.arange(0, 2 * edges + 1, 2))
+    return {"graph": roads, "water": None, "parks": None}
+
+
+class TestSizing:
+    """Tests for weighing map data."""
+
+    def test_roads_and_polygons_are_counted(self):
+        data = location(10)
+        roads_bytes = data_nbytes(data)
+        assert roads_bytes == data["graph"].nbytes
+
+        data["water"] = gpd.GeoDataFrame(geometry=[box(0, 0, 1, 1)], crs="epsg:4326")
+        assert data_nbytes(data) == roads_bytes + 5 * 16 + GEOMETRY_OVERHEAD_BYTES
+
+
+class TestEviction:
+    """Tests for the byte budget."""
+
+    def test_least_recently_used_are_evicted_to_fit(self):
+        store = HotLocations(max_bytes=1000)
+        store.put("a", location(1), nbytes=400)
+        store.put("b", location(1), nbytes=400)
+        store.get("a")
+
+        store.put("c", location(1), nbytes=400)
+
+        assert "a" in store and "c" in store and "b" not in store
+        assert store.stats()["bytes"] == 800
+        assert store.stats()["evictions"] == 1
+
+    def test_one_large_entry_can_evict_several_small_ones(self):
+        store = HotLocations(max_bytes=1000)
+        for key in "abcd":
+            store.put(key, location(1), nbytes=200)
+
+        store.put("metro", location(1), nbytes=900)
+
+        assert list(store._entries) == ["metro"]
+        assert store.stats()["evictions"] == 4
+
+    def test_data_over_budget_is_not_held(self):
+        store = HotLocations(max_bytes=1000)
+        store.put("a", location(1), nbytes=400)
+
+        assert store.put("huge", location(1), nbytes=5000) is False
+        assert "huge" not in store and "a" in store
+
+    def test_zero_budget_disables_the_store(self):
+        store = HotLocations(0)
+
+        assert store.put("a", location(1)) is False
+        assert store.get("a") is None
+        assert store.stats()["misses"] == 0
+
+
+class TestExpiry:
+    """Tests for expiring map data with the disk cache."""
+
+    def test_expired_data_is_dropped(self):
+        store = HotLocations(max_bytes=1000, max_age=60)
+        store.put("old", location(1), nbytes=400, cached_at=time.time() - 61)
+        store.put("new", location(1), nbytes=400, cached_at=time.time() - 59)
+
+        assert store.get("old") is None
+        assert store.get("new") is not None
+        assert store.stats()["bytes"] == 400
+
+
+class TestStats:
+    """Tests for the tuning counters."""
+
+    def test_hits_and_misses(self):
+        store = HotLocations(max_bytes=10 ** 6)
+        store.put("a", location(5))
+        store.get("a")
+        store.get("a")
+        store.get("b")
+
+        stats = store.stats()
+        assert (stats["entries"], stats["hits"], stats["misses"]) == (1, 2, 1)
+        assert stats["hit_rate"] == 2 / 3
+        assert stats["bytes"] == data_nbytes(location(5))
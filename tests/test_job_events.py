@@ -0,0 +1,157 @@
+"""
+Tests for waiting on job changes (long-poll and server-sent events).
+
+These tests verify that:
+1. Every job update bumps its version and wakes waiters, including updates from worker threads
+2. A long-poll status request answers as soon as the job changes, or with the unchanged job on timeout
+3. The event stream sends the job's current state, each change and its preview, and ends when the job finishes
+"""
+
+import asyncio
+import json
+import threading
+
+import pytest
+from httpx import AsyncClient, ASGITransport
+
+from app.main import app
+from app.models import JobStatus, PosterRequest
+from app.services import job_manager
+
+
+@pytest.fixture
+def job_id(monkeypatch):
+    monkeypatch.setattr(job_manager, "jobs", {})
+    monkeypatch.setattr(job_manager, "_change_waiters", {})
+    monkeypatch.setattr(job_manager, "_notify_callback", None)
+    monkeypatch.setattr(job_manager, "_preview_callback", None)
+    return job_manager.create_job(PosterRequest(city="Rome", country="Italy"))
+
+
+def api_client():
+    return AsyncClient(transport=ASGITransport(app=app), base_url="http://test")
+
+
+def parse_events(body):
+    """(event, id, data) of each event in a text/event-stream body, skipping comments."""
+    events = []
+    for frame in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in frame.splitlines() if not line.startswith(":"))
+        if fields:
+            events.append((fields["event"], int(fields["id"]), json.loads(fields["data"])))
+    return events
+
+
+class TestWaitForChange:
+    """Tests for job_manager.wait_for_job_change."""
+
+    @pytest.mark.asyncio
+    async def test_wakes_on_update(self, job_id):
+        waiter = asyncio.create_task(job_manager.wait_for_job_change(job_id, 0, 5))
+        await asyncio.sleep(0)
+        job_manager.update_job(job_id, progress=10)
+
+        job = await asyncio.wait_for(waiter, 1)
+
+        assert job["version"] == 1
+        assert job["progress"] == 10
+        assert job_manager._change_waiters == {}
+
+    @pytest.mark.asyncio
+    async def test_times_out_unchanged(self, job_id):
+        job = await job_manager.wait_for_job_change(job_id, 0, 0.01)
+
+        assert job["version"] == 0
+        assert job_manager._change_waiters == {}
+
+    @pytest.mark.asyncio
+    async def test_stale_version_returns_immediately(self, job_id):
+        job_manager.set_job_preview(job_id, "/tmp/preview.png")
+
+        job = await asyncio.wait_for(job_manager.wait_for_job_change(job_id, 0, 5), 0.1)
+
+        assert job["version"] == 1
+
+    @pytest.mark.asyncio
+    async def test_wakes_on_update_from_thread(self, job_id, monkeypatch):
+        monkeypatch.setattr(job_manager, "_main_loop", asyncio.get_running_loop())
+        waiter = asyncio.create_task(job_manager.wait_for_job_change(job_id, 0, 5))
+        await asyncio.sleep(0)
+
+        thread = threading.Thread(target=job_manager.update_job, args=(job_id,), kwargs={"progress": 50})
+        thread.start()
+        job = await asyncio.wait_for(waiter, 1)
+        thread.join()
+
+        assert job["progress"] == 50
+
+
+class TestLongPoll:
+    """Tests for GET /api/jobs/{job_id}?wait=..."""
+
+    @pytest.mark.asyncio
+    async def test_answers_on_change(self, job_id):
+        async def finish():
+            await asyncio.sleep(0.05)
+            job_manager.update_job(job_id, status=JobStatus.COMPLETED, progress=100)
+
+        async with api_client() as client:
+            updater = asyncio.create_task(finish())
+            response = await client.get(f"/api/jobs/{job_id}", params={"wait": 5, "version": 0})
+            await updater
+
+        body = response.json()
+        assert body["status"] == "completed"
+        assert body["version"] == 1
+
+    @pytest.mark.asyncio
+    async def test_times_out_with_current_state(self, job_id):
+        async with api_client() as client:
+            response = await client.get(f"/api/jobs/{job_id}", params={"wait": 0.05, "version": 0})
+
+        assert response.status_code == 200
+        assert response.json()["version"] == 0
+
+    @pytest.mark.asyncio
+    async def test_finished_job_answers_immediately(self, job_id):
+        job_manager.update_job(job_id, status=JobStatus.FAILED, error="boom")
+
+        async with api_client() as client:
+            response = await asyncio.wait_for(client.get(f"/api/jobs/{job_id}", params={"wait": 30}), 1)
+
+        assert response.json()["status"] == "failed"
+
+
+class TestEventStream:
+    """Tests for GET /api/jobs/{job_id}/events."""
+
+    @pytest.mark.asyncio
+    async def test_streams_until_finished(self, job_id):
+        async def render():
+            await asyncio.sleep(0.02)
+            job_manager.update_job(job_id, status=JobStatus.PROCESSING, progress=20, message="Rendering map...")
+            await asyncio.sleep(0.02)
+            job_manager.set_job_preview(job_id, "/tmp/preview.png")
+            await asyncio.sleep(0.02)
+            job_manager.update_job(job_id, status=JobStatus.COMPLETED, progress=100)
+
+        async with api_client() as client:
+            renderer = asyncio.create_task(render())
+            response = await asyncio.wait_for(client.get(f"/api/jobs/{job_id}/events"), 5)
+            await renderer
+
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = parse_events(response.text)
+        assert [(event, version) for event, version, _ in events] == [
+            ("job_update", 0), ("job_update", 1), ("preview", 2), ("job_update", 2), ("job_update", 3),
+        ]
+        assert events[1][2]["message"] == "Rendering map..."
+        assert events[2][2]["preview_url"] == f"/api/posters/{job_id}/preview"
+        assert events[-1][2]["download_url"] == f"/api/posters/{job_id}"
+
+    @pytest.mark.asyncio
+    async def test_unknown_job(self, job_id):
+        async with api_client() as client:
+            response = await client.get("/api/jobs/nope/events")
+
+        assert response.status_code == 404
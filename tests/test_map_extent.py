@@ -0,0 +1,67 @@
+"""
+Tests for the fetched/drawn map extent (create_map_poster.py).
+
+These tests verify that:
+1. The extent follows the poster format's aspect ratio
+2. Each format's data is cached under its own key
+"""
+
+import math
+
+import pytest
+
+import create_map_poster
+from create_map_poster import get_map_bbox, get_map_extent
+
+
+class TestMapExtent:
+    """Tests for get_map_extent and get_map_bbox."""
+
+    @pytest.mark.parametrize("poster_format, expected", [
+        ("portrait", (9000, 12000)),
+        ("landscape", (12000, 9000)),
+        ("square", (12000, 12000)),
+    ])
+    def test_long_side_spans_distance(self, poster_format, expected):
+        assert get_map_extent(12000, poster_format) == pytest.approx(expected)
+
+    def test_bbox_matches_poster_aspect_on_the_ground(self):
+        lat = 60.0
+        west, south, east, north = get_map_bbox((lat, 10.0), get_map_extent(12000, "portrait"))
+
+        ground_width = (east - west) * math.cos(math.radians(lat))
+        ground_height = north - south
+
+        assert ground_width / ground_height == pytest.approx(12 / 16)
+        assert ground_height == pytest.approx(2 * 12000 / 111195, rel=1e-3)
+
+    def test_margin_grows_bbox(self):
+        extent = get_map_extent(1000)
+        west, south, east, north = get_map_bbox((45.4, 12.3), extent)
+        padded = get_map_bbox((45.4, 12.3), extent, margin=0.1)
+
+        assert padded[0] < west and padded[1] < south
+        assert padded[2] > east and padded[3] > north
+
+
+class TestFormatCaching:
+    """Tests that formats with different extents don't share cache entries."""
+
+    def test_formats_use_separate_keys(self, tmp_path, monkeypatch):
+        import cache
+
+        monkeypatch.setattr(cache, "CACHE_DIR", tmp_path)
+        requested = []
+
+        def fake_download(bbox, layers, source):
+            requested.append(bbox)
+            return {name: [name] for name in layers}
+
+        monkeypatch.setattr(create_map_poster, "download_map_data", fake_download)
+
+        for poster_format in ("portrait", "landscape", "portrait"):
+            create_map_poster.fetch_map_data("Venice", "Italy", (45.4, 12.3), 12000, poster_format=poster_format)
+
+        assert len(requested) == 2
+        assert cache.get_cached_meta("venice_italy_12000") is not None
+        assert cache.get_cached_meta("venice_italy_12000_landscape") is not None
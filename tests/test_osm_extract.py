@@ -0,0 +1,169 @@
+"""
+Tests for reading map data from a local OSM extract (osm_extract.py).
+
+These tests verify that:
+1. Roads are read as SlimRoads, cut to the bbox past its edge, with excluded highway types skipped
+2. Water ways and multipolygon relations become clipped polygons with their true outline and holes
+3. Compressed XML extracts are read like plain ones, and .pbf without pyosmium fails clearly
+4. A data source naming the extract routes create_map_poster's downloads and renders to it
+"""
+
+import gzip
+import sys
+
+import pytest
+
+import create_map_poster
+import osm_extract
+
+BBOX = (0.0, 0.0, 1.0, 1.0)
+
+NODES = {
+    1: (0.2, 0.5), 2: (0.5, 0.5), 3: (0.8, 0.5), 4: (1.5, 0.5), 5: (2.0, 2.0),
+    10: (0.6, 0.6), 11: (1.4, 0.6), 12: (1.4, 0.9), 13: (0.6, 0.9),
+    20: (0.1, 0.1), 21: (0.4, 0.1), 22: (0.4, 0.4), 23: (0.1, 0.4),
+    30: (0.2, 0.2), 31: (0.3, 0.2), 32: (0.3, 0.3), 33: (0.2, 0.3),
+}
+
+WAYS = {
+    100: ([1, 2, 3, 4], {"highway": "primary"}),
+    101: ([1, 2], {"highway": "construction"}),
+    102: ([4, 5], {"highway": "residential"}),
+    200: ([10, 11, 12, 13, 10], {"natural": "water"}),
+    301: ([20, 21, 22, 23, 20], {}),
+    302: ([30, 31, 32, 33, 30], {}),
+}
+
+RELATIONS = {
+    300: ([("way", 301, "outer"), ("way", 302, "inner")], {"type": "multipolygon", "leisure": "park"}),
+}
+
+POLYGON_TAGS = {"water": create_map_poster.WATER_TAGS, "parks": create_map_poster.PARK_TAGS}
+
+
+# The area the test extract declares it covers
+BOUNDS = (-1.0, -1.0, 3.0, 3.0)
+
+
+def osm_xml(nodes=NODES, ways=WAYS, relations=RELATIONS, bounds=BOUNDS):
+    def tags_xml(tags):
+        return "".join(f'<tag k="{k}" v="{v}"/>' for k, v in tags.items())
+
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<osm version="0.6">']
+    if bounds:
+        west, south, east, north = bounds
+        lines.append(f'<bounds minlon="{west}" minlat="{south}" maxlon="{east}" maxlat="{north}"/>')
+    lines += [f'<node id="{i}" lon="{lon}" lat="{lat}"/>' for i, (lon, lat) in nodes.items()]
+    for i, (refs, tags) in ways.items():
+        nds = "".join(f'<nd ref="{ref}"/>' for ref in refs)
+        lines.append(f'<way id="{i}">{nds}{tags_xml(tags)}</way>')
+    for i, (members, tags) in relations.items():
+        xml = "".join(f'<member type="{t}" ref="{ref}" role="{role}"/>' for t, ref, role in members)
+        lines.append(f'<relation id="{i}">{xml}{tags_xml(tags)}</relation>')
+    lines.append("</osm>")
+    return "\n".join(lines)
+
+
+@pytest.fixture
+def extract(tmp_path):
+    path = tmp_path / "area.osm"
+    path.write_text(osm_xml())
+    return str(path)
+
+
+class TestRoads:
+    """Tests for the street network read from an extract."""
+
+    def test_roads_are_cut_to_the_bbox(self, extract):
+        data = osm_extract.read_extract(extract, BBOX, ["graph"], POLYGON_TAGS)
+
+        roads = data["graph"]
+        assert roads.edge_highways() == ["primary"]
+        # Up to the first node past the edge, so the road runs off the poster
+        assert [line.tolist() for line in roads.lines()] == [[[0.2, 0.5], [0.5, 0.5], [0.8, 0.5], [1.5, 0.5]]]
+
+    def test_sparse_roads_reach_past_the_edge(self, tmp_path):
+        nodes = {
+            1: (-2.0, 0.75), 2: (0.5, 0.75), 3: (3.0, 0.75),
+            # 11 -> 12 leaves the bbox at both ends but crosses its corner
+            10: (0.3, 0.95), 11: (0.7, 1.2), 12: (1.2, 0.7), 13: (0.9, 0.15),
+        }
+        ways = {100: ([1, 2, 3], {"highway": "primary"}), 101: ([10, 11, 12, 13], {"highway": "tertiary"})}
+        path = tmp_path / "sparse.osm"
+        path.write_text(osm_xml(nodes, ways, {}))
+
+        roads = osm_extract.read_extract(str(path), BBOX, ["graph"], POLYGON_TAGS)["graph"]
+
+        assert [line.tolist() for line in roads.lines()] == [
+            [[-2.0, 0.75], [0.5, 0.75], [3.0, 0.75]],
+            [[0.3, 0.95], [0.7, 1.2], [1.2, 0.7], [0.9, 0.15]],
+        ]
+
+    def test_only_requested_layers_are_read(self, extract):
+        assert set(osm_extract.read_extract(extract, BBOX, ["graph"], POLYGON_TAGS)) == {"graph"}
+        assert set(osm_extract.read_extract(extract, BBOX, ["water"], POLYGON_TAGS)) == {"water"}
+
+
+class TestPolygons:
+    """Tests for water and park polygons read from an extract."""
+
+    def test_water_keeps_its_outline_beyond_the_bbox(self, extract):
+        water = osm_extract.read_extract(extract, BBOX, ["water"], POLYGON_TAGS)["water"]
+
+        assert list(water.columns) == ["geometry"]
+        assert water.total_bounds.tolist() == pytest.approx([0.6, 0.6, 1.0, 0.9])
+        assert sum(g.area for g in water.geometry) == pytest.approx(0.4 * 0.3)
+
+    def test_multipolygon_relation_keeps_its_hole(self, extract):
+        parks = osm_extract.read_extract(extract, BBOX, ["parks"], POLYGON_TAGS)["parks"]
+
+        assert len(parks) == 1
+        assert sum(g.area for g in parks.geometry) == pytest.approx(0.3 * 0.3 - 0.1 * 0.1)
+
+    def test_layer_without_features_is_none(self, extract):
+        data = osm_extract.read_extract(extract, (5.0, 5.0, 6.0, 6.0), ["water", "parks"], POLYGON_TAGS)
+
+        assert data == {"water": None, "parks": None}
+
+
+class TestFormats:
+    """Tests for the supported extract formats."""
+
+    def test_gzipped_xml(self, tmp_path):
+        path = tmp_path / "area.osm.gz"
+        with gzip.open(path, "wt") as f:
+            f.write(osm_xml())
+
+        data = osm_extract.read_extract(str(path), BBOX, ["graph"], POLYGON_TAGS)
+
+        assert len(data["graph"]) == 1
+
+    def test_pbf_without_pyosmium_is_a_clear_error(self, tmp_path, monkeypatch):
+        path = tmp_path / "area.osm.pbf"
+        path.write_bytes(b"")
+        monkeypatch.setitem(sys.modules, "osmium", None)
+
+        with pytest.raises(RuntimeError, match="pyosmium"):
+            osm_extract.read_extract(str(path), BBOX, ["graph"], POLYGON_TAGS)
+
+    def test_missing_extract(self, tmp_path):
+        with pytest.raises(FileNotFoundError):
+            osm_extract.read_extract(str(tmp_path / "missing.osm"), BBOX, ["graph"], POLYGON_TAGS)
+
+
+class TestDataSource:
+    """Tests for selecting the extract in create_map_poster."""
+
+    def test_download_map_data_reads_the_extract(self, extract):
+        data = create_map_poster.download_map_data(BBOX, source=extract)
+
+        assert set(data) == set(create_map_poster.LAYERS)
+        assert len(data["graph"]) == 1
+        assert data["water"] is not None and data["parks"] is not None
+
+    def test_fetch_map_data_reads_the_given_source(self, extract):
+        data = create_map_poster.fetch_map_data("Nowhere", "Atlantis", (0.5, 0.5), 60000, use_cache=False,
+                                                data_source=extract)
+
+        assert len(data["graph"]) == 1
+        assert data["from_cache"] is False
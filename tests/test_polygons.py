@@ -0,0 +1,51 @@
+"""
+Tests for viewport clipping of water and park layers (polygons.py).
+
+These tests verify that:
+1. Polygons are cut to the viewport and features outside it are dropped
+2. Non-polygon features and OSM tags are not kept
+"""
+
+import pytest
+
+gpd = pytest.importorskip("geopandas")
+from shapely.geometry import LineString, Point, box
+
+from polygons import clip_polygons
+
+BBOX = (12.0, 45.0, 13.0, 46.0)
+
+
+def features(*geometries):
+    return gpd.GeoDataFrame(
+        {"name": [f"feature {i}" for i in range(len(geometries))]},
+        geometry=list(geometries),
+        crs="epsg:4326",
+    )
+
+
+class TestClipPolygons:
+    """Tests for clip_polygons."""
+
+    def test_cuts_polygons_to_bbox(self):
+        sea = box(12.5, 44.0, 14.0, 45.5)
+
+        clipped = clip_polygons(features(sea), BBOX)
+
+        assert clipped.total_bounds.tolist() == [12.5, 45.0, 13.0, 45.5]
+
+    def test_drops_features_outside_bbox(self):
+        clipped = clip_polygons(features(box(12.1, 45.1, 12.2, 45.2), box(20, 20, 21, 21)), BBOX)
+
+        assert len(clipped) == 1
+
+    def test_keeps_only_polygon_geometry(self):
+        clipped = clip_polygons(features(box(12.1, 45.1, 12.2, 45.2), Point(12.5, 45.5), LineString([(12, 45), (13, 46)])), BBOX)
+
+        assert list(clipped.columns) == ["geometry"]
+        assert list(clipped.geometry.type) == ["Polygon"]
+
+    def test_nothing_inside_returns_none(self):
+        assert clip_polygons(features(box(20, 20, 21, 21)), BBOX) is None
+        assert clip_polygons(None, BBOX) is None
+
@@ -0,0 +1,226 @@
+"""
+Tests for supervising poster generation (app/services/poster_generator.py).
+
+These tests verify that:
+1. Generator output is streamed into job progress as it is printed
+2. Timed-out generators are killed along with everything they spawned
+3. POST /api/jobs/{job_id}/cancel stops a running generation immediately
+4. Generators growing past their memory limit are stopped, and jobs too big to run fail cleanly
+"""
+
+import asyncio
+import os
+import textwrap
+import time
+
+import pytest
+from httpx import AsyncClient, ASGITransport
+
+from app.main import app
+from app.config import settings
+from app.models import JobStatus, PosterRequest
+from app.services import job_manager, poster_generator
+from app.services.scheduler import BASE_BYTES, JobScheduler
+
+FAKE_GENERATOR = """
+import os, subprocess, sys, time
+
+args = sys.argv[1:]
+output = args[args.index("--output") + 1]
+preview = args[args.index("--preview-output") + 1]
+if os.environ.get("FAKE_ARGS"):
+    open(os.environ["FAKE_ARGS"], "w").write(" ".join(args))
+print("Looking up coordinates...")
+print("Checking cache for rome_italy_12000...")
+print("✓ Cache hit! Using cached data from today")
+open(preview, "wb").write(b"preview")
+print("PREVIEW_READY " + preview)
+if os.environ.get("FAKE_GROW_MB"):
+    ballast = bytearray(int(os.environ["FAKE_GROW_MB"]) * 1024 * 1024)
+    time.sleep(60)
+if os.environ.get("FAKE_HANG"):
+    child = subprocess.Popen(["sleep", "60"])
+    open(os.environ["FAKE_HANG"], "w").write(str(child.pid))
+    time.sleep(60)
+print("Rendering map...")
+open(output, "wb").write(b"poster")
+print("Saving to " + output + "...")
+print("✓ Done! Poster saved as " + output)
+"""
+
+
+def is_alive(pid, timeout=2):
+    """True if pid is still running after timeout (signalled processes take a moment to die)."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            os.kill(pid, 0)
+            # Unreaped zombies report state Z
+            with open(f"/proc/{pid}/stat") as f:
+                if f.read().split(")")[-1].split()[0] == "Z":
+                    return False
+        except (ProcessLookupError, FileNotFoundError):
+            return False
+        if time.monotonic() > deadline:
+            return True
+        time.sleep(0.05)
+
+
+@pytest.fixture
+def generator_env(tmp_path, monkeypatch):
+    """A fake create_map_poster.py, isolated data dir and job history."""
+    (tmp_path / "create_map_poster.py").write_text(textwrap.dedent(FAKE_GENERATOR))
+    monkeypatch.setattr(settings, "maptoposter_dir", tmp_path)
+    monkeypatch.setattr(settings, "data_dir", tmp_path / "data")
+    (tmp_path / "data").mkdir()
+    monkeypatch.setattr(job_manager, "jobs", {})
+    monkeypatch.setattr(poster_generator, "KILL_GRACE_SECONDS", 1)
+    monkeypatch.setattr(poster_generator, "scheduler", JobScheduler(64 * 1024 ** 3))
+
+    updates = []
+    original_update = job_manager.update_job
+
+    def record_update(job_id, **kwargs):
+        updates.append(kwargs)
+        original_update(job_id, **kwargs)
+
+    monkeypatch.setattr(poster_generator, "update_job", record_update)
+    return tmp_path, updates
+
+
+def new_job():
+    request = PosterRequest(city="Rome", country="Italy", theme="noir")
+    return job_manager.create_job(request), request
+
+
+class TestProgressStages:
+    """Tests for mapping generator output to progress."""
+
+    def test_known_lines_map_to_stages(self):
+        assert poster_generator.match_progress_stage("✓ Cache hit! Using cached data")[0] == 40
+        assert poster_generator.match_progress_stage("PREVIEW_READY /tmp/x.png")[0] == 50
+        assert poster_generator.match_progress_stage("✓ Loaded theme: Noir") is None
+
+
+class TestSupervisor:
+    """Tests for running, timing out and cancelling generators."""
+
+    @pytest.mark.asyncio
+    async def test_output_streams_into_progress(self, generator_env):
+        tmp_path, updates = generator_env
+        job_id, request = new_job()
+
+        await poster_generator.generate_poster_task(job_id, request)
+
+        job = job_manager.get_job(job_id)
+        assert job["status"] == JobStatus.COMPLETED
+        assert job["preview_file"] == str(tmp_path / "data" / f"{job_id}.preview.png")
+        assert (tmp_path / "data" / f"{job_id}.png").read_bytes() == b"poster"
+        progress = [u["progress"] for u in updates if "progress" in u]
+        assert progress == sorted(progress)
+        assert {10, 15, 40, 50, 60, 85, 95, 100} <= set(progress)
+
+    @pytest.mark.asyncio
+    async def test_concurrent_jobs_keep_their_own_posters(self, generator_env):
+        tmp_path, _ = generator_env
+        jobs = [new_job() for _ in range(2)]
+
+        await asyncio.gather(*(poster_generator.generate_poster_task(job_id, request) for job_id, request in jobs))
+
+        for job_id, _ in jobs:
+            job = job_manager.get_job(job_id)
+            assert job["status"] == JobStatus.COMPLETED
+            assert job["result_file"] == str(tmp_path / "data" / f"{job_id}.png")
+            assert (tmp_path / "data" / f"{job_id}.png").exists()
+
+    @pytest.mark.asyncio
+    async def test_print_quality_renders_at_full_resolution(self, generator_env, monkeypatch):
+        tmp_path, _ = generator_env
+        monkeypatch.setenv("FAKE_ARGS", str(tmp_path / "args"))
+        request = PosterRequest(city="Rome", country="Italy", theme="noir", quality="print")
+        job_id = job_manager.create_job(request)
+
+        await poster_generator.generate_poster_task(job_id, request)
+
+        job = job_manager.get_job(job_id)
+        assert job["status"] == JobStatus.COMPLETED
+        assert job["job_class"] == "print"
+        assert job["queue_wait_seconds"] is not None
+        assert "--preview " not in (tmp_path / "args").read_text() + " "
+
+    @pytest.mark.asyncio
+    async def test_timeout_kills_process_group(self, generator_env, monkeypatch):
+        tmp_path, _ = generator_env
+        pid_file = tmp_path / "child.pid"
+        monkeypatch.setenv("FAKE_HANG", str(pid_file))
+        monkeypatch.setattr(poster_generator, "GENERATION_TIMEOUT_SECONDS", 2)
+        job_id, request = new_job()
+
+        await poster_generator.generate_poster_task(job_id, request)
+
+        job = job_manager.get_job(job_id)
+        assert job["status"] == JobStatus.FAILED
+        assert "timed out" in job["error"]
+        assert not is_alive(int(pid_file.read_text()))
+
+    @pytest.mark.asyncio
+    async def test_cancel_endpoint_kills_running_generator(self, generator_env, monkeypatch):
+        tmp_path, _ = generator_env
+        pid_file = tmp_path / "child.pid"
+        monkeypatch.setenv("FAKE_HANG", str(pid_file))
+        job_id, request = new_job()
+        poster_generator.start_poster_job(job_id, request)
+        for _ in range(200):
+            if pid_file.exists() and pid_file.read_text():
+                break
+            await asyncio.sleep(0.05)
+
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.post(f"/api/jobs/{job_id}/cancel")
+            repeat = await client.post(f"/api/jobs/{job_id}/cancel")
+
+        assert response.status_code == 200
+        assert response.json()["status"] == "cancelled"
+        assert repeat.status_code == 409
+        assert job_id not in poster_generator._running
+        assert not is_alive(int(pid_file.read_text()))
+
+    @pytest.mark.asyncio
+    async def test_cancel_pending_job(self, generator_env):
+        job_id, _ = new_job()
+
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.post(f"/api/jobs/{job_id}/cancel")
+            missing = await client.post("/api/jobs/nope/cancel")
+
+        assert response.json()["status"] == "cancelled"
+        assert missing.status_code == 404
+
+
+class TestMemoryLimits:
+    """Tests for jobs that don't fit in memory."""
+
+    @pytest.mark.asyncio
+    async def test_generator_over_limit_is_stopped(self, generator_env, monkeypatch):
+        tmp_path, _ = generator_env
+        monkeypatch.setenv("FAKE_GROW_MB", "200")
+        monkeypatch.setattr(poster_generator, "RSS_POLL_SECONDS", 0.05)
+        cmd = ["python3", str(tmp_path / "create_map_poster.py"), "--output", str(tmp_path / "out.png"),
+               "--preview-output", str(tmp_path / "p.png")]
+
+        with pytest.raises(poster_generator.MemoryLimitExceeded, match="100 MB memory limit"):
+            await asyncio.wait_for(
+                poster_generator._run_generator("job", cmd, tmp_path / "p.png", 100 * 1024 * 1024), timeout=30
+            )
+
+    @pytest.mark.asyncio
+    async def test_refused_job_fails_without_running(self, generator_env, monkeypatch):
+        monkeypatch.setattr(poster_generator, "scheduler", JobScheduler(BASE_BYTES))
+        request = PosterRequest(city="Rome", country="Italy", size="region")
+        job_id = job_manager.create_job(request)
+
+        await poster_generator.generate_poster_task(job_id, request)
+
+        job = job_manager.get_job(job_id)
+        assert job["status"] == JobStatus.FAILED
+        assert "smaller size" in job["error"]
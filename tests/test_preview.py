@@ -0,0 +1,118 @@
+"""
+Tests for quick poster previews.
+
+These tests verify that:
+1. Short edges are dropped when roads are simplified for a preview
+2. create_poster writes the preview and announces it before the full render
+3. The API records, announces and serves a job's preview
+"""
+
+import asyncio
+
+import networkx as nx
+import numpy as np
+import pytest
+from httpx import AsyncClient, ASGITransport
+
+pytest.importorskip("matplotlib")
+
+import cache
+import create_map_poster
+from app.main import app
+from app.services import job_manager
+from roads import SlimRoads, slim_graph
+
+POINT = (45.4371908, 12.3345898)
+
+
+@pytest.fixture
+def poster_env(tmp_path, monkeypatch):
+    """Temporary cache and a fake OSM download."""
+    monkeypatch.setattr(cache, "CACHE_DIR", tmp_path / "cache")
+
+    G = nx.MultiDiGraph(crs="epsg:4326")
+    G.add_node(1, x=POINT[1] - 0.01, y=POINT[0])
+    G.add_node(2, x=POINT[1] + 0.01, y=POINT[0])
+    G.add_edge(1, 2, highway="primary")
+
+    def fake_download(bbox, layers, source):
+        return {"graph": slim_graph(G), "water": None, "parks": None}
+
+    monkeypatch.setattr(create_map_poster, "download_map_data", fake_download)
+    return tmp_path
+
+
+@pytest.fixture
+def clean_jobs(monkeypatch):
+    """Isolate job history."""
+    monkeypatch.setattr(job_manager, "jobs", {})
+
+
+class TestSimplifiedRoads:
+    """Tests for dropping sub-pixel edges."""
+
+    def test_edges_smaller_than_tolerance_are_dropped(self):
+        coords = np.array([[0, 0], [1, 0], [5, 5], [5.1, 5.1], [5.1, 5.2], [8, 0], [8, 3]], dtype=np.float64)
+        roads = SlimRoads(["primary", "residential"], np.array([0, 1, 1], dtype=np.uint8),
+                          coords, np.array([0, 2, 5, 7]))
+
+        simplified = roads.simplified(0.5)
+
+        assert len(simplified) == 2
+        assert simplified.edge_highways() == ["primary", "residential"]
+        assert [len(line) for line in simplified.lines()] == [2, 2]
+        assert simplified.offsets.tolist() == [0, 2, 4]
+
+
+class TestQuickPreview:
+    """Tests for writing the preview during create_poster."""
+
+    def test_preview_is_written_and_announced(self, poster_env, capsys):
+        output = poster_env / "poster.png"
+        preview = poster_env / "poster.preview.png"
+
+        create_map_poster.create_poster("Venice", "Italy", POINT, 2000, str(output),
+                                        create_map_poster.load_theme("noir"), preview=True,
+                                        preview_output=str(preview))
+
+        out = capsys.readouterr().out
+        assert preview.exists() and output.exists()
+        assert f"{create_map_poster.PREVIEW_MARKER} {preview}" in out
+        assert out.index(create_map_poster.PREVIEW_MARKER) < out.index("Done! Poster saved")
+
+
+class TestPreviewEndpoint:
+    """Tests for job previews in the API."""
+
+    def test_set_job_preview_notifies_clients(self, clean_jobs, monkeypatch):
+        sent = []
+
+        async def notify(job_id, preview_url):
+            sent.append((job_id, preview_url))
+
+        loop = asyncio.new_event_loop()
+        monkeypatch.setattr(job_manager, "_main_loop", loop)
+        monkeypatch.setattr(job_manager, "_preview_callback", notify)
+        job_manager.jobs["abc"] = {"preview_file": None}
+
+        job_manager.set_job_preview("abc", "/tmp/abc.preview.png")
+        loop.run_until_complete(asyncio.sleep(0))
+        loop.close()
+
+        assert job_manager.jobs["abc"]["preview_file"] == "/tmp/abc.preview.png"
+        assert sent == [("abc", "/api/posters/abc/preview")]
+
+    @pytest.mark.asyncio
+    async def test_preview_is_served_once_available(self, clean_jobs, tmp_path):
+        preview = tmp_path / "abc.preview.png"
+        preview.write_bytes(b"\x89PNG")
+        job_manager.jobs["abc"] = {"preview_file": None}
+
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            missing = await client.get("/api/posters/abc/preview")
+            job_manager.jobs["abc"]["preview_file"] = str(preview)
+            found = await client.get("/api/posters/abc/preview")
+
+        assert missing.status_code == 404
+        assert found.status_code == 200
+        assert found.content == b"\x89PNG"
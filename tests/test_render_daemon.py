@@ -0,0 +1,140 @@
+"""
+Tests for the JSON-lines render daemon (render_daemon.py).
+
+These tests verify that:
+1. Requests are answered with log events and a done event per job
+2. Bad requests fail only their own job and the daemon keeps serving
+3. Map data of recent locations stays in memory between requests, with counters reported
+4. `create_map_poster.py --serve` starts, reports ready and exits on EOF
+"""
+
+import io
+import json
+import subprocess
+import sys
+
+import networkx as nx
+import pytest
+
+pytest.importorskip("matplotlib")
+
+import cache
+import create_map_poster
+import render_daemon
+from hot_cache import HotLocations
+from shared_cache import SharedLocations
+from roads import slim_graph
+from tests.test_cli_startup import REPO_DIR
+
+POINT = (45.4371908, 12.3345898)
+
+
+@pytest.fixture
+def daemon_env(tmp_path, monkeypatch):
+    """Temporary cache, no geocoding or OSM downloads, and an empty hot store."""
+    monkeypatch.setattr(cache, "CACHE_DIR", tmp_path / "cache")
+    monkeypatch.setattr(render_daemon, "warm_up", lambda: None)
+    # serve() sets the hot store's budget; a fresh, disabled one keeps tests apart
+    monkeypatch.setattr(create_map_poster, "hot_locations", HotLocations(0))
+    monkeypatch.setattr(create_map_poster, "shared_locations", SharedLocations(tmp_path / "shared"))
+    monkeypatch.setattr(create_map_poster, "get_coordinates", lambda city, country: (POINT, None))
+
+    G = nx.MultiDiGraph(crs="epsg:4326")
+    G.add_node(1, x=POINT[1] - 0.01, y=POINT[0])
+    G.add_node(2, x=POINT[1] + 0.01, y=POINT[0])
+    G.add_edge(1, 2, highway="primary")
+    monkeypatch.setattr(create_map_poster, "download_map_data",
+                        lambda bbox, layers, source: {"graph": slim_graph(G), "water": None, "parks": None})
+    return tmp_path
+
+
+def run_daemon(*requests):
+    """Feed requests to an in-process daemon and return its events."""
+    stdin = io.StringIO("".join(json.dumps(r) + "\n" for r in requests))
+    stdout = io.StringIO()
+    assert render_daemon.serve(stdin, stdout) == 0
+    return [json.loads(line) for line in stdout.getvalue().splitlines()]
+
+
+def job(tmp_path, job_id, **kwargs):
+    return {"id": job_id, "city": "Venice", "country": "Italy", "size": "neighborhood", "preview": True,
+            "output": str(tmp_path / f"{job_id}.png"), **kwargs}
+
+
+class TestRenderDaemon:
+    """Tests for the request/event protocol."""
+
+    def test_render_request_streams_log_and_done(self, daemon_env):
+        events = run_daemon(job(daemon_env, "a", theme="noir"))
+
+        assert events[0]["event"] == "ready"
+        done = events[-1]
+        assert (done["id"], done["event"], done["output"]) == ("a", "done", str(daemon_env / "a.png"))
+        lines = [e["line"] for e in events if e["event"] == "log"]
+        assert any(line.startswith("Rendering map") for line in lines)
+        assert (daemon_env / "a.png").exists()
+
+    def test_failed_request_does_not_stop_the_daemon(self, daemon_env):
+        events = run_daemon(
+            job(daemon_env, "bad", theme="no_such_theme"),
+            {"id": "empty"},
+            job(daemon_env, "good"),
+        )
+
+        results = [e for e in events if e["event"] in ("done", "error")]
+        assert [(e["id"], e["event"]) for e in results] == [("bad", "error"), ("empty", "error"), ("good", "done")]
+        assert "no_such_theme" in results[0]["error"]
+
+    def test_invalid_json_is_reported(self, daemon_env):
+        stdout = io.StringIO()
+        render_daemon.serve(io.StringIO("not json\n"), stdout)
+
+        assert json.loads(stdout.getvalue().splitlines()[-1])["event"] == "error"
+
+    def test_repeat_location_skips_the_disk_cache(self, daemon_env, monkeypatch):
+        loads = []
+        original_load_layers = create_map_poster.load_layers
+
+        def counting_load_layers(*args, **kwargs):
+            loads.append(args[0])
+            return original_load_layers(*args, **kwargs)
+
+        monkeypatch.setattr(create_map_poster, "load_layers", counting_load_layers)
+
+        run_daemon(job(daemon_env, "a", theme="noir"))
+        loads_after_first = len(loads)
+        # A different theme misses the base map cache, so map data is needed again
+        events = run_daemon(job(daemon_env, "b", theme="blueprint"))
+
+        assert events[-1]["event"] == "done"
+        assert len(loads) == loads_after_first
+        assert any("held in memory" in e["line"] for e in events if e["event"] == "log")
+        assert events[-1]["hot_cache"]["hits"] == 1
+
+    def test_stats_command_reports_hot_cache(self, daemon_env):
+        events = run_daemon(job(daemon_env, "a"), {"id": "s", "command": "stats"})
+
+        stats = events[-1]
+        assert stats["event"] == "stats"
+        assert stats["hot_cache"]["entries"] == 1
+        assert stats["hot_cache"]["misses"] == 1
+        assert stats["shared_cache"]["entries"] == 1
+        assert 0 < stats["shared_cache"]["bytes"] <= stats["shared_cache"]["max_bytes"]
+
+
+class TestServeCommand:
+    """Tests for running the daemon through the CLI."""
+
+    def test_serve_reports_ready_and_exits_on_eof(self):
+        result = subprocess.run(
+            [sys.executable, "create_map_poster.py", "--serve"],
+            cwd=REPO_DIR,
+            input="",
+            capture_output=True,
+            text=True,
+            timeout=120,
+        )
+
+        assert result.returncode == 0, result.stderr
+        events = [json.loads(line) for line in result.stdout.splitlines()]
+        assert events[0]["event"] == "ready"
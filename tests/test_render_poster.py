@@ -0,0 +1,75 @@
+"""
+Tests for the in-process rendering API (create_map_poster.render_poster).
+
+These tests verify that:
+1. A poster can be rendered to PNG bytes in memory
+2. Rendering leaves no pyplot state behind
+3. Posters with different themes render concurrently from threads
+"""
+
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+import networkx as nx
+import pytest
+
+pytest.importorskip("matplotlib")
+
+import create_map_poster
+from create_map_poster import RenderRequest, render_poster
+from roads import slim_graph
+
+POINT = (45.4371908, 12.3345898)
+
+
+def map_data():
+    G = nx.MultiDiGraph(crs="epsg:4326")
+    G.add_node(1, x=POINT[1] - 0.01, y=POINT[0] - 0.01)
+    G.add_node(2, x=POINT[1] + 0.01, y=POINT[0] + 0.01)
+    G.add_node(3, x=POINT[1] + 0.01, y=POINT[0] - 0.01)
+    G.add_edge(1, 2, highway="primary")
+    G.add_edge(2, 3, highway="residential")
+    return {"graph": slim_graph(G), "water": None, "parks": None}
+
+
+def request(theme_name, **kwargs):
+    return RenderRequest(
+        city="Venice", country="Italy", point=POINT, dist=2000, dpi=36,
+        theme=create_map_poster.load_theme(theme_name), fonts=create_map_poster.load_fonts(),
+        map_data=map_data(), **kwargs,
+    )
+
+
+class TestRenderPoster:
+    """Tests for render_poster."""
+
+    def test_returns_png_bytes(self):
+        from PIL import Image
+
+        png = render_poster(request("noir"))
+
+        assert png.startswith(b"\x89PNG")
+        assert Image.open(io.BytesIO(png)).size == (12 * 36, 16 * 36)
+
+    def test_writes_to_path(self, tmp_path):
+        output = tmp_path / "poster.png"
+
+        assert render_poster(request("noir"), str(output)) == str(output)
+        assert output.read_bytes() == render_poster(request("noir"))
+
+    def test_leaves_no_pyplot_figures(self):
+        import matplotlib.pyplot as plt
+
+        render_poster(request("noir", title="La Serenissima"))
+
+        assert plt.get_fignums() == []
+
+    def test_concurrent_renders_match_sequential(self):
+        themes = ["noir", "blueprint", "sunset", "forest"]
+        expected = [render_poster(request(name)) for name in themes]
+
+        with ThreadPoolExecutor(max_workers=len(themes)) as pool:
+            results = list(pool.map(lambda name: render_poster(request(name)), themes))
+
+        assert results == expected
+        assert len(set(results)) == len(themes)
@@ -0,0 +1,83 @@
+"""
+Tests for the render-only street network (roads.py).
+
+These tests verify that:
+1. Slimming keeps one polyline and highway type per graph edge
+2. Slimmed networks survive the cache and draw as one collection in a latitude-corrected frame
+"""
+
+import pickle
+
+import networkx as nx
+import numpy as np
+import pytest
+from shapely.geometry import LineString
+
+from roads import SlimRoads, frame_axes, road_collection, slim_graph
+
+
+@pytest.fixture
+def graph():
+    G = nx.MultiDiGraph(crs="epsg:4326")
+    G.add_node(1, x=12.30, y=45.40, street_count=3)
+    G.add_node(2, x=12.31, y=45.40, street_count=1)
+    G.add_node(3, x=12.31, y=45.42, street_count=1)
+    G.add_edge(1, 2, highway="primary", osmid=[10, 11], name="Via Garibaldi", lanes="2", length=780.0)
+    G.add_edge(2, 3, highway=["residential", "service"], osmid=12, length=2200.0,
+               geometry=LineString([(12.31, 45.40), (12.32, 45.41), (12.31, 45.42)]))
+    G.add_edge(3, 1, osmid=13, length=2500.0)
+    return G
+
+
+class TestSlimGraph:
+    """Tests for reducing osmnx graphs to SlimRoads."""
+
+    def test_interns_highway_types(self, graph):
+        roads = slim_graph(graph)
+
+        assert len(roads) == 3
+        assert roads.highways == ("primary", "residential", "unclassified")
+        assert roads.codes.dtype.itemsize == 1
+        assert roads.edge_highways() == ["primary", "residential", "unclassified"]
+
+    def test_keeps_geometry_or_end_nodes(self, graph):
+        lines = slim_graph(graph).lines()
+
+        assert lines[0].tolist() == [[12.30, 45.40], [12.31, 45.40]]
+        assert lines[1].tolist() == [[12.31, 45.40], [12.32, 45.41], [12.31, 45.42]]
+        assert lines[2].tolist() == [[12.31, 45.42], [12.30, 45.40]]
+
+    def test_slimming_is_idempotent(self, graph):
+        roads = slim_graph(graph)
+
+        assert slim_graph(roads) is roads
+
+    def test_pickles_smaller_than_graph(self, graph):
+        roads = slim_graph(graph)
+        restored = pickle.loads(pickle.dumps(roads))
+
+        assert isinstance(restored, SlimRoads)
+        assert restored.highways == roads.highways
+        assert restored.coords.tolist() == roads.coords.tolist()
+        assert len(pickle.dumps(roads)) < len(pickle.dumps(graph))
+
+
+class TestDrawRoads:
+    """Tests for drawing SlimRoads."""
+
+    def test_collection_in_frame(self, graph):
+        matplotlib = pytest.importorskip("matplotlib")
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+
+        fig, ax = plt.subplots()
+        ax.add_collection(road_collection(slim_graph(graph), ["red"] * 3, [1.0] * 3))
+        frame_axes(ax, (12.2996, 45.3996, 12.3204, 45.4204))
+
+        assert len(ax.collections) == 1
+        assert len(ax.collections[0].get_segments()) == 3
+        assert ax.get_xlim() == pytest.approx((12.2996, 12.3204))
+        assert ax.get_ylim() == pytest.approx((45.3996, 45.4204))
+        assert ax.get_aspect() == pytest.approx(1 / np.cos(np.deg2rad(45.41)))
+        assert not ax.get_xaxis().get_visible()
+        plt.close(fig)
@@ -0,0 +1,145 @@
+"""
+Tests for routing queued jobs to render workers by location.
+
+These tests verify that:
+1. Locations hash to the same worker every time, and are spread over the fleet
+2. Adding or removing a worker only moves the locations it gains or loses
+3. Jobs are queued for their location's worker, spilling over to the next when it is saturated
+4. Workers take their own jobs first, and the jobs of workers that leave go to the others
+"""
+
+import socket
+import time
+
+import pytest
+
+from app.services import job_manager
+from app.services.broker import InProcessBroker
+from app.services.routing import HashRing, location_key
+
+LOCATIONS = [f"city_{i}_country" for i in range(2000)]
+
+
+@pytest.fixture
+def broker(monkeypatch):
+    """A fresh shared broker and worker ring."""
+    shared = InProcessBroker()
+    monkeypatch.setattr(job_manager, "_broker", shared)
+    monkeypatch.setattr(job_manager, "_ring", HashRing())
+    return shared
+
+
+def owners(ring):
+    return {location: ring.preference(location)[0] for location in LOCATIONS}
+
+
+class TestHashRing:
+    """Tests for the consistent hash ring."""
+
+    def test_location_key_is_normalized(self):
+        assert location_key("New York", "USA", "New York") == location_key("new york", "usa", "new york")
+        assert location_key("Paris", "France") != location_key("Paris", "USA")
+
+    def test_same_key_same_worker(self):
+        first = HashRing(["a", "b", "c"])
+        second = HashRing(["c", "a", "b"])
+
+        assert owners(first) == owners(second)
+
+    def test_locations_spread_over_workers(self):
+        counts = {}
+        for owner in owners(HashRing(["a", "b", "c", "d"])).values():
+            counts[owner] = counts.get(owner, 0) + 1
+
+        assert set(counts) == {"a", "b", "c", "d"}
+        assert min(counts.values()) > len(LOCATIONS) / 4 * 0.5
+
+    def test_adding_a_worker_moves_only_its_share(self):
+        ring = HashRing(["a", "b", "c", "d"])
+        before = owners(ring)
+
+        ring.add("e")
+        after = owners(ring)
+
+        moved = [location for location in LOCATIONS if before[location] != after[location]]
+        assert all(after[location] == "e" for location in moved)
+        assert len(moved) < len(LOCATIONS) / 5 * 1.5
+
+    def test_removing_a_worker_moves_only_its_locations(self):
+        ring = HashRing(["a", "b", "c", "d"])
+        before = owners(ring)
+
+        ring.remove("b")
+        after = owners(ring)
+
+        assert all(after[location] == before[location] for location in LOCATIONS if before[location] != "b")
+        assert "b" not in after.values()
+
+    def test_preference_lists_each_worker_once(self):
+        ring = HashRing(["a", "b", "c"])
+
+        assert sorted(ring.preference("rome_italy")) == ["a", "b", "c"]
+        assert HashRing().preference("rome_italy") == []
+
+
+class TestJobRouting:
+    """Tests for queueing jobs on the worker fleet."""
+
+    def test_job_goes_to_its_locations_worker(self, broker):
+        for worker in ("a", "b", "c"):
+            job_manager.register_worker(worker)
+        owner = HashRing(["a", "b", "c"]).preference("rome_italy")[0]
+
+        assert job_manager.enqueue_job("1", "rome_italy") == owner
+        assert job_manager.dequeue_job(1, owner) == "1"
+
+    def test_saturated_worker_spills_to_the_next(self, broker, monkeypatch):
+        monkeypatch.setattr(job_manager, "SPILL_QUEUE_DEPTH", 1)
+        for worker in ("a", "b"):
+            job_manager.register_worker(worker)
+        first, second = HashRing(["a", "b"]).preference("rome_italy")
+
+        assert job_manager.enqueue_job("1", "rome_italy") == first
+        assert job_manager.enqueue_job("2", "rome_italy") == second
+        # Every worker is saturated
+        assert job_manager.enqueue_job("3", "rome_italy") is None
+        assert broker.llen(job_manager.RENDER_QUEUE) == 1
+
+    def test_without_workers_jobs_go_to_the_shared_queue(self, broker):
+        assert job_manager.enqueue_job("1", "rome_italy") is None
+        assert job_manager.dequeue_job(1) == "1"
+
+    def test_worker_takes_its_own_jobs_first(self, broker):
+        job_manager.register_worker("a")
+        job_manager.enqueue_job("shared")
+        job_manager.enqueue_job("routed", "rome_italy")
+
+        assert job_manager.dequeue_job(1, "a") == "routed"
+        assert job_manager.dequeue_job(1, "a") == "shared"
+
+    def test_retired_workers_jobs_go_to_the_others(self, broker):
+        job_manager.register_worker("a")
+        job_manager.enqueue_job("old")
+        for job_id in ("1", "2"):
+            job_manager.enqueue_job(job_id, "rome_italy")
+
+        job_manager.retire_worker("a")
+
+        assert job_manager.live_workers() == []
+        assert [job_manager.dequeue_job(1, "b") for _ in range(3)] == ["1", "2", "old"]
+
+    def test_worker_id_survives_restarts(self):
+        # Not the per-process node ID: a restarted worker keeps its locations
+        assert job_manager.worker_id == socket.gethostname()
+        assert job_manager.worker_id != job_manager.node_id
+
+    def test_silent_workers_are_reaped(self, broker):
+        job_manager.register_worker("alive")
+        broker.hset(job_manager.WORKERS_KEY, "gone", time.time() - job_manager.WORKER_TIMEOUT_SECONDS - 1)
+        broker.lpush(job_manager.WORKER_QUEUE.format("gone"), "1")
+
+        assert job_manager.live_workers() == ["alive"]
+        job_manager.reap_workers()
+
+        assert broker.hgetall(job_manager.WORKERS_KEY).keys() == {"alive"}
+        assert job_manager.dequeue_job(1, "alive") == "1"
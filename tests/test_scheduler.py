@@ -0,0 +1,309 @@
+"""
+Tests for memory-aware job admission (app/services/scheduler.py).
+
+These tests verify that:
+1. Predicted memory grows with radius and DPI, and uses the cached entry's size when there is one
+2. Jobs too big for the budget are downgraded when auto-sized and refused otherwise
+3. Jobs are admitted only while their predictions fit the budget, the next one blocking those behind it
+4. Previews go ahead of print and background jobs, waiting jobs age up a lane, and clients share fairly
+5. Job status reports each job's class and time spent queued
+"""
+
+import asyncio
+
+import pytest
+
+import cache
+from app.config import settings
+from httpx import AsyncClient, ASGITransport
+
+from app.main import app
+from app.models import JobClass, PosterRequest
+from app.services import job_manager, scheduler
+from app.services.scheduler import JobScheduler, MB, MemoryBudgetError
+
+
+@pytest.fixture
+def cache_index(tmp_path, monkeypatch):
+    """A generator cache under maptoposter_dir, as the scheduler looks for it."""
+    directory = tmp_path / "cache"
+    directory.mkdir()
+    monkeypatch.setattr(cache, "CACHE_DIR", directory)
+    monkeypatch.setattr(settings, "maptoposter_dir", tmp_path)
+    return directory
+
+
+@pytest.fixture
+def tiles(monkeypatch):
+    """Map data from the tiled store, where auto sizes aren't capped."""
+    monkeypatch.setattr(settings, "map_data_source", "tiles")
+
+
+def save_city(city, country, distance, graph):
+    key = cache.get_cache_key(city, country, distance)
+    cache.save_to_cache(key, graph, None, None, (41.9, 12.5), city, country, distance)
+    return cache.get_cached_meta(key)["size_bytes"]
+
+
+class TestPrediction:
+    """Tests for predicting a job's peak memory."""
+
+    def test_grows_with_distance_and_dpi(self):
+        small = scheduler.predict_job_bytes(2000, 72)
+
+        assert scheduler.predict_job_bytes(35000, 72) > small
+        assert scheduler.predict_job_bytes(2000, 300) > small
+
+    def test_cached_location_uses_entry_size(self, cache_index):
+        size = save_city("Rome", "Italy", 12000, list(range(100_000)))
+
+        assert scheduler.cached_location("Rome", "Italy") == (12000, size)
+        assert scheduler.cached_location("Rome", "Italy", 6000) is None
+        assert scheduler.cached_location("Paris", "France") is None
+        assert scheduler.predict_job_bytes(12000, 72, size) == (
+            scheduler.predict_job_bytes(12000, 72, 0) + size * scheduler.CACHED_EXPANSION
+        )
+
+    def test_no_cache_index(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(settings, "maptoposter_dir", tmp_path)
+
+        assert scheduler.cached_location("Rome", "Italy") is None
+
+
+class TestPlan:
+    """Tests for fitting a job to the memory budget."""
+
+    def test_job_that_fits_is_unchanged(self, cache_index):
+        request = PosterRequest(city="Rome", country="Italy", size="metro")
+
+        plan = scheduler.plan_job(request, 72, 64 * 1024 * MB)
+
+        assert plan.location_args == ["--city", "Rome", "--country", "Italy", "--size", "metro"]
+        assert plan.downgraded_to is None
+        assert plan.predicted_bytes < plan.rss_limit_bytes
+
+    def test_auto_size_is_capped_at_city_unless_tiles(self, cache_index, monkeypatch):
+        request = PosterRequest(city="Rome", country="Italy")
+
+        plan = scheduler.plan_job(request, 72, 64 * 1024 * MB)
+        assert plan.location_args[-2:] == ["--size", "city"]
+        assert plan.predicted_bytes == scheduler.predict_job_bytes(scheduler.SIZE_PRESETS["city"], 72)
+
+        monkeypatch.setattr(settings, "map_data_source", "tiles")
+        plan = scheduler.plan_job(request, 72, 64 * 1024 * MB)
+        assert plan.location_args == ["--city", "Rome", "--country", "Italy"]
+        assert plan.predicted_bytes == scheduler.predict_job_bytes(scheduler.AUTO_MAX_DISTANCE, 72)
+
+    def test_auto_size_is_downgraded_to_fit(self, cache_index):
+        request = PosterRequest(city="Rome", country="Italy")
+        budget = scheduler.predict_job_bytes(6000, 72)
+
+        plan = scheduler.plan_job(request, 72, budget)
+
+        assert plan.downgraded_to == "town"
+        assert plan.location_args[-2:] == ["--size", "town"]
+        assert plan.rss_limit_bytes == budget
+
+    def test_auto_size_uses_cached_radius(self, cache_index, tiles):
+        size = save_city("Rome", "Italy", 4000, list(range(1000)))
+
+        plan = scheduler.plan_job(PosterRequest(city="Rome", country="Italy"), 72, 64 * 1024 * MB)
+
+        assert plan.predicted_bytes == scheduler.predict_job_bytes(4000, 72, size)
+
+    def test_uncached_auto_size_is_planned_for_the_largest_radius(self, cache_index, tiles):
+        request = PosterRequest(city="Rome", country="Italy")
+
+        plan = scheduler.plan_job(request, 72, 64 * 1024 * MB)
+        assert plan.predicted_bytes == scheduler.predict_job_bytes(scheduler.AUTO_MAX_DISTANCE, 72)
+        assert plan.location_args == ["--city", "Rome", "--country", "Italy"]
+
+        # Below that, the generator is held to a preset the limit was set for
+        plan = scheduler.plan_job(request, 72, scheduler.predict_job_bytes(35000, 72))
+        assert plan.location_args[-2:] == ["--size", "region"]
+
+    def test_explicit_size_is_refused(self, cache_index):
+        request = PosterRequest(city="Rome", country="Italy", distance=35000)
+
+        with pytest.raises(MemoryBudgetError, match="smaller size"):
+            scheduler.plan_job(request, 72, scheduler.predict_job_bytes(20000, 72))
+
+    def test_nothing_fits(self, cache_index):
+        request = PosterRequest(city="Rome", country="Italy")
+
+        with pytest.raises(MemoryBudgetError):
+            scheduler.plan_job(request, 72, scheduler.BASE_BYTES)
+
+
+class TestJobScheduler:
+    """Tests for admitting jobs against the budget."""
+
+    @pytest.mark.asyncio
+    async def test_jobs_wait_for_memory_in_arrival_order(self):
+        memory = JobScheduler(100)
+        started = []
+        release = {name: asyncio.Event() for name in "abc"}
+
+        async def job(name, nbytes):
+            async with memory.reserve(name, nbytes):
+                started.append(name)
+                await release[name].wait()
+
+        tasks = [asyncio.create_task(job("a", 60))]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(job("b", 60)))
+        await asyncio.sleep(0)
+        # Would fit, but may not overtake b
+        tasks.append(asyncio.create_task(job("c", 30)))
+        await asyncio.sleep(0.01)
+
+        assert started == ["a"]
+        assert memory.stats() == {
+            "budget_bytes": 100, "used_bytes": 60, "running": 1, "waiting": 2,
+            "waiting_by_class": {"preview": 2, "print": 0, "background": 0},
+        }
+        assert not memory.can_start(10)
+
+        release["a"].set()
+        await asyncio.sleep(0.01)
+        assert started == ["a", "b", "c"]
+
+        release["b"].set()
+        release["c"].set()
+        await asyncio.gather(*tasks)
+        assert memory.stats()["used_bytes"] == 0
+
+    @pytest.mark.asyncio
+    async def test_oversized_job_runs_on_idle_machine(self):
+        memory = JobScheduler(100)
+
+        async with memory.reserve("big", 500):
+            assert memory.running == 1
+
+    @pytest.mark.asyncio
+    async def test_cancelled_waiter_leaves_the_queue(self):
+        memory = JobScheduler(100)
+
+        async with memory.reserve("a", 80):
+            waiter = asyncio.create_task(memory.reserve("b", 80).__aenter__())
+            await asyncio.sleep(0.01)
+            waiter.cancel()
+            await asyncio.gather(waiter, return_exceptions=True)
+
+            assert memory.stats()["waiting"] == 0
+            assert memory.can_start(10)
+
+
+async def start_in_order(memory, jobs, hold):
+    """
+    Queue jobs (id, bytes, class, client) behind a job holding the whole
+    budget, release it and return the order in which they started.
+    """
+    started = []
+
+    async def run(job_id, nbytes, job_class, client):
+        async with memory.reserve(job_id, nbytes, job_class, client):
+            started.append(job_id)
+            await asyncio.sleep(0.01)
+
+    holder = asyncio.create_task(run("hold", memory.budget_bytes, JobClass.PREVIEW, "other"))
+    await asyncio.sleep(0)
+    tasks = []
+    for job in jobs:
+        tasks.append(asyncio.create_task(run(*job)))
+        await asyncio.sleep(hold)
+    await asyncio.gather(holder, *tasks)
+    return started[1:]
+
+
+class TestLanes:
+    """Tests for choosing which waiting job starts next."""
+
+    @pytest.mark.asyncio
+    async def test_preview_overtakes_queued_print_and_background(self):
+        jobs = [
+            ("warm", 100, JobClass.BACKGROUND, "warmer"),
+            ("print", 100, JobClass.PRINT, "a"),
+            ("preview", 100, JobClass.PREVIEW, "b"),
+        ]
+
+        assert await start_in_order(JobScheduler(100), jobs, 0) == ["preview", "print", "warm"]
+
+    @pytest.mark.asyncio
+    async def test_waiting_jobs_age_into_faster_lanes(self, monkeypatch):
+        monkeypatch.setattr(scheduler, "AGING_SECONDS", 0.02)
+        jobs = [
+            ("warm", 100, JobClass.BACKGROUND, "warmer"),
+            ("preview", 100, JobClass.PREVIEW, "b"),
+        ]
+
+        # By the time the preview arrives the warm job has waited two lanes' worth
+        assert await start_in_order(JobScheduler(100), jobs, 0.05) == ["warm", "preview"]
+
+    @pytest.mark.asyncio
+    async def test_job_that_ages_to_the_front_starts_without_waiting_for_a_release(self, monkeypatch):
+        monkeypatch.setattr(scheduler, "AGING_SECONDS", 0.02)
+        memory = JobScheduler(100)
+        started = []
+        release = asyncio.Event()
+
+        async def run(job_id, nbytes, job_class, client):
+            async with memory.reserve(job_id, nbytes, job_class, client):
+                started.append(job_id)
+                await release.wait()
+
+        tasks = [asyncio.create_task(run("hold", 60, JobClass.PREVIEW, "a"))]
+        await asyncio.sleep(0)
+        # big is next but doesn't fit; warm fits once it has aged into big's lane
+        tasks.append(asyncio.create_task(run("big", 60, JobClass.PREVIEW, "a")))
+        tasks.append(asyncio.create_task(run("warm", 30, JobClass.BACKGROUND, "warmer")))
+        await asyncio.sleep(0.01)
+        assert started == ["hold"]
+
+        await asyncio.sleep(0.1)
+        assert started == ["hold", "warm"]
+        release.set()
+        await asyncio.gather(*tasks)
+        assert started == ["hold", "warm", "big"]
+
+    @pytest.mark.asyncio
+    async def test_clients_with_fewer_jobs_running_go_first(self):
+        memory = JobScheduler(100)
+        started = []
+        release = asyncio.Event()
+
+        async def run(job_id, client):
+            async with memory.reserve(job_id, 50, JobClass.PRINT, client):
+                started.append(job_id)
+                if job_id == "c1":
+                    await asyncio.sleep(0.01)
+                else:
+                    await release.wait()
+
+        tasks = [asyncio.create_task(run("a1", "a")), asyncio.create_task(run("c1", "c"))]
+        await asyncio.sleep(0)
+        tasks += [asyncio.create_task(run("a2", "a")), asyncio.create_task(run("b1", "b"))]
+        await asyncio.sleep(0.05)
+
+        # c1 finished; a already has a job running, so b goes first
+        assert started == ["a1", "c1", "b1"]
+        release.set()
+        await asyncio.gather(*tasks)
+        assert started == ["a1", "c1", "b1", "a2"]
+
+
+class TestJobStatus:
+    """Tests for the scheduling details in job status."""
+
+    @pytest.mark.asyncio
+    async def test_queued_job_reports_class_and_wait(self, monkeypatch):
+        monkeypatch.setattr(job_manager, "jobs", {})
+        job_id = job_manager.create_job(PosterRequest(city="Rome", country="Italy", quality="print"), client="1.2.3.4")
+
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.get(f"/api/jobs/{job_id}")
+
+        body = response.json()
+        assert body["job_class"] == "print"
+        assert body["queue_wait_seconds"] >= 0
+        assert job_manager.get_job(job_id)["client"] == "1.2.3.4"
@@ -0,0 +1,150 @@
+"""
+Tests for map data shared between render processes (shared_cache.py).
+
+These tests verify that:
+1. Published map data reads back in any process with roads memory-mapped, not copied
+2. Entries are evicted least recently used first to fit the byte budget
+3. Newer map data replaces an older entry, and expired entries are not served
+4. fetch_map_data serves a location published by another process without touching the disk cache
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+import geopandas as gpd
+import numpy as np
+import pytest
+from shapely.geometry import box
+
+import cache
+import create_map_poster
+from hot_cache import HotLocations, data_nbytes
+from roads import SlimRoads
+from shared_cache import SharedLocations
+from tests.test_cli_startup import REPO_DIR
+
+
+def location(edges=10, water=True):
+    coords = np.arange(4 * edges, dtype=np.float64).reshape(-1, 2)
+    roads = SlimRoads(["primary", "residential"], np.arange(edges, dtype=np.uint8) % 2, coords,
+                      np.arange(0, 2 * edges + 1, 2))
+    polygons = gpd.GeoDataFrame(geometry=[box(0, 0, 1, 1), box(2, 2, 3, 4)], crs="epsg:4326")
+    return {"graph": roads, "water": polygons if water else None, "parks": None}
+
+
+class TestPublish:
+    """Tests for writing and mapping entries."""
+
+    def test_round_trip_maps_roads(self, tmp_path):
+        data = location()
+        assert SharedLocations(tmp_path, max_bytes=10 ** 6).put("venice", data)
+
+        shared = SharedLocations(tmp_path, max_bytes=10 ** 6).get("venice")
+
+        assert isinstance(shared["graph"].coords, np.memmap)
+        assert np.array_equal(shared["graph"].coords, data["graph"].coords)
+        assert shared["graph"].edge_highways() == data["graph"].edge_highways()
+        assert list(shared["water"].geometry) == list(data["water"].geometry)
+        assert shared["parks"] is None
+        # The per-process store only pays for what isn't mapped
+        assert data_nbytes(shared) < data_nbytes(data)
+
+    def test_other_processes_map_the_same_files(self, tmp_path):
+        SharedLocations(tmp_path, max_bytes=10 ** 6).put("venice", location())
+        script = (
+            "import numpy as np, sys; from shared_cache import SharedLocations; "
+            f"data = SharedLocations({str(tmp_path)!r}, max_bytes=1).get('venice'); "
+            "sys.exit(0 if isinstance(data['graph'].coords, np.memmap) else 1)"
+        )
+
+        assert subprocess.run([sys.executable, "-c", script], cwd=REPO_DIR).returncode == 0
+
+    def test_disabled_or_unshareable_data_is_not_published(self, tmp_path):
+        assert SharedLocations(tmp_path, max_bytes=0).put("a", location()) is False
+        assert SharedLocations(tmp_path, max_bytes=10).put("a", location()) is False
+        assert SharedLocations(tmp_path, max_bytes=10 ** 6).put("b", {"graph": object()}) is False
+        assert SharedLocations(tmp_path, max_bytes=10 ** 6).entries() == []
+
+
+class TestEviction:
+    """Tests for the shared byte budget."""
+
+    def test_least_recently_used_entries_are_evicted(self, tmp_path):
+        size = SharedLocations(tmp_path / "probe", max_bytes=10 ** 6)
+        size.put("probe", location())
+        entry_bytes = size.stats()["bytes"]
+
+        store = SharedLocations(tmp_path / "store", max_bytes=int(entry_bytes * 2.5))
+        store.put("a", location())
+        store.put("b", location())
+        os.utime(tmp_path / "store" / "a" / "meta.json", (1, 1))
+        os.utime(tmp_path / "store" / "b" / "meta.json", (2, 2))
+        store.get("a")  # a is now the most recently used
+
+        store.put("c", location())
+
+        assert sorted(key for key, _, _ in store.entries()) == ["a", "c"]
+        assert store.stats()["bytes"] <= store.max_bytes
+
+    def test_mapped_entry_survives_eviction(self, tmp_path):
+        store = SharedLocations(tmp_path, max_bytes=10 ** 6)
+        store.put("a", location())
+        mapped = store.get("a")
+
+        store.clear()
+
+        assert store.get("a") is None
+        assert mapped["graph"].coords[1].tolist() == [2.0, 3.0]
+
+
+class TestExpiry:
+    """Tests for keeping shared entries as fresh as the disk cache."""
+
+    def test_newer_data_replaces_an_older_entry(self, tmp_path):
+        store = SharedLocations(tmp_path, max_bytes=10 ** 6)
+        store.put("venice", location(water=False), cached_at=100)
+
+        assert store.put("venice", location(), cached_at=200)
+        # Older data than what is published is left out
+        assert store.put("venice", location(water=False), cached_at=150)
+
+        shared = store.get("venice")
+        assert shared["cached_at"] == 200
+        assert shared["water"] is not None
+        assert len(store.entries()) == 1
+
+    def test_expired_entries_are_not_served(self, tmp_path):
+        store = SharedLocations(tmp_path, max_bytes=10 ** 6, max_age=60)
+        store.put("venice", location(), cached_at=time.time() - 61)
+
+        assert store.get("venice") is None
+        assert store.put("venice", location())
+        assert store.get("venice") is not None
+
+
+class TestFetchShared:
+    """Tests for the shared store in fetch_map_data."""
+
+    def test_location_published_elsewhere_skips_the_disk_cache(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(cache, "CACHE_DIR", tmp_path / "cache")
+        monkeypatch.setattr(cache, "_pending_access", {})
+        monkeypatch.setattr(create_map_poster, "hot_locations", HotLocations(0))
+        store = SharedLocations(tmp_path / "shared", max_bytes=10 ** 6)
+        monkeypatch.setattr(create_map_poster, "shared_locations", store)
+        monkeypatch.setattr(create_map_poster, "download_map_data", lambda bbox, layers, source: location())
+
+        point = (45.43, 12.33)
+        create_map_poster.fetch_map_data("Venice", "Italy", point, 2000)
+
+        def no_load(*args, **kwargs):
+            raise AssertionError("the disk cache should not be read")
+
+        monkeypatch.setattr(create_map_poster, "load_layers", no_load)
+        data = create_map_poster.fetch_map_data("Venice", "Italy", point, 2000)
+
+        assert data["from_cache"] is True
+        assert isinstance(data["graph"].coords, np.memmap)
+        # Counts as a use of the disk entry, so it isn't evicted as unused
+        assert cache.cache_stats()["hits"] == 1
@@ -0,0 +1,254 @@
+"""
+Tests for sharing jobs between API nodes and render workers through a broker.
+
+These tests verify that:
+1. The in-process broker behaves like the Redis commands the service relies on
+2. A job created on one node can be looked up, with its current state, on any other,
+   without broker calls holding up the event loop
+3. Changes published by other nodes wake long-polls and reach this node's WebSocket clients
+4. Render workers and API nodes stop jobs cancelled through another node, and workers
+   take queued jobs in order, skipping cancelled ones
+"""
+
+import asyncio
+import json
+import time
+
+import pytest
+from httpx import AsyncClient, ASGITransport
+
+from app import worker
+from app.main import app
+from app.models import JobStatus, PosterRequest
+from app.services import job_manager, poster_generator
+from app.services.broker import InProcessBroker
+
+
+@pytest.fixture
+async def broker(monkeypatch):
+    """Join an in-process broker as if it were the one shared with other nodes."""
+    monkeypatch.setattr(job_manager, "jobs", {})
+    monkeypatch.setattr(job_manager, "_change_waiters", {})
+    monkeypatch.setattr(job_manager, "_notify_callback", None)
+    monkeypatch.setattr(job_manager, "_preview_callback", None)
+    monkeypatch.setattr(job_manager, "_main_loop", asyncio.get_running_loop())
+    shared = InProcessBroker()
+    job_manager.use_broker(shared)
+    yield shared
+    job_manager.use_broker(None)
+
+
+def update_on_other_node(broker, job_id, **fields):
+    """Change a job the way another node's job_manager.update_job does."""
+    key = job_manager.JOB_KEY.format(job_id)
+    encoded = {name: json.dumps(value) for name, value in fields.items()}
+    broker.hset(key, mapping=encoded)
+    version = broker.hincrby(key, "version", 1)
+    broker.publish(job_manager.JOB_CHANNEL, json.dumps({
+        "node": "other-node", "job_id": job_id, "version": version, "fields": encoded,
+    }))
+
+
+def forget_local_jobs():
+    """Drop this node's copies, as if the jobs had been created on another node."""
+    job_manager.jobs.clear()
+
+
+class TestInProcessBroker:
+    """Tests for the broker stand-in."""
+
+    def test_hashes(self):
+        broker = InProcessBroker()
+
+        broker.hset("job", mapping={"status": "pending", "version": 0})
+
+        assert broker.hincrby("job", "version", 1) == 1
+        assert broker.hgetall("job") == {"status": "pending", "version": "1"}
+        assert broker.hgetall("missing") == {}
+
+    def test_expiry(self):
+        broker = InProcessBroker()
+        broker.hset("job", "status", "pending")
+
+        assert broker.expire("job", 0.01)
+        time.sleep(0.02)
+
+        assert broker.hgetall("job") == {}
+        assert not broker.expire("job", 1)
+
+    def test_list_is_a_fifo_queue(self):
+        broker = InProcessBroker()
+        broker.lpush("queue", "a")
+        broker.lpush("queue", "b")
+
+        assert broker.llen("queue") == 2
+        assert broker.brpop("queue", timeout=1) == ("queue", "a")
+        assert broker.brpop("queue", timeout=1) == ("queue", "b")
+        assert broker.brpop("queue", timeout=0.01) is None
+
+    def test_publish_reaches_every_subscriber(self):
+        broker = InProcessBroker()
+        first, second = broker.pubsub(), broker.pubsub()
+        first.subscribe("events")
+        second.subscribe("events")
+
+        assert broker.publish("events", "hello") == 2
+        for subscriber in (first, second):
+            # As with Redis, the subscription is confirmed first
+            assert subscriber.get_message(timeout=1)["type"] == "subscribe"
+            message = subscriber.get_message(ignore_subscribe_messages=True, timeout=1)
+            assert message == {"type": "message", "channel": "events", "data": "hello"}
+
+        first.close()
+        assert broker.publish("events", "again") == 1
+        assert first.get_message(ignore_subscribe_messages=True, timeout=0.01) is None
+
+
+class TestSharedJobs:
+    """Tests for job records and events shared through the broker."""
+
+    @pytest.mark.asyncio
+    async def test_job_created_elsewhere_is_found(self, broker):
+        job_id = job_manager.create_job(PosterRequest(city="Rome", country="Italy", quality="print"))
+        forget_local_jobs()
+
+        job = job_manager.get_job(job_id)
+
+        assert job["status"] == JobStatus.PENDING
+        assert job["job_class"] == "print"
+        assert job["request"]["city"] == "Rome"
+        assert job_manager.get_job("nope") is None
+
+    @pytest.mark.asyncio
+    async def test_status_request_on_another_node(self, broker):
+        job_id = job_manager.create_job(PosterRequest(city="Rome", country="Italy"))
+        job_manager.update_job(job_id, status=JobStatus.PROCESSING, progress=40)
+        forget_local_jobs()
+
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.get(f"/api/jobs/{job_id}")
+
+        body = response.json()
+        assert body["status"] == "processing"
+        assert body["progress"] == 40
+        assert body["version"] == 1
+
+    @pytest.mark.asyncio
+    async def test_change_on_other_node_wakes_waiters_and_clients(self, broker, monkeypatch):
+        sent = []
+
+        async def notify(job_id, status, progress, *rest):
+            sent.append((status, progress))
+
+        monkeypatch.setattr(job_manager, "_notify_callback", notify)
+        job_id = job_manager.create_job(PosterRequest(city="Rome", country="Italy"))
+        waiter = asyncio.create_task(job_manager.wait_for_job_change(job_id, 0, 5))
+        await asyncio.sleep(0)
+
+        update_on_other_node(broker, job_id, status="completed", progress=100)
+        job = await asyncio.wait_for(waiter, 2)
+        await asyncio.sleep(0.01)
+
+        assert job["status"] == JobStatus.COMPLETED
+        assert job["version"] == 1
+        assert sent == [(JobStatus.COMPLETED, 100)]
+
+    @pytest.mark.asyncio
+    async def test_own_changes_are_not_applied_twice(self, broker, monkeypatch):
+        sent = []
+
+        async def notify(job_id, status, progress, *rest):
+            sent.append(progress)
+
+        monkeypatch.setattr(job_manager, "_notify_callback", notify)
+        job_id = job_manager.create_job(PosterRequest(city="Rome", country="Italy"))
+
+        job_manager.update_job(job_id, progress=10)
+        await asyncio.sleep(0.1)
+
+        assert sent == [10]
+        assert job_manager.get_job(job_id)["version"] == 1
+
+    @pytest.mark.asyncio
+    async def test_job_cancelled_on_another_node_is_stopped_here(self, broker, monkeypatch):
+        monkeypatch.setattr(poster_generator, "generate_poster_task", hold_until_cancelled)
+        request = PosterRequest(city="Rome", country="Italy")
+        job_id = job_manager.create_job(request)
+        task = poster_generator.start_poster_job(job_id, request)
+        await asyncio.sleep(0.1)
+
+        # The cancel reached a node that isn't rendering the job
+        update_on_other_node(broker, job_id, status="cancelled")
+        await asyncio.wait_for(asyncio.wait([task]), 2)
+
+        assert task.cancelled()
+        assert job_manager.get_job(job_id)["message"] == "Generation cancelled"
+
+    @pytest.mark.asyncio
+    async def test_slow_broker_does_not_hold_up_the_event_loop(self, broker, monkeypatch):
+        job_id = job_manager.create_job(PosterRequest(city="Rome", country="Italy"))
+        hset = broker.hset
+
+        def slow_hset(*args, **kwargs):
+            time.sleep(0.2)
+            return hset(*args, **kwargs)
+
+        monkeypatch.setattr(broker, "hset", slow_hset)
+        started = time.monotonic()
+        job_manager.update_job(job_id, progress=10)
+
+        assert time.monotonic() - started < 0.1
+        # Reads come after this node's earlier writes
+        job = await job_manager.load_job(job_id)
+        assert job["progress"] == 10
+        assert job["version"] == 1
+
+
+async def hold_until_cancelled(job_id, request):
+    """Stands in for generate_poster_task."""
+    job_manager.update_job(job_id, status=JobStatus.PROCESSING)
+    try:
+        await asyncio.sleep(60)
+    except asyncio.CancelledError:
+        job_manager.update_job(job_id, status=JobStatus.CANCELLED, message="Generation cancelled")
+        raise
+
+
+class TestWorker:
+    """Tests for render workers taking jobs from the shared queue."""
+
+    @pytest.mark.asyncio
+    async def test_queue_is_first_in_first_out(self, broker):
+        job_manager.enqueue_job("a")
+        job_manager.enqueue_job("b")
+
+        assert job_manager.dequeue_job(1) == "a"
+        assert job_manager.dequeue_job(1) == "b"
+
+    @pytest.mark.asyncio
+    async def test_runs_queued_jobs_and_stops_cancelled_ones(self, broker, monkeypatch):
+        monkeypatch.setattr(worker, "DEQUEUE_TIMEOUT_SECONDS", 0.05)
+        monkeypatch.setattr(poster_generator, "generate_poster_task", hold_until_cancelled)
+        request = PosterRequest(city="Rome", country="Italy")
+        skipped = job_manager.create_job(request)
+        taken = job_manager.create_job(request)
+        job_manager.update_job(skipped, status=JobStatus.CANCELLED)
+        job_manager.enqueue_job(skipped)
+        job_manager.enqueue_job(taken)
+        forget_local_jobs()
+
+        stop = asyncio.Event()
+        running = asyncio.create_task(worker.run_worker(stop))
+        await asyncio.sleep(0.1)
+        assert job_manager.get_job(taken)["status"] == JobStatus.PROCESSING
+        assert taken in poster_generator._running
+        assert skipped not in poster_generator._running
+
+        # Cancelled through an API node
+        update_on_other_node(broker, taken, status="cancelled")
+        await asyncio.sleep(0.1)
+        stop.set()
+        await asyncio.wait_for(running, 2)
+
+        assert taken not in poster_generator._running
+        assert job_manager.get_job(taken)["message"] == "Generation cancelled"
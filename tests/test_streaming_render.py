@@ -0,0 +1,74 @@
+"""
+Tests for drawing roads in bounded chunks (render_base_map).
+
+These tests verify that:
+1. SlimRoads.chunks slices every edge, in order, without copying
+2. Chunked drawing gives the same pixels as drawing every road at once
+3. Roads from the tile store are streamed one tile at a time and render like loaded ones
+"""
+
+import numpy as np
+import pytest
+
+pytest.importorskip("matplotlib")
+
+import create_map_poster
+import tile_store
+from roads import SlimRoads
+from tests.test_osm_extract import BBOX, POLYGON_TAGS, extract  # noqa: F401
+from tests.test_tile_store import store  # noqa: F401
+
+FRAME = (0.05, 0.05, 0.95, 0.95)
+
+
+def grid_roads(n=40):
+    """n horizontal and n vertical two-point roads across the unit square."""
+    lines = [[[0.0, i / n], [1.0, i / n]] for i in range(n)] + [[[i / n, 0.0], [i / n, 1.0]] for i in range(n)]
+    coords = np.array(lines, dtype=np.float64).reshape(-1, 2)
+    codes = np.array([i % 3 for i in range(2 * n)], dtype=np.uint8)
+    return SlimRoads(["motorway", "primary", "residential"], codes, coords, np.arange(0, len(coords) + 1, 2))
+
+
+def render(roads, water=None, parks=None):
+    theme = create_map_poster.load_theme("noir")
+    return create_map_poster.render_base_map(roads, water, parks, FRAME, (3, 4), 50, theme)
+
+
+class TestChunks:
+    """Tests for slicing SlimRoads."""
+
+    def test_chunks_cover_every_edge_in_order(self):
+        roads = grid_roads()
+
+        chunks = list(roads.chunks(7))
+
+        assert [len(chunk) for chunk in chunks] == [7] * 11 + [3]
+        assert [line.tolist() for chunk in chunks for line in chunk.lines()] == \
+            [line.tolist() for line in roads.lines()]
+        assert np.shares_memory(chunks[1].coords, roads.coords)
+
+
+class TestChunkedDrawing:
+    """Tests for streaming roads onto the canvas."""
+
+    def test_chunk_size_does_not_change_pixels(self, monkeypatch):
+        roads = grid_roads()
+        whole = render(roads)
+
+        monkeypatch.setattr(create_map_poster, "ROAD_CHUNK_EDGES", 3)
+
+        assert np.array_equal(render(roads), whole)
+
+    def test_tiled_roads_render_like_loaded_roads(self, store, extract, monkeypatch):
+        tile_store.ingest(extract, BBOX, POLYGON_TAGS)
+        loaded = tile_store.load_bbox(FRAME)
+        streamed = tile_store.load_bbox(FRAME, stream_roads=True)
+
+        reads = []
+        read_tile_roads = tile_store.read_tile_roads
+        monkeypatch.setattr(tile_store, "read_tile_roads", lambda x, y: reads.append((x, y)) or read_tile_roads(x, y))
+
+        assert isinstance(streamed["graph"], tile_store.TiledRoads)
+        assert np.array_equal(render(streamed["graph"], streamed["water"], streamed["parks"]),
+                              render(loaded["graph"], loaded["water"], loaded["parks"]))
+        assert reads == tile_store.tiles_for_bbox(FRAME)
@@ -0,0 +1,138 @@
+"""
+Tests for the tiled map store (tile_store.py).
+
+These tests verify that:
+1. Ingest partitions an extract into tiles in one read, skipping tiles already present
+   and tiles the extract doesn't fully cover
+2. A bbox is assembled from its tiles without gaps in roads or seams in polygons
+3. Locations inside an ingested region are cache hits in fetch_map_data
+4. The "tiles" data source reads only from the store and rejects areas outside it
+"""
+
+import numpy as np
+import pytest
+
+import cache
+import create_map_poster
+import tile_store
+import osm_extract
+from tests.test_osm_extract import BBOX, POLYGON_TAGS, extract, osm_xml  # noqa: F401
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """Empty tile store with small tiles, so the test extract spans several."""
+    monkeypatch.setattr(tile_store, "TILE_DIR", tmp_path / "tiles")
+    monkeypatch.setattr(tile_store, "TILE_DEGREES", 0.25)
+    return tmp_path / "tiles"
+
+
+def road_length(roads):
+    return sum(np.hypot(*np.diff(line, axis=0).T).sum() for line in roads.lines())
+
+
+class TestIngest:
+    """Tests for building tiles from an extract."""
+
+    def test_ingest_writes_every_tile_once(self, store, extract):
+        assert tile_store.ingest(extract, BBOX, POLYGON_TAGS) == (25, 0, 0)
+        assert len(list(store.glob("*.npz"))) == 25
+
+        assert tile_store.ingest(extract, BBOX, POLYGON_TAGS) == (0, 25, 0)
+        assert tile_store.ingest(extract, BBOX, POLYGON_TAGS, force=True) == (25, 0, 0)
+
+    def test_extract_is_read_once_per_ingest(self, store, extract, monkeypatch):
+        reads = []
+        read_extract = osm_extract.read_extract
+
+        def counting(path, bbox, *args):
+            reads.append(bbox)
+            return read_extract(path, bbox, *args)
+
+        monkeypatch.setattr(osm_extract, "read_extract", counting)
+        tile_store.ingest(extract, BBOX, POLYGON_TAGS)
+
+        # All 25 tiles come from one read of the region
+        assert reads == [(0.0, 0.0, 1.25, 1.25)]
+
+    def test_tiles_past_the_extract_edge_are_left_out(self, store, tmp_path):
+        path = tmp_path / "partial.osm"
+        path.write_text(osm_xml(bounds=(0.0, 0.0, 0.6, 1.3)))
+
+        # Only columns 0 and 1 (up to 0.5°) lie wholly inside the extract
+        assert tile_store.ingest(str(path), BBOX, POLYGON_TAGS) == (10, 0, 15)
+        assert tile_store.has_tiles((0.1, 0.1, 0.4, 0.9))
+        assert not tile_store.has_tiles((0.1, 0.1, 0.7, 0.9))
+
+    def test_extract_without_bounds_covers_its_nodes(self, store, tmp_path):
+        path = tmp_path / "unbounded.osm"
+        path.write_text(osm_xml(bounds=None))
+
+        assert osm_extract.extract_coverage(str(path)) == (0.1, 0.1, 2.0, 2.0)
+        # The nodes start at 0.1°, so the tiles along the west and south edges are partial
+        assert tile_store.ingest(str(path), BBOX, POLYGON_TAGS) == (16, 0, 9)
+
+    def test_roads_are_split_at_tile_edges(self, store, extract):
+        tile_store.ingest(extract, BBOX, POLYGON_TAGS)
+
+        def coords(name):
+            with np.load(store / name) as tile:
+                return tile["roads_coords"].tolist()
+
+        # Each segment lives in the tile it starts in and keeps its end vertex
+        assert coords("0_2.npz") == [[0.2, 0.5], [0.5, 0.5]]
+        assert coords("1_2.npz") == []
+        assert coords("2_2.npz") == [[0.5, 0.5], [0.8, 0.5]]
+
+
+class TestLoadBbox:
+    """Tests for assembling map data from tiles."""
+
+    def test_assembled_data_matches_the_extract(self, store, extract):
+        tile_store.ingest(extract, BBOX, POLYGON_TAGS)
+
+        data = tile_store.load_bbox((0.05, 0.05, 0.95, 0.95))
+
+        assert data["graph"].edge_highways() == ["primary"] * len(data["graph"])
+        # The road runs on past the bbox to its next node, as in the extract
+        assert road_length(data["graph"]) == pytest.approx(1.3)
+        # The park was stored in four pieces around its hole and is merged back
+        assert len(data["parks"]) == 1
+        assert data["parks"].geometry[0].area == pytest.approx(0.3 * 0.3 - 0.1 * 0.1)
+        assert data["water"].total_bounds.tolist() == pytest.approx([0.6, 0.6, 0.95, 0.9])
+
+    def test_bbox_outside_the_ingested_region_is_not_covered(self, store, extract):
+        tile_store.ingest(extract, BBOX, POLYGON_TAGS)
+
+        assert tile_store.load_bbox((0.9, 0.9, 1.3, 1.3)) is None
+
+
+class TestFetchFromTiles:
+    """Tests for the tiled store as a cache tier."""
+
+    def test_ingested_location_is_a_cache_hit(self, store, extract, tmp_path, monkeypatch, capsys):
+        monkeypatch.setattr(cache, "CACHE_DIR", tmp_path / "cache")
+        monkeypatch.setattr(create_map_poster, "get_map_bbox", lambda point, extent, margin: (0.1, 0.1, 0.9, 0.9))
+
+        def no_download(bbox, layers, source):
+            raise AssertionError("tiled locations must not be downloaded")
+
+        monkeypatch.setattr(create_map_poster, "download_map_data", no_download)
+        tile_store.ingest(extract, BBOX, POLYGON_TAGS)
+
+        data = create_map_poster.fetch_map_data("Nowhere", "Atlantis", (0.5, 0.5), 2000)
+
+        assert data["from_cache"] is True
+        assert isinstance(data["graph"], tile_store.TiledRoads)
+        assert sum(len(chunk) for chunk in data["graph"].chunks(100)) > 0
+        assert "tiled map store" in capsys.readouterr().out
+
+    def test_tiles_source_reads_only_the_store(self, store, extract):
+        tile_store.ingest(extract, BBOX, POLYGON_TAGS)
+
+        data = create_map_poster.download_map_data((0.1, 0.1, 0.9, 0.9), ["graph", "water"], "tiles")
+
+        assert set(data) == {"graph", "water"}
+        assert isinstance(data["graph"], tile_store.TiledRoads)
+        with pytest.raises(ValueError, match="not in the tiled map store"):
+            create_map_poster.download_map_data((0.9, 0.9, 1.3, 1.3), ["graph"], "tiles")
@@ -0,0 +1,353 @@
+"""
+Tiled on-disk store of map data, built from regional OSM extracts.
+
+Reading even a local extract scans the whole file, so regions that are
+ordered from often can be ingested once into fixed lon/lat tiles
+(TILE_DEGREES square, one .npz file each). A poster's bbox is then
+assembled from the few tiles it overlaps, and every location inside an
+ingested region is a cache hit without any download.
+
+Each tile is columnar:
+
+- roads_highways / roads_codes / roads_coords / roads_offsets: the SlimRoads
+  arrays of the road segments that start inside the tile. Segments keep
+  their end vertex, so roads crossing a tile edge join up without gaps.
+- {layer}_wkb / {layer}_offsets: the water and park polygons cut to the
+  tile, as concatenated WKB. Pieces of one polygon are merged again when
+  tiles are assembled, so tile edges never show as seams.
+
+Ingest is incremental: tiles already on disk are skipped unless forced, so
+regions can be added over time. The extract is streamed once per ingest and
+what it holds for the region is bucketed into tiles, so memory follows the
+region ingested; split very large regions over several ingests. Tiles the
+extract doesn't fully cover are not written, since they would serve maps
+cut off at the extract's edge. Tiles are written to a temp file and renamed
+into place.
+
+    python create_map_poster.py tiles ingest italy-latest.osm.pbf --bbox 12.0 45.2 12.8 45.7
+    python create_map_poster.py tiles stats
+"""
+
+import math
+import os
+import sys
+import uuid
+from pathlib import Path
+
+TILE_DIR = Path(os.environ.get("MAP_TILE_DIR", "tiles"))
+TILE_DEGREES = 0.25
+
+POLYGON_LAYERS = ("water", "parks")
+
+
+def tile_index(lon, lat):
+    """(x, y) index of the tile containing a point."""
+    return math.floor(lon / TILE_DEGREES), math.floor(lat / TILE_DEGREES)
+
+
+def tile_bbox(x, y):
+    """(west, south, east, north) of a tile."""
+    return x * TILE_DEGREES, y * TILE_DEGREES, (x + 1) * TILE_DEGREES, (y + 1) * TILE_DEGREES
+
+
+def tiles_for_bbox(bbox):
+    """Indexes of every tile overlapping a bbox, row by row."""
+    west, south, east, north = bbox
+    x0, y0 = tile_index(west, south)
+    x1, y1 = tile_index(east, north)
+    return [(x, y) for y in range(y0, y1 + 1) for x in range(x0, x1 + 1)]
+
+
+def tile_path(x, y):
+    return TILE_DIR / f"{x}_{y}.npz"
+
+
+def has_tiles(bbox):
+    """True if every tile of a bbox has been ingested."""
+    return all(tile_path(x, y).exists() for x, y in tiles_for_bbox(bbox))
+
+
+# --- Writing ---------------------------------------------------------------
+
+def split_roads(roads, tiles):
+    """
+    Partition roads into tiles by the tile each segment starts in.
+
+    Consecutive segments of an edge starting in the same tile stay one
+    polyline. Segments starting outside `tiles` are dropped.
+
+    Returns:
+        dict of tile index -> (highway list, [polylines])
+    """
+    import numpy as np
+
+    tiles = set(tiles)
+    parts = {}
+    for highway, line in zip(roads.edge_highways(), roads.lines()):
+        if len(line) < 2:
+            continue
+        xs = np.floor(line[:-1, 0] / TILE_DEGREES).astype(np.int64)
+        ys = np.floor(line[:-1, 1] / TILE_DEGREES).astype(np.int64)
+        breaks = np.flatnonzero((np.diff(xs) != 0) | (np.diff(ys) != 0)) + 1
+        starts = np.concatenate(([0], breaks))
+        ends = np.concatenate((breaks, [len(xs)]))
+        for start, end in zip(starts, ends):
+            tile = (int(xs[start]), int(ys[start]))
+            if tile in tiles:
+                highways, lines = parts.setdefault(tile, ([], []))
+                highways.append(highway)
+                lines.append(line[start:end + 1])
+    return parts
+
+
+def _encode_wkb(geometries):
+    import numpy as np
+    import shapely
+
+    blobs = [shapely.to_wkb(geometry) for geometry in geometries]
+    offsets = np.zeros(len(blobs) + 1, dtype=np.int64)
+    np.cumsum([len(blob) for blob in blobs], out=offsets[1:])
+    return np.frombuffer(b"".join(blobs), dtype=np.uint8), offsets
+
+
+def write_tile(x, y, highways, lines, polygons):
+    """
+    Write one tile.
+
+    Args:
+        highways, lines: highway type and (n, 2) vertex array of each road polyline
+        polygons: layer name -> list of shapely polygons inside the tile
+    """
+    import numpy as np
+
+    names = list(dict.fromkeys(highways))
+    lookup = {name: code for code, name in enumerate(names)}
+    offsets = np.zeros(len(lines) + 1, dtype=np.int64)
+    np.cumsum([len(line) for line in lines], out=offsets[1:])
+    arrays = {
+        "roads_highways": np.array(names, dtype=str),
+        "roads_codes": np.array([lookup[h] for h in highways], dtype=np.uint16),
+        "roads_coords": np.concatenate(lines) if lines else np.empty((0, 2)),
+        "roads_offsets": offsets,
+    }
+    for layer in POLYGON_LAYERS:
+        arrays[f"{layer}_wkb"], arrays[f"{layer}_offsets"] = _encode_wkb(polygons.get(layer, []))
+
+    TILE_DIR.mkdir(parents=True, exist_ok=True)
+    path = tile_path(x, y)
+    tmp_path = path.with_name(f".tmp-{path.stem}-{uuid.uuid4().hex[:8]}.npz")
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+
+def ingest(source, bbox, polygon_tags, force=False):
+    """
+    Ingest the tiles of a bbox from a local OSM extract.
+
+    Args:
+        source: .osm/.osm.pbf extract (see osm_extract.py)
+        bbox: (west, south, east, north) of the region to ingest
+        polygon_tags: layer name -> tag filter for the polygon layers
+        force: re-ingest tiles that already exist
+
+    Returns:
+        (tiles written, tiles already present, tiles not fully covered by the extract)
+    """
+    from osm_extract import extract_coverage, read_extract
+    from polygons import clip_polygons
+
+    tiles = tiles_for_bbox(bbox)
+    todo = [tile for tile in tiles if force or not tile_path(*tile).exists()]
+    skipped = len(tiles) - len(todo)
+
+    coverage = extract_coverage(source)
+    if coverage is None:
+        return 0, skipped, len(todo)
+    covered = [tile for tile in todo if _covers(coverage, tile_bbox(*tile))]
+    if not covered:
+        return 0, skipped, len(todo)
+
+    # Roads are read up to their first node past the region's edge, so segments
+    # leaving an edge tile keep their end vertex (see split_roads)
+    wests, souths, easts, norths = zip(*(tile_bbox(*tile) for tile in covered))
+    region = (min(wests), min(souths), max(easts), max(norths))
+    print(f"Reading {len(covered)} tiles from {source}...")
+    data = read_extract(source, region, ("graph",) + POLYGON_LAYERS, polygon_tags)
+
+    roads = split_roads(data["graph"], covered)
+    for tile in covered:
+        polygons = {}
+        for layer in POLYGON_LAYERS:
+            clipped = clip_polygons(data.get(layer), tile_bbox(*tile))
+            polygons[layer] = [] if clipped is None else list(clipped.geometry)
+        highways, lines = roads.get(tile, ([], []))
+        write_tile(*tile, highways, lines, polygons)
+
+    return len(covered), skipped, len(todo) - len(covered)
+
+
+def _covers(outer, inner):
+    return outer[0] <= inner[0] and outer[1] <= inner[1] and outer[2] >= inner[2] and outer[3] >= inner[3]
+
+
+# --- Reading ---------------------------------------------------------------
+
+def _crop_roads(roads, bbox):
+    """Keep only edges whose bounds overlap bbox."""
+    import numpy as np
+
+    if len(roads) == 0:
+        return roads
+    west, south, east, north = bbox
+    starts = roads.offsets[:-1]
+    low = np.minimum.reduceat(roads.coords, starts)
+    high = np.maximum.reduceat(roads.coords, starts)
+    return roads.select((high[:, 0] >= west) & (low[:, 0] <= east) & (high[:, 1] >= south) & (low[:, 1] <= north))
+
+
+def read_tile_roads(x, y):
+    """The roads stored in one tile, as SlimRoads."""
+    import numpy as np
+    from roads import SlimRoads
+
+    with np.load(tile_path(x, y)) as tile:
+        return SlimRoads(
+            highways=[str(name) for name in tile["roads_highways"]],
+            codes=tile["roads_codes"],
+            coords=tile["roads_coords"],
+            offsets=tile["roads_offsets"],
+        )
+
+
+class TiledRoads:
+    """
+    The roads of a bbox, read from the tile store one tile at a time.
+
+    Stands in for SlimRoads when rendering (see render_base_map): chunks()
+    loads, crops and yields one tile's roads, then drops them before the
+    next tile is read, so a regional poster never holds its whole street
+    network in memory.
+    """
+
+    __slots__ = ("bbox", "tolerance")
+
+    def __init__(self, bbox, tolerance=None):
+        self.bbox = bbox
+        self.tolerance = tolerance
+
+    def chunks(self, max_edges):
+        for x, y in tiles_for_bbox(self.bbox):
+            roads = _crop_roads(read_tile_roads(x, y), self.bbox)
+            if self.tolerance:
+                roads = roads.simplified(self.tolerance)
+            yield from roads.chunks(max_edges)
+
+    def simplified(self, tolerance):
+        """Like SlimRoads.simplified, applied to each tile as it is read."""
+        return TiledRoads(self.bbox, tolerance)
+
+
+def load_bbox(bbox, stream_roads=False):
+    """
+    Assemble map data for a bbox from its tiles.
+
+    With stream_roads, graph is a TiledRoads that reads the roads while
+    they are drawn, and only the polygon layers are loaded here.
+
+    Returns:
+        dict with graph (SlimRoads or TiledRoads), water and parks (clipped
+        GeoDataFrame or None), or None if any tile of the bbox has not been
+        ingested
+    """
+    if not has_tiles(bbox):
+        return None
+
+    import geopandas as gpd
+    import numpy as np
+    import shapely
+    from polygons import clip_polygons
+    from roads import SlimRoads
+
+    highways = {}
+    codes, coords, lengths = [], [], []
+    pieces = {layer: [] for layer in POLYGON_LAYERS}
+    for x, y in tiles_for_bbox(bbox):
+        with np.load(tile_path(x, y)) as tile:
+            remap = np.array([highways.setdefault(str(name), len(highways)) for name in tile["roads_highways"]],
+                             dtype=np.uint16)
+            if not stream_roads and len(tile["roads_codes"]):
+                codes.append(remap[tile["roads_codes"]])
+                coords.append(tile["roads_coords"])
+                lengths.append(np.diff(tile["roads_offsets"]))
+            for layer in POLYGON_LAYERS:
+                wkb = tile[f"{layer}_wkb"].tobytes()
+                offsets = tile[f"{layer}_offsets"]
+                pieces[layer].extend(wkb[start:end] for start, end in zip(offsets[:-1], offsets[1:]))
+
+    offsets = np.zeros(sum(len(part) for part in lengths) + 1, dtype=np.int64)
+    if lengths:
+        np.cumsum(np.concatenate(lengths), out=offsets[1:])
+    code_dtype = np.uint8 if len(highways) <= 256 else np.uint16
+    roads = SlimRoads(
+        highways=highways,
+        codes=np.concatenate(codes).astype(code_dtype) if codes else np.empty(0, dtype=code_dtype),
+        coords=np.concatenate(coords) if coords else np.empty((0, 2)),
+        offsets=offsets,
+    )
+
+    data = {"graph": TiledRoads(bbox) if stream_roads else _crop_roads(roads, bbox)}
+    for layer in POLYGON_LAYERS:
+        if not pieces[layer]:
+            data[layer] = None
+            continue
+        # Polygons crossing tile edges were stored in pieces; merge them back
+        merged = shapely.get_parts(shapely.union_all(shapely.from_wkb(pieces[layer])))
+        data[layer] = clip_polygons(gpd.GeoDataFrame(geometry=merged, crs="epsg:4326"), bbox)
+    return data
+
+
+def tile_stats():
+    """Number of ingested tiles and their total size in bytes."""
+    if not TILE_DIR.exists():
+        return {"tiles": 0, "bytes": 0}
+    paths = list(TILE_DIR.glob("*.npz"))
+    return {"tiles": len(paths), "bytes": sum(path.stat().st_size for path in paths)}
+
+
+# --- CLI -------------------------------------------------------------------
+
+def main(argv=None):
+    """Entry point for `python create_map_poster.py tiles ...`."""
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="tiles", description="Build and inspect the tiled map store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    ingest_parser = subparsers.add_parser("ingest", help="Ingest the tiles of a region from a local OSM extract")
+    ingest_parser.add_argument("extract", help=".osm, .osm.gz, .osm.bz2 or .osm.pbf file")
+    ingest_parser.add_argument("--bbox", type=float, nargs=4, required=True, metavar=("WEST", "SOUTH", "EAST", "NORTH"),
+                               help="Region to ingest, in degrees")
+    ingest_parser.add_argument("--force", action="store_true", help="Re-ingest tiles that already exist")
+    subparsers.add_parser("stats", help="Show the number and size of ingested tiles")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "ingest":
+        from create_map_poster import PARK_TAGS, WATER_TAGS
+
+        if not os.path.exists(args.extract):
+            print(f"Error: extract not found: {args.extract}")
+            return 1
+        written, skipped, uncovered = ingest(args.extract, tuple(args.bbox),
+                                             {"water": WATER_TAGS, "parks": PARK_TAGS}, force=args.force)
+        print(f"✓ Ingested {written} tiles into {TILE_DIR} ({skipped} already present)")
+        if uncovered:
+            print(f"  {uncovered} tiles left out: the extract doesn't cover them completely")
+    elif args.command == "stats":
+        stats = tile_stats()
+        print(f"Tiles:  {stats['tiles']} ({TILE_DEGREES}° each) in {TILE_DIR}")
+        print(f"Size:   {stats['bytes'] / 1024 ** 2:.1f} MB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())